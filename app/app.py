@@ -1,4 +1,6 @@
 import os
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
 from fastapi.responses import HTMLResponse, JSONResponse, FileResponse
 from fastapi.middleware.cors import CORSMiddleware
@@ -8,6 +10,15 @@ from fastapi.templating import Jinja2Templates
 # Import the routers
 from routes import router as api_router
 from lti.routes import router as lti_router
+from domain.llm_registry import llm_registry
+from domain.checkpointer import checkpoint_maintenance
+from domain.query_logic import rag_graph
+from services.tracing_service import tracing
+from services.logging_service import analytics_emitter
+from services.metrics_service import MetricsMiddleware
+from core.rate_limiter import rate_limiter
+from services.session_service import session_store
+from services.rag_client import rag_client
 
 
 APP_ROOT = os.path.dirname(os.path.abspath(__file__))
@@ -15,8 +26,36 @@ STATIC_DIR = os.path.join(APP_ROOT, "web", "static")
 TEMPLATES_DIR = os.path.join(APP_ROOT, "web", "templates")
 GRAPHS_DIR = os.path.join(APP_ROOT, "analytics", "graphs")
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Manage application lifecycle"""
+    # Startup: open the async checkpointer (if configured) and start checkpoint compaction
+    await checkpoint_maintenance.start(rag_graph)
+    # Langfuse client with background trace export (never flushed in the request path)
+    tracing.start()
+    # Analytics events are batched and sent to the logging service in the background
+    analytics_emitter.start()
+    # Users with no request left in the rate limit window are dropped in the background
+    rate_limiter.start()
+    # Expired chat sessions are removed in the background as well
+    session_store.start()
+
+    yield
+
+    # Shutdown: release pooled connections held by shared clients
+    await rate_limiter.stop()
+    await session_store.stop()
+    await checkpoint_maintenance.stop(rag_graph)
+    await llm_registry.aclose()
+    await rag_client.aclose()
+    # Send the analytics events still queued (bounded wait) and close their pool
+    await analytics_emitter.stop()
+    # Export the traces still queued (bounded wait, off the event loop)
+    await asyncio.to_thread(tracing.shutdown)
+
+
 # Create the main FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # CORS Configuration
 origins = [
@@ -33,9 +72,12 @@ app.add_middleware(
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
     allow_headers=["*"],
     allow_credentials=True,
-    expose_headers=["X-RateLimit-Limit", "X-RateLimit-Remaining", "X-RateLimit-Reset"],
+    expose_headers=["X-RateLimit-Limit", "X-RateLimit-Remaining", "X-RateLimit-Reset", "Server-Timing"],
 )
 
+# Latency and status of the chat endpoints (GET /metrics) and their Server-Timing header
+app.add_middleware(MetricsMiddleware)
+
 # Include the Shared API Router
 app.include_router(api_router)
 app.include_router(lti_router)
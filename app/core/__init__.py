@@ -24,7 +24,8 @@ from .config import (
 from .rate_limiter import (
     check_rate_limit, get_rate_limit_info,
     RATE_LIMIT_REQUESTS, RATE_LIMIT_WINDOW,
-    get_rate_limit_config, cleanup_expired_rate_limits
+    get_rate_limit_config, cleanup_expired_rate_limits,
+    rate_limiter
 )
 
 __all__ = [
@@ -45,5 +46,6 @@ __all__ = [
     # Rate Limiter
     'check_rate_limit', 'get_rate_limit_info',
     'RATE_LIMIT_REQUESTS', 'RATE_LIMIT_WINDOW',
-    'get_rate_limit_config', 'cleanup_expired_rate_limits'
+    'get_rate_limit_config', 'cleanup_expired_rate_limits',
+    'rate_limiter'
 ]
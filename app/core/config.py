@@ -23,6 +23,10 @@ BASE_CHROMA_PATH = os.getenv("BASE_CHROMA_PATH", "rag/chroma")
 LOGGING_SERVICE_URL = os.getenv("LOGGING_SERVICE_URL", "http://localhost:8002")
 LOGGING_TIMEOUT = float(os.getenv("LOGGING_TIMEOUT", "5.0"))
 
+# --- Admin Endpoints ---
+# Token required in the X-Admin-Token header by /admin/*; unset disables those endpoints
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
 # --- Deprecated/Legacy ---
 # Only kept for backward compatibility - not used for actual logging
 BASE_LOG_DIR = "storage/logs"  # Legacy, not used
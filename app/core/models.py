@@ -18,6 +18,8 @@ class ChatRequest(BaseModel):
     subject: str = Field(default="default", max_length=50, description="Subject/course name")
     email: str = Field(default="anonimo", max_length=100, description="User email (anonymized)")
     mode: str = Field(default="rag", description="Chat mode (rag, base, rag_lora)")
+    bypass_cache: bool = Field(default=False, description="Skip the semantic answer cache for this request")
+    debug: bool = Field(default=False, description="Return the per-phase timing breakdown (as in the Server-Timing header)")
     
     @field_validator('mode')
     def validate_mode(cls, v):
@@ -33,6 +35,13 @@ class ChatRequest(BaseModel):
         return v.strip()
 
 
+class PhaseTiming(BaseModel):
+    """Duration of one phase of a chat request"""
+    name: str = Field(..., description="Phase name (rate_limit, session, llm-1, tool-1, total...)")
+    duration_ms: float = Field(..., description="Phase duration in milliseconds")
+    description: Optional[str] = Field(None, description="Detail of the phase (e.g. the tool name)")
+
+
 class ChatResponse(BaseModel):
     """Simple response model for chat endpoint"""
     response: str = Field(..., description="Bot response text")
@@ -40,6 +49,8 @@ class ChatResponse(BaseModel):
     model_used: str = Field(..., description="Model type used for response")
     session_id: str = Field(..., description="Session identifier")
     query_type: str = Field(..., description="Classified query type")
+    cached: bool = Field(default=False, description="Whether the answer was served from the semantic answer cache")
+    timings: Optional[List[PhaseTiming]] = Field(None, description="Per-phase durations, only when the request sets debug")
 
 
 class ErrorResponse(BaseModel):
@@ -1,18 +1,31 @@
 """
 Rate limiting functionality for the API.
 
-This module provides in-memory rate limiting capabilities with:
+This module provides rate limiting capabilities with:
 - Per-user request counting
 - Sliding window implementation
 - Configurable limits and time windows
 - Request status checking
 - Automatic cleanup of old entries
+
+The backend is chosen with RATE_LIMIT_BACKEND:
+- "memory" (default): per-process sliding window. Each check only touches the
+  requesting user's entry (amortized O(1)), whatever the number of active users.
+  Users are kept in order of their last allowed request, so the background sweeper
+  finds the expired ones at the front without scanning the rest.
+- "mongo": sliding-window counters in MongoDB, shared by every worker and replica,
+  so the quota holds when the backend is scaled horizontally.
 """
 
 import os
 import time
+import math
+import asyncio
 import logging
-from typing import Dict
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -23,132 +36,369 @@ logger = logging.getLogger(__name__)
 # --- Rate Limiting Configuration ---
 RATE_LIMIT_REQUESTS = int(os.getenv("RATE_LIMIT_REQUESTS", "20"))  # 20 requests per minute
 RATE_LIMIT_WINDOW = int(os.getenv("RATE_LIMIT_WINDOW", "60"))      # 60 seconds window
+# Seconds between background sweeps of users with no request in the window (0 = disabled)
+RATE_LIMIT_SWEEP_INTERVAL = float(os.getenv("RATE_LIMIT_SWEEP_INTERVAL", "60"))
+# "memory" (per process) or "mongo" (shared by all workers and replicas)
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_MONGO_URI = os.getenv("RATE_LIMIT_MONGO_URI", os.getenv("MONGO_URI", "mongodb://mongodb:27017"))
+RATE_LIMIT_MONGO_DB = os.getenv("RATE_LIMIT_MONGO_DB", os.getenv("MONGODB_DATABASE", "chatbot_users"))
+RATE_LIMIT_MONGO_TIMEOUT_MS = int(os.getenv("RATE_LIMIT_MONGO_TIMEOUT_MS", "500"))
+# Seconds the counters read by a check are reused to answer get_rate_limit_info
+RATE_LIMIT_CACHE_TTL = float(os.getenv("RATE_LIMIT_CACHE_TTL", "1.0"))
+RATE_LIMIT_CACHE_SIZE = int(os.getenv("RATE_LIMIT_CACHE_SIZE", "10000"))
+
+
+class RateLimitBackend:
+    """Interface of the rate limit backends."""
+
+    async def acheck(self, user_identifier: str) -> bool:
+        """Record the request and return True if it is allowed, False if rate limited."""
+        raise NotImplementedError
+
+    async def ainfo(self, user_identifier: str) -> Dict[str, int]:
+        """Requests made and remaining in the current window, and when the limit resets."""
+        raise NotImplementedError
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {}
+
+    def start(self) -> None:
+        """Start background work, if any. Called on app startup."""
+
+    async def stop(self) -> None:
+        """Stop background work and release connections. Called on app shutdown."""
+
+
+class SlidingWindowRateLimiter(RateLimitBackend):
+    """
+    Exact sliding-window limiter: for each user, a deque with the timestamps of the
+    requests allowed in the last `window` seconds (never more than `limit`).
+    """
+
+    def __init__(self, limit: int = RATE_LIMIT_REQUESTS, window: int = RATE_LIMIT_WINDOW,
+                 sweep_interval: float = RATE_LIMIT_SWEEP_INTERVAL,
+                 clock: Callable[[], float] = time.time):
+        self.limit = limit
+        self.window = window
+        self.sweep_interval = sweep_interval
+        self._clock = clock
+        # user -> allowed request timestamps, least recently allowed user first
+        self._users: "OrderedDict[str, Deque[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"allowed": 0, "limited": 0, "swept": 0}
+
+    def _expire(self, requests: Deque[float], now: float) -> None:
+        cutoff = now - self.window
+        while requests and requests[0] <= cutoff:
+            requests.popleft()
+
+    def check(self, user_identifier: str) -> bool:
+        """Record the request and return True if it is allowed, False if rate limited."""
+        now = self._clock()
+        with self._lock:
+            requests = self._users.get(user_identifier)
+            if requests is None:
+                requests = self._users[user_identifier] = deque()
+            else:
+                self._expire(requests, now)
+            if len(requests) >= self.limit:
+                self.stats["limited"] += 1
+                logger.warning(f"Rate limit exceeded for user: {user_identifier[:8]}... ({len(requests)} requests)")
+                return False
+            requests.append(now)
+            self._users.move_to_end(user_identifier)
+            self.stats["allowed"] += 1
+            return True
+
+    def info(self, user_identifier: str) -> Dict[str, int]:
+        """Requests made and remaining in the current window, and when the oldest one expires."""
+        now = self._clock()
+        with self._lock:
+            requests = self._users.get(user_identifier)
+            if requests:
+                self._expire(requests, now)
+            requests_made = len(requests) if requests else 0
+            reset_time = int(requests[0] + self.window) if requests_made else int(now + self.window)
+        return {
+            "requests_made": requests_made,
+            "requests_remaining": max(0, self.limit - requests_made),
+            "reset_time": reset_time
+        }
+
+    def sweep(self) -> int:
+        """Drop the users with no request left in the window; returns how many were dropped."""
+        cutoff = self._clock() - self.window
+        removed = 0
+        with self._lock:
+            while self._users:
+                user_identifier, requests = next(iter(self._users.items()))
+                if requests and requests[-1] > cutoff:
+                    break  # every user after this one made a request even later
+                del self._users[user_identifier]
+                removed += 1
+            self.stats["swept"] += removed
+        return removed
+
+    async def acheck(self, user_identifier: str) -> bool:
+        return self.check(user_identifier)
+
+    async def ainfo(self, user_identifier: str) -> Dict[str, int]:
+        return self.info(user_identifier)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"tracked_users": len(self._users), **self.stats}
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            removed = self.sweep()
+            if removed:
+                logger.debug(f"Cleaned up {removed} expired rate limit entries")
+
+    def start(self) -> None:
+        """Start the background sweeper. Called on app startup."""
+        if self.sweep_interval > 0 and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the background sweeper. Called on app shutdown."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+class MongoRateLimiter(RateLimitBackend):
+    """
+    Sliding-window counter shared through MongoDB by every worker and replica.
+
+    One document per user keeps the request count of the current fixed window and of the
+    previous one; the estimate is `previous * (part of the window still to run) + current`.
+    A check is a single atomic find_one_and_update (update pipeline with upsert) that only
+    counts the request if it is allowed. Documents expire through a TTL index.
+
+    Local cache: the counters returned by a check answer `ainfo` for RATE_LIMIT_CACHE_TTL
+    seconds (the X-RateLimit-* headers of the same request), and a user whose cached
+    estimate is over the limit is rejected without a round trip (counters only grow, so
+    the shared estimate cannot be lower). If MongoDB is unreachable, the checks fall back
+    to an in-memory limiter of this process.
+    """
+
+    def __init__(self, collection=None, limit: int = RATE_LIMIT_REQUESTS, window: int = RATE_LIMIT_WINDOW,
+                 cache_ttl: float = RATE_LIMIT_CACHE_TTL, cache_size: int = RATE_LIMIT_CACHE_SIZE,
+                 uri: str = RATE_LIMIT_MONGO_URI, db_name: str = RATE_LIMIT_MONGO_DB,
+                 clock: Callable[[], float] = time.time):
+        self.limit = limit
+        self.window = window
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self.uri = uri
+        self.db_name = db_name
+        self._clock = clock
+        self._client = None
+        self._collection = collection
+        self._indexed = False
+        # user -> (read at, window number, previous window count, current window count)
+        self._cache: "OrderedDict[str, Tuple[float, int, int, int]]" = OrderedDict()
+        self._fallback = SlidingWindowRateLimiter(limit, window, sweep_interval=0, clock=clock)
+        self.stats = {"allowed": 0, "limited": 0, "round_trips": 0, "cache_hits": 0, "errors": 0}
+
+    async def _get_collection(self):
+        if self._collection is None:
+            from motor.motor_asyncio import AsyncIOMotorClient
+            self._client = AsyncIOMotorClient(self.uri, serverSelectionTimeoutMS=RATE_LIMIT_MONGO_TIMEOUT_MS)
+            self._collection = self._client[self.db_name]["rate_limits"]
+        if not self._indexed:
+            await self._collection.create_index("expires_at", expireAfterSeconds=0)
+            self._indexed = True
+        return self._collection
+
+    def _check_pipeline(self, window_number: int, weight: float, expires_at: datetime) -> List[Dict[str, Any]]:
+        """Roll the window if needed, then count the request only if the estimate is under the limit."""
+        in_window = {"$eq": ["$window", window_number]}
+        return [
+            {"$set": {
+                "prev": {"$switch": {"branches": [
+                    {"case": in_window, "then": {"$ifNull": ["$prev", 0]}},
+                    {"case": {"$eq": ["$window", window_number - 1]}, "then": {"$ifNull": ["$count", 0]}},
+                ], "default": 0}},
+                "count": {"$cond": [in_window, {"$ifNull": ["$count", 0]}, 0]},
+                "window": window_number,
+            }},
+            {"$set": {"allowed": {"$lt": [{"$add": [{"$multiply": ["$prev", weight]}, "$count"]}, self.limit]}}},
+            {"$set": {
+                "count": {"$cond": ["$allowed", {"$add": ["$count", 1]}, "$count"]},
+                "expires_at": expires_at,
+            }},
+        ]
+
+    def _estimate(self, now: float, window_number: int, prev: int, count: int) -> float:
+        current = int(now // self.window)
+        remaining = 1 - (now % self.window) / self.window
+        if current == window_number:
+            return prev * remaining + count
+        if current == window_number + 1:
+            return count * remaining
+        return 0.0
+
+    def _reset_time(self, now: float, window_number: int, prev: int, count: int) -> float:
+        """When the estimate drops under the limit again (if no more requests arrive)."""
+        start = window_number * self.window
+        if count >= self.limit:
+            return start + self.window * (2 - self.limit / count)
+        if prev > 0:
+            return max(now, start + self.window * (1 - (self.limit - count) / prev))
+        return now
+
+    def _remember(self, user_identifier: str, entry: Tuple[float, int, int, int]) -> None:
+        self._cache[user_identifier] = entry
+        self._cache.move_to_end(user_identifier)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def acheck(self, user_identifier: str) -> bool:
+        now = self._clock()
+        cached = self._cache.get(user_identifier)
+        if cached is not None and self._estimate(now, *cached[1:]) >= self.limit:
+            self.stats["cache_hits"] += 1
+            self.stats["limited"] += 1
+            return False
+
+        from pymongo import ReturnDocument
+        window_number = int(now // self.window)
+        weight = 1 - (now % self.window) / self.window
+        expires_at = datetime.fromtimestamp((window_number + 2) * self.window, tz=timezone.utc)
+        try:
+            collection = await self._get_collection()
+            doc = await collection.find_one_and_update(
+                {"_id": user_identifier},
+                self._check_pipeline(window_number, weight, expires_at),
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.warning(f"Shared rate limit unavailable, using the local limiter: {e}")
+            return self._fallback.check(user_identifier)
+
+        self.stats["round_trips"] += 1
+        self._remember(user_identifier, (now, doc["window"], doc["prev"], doc["count"]))
+        if not doc["allowed"]:
+            self.stats["limited"] += 1
+            logger.warning(f"Rate limit exceeded for user: {user_identifier[:8]}... ({doc['count']} requests)")
+            return False
+        self.stats["allowed"] += 1
+        return True
+
+    async def ainfo(self, user_identifier: str) -> Dict[str, int]:
+        now = self._clock()
+        cached = self._cache.get(user_identifier)
+        if cached is not None and now - cached[0] <= self.cache_ttl:
+            self.stats["cache_hits"] += 1
+        else:
+            try:
+                collection = await self._get_collection()
+                doc = await collection.find_one({"_id": user_identifier})
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.warning(f"Shared rate limit unavailable, using the local limiter: {e}")
+                return self._fallback.info(user_identifier)
+            self.stats["round_trips"] += 1
+            cached = (now, doc["window"], doc["prev"], doc["count"]) if doc else (now, int(now // self.window), 0, 0)
+            self._remember(user_identifier, cached)
+
+        requests_made = int(self._estimate(now, *cached[1:]))
+        if requests_made >= self.limit:
+            reset_time = math.ceil(self._reset_time(now, *cached[1:]))
+        else:
+            reset_time = (int(now // self.window) + 1) * self.window
+        return {
+            "requests_made": requests_made,
+            "requests_remaining": max(0, self.limit - requests_made),
+            "reset_time": int(reset_time)
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"cached_users": len(self._cache), **self.stats}
+
+    async def stop(self) -> None:
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+            self._collection = None
+            self._indexed = False
+
+
+def create_rate_limiter(backend: str = RATE_LIMIT_BACKEND) -> RateLimitBackend:
+    """Rate limit backend for RATE_LIMIT_BACKEND ("memory" or "mongo")."""
+    backend = backend.lower()
+    if backend == "memory":
+        return SlidingWindowRateLimiter()
+    if backend == "mongo":
+        return MongoRateLimiter()
+    raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {backend!r} (expected 'memory' or 'mongo')")
+
 
 # --- Rate Limiting State ---
-# In-memory rate limiting storage (requests per minute per user)
-rate_limit_storage: Dict[str, Dict] = {}
+rate_limiter = create_rate_limiter()
 
 
-def check_rate_limit(user_identifier: str) -> bool:
+async def check_rate_limit(user_identifier: str) -> bool:
     """
     Simple rate limiting: Allow max X requests per minute per user.
     Returns True if request is allowed, False if rate limited.
-    
+
     Args:
         user_identifier: Unique identifier for the user (e.g., hashed email)
-        
+
     Returns:
         bool: True if request is allowed, False if rate limited
     """
-    current_time = time.time()
-    
-    # Clean up old entries (older than rate limit window)
-    cleanup_time = current_time - RATE_LIMIT_WINDOW
-    users_to_remove = []
-    
-    for user_id, data in rate_limit_storage.items():
-        # Remove old requests outside the time window
-        data['requests'] = [req_time for req_time in data['requests'] if req_time > cleanup_time]
-        if not data['requests']:
-            users_to_remove.append(user_id)
-    
-    # Clean up empty users
-    for user_id in users_to_remove:
-        del rate_limit_storage[user_id]
-    
-    # Check current user's rate limitvalidator
-    if user_identifier not in rate_limit_storage:
-        rate_limit_storage[user_identifier] = {'requests': []}
-    
-    user_requests = rate_limit_storage[user_identifier]['requests']
-    
-    # Count requests in current window
-    recent_requests = [req_time for req_time in user_requests if req_time > cleanup_time]
-    
-    if len(recent_requests) >= RATE_LIMIT_REQUESTS:
-        logger.warning(f"Rate limit exceeded for user: {user_identifier[:8]}... ({len(recent_requests)} requests)")
-        return False
-    
-    # Add current request
-    user_requests.append(current_time)
-    rate_limit_storage[user_identifier]['requests'] = user_requests
-    
-    return True
-
-
-def get_rate_limit_info(user_identifier: str) -> Dict[str, int]:
+    return await rate_limiter.acheck(user_identifier)
+
+
+async def get_rate_limit_info(user_identifier: str) -> Dict[str, int]:
     """
     Get rate limit information for a user.
-    
+
     Args:
         user_identifier: Unique identifier for the user
-        
+
     Returns:
         Dict containing requests_made, requests_remaining, and reset_time
     """
-    current_time = time.time()
-    cleanup_time = current_time - RATE_LIMIT_WINDOW
-    
-    if user_identifier not in rate_limit_storage:
-        return {
-            "requests_made": 0,
-            "requests_remaining": RATE_LIMIT_REQUESTS,
-            "reset_time": int(current_time + RATE_LIMIT_WINDOW)
-        }
-    
-    user_requests = rate_limit_storage[user_identifier]['requests']
-    recent_requests = [req_time for req_time in user_requests if req_time > cleanup_time]
-    
-    requests_made = len(recent_requests)
-    requests_remaining = max(0, RATE_LIMIT_REQUESTS - requests_made)
-    
-    # Calculate reset time (when the oldest request in window expires)
-    if recent_requests:
-        oldest_request = min(recent_requests)
-        reset_time = int(oldest_request + RATE_LIMIT_WINDOW)
-    else:
-        reset_time = int(current_time + RATE_LIMIT_WINDOW)
-    
-    return {
-        "requests_made": requests_made,
-        "requests_remaining": requests_remaining,
-        "reset_time": reset_time
-    }
+    return await rate_limiter.ainfo(user_identifier)
 
 
-def get_rate_limit_config() -> Dict[str, int]:
+def get_rate_limit_config() -> Dict[str, Any]:
     """
     Get the current rate limiting configuration.
-    
+
     Returns:
         Dict containing the rate limiting configuration
     """
     return {
         "requests_per_window": RATE_LIMIT_REQUESTS,
-        "window_seconds": RATE_LIMIT_WINDOW
+        "window_seconds": RATE_LIMIT_WINDOW,
+        "backend": RATE_LIMIT_BACKEND
     }
 
 
 def cleanup_expired_rate_limits() -> int:
     """
     Clean up expired rate limit entries to free memory.
-    
+    The background sweeper does this periodically; this runs one sweep now.
+    (The MongoDB backend expires its entries with a TTL index.)
+
     Returns:
         Number of cleaned up entries
     """
-    current_time = time.time()
-    cleanup_time = current_time - RATE_LIMIT_WINDOW
-    users_to_remove = []
-    
-    for user_id, data in rate_limit_storage.items():
-        # Remove old requests outside the time window
-        data['requests'] = [req_time for req_time in data['requests'] if req_time > cleanup_time]
-        if not data['requests']:
-            users_to_remove.append(user_id)
-    
-    # Clean up empty users
-    for user_id in users_to_remove:
-        del rate_limit_storage[user_id]
-    
-    logger.debug(f"Cleaned up {len(users_to_remove)} expired rate limit entries")
-    return len(users_to_remove)
+    if not isinstance(rate_limiter, SlidingWindowRateLimiter):
+        return 0
+    removed = rate_limiter.sweep()
+    logger.debug(f"Cleaned up {removed} expired rate limit entries")
+    return removed
@@ -0,0 +1,326 @@
+"""
+Control de admisión de las ejecuciones del agente.
+
+Cada ejecución del grafo tiene abierta una o varias llamadas al LLM durante segundos.
+Si Gemini se ralentiza o nos limita la cuota, las peticiones se acumulan sin límite
+hasta agotar la memoria o encadenar timeouts. Aquí se acota cuántas se ejecutan a la vez:
+
+- Como mucho AGENT_MAX_CONCURRENT ejecuciones en total y AGENT_MAX_PER_SUBJECT por
+  asignatura, para que una asignatura en época de exámenes no acapare el servicio.
+- Las que no caben esperan en una cola acotada (AGENT_QUEUE_SIZE) un máximo de
+  AGENT_QUEUE_TIMEOUT segundos. Con la cola llena se rechazan al momento (503 con
+  Retry-After estimado a partir de la duración media de las ejecuciones).
+- Las peticiones de sesiones lanzadas desde Moodle (LTI) tienen prioridad: salen antes
+  de la cola y, con la cola llena, ocupan el sitio de la última petición sin prioridad.
+  La prioridad solo se concede si el token de sesión corresponde a una sesión LTI activa
+  (`LTIPriority`, con la consulta cacheada unos segundos).
+
+Solo se pide plaza para ejecutar el grafo: los aciertos de la caché de respuestas y las
+peticiones acopladas a otra idéntica no la necesitan.
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from services.metrics_service import metrics, current_timings
+
+# --- CONFIGURACIÓN ---
+# Ejecuciones del agente simultáneas en el proceso
+AGENT_MAX_CONCURRENT = int(os.getenv("AGENT_MAX_CONCURRENT", "16"))
+# Ejecuciones simultáneas de una misma asignatura
+AGENT_MAX_PER_SUBJECT = int(os.getenv("AGENT_MAX_PER_SUBJECT", "8"))
+# Peticiones esperando plaza; a partir de ahí, 503
+AGENT_QUEUE_SIZE = int(os.getenv("AGENT_QUEUE_SIZE", "64"))
+# Segundos que una petición espera plaza antes del 503
+AGENT_QUEUE_TIMEOUT = float(os.getenv("AGENT_QUEUE_TIMEOUT", "20"))
+
+# Segundos que se reutiliza la validación de un token de sesión LTI (válido o no)
+LTI_TOKEN_CACHE_TTL = float(os.getenv("LTI_TOKEN_CACHE_TTL", "60"))
+# Tokens recordados como mucho; se descartan los menos usados
+LTI_TOKEN_CACHE_SIZE = int(os.getenv("LTI_TOKEN_CACHE_SIZE", "10000"))
+# Espera máxima (segundos) de la consulta de la sesión; si se agota, sin prioridad
+LTI_TOKEN_LOOKUP_TIMEOUT = float(os.getenv("LTI_TOKEN_LOOKUP_TIMEOUT", "0.5"))
+# Segundos sin volver a consultar tras un error o timeout (MongoDB caído)
+LTI_TOKEN_ERROR_TTL = float(os.getenv("LTI_TOKEN_ERROR_TTL", "5"))
+
+# Menor valor, más prioridad
+PRIORITY_LTI = 0
+PRIORITY_DEFAULT = 1
+_PRIORITY_NAMES = {PRIORITY_LTI: "lti", PRIORITY_DEFAULT: "default"}
+
+# Peso de la última ejecución en la duración media usada para estimar el Retry-After
+_RUN_TIME_SMOOTHING = 0.2
+
+
+class AdmissionRejectedError(Exception):
+    """No hay plaza para ejecutar el agente (503)."""
+
+    status_code = 503
+
+    def __init__(self, detail: str, retry_after: int = 1):
+        super().__init__(detail)
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "subject", "future")
+
+    def __init__(self, priority: int, seq: int, subject: str, future: asyncio.Future):
+        self.priority = priority
+        self.seq = seq
+        self.subject = subject
+        self.future = future
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class AdmissionController:
+    """
+    Plazas de ejecución global y por asignatura con una cola de espera por prioridad.
+
+    Invariante: tras cada cambio de estado ninguna petición de la cola tiene plaza
+    disponible, así que una petición nueva con plaza puede entrar sin adelantar a nadie.
+    """
+
+    def __init__(self, max_concurrent: int = AGENT_MAX_CONCURRENT, max_per_subject: int = AGENT_MAX_PER_SUBJECT,
+                 queue_size: int = AGENT_QUEUE_SIZE, queue_timeout: float = AGENT_QUEUE_TIMEOUT):
+        self.max_concurrent = max_concurrent
+        self.max_per_subject = max_per_subject
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.running = 0
+        self._by_subject: Dict[str, int] = {}
+        self._queue: List[_Waiter] = []
+        self._seq = itertools.count()
+        # Duración media de una ejecución (s); se parte de una estimación conservadora
+        self._avg_run = 5.0
+        self.stats = {"admitted": 0, "queued": 0, "rejected": 0, "shed": 0, "timeouts": 0}
+
+    def _has_slot(self, subject: str) -> bool:
+        return self.running < self.max_concurrent and self._by_subject.get(subject, 0) < self.max_per_subject
+
+    def retry_after(self) -> int:
+        """Segundos estimados hasta que se vacíe la cola actual."""
+        waves = (len(self._queue) + 1) / self.max_concurrent
+        return max(1, min(60, math.ceil(self._avg_run * waves)))
+
+    def would_reject(self, subject: str, priority: int = PRIORITY_DEFAULT) -> bool:
+        """Si una petición nueva se rechazaría ahora mismo (para contestar 503 antes de empezar un stream)."""
+        if self._has_slot(subject) or len(self._queue) < self.queue_size:
+            return False
+        return not any(waiter.priority > priority for waiter in self._queue)
+
+    def _start(self, subject: str) -> None:
+        self.running += 1
+        self._by_subject[subject] = self._by_subject.get(subject, 0) + 1
+        self.stats["admitted"] += 1
+        metrics.in_flight.inc("agent")
+
+    def _remove(self, waiter: _Waiter) -> None:
+        self._queue.remove(waiter)
+        heapq.heapify(self._queue)
+        metrics.admission_queued.dec(_PRIORITY_NAMES[waiter.priority])
+
+    def _dispatch(self) -> None:
+        """Da plaza a las peticiones de la cola, por prioridad, cuyas asignaturas tengan hueco."""
+        skipped = []
+        while self._queue and self.running < self.max_concurrent:
+            waiter = heapq.heappop(self._queue)
+            if self._by_subject.get(waiter.subject, 0) >= self.max_per_subject:
+                skipped.append(waiter)
+                continue
+            metrics.admission_queued.dec(_PRIORITY_NAMES[waiter.priority])
+            self._start(waiter.subject)
+            waiter.future.set_result(None)
+        for waiter in skipped:
+            heapq.heappush(self._queue, waiter)
+
+    def _rejected(self, reason: str, priority: int, start: float) -> AdmissionRejectedError:
+        self.stats["timeouts" if reason == "timeout" else reason] += 1
+        self._observe(priority, reason, start)
+        return AdmissionRejectedError("The assistant is at capacity, please try again shortly",
+                                      retry_after=self.retry_after())
+
+    def _observe(self, priority: int, outcome: str, start: float) -> None:
+        elapsed = time.perf_counter() - start
+        metrics.admission_wait.observe(elapsed, _PRIORITY_NAMES[priority], outcome)
+        timings = current_timings()
+        if timings is not None:
+            timings.add("admission", start, elapsed)
+
+    async def acquire(self, subject: str, priority: int = PRIORITY_DEFAULT) -> None:
+        """
+        Espera plaza para una ejecución de `subject`. Hay que devolverla con `release`.
+
+        Raises:
+            AdmissionRejectedError: cola llena, desplazada por una petición prioritaria
+                o sin plaza tras AGENT_QUEUE_TIMEOUT segundos
+        """
+        start = time.perf_counter()
+        if self._has_slot(subject):
+            self._start(subject)
+            self._observe(priority, "admitted", start)
+            return
+
+        if len(self._queue) >= self.queue_size:
+            # La última en salir de la cola: menor prioridad y la más reciente
+            victim = max(self._queue, default=None)
+            if victim is None or victim.priority <= priority:
+                raise self._rejected("rejected", priority, start)
+            self._remove(victim)
+            self.stats["shed"] += 1
+            victim.future.set_exception(AdmissionRejectedError(
+                "The assistant is at capacity, please try again shortly", retry_after=self.retry_after()))
+
+        waiter = _Waiter(priority, next(self._seq), subject, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._queue, waiter)
+        self.stats["queued"] += 1
+        metrics.admission_queued.inc(_PRIORITY_NAMES[priority])
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout)
+        except AdmissionRejectedError:
+            self._observe(priority, "shed", start)
+            raise
+        except asyncio.TimeoutError:
+            if not (waiter.future.done() and waiter.future.exception() is None):
+                self._remove(waiter)
+                raise self._rejected("timeout", priority, start)
+        except BaseException:
+            # Cancelada mientras esperaba: si ya tenía plaza, se devuelve
+            if waiter.future.done() and not waiter.future.exception():
+                self.release(subject)
+            elif not waiter.future.done():
+                self._remove(waiter)
+            raise
+        self._observe(priority, "admitted", start)
+
+    def release(self, subject: str, run_seconds: Optional[float] = None) -> None:
+        """Devuelve la plaza y se la da a la siguiente petición de la cola que quepa."""
+        self.running -= 1
+        remaining = self._by_subject[subject] - 1
+        if remaining:
+            self._by_subject[subject] = remaining
+        else:
+            del self._by_subject[subject]
+        metrics.in_flight.dec("agent")
+        if run_seconds is not None:
+            self._avg_run += _RUN_TIME_SMOOTHING * (run_seconds - self._avg_run)
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, subject: str, priority: int = PRIORITY_DEFAULT) -> AsyncIterator[None]:
+        """Plaza de ejecución mientras dura el bloque."""
+        await self.acquire(subject, priority)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(subject, time.perf_counter() - start)
+
+    def get_stats(self) -> Dict[str, Any]:
+        queued = {name: 0 for name in _PRIORITY_NAMES.values()}
+        for waiter in self._queue:
+            queued[_PRIORITY_NAMES[waiter.priority]] += 1
+        return {
+            "running": self.running,
+            "running_by_subject": dict(self._by_subject),
+            "waiting": queued,
+            "max_concurrent": self.max_concurrent,
+            "max_per_subject": self.max_per_subject,
+            "queue_size": self.queue_size,
+            "queue_timeout": self.queue_timeout,
+            "avg_run_seconds": round(self._avg_run, 3),
+            "retry_after": self.retry_after(),
+            **self.stats,
+        }
+
+
+admission = AdmissionController()
+
+
+class LTIPriority:
+    """
+    Prioridad de una petición según su cabecera X-Session-Token. Solo las sesiones LTI
+    activas (según `lookup`, que devuelve la sesión o None) tienen PRIORITY_LTI: un token
+    inventado no adelanta a nadie en la cola. El resultado se cachea LTI_TOKEN_CACHE_TTL
+    segundos, y nunca más allá de la caducidad de la sesión.
+
+    La consulta está en el camino de cada petición: se acota a `lookup_timeout` segundos
+    y, si falla o se agota, no se vuelve a consultar durante `error_ttl` segundos (las
+    peticiones no cacheadas van sin prioridad mientras tanto).
+    """
+
+    def __init__(self, lookup: Callable[[str], Awaitable[Optional[Dict[str, Any]]]],
+                 ttl: float = LTI_TOKEN_CACHE_TTL, max_size: int = LTI_TOKEN_CACHE_SIZE,
+                 lookup_timeout: float = LTI_TOKEN_LOOKUP_TIMEOUT, error_ttl: float = LTI_TOKEN_ERROR_TTL,
+                 clock: Callable[[], float] = time.time):
+        self._lookup = lookup
+        self.ttl = ttl
+        self.max_size = max_size
+        self.lookup_timeout = lookup_timeout
+        self.error_ttl = error_ttl
+        self._clock = clock
+        # token -> (sesión activa, válido hasta)
+        self._tokens: "OrderedDict[str, Tuple[bool, float]]" = OrderedDict()
+        # Tras un error no se consulta hasta este instante
+        self._unavailable_until = 0.0
+        self.stats = {"hits": 0, "lookups": 0, "invalid": 0, "errors": 0, "skipped": 0}
+
+    @staticmethod
+    def _expires_at(session: Dict[str, Any]) -> Optional[float]:
+        expires_at = session.get("expires_at")
+        if not isinstance(expires_at, datetime):
+            return None
+        if expires_at.tzinfo is None:  # MongoDB guarda UTC sin zona
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        return expires_at.timestamp()
+
+    async def is_active(self, token: str) -> bool:
+        now = self._clock()
+        cached = self._tokens.get(token)
+        if cached is not None and cached[1] > now:
+            self._tokens.move_to_end(token)
+            self.stats["hits"] += 1
+            return cached[0]
+
+        if now < self._unavailable_until:
+            self.stats["skipped"] += 1
+            return False
+
+        self.stats["lookups"] += 1
+        try:
+            session = await asyncio.wait_for(self._lookup(token), self.lookup_timeout)
+        except Exception:
+            # Sin poder validar, sin prioridad; no se reintenta hasta pasados error_ttl segundos
+            self.stats["errors"] += 1
+            self._unavailable_until = self._clock() + self.error_ttl
+            return False
+
+        active = session is not None
+        valid_until = now + self.ttl
+        if active:
+            session_end = self._expires_at(session)
+            if session_end is not None:
+                valid_until = min(valid_until, session_end)
+        else:
+            self.stats["invalid"] += 1
+        self._tokens[token] = (active, valid_until)
+        self._tokens.move_to_end(token)
+        while len(self._tokens) > self.max_size:
+            self._tokens.popitem(last=False)
+        return active
+
+    async def resolve(self, token: Optional[str]) -> int:
+        """PRIORITY_LTI si `token` es de una sesión LTI activa; si no, PRIORITY_DEFAULT."""
+        if token and await self.is_active(token):
+            return PRIORITY_LTI
+        return PRIORITY_DEFAULT
@@ -0,0 +1,282 @@
+"""
+Caché semántica de respuestas por asignatura.
+
+Muchas preguntas se repiten casi literalmente (porcentajes de evaluación, quién imparte
+la asignatura, tutorías...). Antes de lanzar el grafo, `query_rag` busca una respuesta
+previa de la misma asignatura cuya pregunta sea suficientemente parecida:
+
+- Primero por texto normalizado (sin llamar al servicio de embeddings).
+- Después por similitud coseno del embedding de la pregunta (ANSWER_CACHE_THRESHOLD),
+  con un único producto matriz-vector sobre los embeddings de la asignatura.
+
+Cada entrada guarda la versión de los documentos de la asignatura con la que se
+generó (corpus ChromaDB + guía docente, según el RAG Service). Cuando la versión
+cambia se descartan todas las entradas de esa asignatura.
+
+Solo se guardan respuestas basadas en documentos (con fuentes) a preguntas que no
+dependen del contexto de la conversación.
+"""
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from services.rag_client import rag_client
+from services.utils_service import normalize_text
+
+# --- CONFIGURACIÓN ---
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+# Similitud coseno mínima para considerar dos preguntas equivalentes
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.93"))
+# Vida máxima de una entrada (segundos), aunque no cambien los documentos
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "86400"))
+# Entradas por asignatura (se descartan las menos usadas recientemente)
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "256"))
+# Cada cuánto se vuelve a preguntar al RAG Service la versión de los documentos
+ANSWER_CACHE_VERSION_TTL = float(os.getenv("ANSWER_CACHE_VERSION_TTL", "30"))
+
+# Preguntas que dependen de turnos anteriores ("¿y eso?", "dame otro ejemplo")
+_FOLLOW_UP_START = re.compile(r"^(y|e|pero|entonces|vale|ok|y si|y que|y el|y la)\b")
+_FOLLOW_UP_WORDS = re.compile(
+    r"\b(eso|esto|esos|esas|estos|estas|anterior|anteriores|dijiste|otro ejemplo|mas detalle|lo mismo)\b"
+)
+_MIN_QUESTION_WORDS = 3
+
+
+def is_cacheable_question(question: str) -> bool:
+    """Heurística: la pregunta se entiende sin el resto de la conversación."""
+    text = normalize_text(question)
+    if len(text.split()) < _MIN_QUESTION_WORDS:
+        return False
+    return not (_FOLLOW_UP_START.match(text) or _FOLLOW_UP_WORDS.search(text))
+
+
+def _unit(vector: List[float]) -> np.ndarray:
+    array = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(array))
+    return array / norm if norm else array
+
+
+class CacheEntry:
+    """Respuesta cacheada con el vector de su pregunta y la versión de los documentos."""
+
+    def __init__(self, question: str, vector: np.ndarray, result: Dict[str, Any], version: str):
+        self.question = question
+        self.vector = vector
+        self.result = result
+        self.version = version
+        self.created_at = time.time()
+        self.hits = 0
+
+
+class CacheProbe:
+    """Resultado de una búsqueda fallida, reutilizable para guardar la respuesta sin volver a embeber."""
+
+    def __init__(self, subject: str, key: str, question: str, vector: np.ndarray, version: str):
+        self.subject = subject
+        self.key = key
+        self.question = question
+        self.vector = vector
+        self.version = version
+
+
+class SubjectCache:
+    """Entradas y contadores de una asignatura."""
+
+    def __init__(self):
+        self.entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self.version: Optional[str] = None
+        self.version_checked_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.skipped = 0
+        self.invalidations = 0
+        # Matriz de vectores de las entradas, reconstruida solo cuando cambian las entradas
+        self._index: Optional[Tuple[str, int, List[str], np.ndarray]] = None
+
+    def changed(self) -> None:
+        """Llamar tras añadir o quitar entradas."""
+        self._index = None
+
+    def nearest(self, vector: np.ndarray, version: str) -> Tuple[Optional[str], float]:
+        """Entrada de la versión dada más parecida al vector (unitario) y su similitud coseno."""
+        if self._index is None or self._index[:2] != (version, len(vector)):
+            keys = [key for key, entry in self.entries.items()
+                    if entry.version == version and len(entry.vector) == len(vector)]
+            matrix = (np.stack([self.entries[key].vector for key in keys]) if keys
+                      else np.empty((0, len(vector)), dtype=np.float32))
+            self._index = (version, len(vector), keys, matrix)
+        _, _, keys, matrix = self._index
+        if not keys:
+            return None, -1.0
+        scores = matrix @ vector
+        best = int(np.argmax(scores))
+        return keys[best], float(scores[best])
+
+    def to_dict(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "version": self.version,
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "skipped": self.skipped,
+            "invalidations": self.invalidations,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+class SemanticAnswerCache:
+    """Caché semántica de respuestas, separada por asignatura."""
+
+    def __init__(self,
+                 enabled: bool = ANSWER_CACHE_ENABLED,
+                 threshold: float = ANSWER_CACHE_THRESHOLD,
+                 ttl: float = ANSWER_CACHE_TTL,
+                 max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+                 version_ttl: float = ANSWER_CACHE_VERSION_TTL):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.version_ttl = version_ttl
+        self._subjects: Dict[str, SubjectCache] = {}
+
+    def _subject(self, subject: str) -> SubjectCache:
+        cache = self._subjects.get(subject)
+        if cache is None:
+            cache = self._subjects[subject] = SubjectCache()
+        return cache
+
+    async def _current_version(self, subject: str, cache: SubjectCache) -> Optional[str]:
+        """Versión de los documentos; si ha cambiado se vacía la caché de la asignatura."""
+        now = time.time()
+        if cache.version is not None and now - cache.version_checked_at < self.version_ttl:
+            return cache.version
+
+        version = await rag_client.aget_subject_version(subject)
+        if version is None:
+            # Sin versión no se puede garantizar que la respuesta siga siendo válida
+            return None
+        if cache.version is not None and version != cache.version and cache.entries:
+            print(f"--- INFO: Documentos de '{subject}' actualizados, "
+                  f"se descartan {len(cache.entries)} respuestas cacheadas ---")
+            cache.entries.clear()
+            cache.changed()
+            cache.invalidations += 1
+        cache.version = version
+        cache.version_checked_at = now
+        return version
+
+    def _expire(self, cache: SubjectCache) -> None:
+        deadline = time.time() - self.ttl
+        expired = [k for k, e in cache.entries.items() if e.created_at < deadline]
+        for key in expired:
+            del cache.entries[key]
+        if expired:
+            cache.changed()
+
+    def _hit(self, cache: SubjectCache, key: str, entry: CacheEntry) -> Dict[str, Any]:
+        cache.entries.move_to_end(key)
+        cache.hits += 1
+        entry.hits += 1
+        return dict(entry.result)
+
+    async def lookup(self, subject: str, question: str) -> Tuple[Optional[Dict[str, Any]], Optional[CacheProbe]]:
+        """
+        Busca una respuesta previa para la pregunta.
+
+        Returns:
+            Tupla (resultado cacheado o None, probe para `store` o None si no se debe cachear)
+        """
+        if not self.enabled or not subject:
+            return None, None
+        cache = self._subject(subject)
+        if not is_cacheable_question(question):
+            cache.skipped += 1
+            return None, None
+
+        version = await self._current_version(subject, cache)
+        if version is None:
+            cache.skipped += 1
+            return None, None
+
+        self._expire(cache)
+        key = normalize_text(question)
+        entry = cache.entries.get(key)
+        if entry is not None and entry.version == version:
+            return self._hit(cache, key, entry), None
+
+        vector = await rag_client.aembed_query(question)
+        if not vector:
+            cache.skipped += 1
+            return None, None
+        vector = _unit(vector)
+
+        best_key, best_score = cache.nearest(vector, version)
+        if best_key is not None and best_score >= self.threshold:
+            print(f"--- INFO: Respuesta cacheada para '{subject}' (similitud {best_score:.3f}) ---")
+            return self._hit(cache, best_key, cache.entries[best_key]), None
+
+        cache.misses += 1
+        return None, CacheProbe(subject, key, question, vector, version)
+
+    def store(self, probe: Optional[CacheProbe], result: Dict[str, Any]) -> bool:
+        """Guarda la respuesta generada tras un fallo de `lookup`. Devuelve True si se guardó."""
+        if probe is None or not result.get("response") or not result.get("sources"):
+            return False
+        cache = self._subject(probe.subject)
+        if cache.version != probe.version:
+            # Los documentos cambiaron mientras se generaba la respuesta
+            return False
+        cache.entries[probe.key] = CacheEntry(probe.question, probe.vector, dict(result), probe.version)
+        cache.entries.move_to_end(probe.key)
+        while len(cache.entries) > self.max_entries:
+            cache.entries.popitem(last=False)
+        cache.changed()
+        return True
+
+    def record_bypass(self, subject: str) -> None:
+        """Cuenta una petición que pidió saltarse la caché."""
+        if self.enabled and subject:
+            self._subject(subject).bypassed += 1
+
+    def invalidate(self, subject: Optional[str] = None) -> int:
+        """Vacía la caché de una asignatura (o de todas). Devuelve las entradas descartadas."""
+        subjects = [subject] if subject else list(self._subjects)
+        removed = 0
+        for name in subjects:
+            cache = self._subjects.get(name)
+            if cache is None:
+                continue
+            removed += len(cache.entries)
+            cache.entries.clear()
+            cache.changed()
+            cache.version = None
+            cache.invalidations += 1
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        """Métricas globales y por asignatura (aciertos, fallos, tasa de acierto, entradas)."""
+        subjects = {name: cache.to_dict() for name, cache in self._subjects.items()}
+        hits = sum(s["hits"] for s in subjects.values())
+        misses = sum(s["misses"] for s in subjects.values())
+        return {
+            "enabled": self.enabled,
+            "threshold": self.threshold,
+            "entries": sum(s["entries"] for s in subjects.values()),
+            "hits": hits,
+            "misses": misses,
+            "bypassed": sum(s["bypassed"] for s in subjects.values()),
+            "hit_rate": round(hits / (hits + misses), 3) if hits + misses else 0.0,
+            "subjects": subjects,
+        }
+
+
+# Instancia global de la caché
+answer_cache = SemanticAnswerCache()
@@ -0,0 +1,866 @@
+"""
+Backends de checkpoints del grafo (la memoria persistente de las conversaciones).
+
+CHECKPOINT_BACKEND elige el almacenamiento:
+- "sqlite" (por defecto): SQLite en modo WAL con busy_timeout, de modo que varios
+  workers de uvicorn pueden compartir el fichero. La E/S va al pool de hilos.
+- "sqlite-async": AsyncSqliteSaver (aiosqlite). Necesita el event loop, así que se
+  abre al arrancar la aplicación (`checkpoint_maintenance.start`).
+- "mongo": el MongoDB que ya usa el User Service (colecciones `checkpoints` y
+  `checkpoint_writes`).
+- "memory": en memoria, para desarrollo y tests.
+
+Todos los backends conservan solo los CHECKPOINT_KEEP_LAST checkpoints más recientes
+de cada hilo. Los hilos escritos se marcan y una tarea en segundo plano los compacta
+cada CHECKPOINT_COMPACTION_INTERVAL segundos (al arrancar se compacta todo).
+
+La misma tarea registra la última actividad de cada hilo y borra por completo
+(checkpoints y escrituras) los hilos sin actividad en CHECKPOINT_THREAD_TTL_DAYS días.
+En SQLite, después se devuelven al sistema las páginas libres con `incremental_vacuum`.
+
+La lectura y la escritura de checkpoints que hace el grafo se miden en las etapas
+`checkpoint_load` y `checkpoint_save` de services.metrics_service.
+"""
+import asyncio
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+from langgraph.checkpoint.memory import InMemorySaver
+
+from services.metrics_service import metrics
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+# --- CONFIGURACIÓN ---
+CHECKPOINT_BACKEND = os.getenv("CHECKPOINT_BACKEND", "sqlite").lower()
+STORAGE_DIR = os.path.join(os.path.dirname(__file__), "..", "storage")
+CHECKPOINT_SQLITE_PATH = os.getenv("CHECKPOINT_SQLITE_PATH", os.path.join(STORAGE_DIR, "checkpoints.sqlite"))
+# Espera máxima (segundos) por el bloqueo de escritura cuando otro worker está escribiendo
+CHECKPOINT_SQLITE_BUSY_TIMEOUT = float(os.getenv("CHECKPOINT_SQLITE_BUSY_TIMEOUT", "10"))
+CHECKPOINT_MONGO_URI = os.getenv("CHECKPOINT_MONGO_URI", os.getenv("MONGO_URI", "mongodb://mongodb:27017"))
+CHECKPOINT_MONGO_DB = os.getenv("CHECKPOINT_MONGO_DB", "chatbot_checkpoints")
+# Checkpoints que se conservan por hilo (0 = sin límite). Con uno basta para continuar
+# la conversación; se guardan algunos más para poder depurar los últimos pasos.
+CHECKPOINT_KEEP_LAST = int(os.getenv("CHECKPOINT_KEEP_LAST", "10"))
+CHECKPOINT_COMPACTION_INTERVAL = float(os.getenv("CHECKPOINT_COMPACTION_INTERVAL", "300"))
+# Días sin actividad tras los que se borra un hilo entero (0 = nunca)
+CHECKPOINT_THREAD_TTL = float(os.getenv("CHECKPOINT_THREAD_TTL_DAYS", "30")) * 86400
+# Segundos que la actividad guardada de un hilo puede ir por detrás de su último checkpoint
+# (muy por debajo del TTL: la caducidad solo consulta la actividad guardada)
+CHECKPOINT_ACTIVITY_INTERVAL = float(os.getenv("CHECKPOINT_ACTIVITY_INTERVAL", "300"))
+# Páginas libres que se devuelven al sistema en cada pasada de mantenimiento (SQLite)
+CHECKPOINT_VACUUM_PAGES = int(os.getenv("CHECKPOINT_VACUUM_PAGES", "1000"))
+
+SUPPORTED_BACKENDS = ("sqlite", "sqlite-async", "mongo", "memory")
+
+ThreadKey = Tuple[str, str]
+
+
+def _thread_key(config: RunnableConfig) -> ThreadKey:
+    configurable = config["configurable"]
+    return str(configurable["thread_id"]), configurable.get("checkpoint_ns", "")
+
+
+class CompactionMixin:
+    """
+    Marca los hilos escritos, poda sus checkpoints antiguos y borra los hilos inactivos.
+
+    La última actividad de cada hilo se acumula en memoria y se vuelca al backend cuando
+    la guardada tiene más de `activity_interval` segundos (y en cada pasada de
+    mantenimiento), para no añadir una escritura más por checkpoint. Así la tabla de
+    actividad está al día para todos los procesos que comparten el almacenamiento, y la
+    caducidad de hilos inactivos solo la consulta a ella.
+    """
+
+    def _init_compaction(self, keep_last: int, thread_ttl: float = CHECKPOINT_THREAD_TTL) -> None:
+        self.keep_last = keep_last
+        self.thread_ttl = thread_ttl
+        self._dirty: Set[ThreadKey] = set()
+        self._activity: Dict[str, float] = {}
+        # Última actividad guardada por este proceso, de los hilos escritos hace poco
+        self._persisted: Dict[str, float] = {}
+        self.activity_interval = CHECKPOINT_ACTIVITY_INTERVAL
+        self._dirty_lock = threading.Lock()
+        self.compaction_stats: Dict[str, Any] = {"runs": 0, "checkpoints_deleted": 0, "last_run": None}
+        self.expiry_stats: Dict[str, Any] = {"runs": 0, "threads_deleted": 0, "last_run": None}
+
+    def _mark_dirty(self, config: RunnableConfig) -> bool:
+        """Marca el hilo como escrito. Devuelve True si hay que guardar ya su actividad."""
+        key = _thread_key(config)
+        now = time.time()
+        with self._dirty_lock:
+            self._dirty.add(key)
+            self._activity[key[0]] = now
+            return now - self._persisted.get(key[0], 0.0) >= self.activity_interval
+
+    def _take_dirty(self) -> Set[ThreadKey]:
+        with self._dirty_lock:
+            dirty, self._dirty = self._dirty, set()
+        return dirty
+
+    def _take_activity(self) -> Dict[str, float]:
+        with self._dirty_lock:
+            activity, self._activity = self._activity, {}
+            cutoff = time.time() - self.activity_interval
+            self._persisted = {thread_id: ts for thread_id, ts in self._persisted.items() if ts >= cutoff}
+            self._persisted.update(activity)
+        return activity
+
+    def _forget_thread(self, thread_id: str) -> None:
+        with self._dirty_lock:
+            self._activity.pop(thread_id, None)
+            self._persisted.pop(thread_id, None)
+            self._dirty = {key for key in self._dirty if key[0] != thread_id}
+
+    def _record_compaction(self, deleted: int) -> int:
+        self.compaction_stats["runs"] += 1
+        self.compaction_stats["checkpoints_deleted"] += deleted
+        self.compaction_stats["last_run"] = time.time()
+        return deleted
+
+    def _all_threads(self) -> List[ThreadKey]:
+        raise NotImplementedError
+
+    def _prune(self, thread_id: str, checkpoint_ns: str, keep: int) -> int:
+        raise NotImplementedError
+
+    def _flush_activity(self) -> None:
+        """Guarda la actividad pendiente."""
+        raise NotImplementedError
+
+    def _idle_threads(self, cutoff: float) -> List[str]:
+        """Hilos cuya última actividad guardada es anterior a `cutoff`."""
+        raise NotImplementedError
+
+    def _save_activity(self) -> None:
+        """Guarda la actividad al escribir un checkpoint; si falla, el checkpoint sigue escrito."""
+        try:
+            self._flush_activity()
+        except Exception as e:
+            print(f"--- WARNING: No se pudo guardar la actividad de las conversaciones: {e} ---")
+
+    def compact(self, full: bool = False) -> int:
+        """
+        Borra los checkpoints (y sus escrituras) más antiguos que los `keep_last` últimos.
+
+        Args:
+            full: Revisar todos los hilos, no solo los escritos desde la última compactación
+
+        Returns:
+            Número de checkpoints borrados
+        """
+        if self.keep_last <= 0:
+            self._take_dirty()
+            return 0
+        targets = self._all_threads() if full else self._take_dirty()
+        deleted = sum(self._prune(thread_id, ns, self.keep_last) for thread_id, ns in targets)
+        return self._record_compaction(deleted)
+
+    async def acompact(self, full: bool = False) -> int:
+        return await asyncio.to_thread(self.compact, full)
+
+    def expire_idle(self, ttl: Optional[float] = None) -> List[str]:
+        """
+        Borra por completo los hilos sin actividad en `ttl` segundos (por defecto `thread_ttl`).
+
+        Returns:
+            Identificadores de los hilos borrados
+        """
+        ttl = self.thread_ttl if ttl is None else ttl
+        self._flush_activity()
+        if ttl <= 0:
+            return []
+        expired = self._idle_threads(time.time() - ttl)
+        for thread_id in expired:
+            self.delete_thread(thread_id)
+        self.expiry_stats["runs"] += 1
+        self.expiry_stats["threads_deleted"] += len(expired)
+        self.expiry_stats["last_run"] = time.time()
+        return expired
+
+    async def aexpire_idle(self, ttl: Optional[float] = None) -> List[str]:
+        return await asyncio.to_thread(self.expire_idle, ttl)
+
+    async def aflush_activity(self) -> None:
+        await asyncio.to_thread(self._flush_activity)
+
+    def vacuum(self, pages: int = CHECKPOINT_VACUUM_PAGES) -> int:
+        """Devuelve espacio libre al sistema. Devuelve las páginas liberadas."""
+        return 0
+
+    async def avacuum(self, pages: int = CHECKPOINT_VACUUM_PAGES) -> int:
+        return await asyncio.to_thread(self.vacuum, pages)
+
+    def storage_stats(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    async def astorage_stats(self) -> Dict[str, Any]:
+        return await asyncio.to_thread(self.storage_stats)
+
+    def _maintenance_stats(self) -> Dict[str, Any]:
+        return {
+            "keep_last": self.keep_last,
+            "thread_ttl_days": round(self.thread_ttl / 86400, 2),
+            "compaction": dict(self.compaction_stats),
+            "expiry": dict(self.expiry_stats),
+        }
+
+
+class ThreadedSaverMixin:
+    """
+    Interfaz asíncrona que necesita el grafo (astream, aget_state...) para savers que
+    solo implementan los métodos síncronos: se ejecutan en el pool de hilos por defecto
+    para que la E/S no bloquee el event loop.
+    """
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        items = await asyncio.to_thread(
+            lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+        )
+        for item in items:
+            yield item
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+
+# --- SQLITE ---
+
+_PRUNE_CHECKPOINTS_SQL = """
+DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id NOT IN (
+    SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?
+    ORDER BY checkpoint_id DESC LIMIT ?
+)"""
+_PRUNE_WRITES_SQL = """
+DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id NOT IN (
+    SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?
+)"""
+_ACTIVITY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS thread_activity (
+    thread_id TEXT PRIMARY KEY,
+    last_activity REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_thread_activity_last ON thread_activity (last_activity);
+"""
+_UPSERT_ACTIVITY_SQL = """
+INSERT INTO thread_activity (thread_id, last_activity) VALUES (?, ?)
+ON CONFLICT(thread_id) DO UPDATE SET last_activity = MAX(last_activity, excluded.last_activity)"""
+# Hilos sin actividad registrada (anteriores al registro, o de un proceso que terminó sin
+# volcarla): cuentan desde el arranque. Se ejecuta una vez, en `setup`.
+_ADOPT_THREADS_SQL = """
+INSERT OR IGNORE INTO thread_activity (thread_id, last_activity)
+SELECT DISTINCT thread_id, ? FROM checkpoints"""
+_SQLITE_PRAGMAS = (
+    # Debe ir antes de crear las tablas; en bases de datos existentes lo aplica `vacuum`
+    "PRAGMA auto_vacuum=INCREMENTAL;",
+    "PRAGMA journal_mode=WAL;",
+    "PRAGMA synchronous=NORMAL;",
+    "PRAGMA busy_timeout={busy_ms};",
+)
+_AUTO_VACUUM_INCREMENTAL = 2
+
+
+def _sqlite_pragmas() -> List[str]:
+    busy_ms = int(CHECKPOINT_SQLITE_BUSY_TIMEOUT * 1000)
+    return [pragma.format(busy_ms=busy_ms) for pragma in _SQLITE_PRAGMAS]
+
+
+def _file_size(path: str) -> int:
+    return os.path.getsize(path) if path and os.path.exists(path) else 0
+
+
+def connect_sqlite(checkpoint_path: str = CHECKPOINT_SQLITE_PATH) -> sqlite3.Connection:
+    """Abre la base de datos de checkpoints en modo WAL, creando el fichero si hace falta."""
+    storage_dir = os.path.dirname(checkpoint_path)
+    os.makedirs(storage_dir, exist_ok=True)
+
+    try:
+        conn = sqlite3.connect(checkpoint_path, check_same_thread=False, timeout=CHECKPOINT_SQLITE_BUSY_TIMEOUT)
+    except sqlite3.OperationalError as e:
+        print(f"Error connecting to database at {checkpoint_path}: {e}")
+        print("Attempting to create database and directory structure...")
+
+        # Ensure the directory exists and has proper permissions
+        os.makedirs(storage_dir, mode=0o755, exist_ok=True)
+
+        # Try to create an empty database file
+        try:
+            open(checkpoint_path, 'w').close()  # Create empty file
+            # Set file permissions
+            os.chmod(checkpoint_path, 0o644)
+            print(f"Created database file at {checkpoint_path}")
+
+            # Now try to connect again
+            conn = sqlite3.connect(checkpoint_path, check_same_thread=False,
+                                   timeout=CHECKPOINT_SQLITE_BUSY_TIMEOUT)
+            print("Successfully connected to newly created database")
+        except Exception as create_error:
+            print(f"Failed to create database: {create_error}")
+            raise
+
+    # WAL: lectores y un escritor concurrentes, también entre procesos (varios workers)
+    for pragma in _sqlite_pragmas():
+        conn.execute(pragma)
+    return conn
+
+
+class ThreadedSqliteSaver(ThreadedSaverMixin, CompactionMixin, SqliteSaver):
+    """SqliteSaver con interfaz asíncrona (pool de hilos) y mantenimiento de hilos."""
+
+    def __init__(self, conn: sqlite3.Connection, keep_last: int = CHECKPOINT_KEEP_LAST,
+                 thread_ttl: float = CHECKPOINT_THREAD_TTL, **kwargs):
+        super().__init__(conn, **kwargs)
+        self._init_compaction(keep_last, thread_ttl)
+        self.vacuum_stats: Dict[str, Any] = {"runs": 0, "pages_freed": 0, "last_run": None}
+
+    def setup(self) -> None:
+        if self.is_setup:
+            return
+        super().setup()
+        self.conn.executescript(_ACTIVITY_SCHEMA)
+        self.conn.execute(_ADOPT_THREADS_SQL, (time.time(),))
+        self.conn.commit()
+
+    def put(self, config, checkpoint, metadata, new_versions) -> RunnableConfig:
+        next_config = super().put(config, checkpoint, metadata, new_versions)
+        if self._mark_dirty(next_config):
+            self._save_activity()
+        return next_config
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self.cursor() as cur:
+            cur.execute("DELETE FROM checkpoints WHERE thread_id = ?", (str(thread_id),))
+            cur.execute("DELETE FROM writes WHERE thread_id = ?", (str(thread_id),))
+            cur.execute("DELETE FROM thread_activity WHERE thread_id = ?", (str(thread_id),))
+        self._forget_thread(str(thread_id))
+
+    def _all_threads(self) -> List[ThreadKey]:
+        self.setup()
+        with self.cursor(transaction=False) as cur:
+            cur.execute("SELECT DISTINCT thread_id, checkpoint_ns FROM checkpoints")
+            return [(thread_id, ns) for thread_id, ns in cur.fetchall()]
+
+    def _prune(self, thread_id: str, checkpoint_ns: str, keep: int) -> int:
+        with self.cursor() as cur:
+            cur.execute(_PRUNE_CHECKPOINTS_SQL, (thread_id, checkpoint_ns, thread_id, checkpoint_ns, keep))
+            deleted = cur.rowcount
+            cur.execute(_PRUNE_WRITES_SQL, (thread_id, checkpoint_ns, thread_id, checkpoint_ns))
+        return max(deleted, 0)
+
+    def _flush_activity(self) -> None:
+        activity = self._take_activity()
+        with self.cursor() as cur:
+            cur.executemany(_UPSERT_ACTIVITY_SQL, list(activity.items()))
+
+    def _idle_threads(self, cutoff: float) -> List[str]:
+        with self.cursor(transaction=False) as cur:
+            cur.execute("SELECT thread_id FROM thread_activity WHERE last_activity < ?", (cutoff,))
+            return [row[0] for row in cur.fetchall()]
+
+    def vacuum(self, pages: int = CHECKPOINT_VACUUM_PAGES) -> int:
+        """
+        Libera hasta `pages` páginas con `incremental_vacuum` y trunca el WAL. La primera
+        vez en una base de datos sin auto_vacuum hace un VACUUM completo para activarlo.
+        """
+        with self.cursor(transaction=False) as cur:
+            freelist_before = cur.execute("PRAGMA freelist_count").fetchone()[0]
+            if cur.execute("PRAGMA auto_vacuum").fetchone()[0] != _AUTO_VACUUM_INCREMENTAL:
+                print("--- INFO: Activando auto_vacuum incremental en la base de datos de checkpoints ---")
+                cur.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                cur.execute("VACUUM")
+            elif freelist_before:
+                # sqlite3 solo avanza un paso de la sentencia (una página); executescript la completa
+                self.conn.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+            cur.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+            freed = max(freelist_before - cur.execute("PRAGMA freelist_count").fetchone()[0], 0)
+        self.vacuum_stats["runs"] += 1
+        self.vacuum_stats["pages_freed"] += freed
+        self.vacuum_stats["last_run"] = time.time()
+        return freed
+
+    def storage_stats(self) -> Dict[str, Any]:
+        """Tamaño del fichero, páginas, hilos y contadores del mantenimiento."""
+        cutoff = time.time() - self.thread_ttl if self.thread_ttl > 0 else 0
+        with self.cursor(transaction=False) as cur:
+            path = cur.execute("PRAGMA database_list").fetchone()[2]
+            page_size = cur.execute("PRAGMA page_size").fetchone()[0]
+            page_count = cur.execute("PRAGMA page_count").fetchone()[0]
+            freelist = cur.execute("PRAGMA freelist_count").fetchone()[0]
+            auto_vacuum = cur.execute("PRAGMA auto_vacuum").fetchone()[0]
+            threads = cur.execute("SELECT COUNT(DISTINCT thread_id) FROM checkpoints").fetchone()[0]
+            checkpoints = cur.execute("SELECT COUNT(*) FROM checkpoints").fetchone()[0]
+            writes = cur.execute("SELECT COUNT(*) FROM writes").fetchone()[0]
+            idle = cur.execute(
+                "SELECT COUNT(*) FROM thread_activity WHERE last_activity < ?", (cutoff,)
+            ).fetchone()[0]
+        return {
+            "backend": "sqlite",
+            "path": path,
+            "file_bytes": _file_size(path),
+            "wal_bytes": _file_size(f"{path}-wal" if path else ""),
+            "page_size": page_size,
+            "page_count": page_count,
+            "freelist_pages": freelist,
+            "incremental_vacuum": auto_vacuum == _AUTO_VACUUM_INCREMENTAL,
+            "threads": threads,
+            "checkpoints": checkpoints,
+            "writes": writes,
+            "idle_threads": idle,
+            "vacuum": dict(self.vacuum_stats),
+            **self._maintenance_stats(),
+        }
+
+
+def _async_sqlite_saver_class():
+    """AsyncSqliteSaver con mantenimiento; se importa bajo demanda (requiere aiosqlite)."""
+    from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+    class MaintainedAsyncSqliteSaver(AsyncSqliteSaver):
+        """
+        Las lecturas y escrituras del grafo van por aiosqlite; el mantenimiento lo hace un
+        ThreadedSqliteSaver sobre el mismo fichero (WAL admite ambas conexiones).
+        """
+
+        def __init__(self, conn, maintenance: ThreadedSqliteSaver, **kwargs):
+            super().__init__(conn, **kwargs)
+            self.maintenance = maintenance
+
+        @property
+        def keep_last(self) -> int:
+            return self.maintenance.keep_last
+
+        @keep_last.setter
+        def keep_last(self, value: int) -> None:
+            self.maintenance.keep_last = value
+
+        async def aput(self, config, checkpoint, metadata, new_versions) -> RunnableConfig:
+            next_config = await super().aput(config, checkpoint, metadata, new_versions)
+            if self.maintenance._mark_dirty(next_config):
+                await asyncio.to_thread(self.maintenance._save_activity)
+            return next_config
+
+        async def adelete_thread(self, thread_id: str) -> None:
+            await self.setup()
+            await self.maintenance.adelete_thread(thread_id)
+
+        async def acompact(self, full: bool = False) -> int:
+            await self.setup()
+            return await self.maintenance.acompact(full)
+
+        async def aexpire_idle(self, ttl: Optional[float] = None) -> List[str]:
+            await self.setup()
+            return await self.maintenance.aexpire_idle(ttl)
+
+        async def aflush_activity(self) -> None:
+            await self.setup()
+            await self.maintenance.aflush_activity()
+
+        async def avacuum(self, pages: int = CHECKPOINT_VACUUM_PAGES) -> int:
+            return await self.maintenance.avacuum(pages)
+
+        async def astorage_stats(self) -> Dict[str, Any]:
+            await self.setup()
+            return {**await self.maintenance.astorage_stats(), "backend": "sqlite-async"}
+
+        async def aclose(self) -> None:
+            await self.conn.close()
+            self.maintenance.conn.close()
+
+    return MaintainedAsyncSqliteSaver
+
+
+async def open_async_sqlite_saver(checkpoint_path: str = CHECKPOINT_SQLITE_PATH) -> BaseCheckpointSaver:
+    """Abre el saver aiosqlite (debe llamarse con el event loop en marcha)."""
+    import aiosqlite
+
+    maintenance = ThreadedSqliteSaver(connect_sqlite(checkpoint_path))
+    conn = await aiosqlite.connect(checkpoint_path, timeout=CHECKPOINT_SQLITE_BUSY_TIMEOUT)
+    for pragma in _sqlite_pragmas():
+        await conn.execute(pragma)
+    return _async_sqlite_saver_class()(conn, maintenance)
+
+
+# --- MONGODB ---
+
+class MongoSaver(ThreadedSaverMixin, CompactionMixin, BaseCheckpointSaver):
+    """Checkpoints en MongoDB (pymongo), con interfaz asíncrona en el pool de hilos."""
+
+    def __init__(self, client, db_name: str = CHECKPOINT_MONGO_DB, keep_last: int = CHECKPOINT_KEEP_LAST, **kwargs):
+        super().__init__(**kwargs)
+        self.jsonplus_serde = JsonPlusSerializer()
+        self.client = client
+        db = client[db_name]
+        self.checkpoints = db["checkpoints"]
+        self.writes = db["checkpoint_writes"]
+        self.threads = db["checkpoint_threads"]
+        self._init_compaction(keep_last)
+        self.is_setup = False
+
+    def setup(self) -> None:
+        if self.is_setup:
+            return
+        self.checkpoints.create_index(
+            [("thread_id", 1), ("checkpoint_ns", 1), ("checkpoint_id", -1)], unique=True
+        )
+        self.writes.create_index(
+            [("thread_id", 1), ("checkpoint_ns", 1), ("checkpoint_id", 1), ("task_id", 1), ("idx", 1)],
+            unique=True
+        )
+        self.threads.create_index([("last_activity", 1)])
+        self._adopt_threads()
+        self.is_setup = True
+
+    def _adopt_threads(self) -> None:
+        """
+        Da de alta, contando desde ahora, los hilos sin actividad registrada (anteriores al
+        registro, o de un proceso que terminó sin volcarla). Se ejecuta una vez, en `setup`.
+        """
+        from pymongo import UpdateOne
+
+        now = time.time()
+        operations = [
+            UpdateOne({"_id": thread_id}, {"$setOnInsert": {"last_activity": now}}, upsert=True)
+            for thread_id in self.checkpoints.distinct("thread_id")
+        ]
+        if operations:
+            self.threads.bulk_write(operations, ordered=False)
+
+    def _load_writes(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str) -> List[Tuple[str, str, Any]]:
+        cursor = self.writes.find(
+            {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id}
+        ).sort([("task_id", 1), ("idx", 1)])
+        return [
+            (doc["task_id"], doc["channel"], self.serde.loads_typed((doc["type"], doc["value"])))
+            for doc in cursor
+        ]
+
+    def _to_tuple(self, doc: Dict[str, Any]) -> CheckpointTuple:
+        thread_id, checkpoint_ns = doc["thread_id"], doc["checkpoint_ns"]
+        parent_id = doc.get("parent_checkpoint_id")
+        return CheckpointTuple(
+            {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns,
+                              "checkpoint_id": doc["checkpoint_id"]}},
+            self.serde.loads_typed((doc["type"], doc["checkpoint"])),
+            self.jsonplus_serde.loads(doc["metadata"]) if doc.get("metadata") is not None else {},
+            ({"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns,
+                               "checkpoint_id": parent_id}} if parent_id else None),
+            self._load_writes(thread_id, checkpoint_ns, doc["checkpoint_id"]),
+        )
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        self.setup()
+        thread_id, checkpoint_ns = _thread_key(config)
+        query = {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns}
+        if checkpoint_id := get_checkpoint_id(config):
+            query["checkpoint_id"] = checkpoint_id
+        doc = self.checkpoints.find_one(query, sort=[("checkpoint_id", -1)])
+        return self._to_tuple(doc) if doc else None
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[CheckpointTuple]:
+        self.setup()
+        query: Dict[str, Any] = {}
+        if config:
+            configurable = config["configurable"]
+            query["thread_id"] = str(configurable["thread_id"])
+            if "checkpoint_ns" in configurable:
+                query["checkpoint_ns"] = configurable["checkpoint_ns"]
+            if checkpoint_id := get_checkpoint_id(config):
+                query["checkpoint_id"] = checkpoint_id
+        if before and (before_id := get_checkpoint_id(before)):
+            query["checkpoint_id"] = {"$lt": before_id}
+
+        returned = 0
+        for doc in self.checkpoints.find(query).sort("checkpoint_id", -1):
+            item = self._to_tuple(doc)
+            if filter and any(item.metadata.get(k) != v for k, v in filter.items()):
+                continue
+            yield item
+            returned += 1
+            if limit and returned >= limit:
+                return
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        self.setup()
+        thread_id, checkpoint_ns = _thread_key(config)
+        type_, serialized_checkpoint = self.serde.dumps_typed(checkpoint)
+        key = {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint["id"]}
+        self.checkpoints.replace_one(key, {
+            **key,
+            "parent_checkpoint_id": config["configurable"].get("checkpoint_id"),
+            "type": type_,
+            "checkpoint": serialized_checkpoint,
+            "metadata": self.jsonplus_serde.dumps(get_checkpoint_metadata(config, metadata)),
+        }, upsert=True)
+        next_config = {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns,
+                                        "checkpoint_id": checkpoint["id"]}}
+        if self._mark_dirty(next_config):
+            self._save_activity()
+        return next_config
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        from pymongo import ReplaceOne, UpdateOne
+
+        self.setup()
+        thread_id, checkpoint_ns = _thread_key(config)
+        checkpoint_id = str(config["configurable"]["checkpoint_id"])
+        # Igual que SqliteSaver: las escrituras especiales se reemplazan, el resto no se pisa
+        replace = all(channel in WRITES_IDX_MAP for channel, _ in writes)
+        operations = []
+        for idx, (channel, value) in enumerate(writes):
+            key = {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id,
+                   "task_id": task_id, "idx": WRITES_IDX_MAP.get(channel, idx)}
+            type_, serialized_value = self.serde.dumps_typed(value)
+            doc = {**key, "channel": channel, "type": type_, "value": serialized_value, "task_path": task_path}
+            operations.append(ReplaceOne(key, doc, upsert=True) if replace
+                              else UpdateOne(key, {"$setOnInsert": doc}, upsert=True))
+        if operations:
+            self.writes.bulk_write(operations, ordered=False)
+
+    def delete_thread(self, thread_id: str) -> None:
+        self.checkpoints.delete_many({"thread_id": str(thread_id)})
+        self.writes.delete_many({"thread_id": str(thread_id)})
+        self.threads.delete_one({"_id": str(thread_id)})
+        self._forget_thread(str(thread_id))
+
+    def get_next_version(self, current: Optional[str], channel: None) -> str:
+        # Mismo formato de versiones que SqliteSaver (cadenas ordenables)
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            current_v = current
+        else:
+            current_v = int(current.split(".")[0])
+        next_v = current_v + 1
+        next_h = random.random()
+        return f"{next_v:032}.{next_h:016}"
+
+    def _all_threads(self) -> List[ThreadKey]:
+        self.setup()
+        groups = self.checkpoints.aggregate([
+            {"$group": {"_id": {"thread_id": "$thread_id", "checkpoint_ns": "$checkpoint_ns"}}}
+        ])
+        return [(g["_id"]["thread_id"], g["_id"]["checkpoint_ns"]) for g in groups]
+
+    def _prune(self, thread_id: str, checkpoint_ns: str, keep: int) -> int:
+        scope = {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns}
+        keep_ids = [
+            doc["checkpoint_id"]
+            for doc in self.checkpoints.find(scope, {"checkpoint_id": 1}).sort("checkpoint_id", -1).limit(keep)
+        ]
+        result = self.checkpoints.delete_many({**scope, "checkpoint_id": {"$nin": keep_ids}})
+        self.writes.delete_many({**scope, "checkpoint_id": {"$nin": keep_ids}})
+        return result.deleted_count
+
+    def _flush_activity(self) -> None:
+        from pymongo import UpdateOne
+
+        self.setup()
+        operations = [
+            UpdateOne({"_id": thread_id}, {"$max": {"last_activity": ts}}, upsert=True)
+            for thread_id, ts in self._take_activity().items()
+        ]
+        if operations:
+            self.threads.bulk_write(operations, ordered=False)
+
+    def _idle_threads(self, cutoff: float) -> List[str]:
+        return [doc["_id"] for doc in self.threads.find({"last_activity": {"$lt": cutoff}}, {"_id": 1})]
+
+    def storage_stats(self) -> Dict[str, Any]:
+        """Tamaño de la base de datos (dbStats), hilos y contadores del mantenimiento."""
+        self.setup()
+        db_stats = self.checkpoints.database.command("dbstats")
+        cutoff = time.time() - self.thread_ttl if self.thread_ttl > 0 else 0
+        return {
+            "backend": "mongo",
+            "database": self.checkpoints.database.name,
+            "data_bytes": db_stats.get("dataSize", 0),
+            "storage_bytes": db_stats.get("storageSize", 0),
+            "index_bytes": db_stats.get("indexSize", 0),
+            "threads": self.threads.estimated_document_count(),
+            "checkpoints": self.checkpoints.estimated_document_count(),
+            "writes": self.writes.estimated_document_count(),
+            "idle_threads": self.threads.count_documents({"last_activity": {"$lt": cutoff}}),
+            **self._maintenance_stats(),
+        }
+
+
+# --- FACTORÍA Y MANTENIMIENTO ---
+
+def instrument_checkpointer(saver: BaseCheckpointSaver) -> BaseCheckpointSaver:
+    """Mide `aget_tuple` y `aput` del saver (sea cual sea el backend) como etapas de la petición."""
+    for method, stage in (("aget_tuple", "checkpoint_load"), ("aput", "checkpoint_save")):
+        original = getattr(saver, method)
+
+        async def timed(*args, _original=original, _stage=stage, **kwargs):
+            with metrics.stage(_stage):
+                return await _original(*args, **kwargs)
+
+        setattr(saver, method, timed)
+    return saver
+
+
+def create_checkpointer(backend: str = CHECKPOINT_BACKEND) -> BaseCheckpointSaver:
+    """
+    Crea el checkpointer al construir el grafo. Con "sqlite-async" se devuelve el saver
+    SQLite con hilos (mismo fichero y esquema) hasta que `checkpoint_maintenance.start`
+    lo sustituye por el de aiosqlite.
+    """
+    backend = backend.lower()
+    if backend in ("sqlite", "sqlite-async"):
+        return instrument_checkpointer(ThreadedSqliteSaver(connect_sqlite()))
+    if backend == "mongo":
+        from pymongo import MongoClient
+        return instrument_checkpointer(MongoSaver(MongoClient(CHECKPOINT_MONGO_URI), CHECKPOINT_MONGO_DB))
+    if backend == "memory":
+        return instrument_checkpointer(InMemorySaver())
+    raise ValueError(f"Backend de checkpoints desconocido: '{backend}'. Disponibles: {SUPPORTED_BACKENDS}")
+
+
+class CheckpointMaintenance:
+    """
+    Abre el backend asíncrono (si procede) y, en segundo plano, compacta los checkpoints,
+    borra los hilos inactivos y libera el espacio sobrante.
+    """
+
+    def __init__(self, backend: str = CHECKPOINT_BACKEND, interval: float = CHECKPOINT_COMPACTION_INTERVAL):
+        self.backend = backend.lower()
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self._async_saver: Optional[BaseCheckpointSaver] = None
+
+    async def _compact(self, graph, full: bool) -> None:
+        saver = graph.checkpointer
+        if not hasattr(saver, "acompact"):
+            return
+        try:
+            deleted = await saver.acompact(full=full)
+            if deleted:
+                print(f"--- INFO: Compactación de checkpoints: {deleted} checkpoints antiguos borrados ---")
+        except Exception as e:
+            print(f"--- WARNING: Compactación de checkpoints fallida: {e} ---")
+
+    async def _expire_and_vacuum(self, graph) -> None:
+        saver = graph.checkpointer
+        if not hasattr(saver, "aexpire_idle"):
+            return
+        try:
+            expired = await saver.aexpire_idle()
+            if expired:
+                print(f"--- INFO: {len(expired)} conversaciones inactivas borradas ---")
+            await saver.avacuum()
+        except Exception as e:
+            print(f"--- WARNING: Limpieza de conversaciones inactivas fallida: {e} ---")
+
+    async def run_once(self, graph, full: bool = False) -> Dict[str, Any]:
+        """Pasada completa de mantenimiento; devuelve las estadísticas resultantes."""
+        await self._compact(graph, full=full)
+        await self._expire_and_vacuum(graph)
+        return await self.stats(graph)
+
+    async def stats(self, graph) -> Dict[str, Any]:
+        """Estadísticas de almacenamiento del checkpointer activo."""
+        saver = graph.checkpointer
+        if not hasattr(saver, "astorage_stats"):
+            return {"backend": type(saver).__name__, "maintenance": False}
+        return {**await saver.astorage_stats(), "maintenance_interval": self.interval}
+
+    async def _run(self, graph) -> None:
+        full = True
+        while True:
+            await self._compact(graph, full=full)
+            await self._expire_and_vacuum(graph)
+            full = False
+            await asyncio.sleep(self.interval)
+
+    async def start(self, graph) -> None:
+        """Se llama en el arranque de la aplicación."""
+        if self.backend == "sqlite-async":
+            self._async_saver = instrument_checkpointer(await open_async_sqlite_saver())
+            graph.checkpointer = self._async_saver
+        if self.interval > 0:
+            self._task = asyncio.create_task(self._run(graph))
+
+    async def stop(self, graph) -> None:
+        """Se llama al apagar la aplicación."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._compact(graph, full=False)
+        if hasattr(graph.checkpointer, "aflush_activity"):
+            try:
+                await graph.checkpointer.aflush_activity()
+            except Exception as e:
+                print(f"--- WARNING: No se pudo guardar la actividad de las conversaciones: {e} ---")
+        if self._async_saver is not None:
+            await self._async_saver.aclose()
+            self._async_saver = None
+
+
+# Instancia global del mantenimiento de checkpoints
+checkpoint_maintenance = CheckpointMaintenance()
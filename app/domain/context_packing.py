@@ -0,0 +1,211 @@
+"""
+Empaquetado del contexto recuperado antes de pasarlo al LLM.
+
+El RAG Service trocea los apuntes en fragmentos de 800 caracteres con 150 de solape,
+así que los `k` documentos que devuelve `chroma_retriever` suelen repetir texto:
+fragmentos consecutivos del mismo fichero comparten el solape, y a veces llegan
+fragmentos casi idénticos de copias del mismo material. `pack_context`:
+
+1. Fusiona fragmentos consecutivos (o que se solapan) de la misma fuente.
+2. Descarta los casi duplicados (similitud de Jaccard sobre trigramas de palabras).
+3. Recorta el resultado, por orden de relevancia, a un presupuesto de tokens
+   (CONTEXT_TOKEN_BUDGET, o uno por proveedor: el modelo local tiene 4k de contexto).
+
+Se contabilizan los tokens ahorrados por petición y en total (`packing_stats`).
+"""
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+from langchain_core.runnables import RunnableConfig
+
+from domain.llm_registry import LLM_PROVIDER
+from services.utils_service import count_tokens, normalize_text, truncate_to_tokens
+
+# --- CONFIGURACIÓN ---
+CONTEXT_PACKING_ENABLED = os.getenv("CONTEXT_PACKING_ENABLED", "true").lower() == "true"
+# Presupuesto de tokens de los documentos recuperados por búsqueda (0 = por proveedor)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "0"))
+DEFAULT_TOKEN_BUDGETS = {
+    "gemini": 4000,
+    # Phi-3-mini-4k: prompt de sistema + historial + documentos + respuesta en 4096 tokens
+    "vllm": 1200,
+}
+# Similitud de Jaccard a partir de la cual dos fragmentos se consideran el mismo
+CONTEXT_DUPLICATE_THRESHOLD = float(os.getenv("CONTEXT_DUPLICATE_THRESHOLD", "0.8"))
+# Un documento no se recorta por debajo de estos tokens (mejor descartarlo)
+CONTEXT_MIN_TRUNCATED_TOKENS = 40
+
+# Solape de texto mínimo y máximo (caracteres) que se busca al unir dos fragmentos
+_MIN_OVERLAP_CHARS = 20
+_MAX_OVERLAP_CHARS = 400
+_TRUNCATION_MARK = " [...]"
+
+# Contadores acumulados desde el arranque
+packing_stats: Dict[str, int] = {
+    "requests": 0, "chunks_in": 0, "chunks_out": 0, "merged": 0, "duplicates": 0,
+    "truncated": 0, "tokens_in": 0, "tokens_out": 0, "tokens_saved": 0,
+}
+
+
+def token_budget(config: Optional[RunnableConfig] = None) -> int:
+    """Presupuesto de la petición: `configurable.context_token_budget`, el global o el del proveedor."""
+    configurable = (config or {}).get("configurable", {}) or {}
+    if configurable.get("context_token_budget"):
+        return int(configurable["context_token_budget"])
+    if CONTEXT_TOKEN_BUDGET > 0:
+        return CONTEXT_TOKEN_BUDGET
+    provider = configurable.get("llm_provider") or LLM_PROVIDER
+    return DEFAULT_TOKEN_BUDGETS.get(provider, DEFAULT_TOKEN_BUDGETS["gemini"])
+
+
+def _chunk_position(doc: Document) -> Optional[Tuple[str, int]]:
+    """(fuente, índice) a partir del id `fuente-índice` que asigna el RAG Service."""
+    chunk_id = str(doc.metadata.get("id", ""))
+    source, _, index = chunk_id.rpartition("-")
+    if not source or not index.isdigit():
+        return None
+    return source, int(index)
+
+
+def _text_overlap(left: str, right: str) -> int:
+    """Longitud del sufijo de `left` que es prefijo de `right` (0 si no llega al mínimo)."""
+    longest = min(len(left), len(right), _MAX_OVERLAP_CHARS)
+    for size in range(longest, _MIN_OVERLAP_CHARS - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def _join(left: str, right: str) -> str:
+    overlap = _text_overlap(left, right)
+    if overlap:
+        return left + right[overlap:]
+    return left.rstrip() + "\n" + right.lstrip()
+
+
+def merge_adjacent(documents: List[Document]) -> Tuple[List[Document], int]:
+    """
+    Une los fragmentos consecutivos de la misma fuente (por id o por texto solapado).
+
+    Returns:
+        Tupla (documentos en orden de relevancia del mejor fragmento de cada grupo,
+        número de fusiones)
+    """
+    # (rango del mejor fragmento, posición del primero, posición del último, texto, metadatos)
+    groups: List[List[Any]] = []
+    merges = 0
+    for rank, doc in enumerate(documents):
+        position = _chunk_position(doc)
+        source = doc.metadata.get("source")
+        text = doc.page_content
+        for group in groups:
+            if group[4].get("source") != source:
+                continue
+            first, last = group[1], group[2]
+            if position and last and position[0] == last[0] and position[1] == last[1] + 1:
+                group[3], group[2] = _join(group[3], text), position
+            elif position and first and position[0] == first[0] and position[1] == first[1] - 1:
+                group[3], group[1] = _join(text, group[3]), position
+            elif _text_overlap(group[3], text):
+                group[3] = _join(group[3], text)
+            elif _text_overlap(text, group[3]):
+                group[3] = _join(text, group[3])
+            else:
+                continue
+            group[4]["merged_chunks"] = group[4].get("merged_chunks", 1) + 1
+            merges += 1
+            break
+        else:
+            groups.append([rank, position, position, text, dict(doc.metadata)])
+
+    groups.sort(key=lambda group: group[0])
+    return [Document(page_content=text, metadata=metadata) for _, _, _, text, metadata in groups], merges
+
+
+def _shingles(text: str) -> set:
+    words = normalize_text(text).split()
+    if len(words) < 3:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + 3]) for i in range(len(words) - 2)}
+
+
+def drop_near_duplicates(documents: List[Document],
+                         threshold: float = CONTEXT_DUPLICATE_THRESHOLD) -> Tuple[List[Document], int]:
+    """Descarta los documentos casi iguales (o contenidos) en otro más relevante."""
+    kept: List[Document] = []
+    kept_shingles: List[set] = []
+    dropped = 0
+    for doc in documents:
+        shingles = _shingles(doc.page_content)
+        duplicate = False
+        for other in kept_shingles:
+            if not shingles or not other:
+                continue
+            common = len(shingles & other)
+            if common / len(shingles | other) >= threshold or common / len(shingles) >= threshold:
+                duplicate = True
+                break
+        if duplicate:
+            dropped += 1
+            continue
+        kept.append(doc)
+        kept_shingles.append(shingles)
+    return kept, dropped
+
+
+def fit_to_budget(documents: List[Document], budget: int) -> Tuple[List[Document], int, int]:
+    """
+    Conserva los documentos por orden de relevancia hasta agotar el presupuesto; el que no
+    cabe entero se recorta si le quedan al menos CONTEXT_MIN_TRUNCATED_TOKENS.
+
+    Returns:
+        Tupla (documentos, tokens usados, documentos recortados)
+    """
+    packed: List[Document] = []
+    used = 0
+    truncated = 0
+    for doc in documents:
+        tokens = count_tokens(doc.page_content)
+        remaining = budget - used
+        if tokens <= remaining:
+            packed.append(doc)
+            used += tokens
+            continue
+        if remaining >= CONTEXT_MIN_TRUNCATED_TOKENS:
+            text = truncate_to_tokens(doc.page_content, remaining - count_tokens(_TRUNCATION_MARK))
+            packed.append(Document(page_content=text.rstrip() + _TRUNCATION_MARK,
+                                   metadata={**doc.metadata, "truncated": True}))
+            used += count_tokens(packed[-1].page_content)
+            truncated += 1
+        break
+    return packed, used, truncated
+
+
+def pack_context(documents: List[Document], budget: Optional[int] = None) -> Tuple[List[Document], Dict[str, int]]:
+    """
+    Fusiona, deduplica y recorta los documentos recuperados.
+
+    Args:
+        documents: Documentos en orden de relevancia (como los devuelve el RAG Service)
+        budget: Presupuesto de tokens (por defecto `token_budget()`)
+
+    Returns:
+        Tupla (documentos empaquetados, estadísticas de la petición)
+    """
+    tokens_in = sum(count_tokens(doc.page_content) for doc in documents)
+    stats = {"chunks_in": len(documents), "chunks_out": len(documents), "merged": 0, "duplicates": 0,
+             "truncated": 0, "tokens_in": tokens_in, "tokens_out": tokens_in, "tokens_saved": 0}
+    if not CONTEXT_PACKING_ENABLED or not documents:
+        return documents, stats
+
+    merged, stats["merged"] = merge_adjacent(documents)
+    unique, stats["duplicates"] = drop_near_duplicates(merged)
+    packed, stats["tokens_out"], stats["truncated"] = fit_to_budget(unique, budget or token_budget())
+    stats["chunks_out"] = len(packed)
+    stats["tokens_saved"] = max(tokens_in - stats["tokens_out"], 0)
+
+    packing_stats["requests"] += 1
+    for key, value in stats.items():
+        packing_stats[key] += value
+    return packed, stats
@@ -0,0 +1,187 @@
+"""
+Serialización de las peticiones concurrentes sobre una misma conversación.
+
+Un doble clic en enviar o dos pestañas abiertas lanzan dos peticiones sobre el mismo
+hilo (`email-subject`): las dos pagan el LLM y compiten al escribir el checkpoint.
+
+- Un lock asíncrono por hilo hace que las peticiones de una conversación se atiendan
+  de una en una. La espera está acotada: si hay CONVERSATION_MAX_PENDING peticiones
+  en curso o esperando se rechaza al momento (429), y si el turno no llega en
+  CONVERSATION_LOCK_TIMEOUT segundos se rechaza con 409.
+- Una petición idéntica a otra en curso (mismo hilo y mismo mensaje normalizado) no
+  se ejecuta: espera el resultado de la primera y lo reutiliza.
+"""
+import asyncio
+import os
+from typing import Any, Dict, Optional, Tuple
+
+from services.utils_service import normalize_text
+
+# --- CONFIGURACIÓN ---
+# Segundos que una petición espera su turno (o el resultado de una idéntica) antes del 409
+CONVERSATION_LOCK_TIMEOUT = float(os.getenv("CONVERSATION_LOCK_TIMEOUT", "30"))
+# Peticiones por conversación en curso o esperando; a partir de ahí, 429
+CONVERSATION_MAX_PENDING = int(os.getenv("CONVERSATION_MAX_PENDING", "3"))
+
+
+class ConversationBusyError(Exception):
+    """La conversación no puede atender la petición ahora (409 o 429)."""
+
+    def __init__(self, status_code: int, detail: str, retry_after: int = 1):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class _Conversation:
+    __slots__ = ("lock", "pending")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.pending = 0
+
+
+class ConversationTurn:
+    """
+    Turno concedido sobre una conversación. Si `leader` es True la petición tiene el lock
+    y debe ejecutarse y publicar su resultado con `set_result`; si no, hay una petición
+    idéntica en curso y `wait()` devuelve su resultado. Se usa con `async with`, que
+    libera el lock (y propaga el error a las peticiones acopladas) al salir.
+    """
+
+    def __init__(self, guard: "ConversationGuard", thread_id: str, key: Optional[Tuple[str, str]],
+                 future: Optional[asyncio.Future], leader: bool):
+        self._guard = guard
+        self.thread_id = thread_id
+        self.key = key
+        self.future = future
+        self.leader = leader
+        self._released = False
+
+    def set_result(self, result: Dict[str, Any]) -> None:
+        if self.future is not None and not self.future.done():
+            self.future.set_result(result)
+
+    async def wait(self) -> Dict[str, Any]:
+        """Resultado de la petición idéntica en curso (espera acotada)."""
+        try:
+            return await asyncio.wait_for(asyncio.shield(self.future), self._guard.timeout)
+        except asyncio.TimeoutError:
+            self._guard.stats["timeouts"] += 1
+            raise ConversationBusyError(409, "An identical request for this conversation is still in progress")
+
+    def release(self, error: Optional[BaseException] = None) -> None:
+        if self._released or not self.leader:
+            return
+        self._released = True
+        if self.future is not None and not self.future.done():
+            if error is None or not isinstance(error, Exception):  # cancelada o stream cerrado
+                error = ConversationBusyError(409, "The identical request for this conversation was interrupted")
+            self.future.set_exception(error)
+        self._guard._release(self)
+
+    async def __aenter__(self) -> "ConversationTurn":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        self.release(exc)
+
+
+class ConversationGuard:
+    """Locks por hilo y registro de las peticiones en curso para acoplar las idénticas."""
+
+    def __init__(self, timeout: float = CONVERSATION_LOCK_TIMEOUT, max_pending: int = CONVERSATION_MAX_PENDING):
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self._conversations: Dict[str, _Conversation] = {}
+        self._in_flight: Dict[Tuple[str, str], asyncio.Future] = {}
+        self.stats = {"served": 0, "coalesced": 0, "waited": 0, "rejected": 0, "timeouts": 0}
+
+    async def acquire(self, thread_id: str, message: Optional[str] = None) -> ConversationTurn:
+        """
+        Turno para una petición sobre `thread_id`. Sin `message` (p. ej. borrar la sesión)
+        la petición solo se serializa, nunca se acopla.
+
+        Raises:
+            ConversationBusyError: 429 si hay demasiadas peticiones pendientes en el hilo,
+                409 si el turno no llega a tiempo.
+        """
+        key = (thread_id, normalize_text(message)) if message else None
+        future = self._in_flight.get(key) if key else None
+        if future is not None:
+            self.stats["coalesced"] += 1
+            return ConversationTurn(self, thread_id, key, future, leader=False)
+
+        conversation = self._conversations.get(thread_id)
+        if conversation is None:
+            conversation = self._conversations[thread_id] = _Conversation()
+        if conversation.pending >= self.max_pending:
+            self.stats["rejected"] += 1
+            raise ConversationBusyError(429, "Too many requests in progress for this conversation",
+                                        retry_after=max(1, int(self.timeout / self.max_pending)))
+
+        # Se registra antes de esperar el turno: una petición idéntica que llegue mientras
+        # tanto también se acopla a esta
+        future = None
+        if key is not None:
+            future = asyncio.get_running_loop().create_future()
+            # Nadie lo recoge si no hay peticiones acopladas
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            self._in_flight[key] = future
+        turn = ConversationTurn(self, thread_id, key, future, leader=True)
+
+        idle = conversation.pending == 0
+        conversation.pending += 1
+        try:
+            if idle:
+                await conversation.lock.acquire()
+            else:
+                self.stats["waited"] += 1
+                await asyncio.wait_for(conversation.lock.acquire(), self.timeout)
+        except BaseException as e:
+            if isinstance(e, asyncio.TimeoutError):
+                self.stats["timeouts"] += 1
+                e = ConversationBusyError(409, "Another request for this conversation is still in progress",
+                                          retry_after=max(1, int(self.timeout)))
+            self._abandon(turn, e)
+            raise e
+
+        self.stats["served"] += 1
+        return turn
+
+    def _leave(self, thread_id: str, conversation: _Conversation) -> None:
+        conversation.pending -= 1
+        if conversation.pending == 0:
+            del self._conversations[thread_id]
+
+    def _forget(self, turn: ConversationTurn) -> None:
+        if turn.key is not None and self._in_flight.get(turn.key) is turn.future:
+            del self._in_flight[turn.key]
+
+    def _abandon(self, turn: ConversationTurn, error: BaseException) -> None:
+        """La petición no llegó a tener el turno: las acopladas a ella reciben el mismo error."""
+        self._forget(turn)
+        turn._released = True
+        if turn.future is not None and not turn.future.done():
+            turn.future.set_exception(error if isinstance(error, Exception) else
+                                      ConversationBusyError(409, "The identical request for this conversation was interrupted"))
+        self._leave(turn.thread_id, self._conversations[turn.thread_id])
+
+    def _release(self, turn: ConversationTurn) -> None:
+        self._forget(turn)
+        conversation = self._conversations[turn.thread_id]
+        conversation.lock.release()
+        self._leave(turn.thread_id, conversation)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "active_conversations": len(self._conversations),
+            "in_flight": len(self._in_flight),
+            "lock_timeout": self.timeout,
+            "max_pending": self.max_pending,
+            **self.stats,
+        }
+
+
+conversation_guard = ConversationGuard()
@@ -1,40 +1,60 @@
-import json
+import asyncio
+import logging
 import os
-import sqlite3
-import subprocess
+import time
 from dotenv import load_dotenv
-from typing import Literal, List, Dict, Any, Tuple
+from typing import Literal, List, Dict, Any, Tuple, Optional
 from langchain_core.documents import Document
 from langchain_core.messages import HumanMessage, SystemMessage, ToolMessage, AIMessage
 from langchain_core.tools import tool
-from langchain_openai import ChatOpenAI
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langgraph.graph import StateGraph, END, MessagesState
-from langgraph.checkpoint.memory import InMemorySaver
-from langgraph.checkpoint.sqlite import SqliteSaver
-from typing_extensions import TypedDict
+from langgraph.graph import StateGraph, MessagesState
 
 from services.rag_client import rag_client
+from services.metrics_service import metrics
 from langchain_core.runnables import RunnableConfig
+from domain.llm_registry import llm_registry, LLM_PROVIDER
+from domain.memory import manage_memory, with_summary
+from domain.checkpointer import create_checkpointer
+from domain.prompts import system_prompt_for
+from domain.intent_router import route_intent, after_routing
+from domain.context_packing import pack_context, token_budget
+from services.utils_service import normalize_text
+
+logger = logging.getLogger(__name__)
 
 # --- CONFIGURACIÓN ---
 load_dotenv()
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 os.environ["GOOGLE_API_KEY"] = GEMINI_API_KEY
-VLLM_URL = os.getenv("VLLM_URL", "http://localhost:8000") + "/v1"
-VLLM_MODEL_NAME = os.getenv("MODEL_DIR", "/models/Sreenington--Phi-3-mini-4k-instruct-AWQ")
 
-LOCAL_INFERENCE=False
+# Llamadas a herramientas en paralelo por paso del agente, y timeout de cada una
+TOOL_MAX_CONCURRENCY = int(os.getenv("TOOL_MAX_CONCURRENCY", "4"))
+TOOL_CALL_TIMEOUT = float(os.getenv("TOOL_CALL_TIMEOUT", "20"))
+# Documentos que recupera chroma_retriever
+RETRIEVER_K = 6
+
+# Recuperación especulativa: se lanza la búsqueda con la pregunta del usuario a la vez
+# que la primera llamada al LLM, y se reutiliza si el modelo pide algo equivalente
+SPECULATIVE_RETRIEVAL = os.getenv("SPECULATIVE_RETRIEVAL", "false").lower() == "true"
+# Proporción mínima de palabras de la consulta del modelo presentes en la del usuario
+SPECULATIVE_MATCH_THRESHOLD = float(os.getenv("SPECULATIVE_MATCH_THRESHOLD", "0.8"))
+# Búsquedas especulativas no reclamadas se descartan pasado este tiempo (segundos)
+SPECULATIVE_PREFETCH_TTL = 60.0
 
 # Estado del agente, incluyendo los documentos recuperados y la asignatura
 class AgentState(MessagesState):
     retrieved_docs: List[Document]
     subject: str 
+    # Resumen acumulado de los turnos antiguos (ver domain.memory)
+    summary: str
+    memory_stats: Dict[str, Any]
+    # Tokens ahorrados al empaquetar los documentos recuperados en este turno
+    context_stats: Dict[str, int]
 
 # --- HERRAMIENTAS ---
 
 @tool
-def consultar_guia_docente(seccion: str, config: RunnableConfig) -> Tuple[str, List[Document]]:
+async def consultar_guia_docente(seccion: str, config: RunnableConfig) -> Tuple[str, List[Document]]:
     """
     Consulta información específica de la guía docente de la asignatura.
     
@@ -61,7 +81,7 @@ def consultar_guia_docente(seccion: str, config: RunnableConfig) -> Tuple[str, L
         subject = config["configurable"]["subject"]
 
         # Usar el RAG client para obtener la guía docente
-        guia_data = rag_client.get_guia_docente(subject, seccion)
+        guia_data = await rag_client.aget_guia_docente(subject, seccion)
         
         if not guia_data:
             error_msg = f"No se encontró información de guía docente para '{subject}'"
@@ -110,8 +130,42 @@ def consultar_guia_docente(seccion: str, config: RunnableConfig) -> Tuple[str, L
         return error_msg, []
 
 
+def _format_retrieval(subject: str, documents: List[Document],
+                      config: Optional[RunnableConfig] = None) -> Tuple[str, List[Document]]:
+    """
+    Empaqueta los documentos recuperados (ver domain.context_packing) y los formatea para
+    el LLM (salida de chroma_retriever). Si la config trae `context_stats`, se le suman
+    las estadísticas del empaquetado.
+    """
+    if not documents:
+        error_msg = f"No se encontraron documentos para la asignatura '{subject}' en el RAG Service"
+        return error_msg, []
+
+    documents, stats = pack_context(documents, token_budget(config))
+    accumulator = ((config or {}).get("configurable", {}) or {}).get("context_stats")
+    if accumulator is not None:
+        for key, value in stats.items():
+            accumulator[key] = accumulator.get(key, 0) + value
+    
+    formatted_results = []
+    formatted_results.append(f"Encontrados {len(documents)} documentos relevantes:\n")
+    
+    for i, doc in enumerate(documents, 1):
+        source = doc.metadata.get("source", "Fuente desconocida")
+        page = doc.metadata.get("page", "N/A")
+        
+        formatted_results.append(f"--- Resultado {i} ---")
+        formatted_results.append(f"Fuente: {source}")
+        if page != "N/A":
+            formatted_results.append(f"Página: {page}")
+        formatted_results.append(f"Contenido: {doc.page_content}")
+        formatted_results.append("")
+    
+    return "\n".join(formatted_results), documents
+
+
 @tool
-def chroma_retriever(pregunta: str, config: RunnableConfig) -> Tuple[str, List[Document]]:
+async def chroma_retriever(pregunta: str, config: RunnableConfig) -> Tuple[str, List[Document]]:
     """
     Busca en los apuntes de la asignatura usando el RAG Service.
     Esta herramienta es para preguntas conceptuales, sobre el material de estudio, etc.
@@ -121,32 +175,13 @@ def chroma_retriever(pregunta: str, config: RunnableConfig) -> Tuple[str, List[D
         subject = config["configurable"]["subject"]
         
         # Usar el cliente RAG Service
-        documents, sources = rag_client.search_documents(
+        documents, sources = await rag_client.asearch_documents(
             query=pregunta,
             subject=subject,
-            k=6
+            k=RETRIEVER_K
         )
         
-        if not documents:
-            error_msg = f"No se encontraron documentos para la asignatura '{subject}' en el RAG Service"
-            return error_msg, []
-        
-        # Formatear resultados
-        formatted_results = []
-        formatted_results.append(f"Encontrados {len(documents)} documentos relevantes:\n")
-        
-        for i, doc in enumerate(documents, 1):
-            source = doc.metadata.get("source", "Fuente desconocida")
-            page = doc.metadata.get("page", "N/A")
-            
-            formatted_results.append(f"--- Resultado {i} ---")
-            formatted_results.append(f"Fuente: {source}")
-            if page != "N/A":
-                formatted_results.append(f"Página: {page}")
-            formatted_results.append(f"Contenido: {doc.page_content}")
-            formatted_results.append("")
-        
-        return "\n".join(formatted_results), documents
+        return _format_retrieval(subject, documents, config)
         
     except KeyError as e:
         error_msg = f"Error: Falta configuración requerida: {str(e)}"
@@ -155,68 +190,199 @@ def chroma_retriever(pregunta: str, config: RunnableConfig) -> Tuple[str, List[D
         error_msg = f"Error en búsqueda RAG: {str(e)}"
         return error_msg, []
 
+AGENT_TOOLS = [consultar_guia_docente, chroma_retriever]
+
+# --- RECUPERACIÓN ESPECULATIVA ---
+
+_STOP_WORDS = {
+    'que', 'los', 'las', 'del', 'una', 'uno', 'como', 'para', 'por', 'con', 'sobre', 'cual', 'cuales',
+    'son', 'esta', 'este', 'sus', 'mas', 'pero', 'hay', 'me', 'puedes', 'podrias', 'explica', 'explicame',
+}
+
+# Búsquedas especulativas reclamadas por una tool_call, pendientes de que las use execute_tools
+_prefetched: Dict[str, Tuple[float, asyncio.Task]] = {}
+speculation_stats = {"started": 0, "reused": 0, "discarded": 0, "failed": 0}
+
+
+def _content_words(text: str) -> set:
+    return {w for w in normalize_text(text).split() if len(w) > 2 and w not in _STOP_WORDS}
+
+
+def _queries_match(question: str, tool_query: str) -> bool:
+    """La consulta del modelo está (casi) contenida en la pregunta del usuario."""
+    question_words, tool_words = _content_words(question), _content_words(tool_query)
+    if not tool_words:
+        return False
+    return len(tool_words & question_words) / len(tool_words) >= SPECULATIVE_MATCH_THRESHOLD
+
+
+def _speculation_enabled(config: RunnableConfig) -> bool:
+    configurable = (config or {}).get("configurable", {}) or {}
+    value = configurable.get("speculative_retrieval")
+    return SPECULATIVE_RETRIEVAL if value is None else bool(value)
+
+
+def _claim_prefetch(response: AIMessage, question: str, task: asyncio.Task) -> None:
+    """Asocia la búsqueda especulativa a la llamada equivalente a chroma_retriever, o la descarta."""
+    now = time.monotonic()
+    # Reclamadas que execute_tools no llegó a usar (p. ej. la ejecución se interrumpió)
+    for call_id in [k for k, (created, _) in _prefetched.items() if now - created > SPECULATIVE_PREFETCH_TTL]:
+        _prefetched.pop(call_id)[1].cancel()
+        speculation_stats["discarded"] += 1
+
+    for call in getattr(response, "tool_calls", None) or []:
+        if (call["name"] == chroma_retriever.name and call.get("id")
+                and _queries_match(question, str(call["args"].get("pregunta", "")))):
+            _prefetched[call["id"]] = (now, task)
+            return
+    task.cancel()
+    speculation_stats["discarded"] += 1
+
+
+def _take_prefetch(call_id: Optional[str]) -> Optional[asyncio.Task]:
+    """Entrega a la llamada la búsqueda especulativa que reclamó; solo entonces cuenta como reutilizada."""
+    entry = _prefetched.pop(call_id, None) if call_id else None
+    if entry is None:
+        return None
+    speculation_stats["reused"] += 1
+    return entry[1]
+
 # --- LÓGICA DEL GRAFO ---
 
-def call_agent(state: AgentState):
-    """Nodo del Agente. Decide si responder o usar una herramienta."""
+async def call_agent(state: AgentState, config: RunnableConfig):
+    """
+    Nodo del Agente. Decide si responder o usar una herramienta.
 
-    if LOCAL_INFERENCE:
-        llm = ChatOpenAI(model=VLLM_MODEL_NAME, openai_api_key="EMPTY", openai_api_base=VLLM_URL, temperature=0)
-    else:
-        llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash",temperature=0)
+    Con recuperación especulativa activa, en el primer paso de cada turno se lanza en
+    paralelo la búsqueda en los apuntes con la pregunta literal del usuario; si el
+    modelo pide chroma_retriever con una consulta equivalente, execute_tools reutiliza
+    ese resultado en lugar de volver a buscar.
+    """
 
-    tools = [consultar_guia_docente, chroma_retriever]
-    
-    llm_with_tools = llm.bind_tools(tools)
+    # El modelo con herramientas se crea una vez por proceso y se reutiliza
+    llm_with_tools = llm_registry.for_config(AGENT_TOOLS, config)
+
+    messages = state["messages"]
+    subject = state.get("subject")
+    prefetch = None
+    if (_speculation_enabled(config) and subject and messages
+            and isinstance(messages[-1], HumanMessage) and isinstance(messages[-1].content, str)):
+        question = messages[-1].content
+        prefetch = asyncio.create_task(
+            rag_client.asearch_documents(query=question, subject=subject, k=RETRIEVER_K)
+        )
+        speculation_stats["started"] += 1
 
-    response = llm_with_tools.invoke(state["messages"])
+    # El prompt de sistema no se guarda en el checkpoint (los hilos antiguos ya lo
+    # tienen como primer mensaje)
+    prompt_messages = messages
+    if subject and not (messages and isinstance(messages[0], SystemMessage)):
+        prompt_messages = [SystemMessage(content=system_prompt_for(subject)), *messages]
+
+    provider = ((config or {}).get("configurable", {}) or {}).get("llm_provider") or LLM_PROVIDER
+    try:
+        with metrics.stage("llm"), metrics.in_flight.track("llm"):
+            response = await llm_with_tools.ainvoke(with_summary(prompt_messages, state.get("summary", "")))
+    except BaseException as e:
+        if isinstance(e, Exception):
+            metrics.llm_calls.inc(provider, "error")
+        if prefetch is not None:
+            prefetch.cancel()
+        raise
+
+    metrics.record_llm_usage(provider, response)
+    if prefetch is not None:
+        _claim_prefetch(response, question, prefetch)
 
     return {"messages": [response]}
 
 
-def execute_tools(state: AgentState) -> Dict[str, Any]:
+async def _run_tool_call(call: Dict[str, Any], tool_map: Dict[str, Any], subject: str,
+                         semaphore: asyncio.Semaphore, budget: int,
+                         context_stats: Dict[str, int]) -> Tuple[ToolMessage, List[Document]]:
+    """Ejecuta una llamada a herramienta con su propio timeout. Nunca lanza excepciones."""
+    tool_name = call['name']
+
+    tool_function = tool_map.get(tool_name)
+    if not tool_function:
+        error_message = f"Error: La herramienta '{tool_name}' no existe."
+        return ToolMessage(content=error_message, tool_call_id=call['id']), []
+
+    tool_args = call['args']
+    prefetch = _take_prefetch(call.get('id'))
+
+    # Create proper config with subject from state
+    config = RunnableConfig(
+        configurable={
+            "subject": subject,
+            "thread_id": "default",
+            "context_token_budget": budget,
+            "context_stats": context_stats,
+        }
+    )
+
+    try:
+        async with semaphore:
+            with metrics.tool(tool_name):
+                result = None
+                if prefetch is not None:
+                    # Resultado de la búsqueda especulativa lanzada junto a la llamada al LLM
+                    try:
+                        documents, _ = await asyncio.wait_for(prefetch, TOOL_CALL_TIMEOUT)
+                        result = _format_retrieval(subject, documents, config)
+                    except Exception as e:
+                        # Si falla o no llega a tiempo se hace la llamada normal a la herramienta
+                        speculation_stats["failed"] += 1
+                        logger.warning(f"Búsqueda especulativa fallida, se repite la consulta: {e!r}")
+                if result is None:
+                    result = await asyncio.wait_for(tool_function.ainvoke(tool_args, config), TOOL_CALL_TIMEOUT)
+                content, docs = result
+        return ToolMessage(content=content, tool_call_id=call['id']), docs or []
+    except asyncio.TimeoutError:
+        error_msg = f"Error: La herramienta {tool_name} superó el tiempo límite de {TOOL_CALL_TIMEOUT:.0f}s."
+        return ToolMessage(content=error_msg, tool_call_id=call['id']), []
+    except Exception as e:
+        error_msg = f"Error al ejecutar la herramienta {tool_name}: {e}"
+        return ToolMessage(content=error_msg, tool_call_id=call['id']), []
+
+
+async def execute_tools(state: AgentState, config: Optional[RunnableConfig] = None) -> Dict[str, Any]:
     """
     Ejecuta las herramientas. Extrae dependencias (como 'subject') del estado
     y las inyecta en la llamada a la herramienta. Maneja correctamente la salida.
+
+    Las llamadas de un mismo paso se ejecutan en paralelo (como máximo
+    TOOL_MAX_CONCURRENCY a la vez), cada una con su timeout. Los ToolMessage y los
+    documentos se devuelven en el mismo orden que las tool_calls del modelo.
+
+    Los resultados de chroma_retriever se empaquetan en el presupuesto de tokens del
+    modelo; los tokens ahorrados se acumulan en `context_stats` durante el turno.
     """
     last_message = state['messages'][-1]
     tool_calls = last_message.tool_calls
     
     # Este mapa es crucial para llamar a la función correcta.
-    tool_map = {"consultar_guia_docente": consultar_guia_docente, "chroma_retriever": chroma_retriever}
-    
-    tool_messages = []
-    all_retrieved_docs = []
-    
-    for call in tool_calls:
-        tool_name = call['name']
-        
-        tool_function = tool_map.get(tool_name)
-        if not tool_function:
-            error_message = f"Error: La herramienta '{tool_name}' no existe."
-            tool_messages.append(ToolMessage(content=error_message, tool_call_id=call['id']))
-            continue
-
-        tool_args = call['args']
-
-        # Create proper config with subject from state
-        config = RunnableConfig(
-            configurable={
-                "subject": state.get("subject", "unknown"),
-                "thread_id": "default"
-            }
+    tool_map = {t.name: t for t in AGENT_TOOLS}
+    subject = state.get("subject", "unknown")
+    semaphore = asyncio.Semaphore(TOOL_MAX_CONCURRENCY)
+    budget = token_budget(config)
+    context_stats = dict(state.get("context_stats") or {})
+
+    with metrics.stage("tools"):
+        results = await asyncio.gather(
+            *(_run_tool_call(call, tool_map, subject, semaphore, budget, context_stats) for call in tool_calls)
         )
 
-        try:
-            content, docs = tool_function.invoke(tool_args, config)
-            tool_messages.append(ToolMessage(content=content, tool_call_id=call['id']))
-            if docs:
-                all_retrieved_docs.extend(docs)
-        except Exception as e:
-            error_msg = f"Error al ejecutar la herramienta {tool_name}: {e}"
-            tool_messages.append(ToolMessage(content=error_msg, tool_call_id=call['id']))
+    tool_messages = []
+    all_retrieved_docs = []
+    for tool_message, docs in results:
+        tool_messages.append(tool_message)
+        all_retrieved_docs.extend(docs)
 
-    return {"messages": tool_messages, "retrieved_docs": all_retrieved_docs}
+    if context_stats.get("tokens_saved"):
+        logger.debug(f"Contexto empaquetado: {context_stats['tokens_in']} -> "
+                     f"{context_stats['tokens_out']} tokens ({context_stats['tokens_saved']} ahorrados)")
+    return {"messages": tool_messages, "retrieved_docs": all_retrieved_docs, "context_stats": context_stats}
 
 def should_continue(state: AgentState) -> Literal["tools", "__end__"]:
     """Router: Decide si el ciclo continúa o termina."""
@@ -231,10 +397,19 @@ def build_graph():
     """Construye y compila el grafo del agente."""
     graph_builder = StateGraph(AgentState)
     
+    graph_builder.add_node("memory", manage_memory)
+    graph_builder.add_node("router", route_intent)
     graph_builder.add_node("agent", call_agent)
     graph_builder.add_node("tools", execute_tools)
 
-    graph_builder.set_entry_point("agent")
+    graph_builder.set_entry_point("memory")
+    graph_builder.add_edge("memory", "router")
+    # Preguntas administrativas claras: la guía docente se consulta antes del primer LLM
+    graph_builder.add_conditional_edges(
+        "router",
+        after_routing,
+        {"tools": "tools", "agent": "agent"}
+    )
     graph_builder.add_conditional_edges(
         "agent",
         should_continue,
@@ -242,38 +417,8 @@ def build_graph():
     )
     graph_builder.add_edge("tools", "agent")
 
-    # Use storage directory for checkpoints - persistent across container restarts
-    # Create storage directory if it doesn't exist
-    storage_dir = os.path.join(os.path.dirname(__file__), "..", "storage")
-    os.makedirs(storage_dir, exist_ok=True)
-    
-    checkpoint_path = os.path.join(storage_dir, "checkpoints.sqlite")
-        
-    try:
-        conn = sqlite3.connect(checkpoint_path, check_same_thread=False)
-    except sqlite3.OperationalError as e:
-        print(f"Error connecting to database at {checkpoint_path}: {e}")
-        print("Attempting to create database and directory structure...")
-        
-        # Ensure the directory exists and has proper permissions
-        os.makedirs(storage_dir, mode=0o755, exist_ok=True)
-        
-        # Try to create an empty database file
-        try:
-            with open(checkpoint_path, 'w') as f:
-                pass  # Create empty file
-            # Set file permissions
-            os.chmod(checkpoint_path, 0o644)
-            print(f"Created database file at {checkpoint_path}")
-            
-            # Now try to connect again
-            conn = sqlite3.connect(checkpoint_path, check_same_thread=False)
-            print("Successfully connected to newly created database")
-        except Exception as create_error:
-            print(f"Failed to create database: {create_error}")
-            raise
-    
-    memory = SqliteSaver(conn)
+    # Checkpoints persistentes (SQLite WAL, aiosqlite, MongoDB o memoria; ver domain.checkpointer)
+    memory = create_checkpointer()
 
     return graph_builder.compile(checkpointer=memory)
 
@@ -330,15 +475,18 @@ Ejemplo de uso:
         "retrieved_docs": []
     }
     
-    final_agent_response = None
-    # Usamos .stream() para ver cada paso del proceso
-    events = graph.stream(initial_state, config=thread_config)
-    for event in events:
-        # Busca el evento final del nodo 'agent' que no tiene tool_calls
-        if "agent" in event:
-            last_msg = event["agent"].get("messages", [])[-1]
-            if isinstance(last_msg, AIMessage) and not last_msg.tool_calls:
-                 final_agent_response = last_msg
+    async def run_example():
+        final_response = None
+        # Usamos .astream() para ver cada paso del proceso
+        async for event in graph.astream(initial_state, config=thread_config):
+            # Busca el evento final del nodo 'agent' que no tiene tool_calls
+            if "agent" in event:
+                last_msg = event["agent"].get("messages", [])[-1]
+                if isinstance(last_msg, AIMessage) and not last_msg.tool_calls:
+                    final_response = last_msg
+        return final_response
+
+    final_agent_response = asyncio.run(run_example())
 
     # Mostrar la respuesta y los documentos recuperados del estado final
     if final_agent_response:
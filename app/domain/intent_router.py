@@ -0,0 +1,126 @@
+"""
+Enrutado de intención previo al LLM.
+
+Las preguntas administrativas (profesorado, evaluación, temario...) siempre acaban en
+`consultar_guia_docente` con una sección predecible por palabras clave. El nodo
+`route_intent` se ejecuta antes del agente y, si la pregunta encaja claramente con una
+o dos secciones de la guía docente, emite directamente la llamada a la herramienta.
+Así el LLM recibe los resultados en su primera invocación y se ahorra una ida y vuelta.
+
+Las preguntas ambiguas o conceptuales siguen el bucle normal del agente.
+"""
+import logging
+import os
+import re
+import uuid
+from typing import Any, Dict, List, Literal, Optional
+
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.runnables import RunnableConfig
+
+from services.utils_service import normalize_text
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIGURACIÓN ---
+INTENT_ROUTER_ENABLED = os.getenv("INTENT_ROUTER_ENABLED", "true").lower() == "true"
+# Secciones de la guía como máximo por pregunta; con más se deja decidir al agente
+INTENT_ROUTER_MAX_SECTIONS = int(os.getenv("INTENT_ROUTER_MAX_SECTIONS", "2"))
+
+GUIA_DOCENTE_TOOL = "consultar_guia_docente"
+
+# Palabras clave (normalizadas: sin tildes ni mayúsculas) por sección de la guía docente.
+# Las secciones son las que admite `consultar_guia_docente`.
+SECTION_KEYWORDS: Dict[str, List[str]] = {
+    "profesorado": [
+        "profesor", "profesora", "profesores", "profesorado", "quien imparte", "quien da",
+        "tutoria", "tutorias", "despacho", "horario de tutoria", "coordinador", "coordinadora",
+    ],
+    "evaluacion": [
+        "evaluacion", "evalua", "evaluan", "examen", "examenes", "porcentaje", "porcentajes",
+        "calificacion", "nota final", "aprobar", "convocatoria", "extraordinaria",
+        "evaluacion unica", "cuanto vale", "cuanto cuenta",
+    ],
+    "temario": [
+        "temario", "temas", "programa de la asignatura", "contenidos", "que se ve", "que se da",
+        "programa de practicas",
+    ],
+    "metodologia": ["metodologia", "metodologias", "como se imparte", "como son las clases"],
+    "bibliografia": ["bibliografia", "libro", "libros", "manual recomendado", "lecturas recomendadas"],
+    "prerrequisitos": [
+        "prerrequisito", "prerrequisitos", "requisitos previos", "conocimientos previos",
+        "recomendaciones previas", "necesito saber antes",
+    ],
+    "competencias": ["competencias", "resultados de aprendizaje", "que voy a aprender"],
+    "enlaces": ["enlaces", "recursos web", "paginas web", "enlace recomendado"],
+}
+
+# Señales de pregunta conceptual: se deja la decisión al agente (puede necesitar los apuntes)
+CONCEPTUAL_KEYWORDS = [
+    "que es", "que son", "define", "definicion", "explica", "explicame", "ejemplo", "ejemplos",
+    "diferencia", "como funciona", "como se calcula", "demuestra", "resuelve", "ejercicio",
+]
+
+_PATTERNS = {
+    section: re.compile(r"\b(" + "|".join(re.escape(k) for k in keywords) + r")\b")
+    for section, keywords in SECTION_KEYWORDS.items()
+}
+_CONCEPTUAL = re.compile(r"\b(" + "|".join(re.escape(k) for k in CONCEPTUAL_KEYWORDS) + r")\b")
+
+
+def classify_intent(question: str) -> Optional[List[str]]:
+    """
+    Secciones de la guía docente a consultar para la pregunta, o None si es ambigua.
+
+    Returns:
+        Lista de secciones (por orden de aparición) o None si se debe dejar al agente
+    """
+    text = normalize_text(question)
+    if not text or _CONCEPTUAL.search(text):
+        return None
+
+    matches = []
+    for section, pattern in _PATTERNS.items():
+        match = pattern.search(text)
+        if match:
+            matches.append((match.start(), section))
+    if not matches or len(matches) > INTENT_ROUTER_MAX_SECTIONS:
+        return None
+    return [section for _, section in sorted(matches)]
+
+
+def _last_question(messages: List[Any]) -> Optional[str]:
+    """Texto del último mensaje si es del usuario (inicio de turno)."""
+    if messages and isinstance(messages[-1], HumanMessage) and isinstance(messages[-1].content, str):
+        return messages[-1].content
+    return None
+
+
+async def route_intent(state: Dict[str, Any], config: RunnableConfig) -> Dict[str, Any]:
+    """
+    Nodo de enrutado: si la pregunta es claramente administrativa, emite las llamadas a
+    `consultar_guia_docente` como si las hubiera pedido el modelo.
+    """
+    configurable = (config or {}).get("configurable", {}) or {}
+    if not INTENT_ROUTER_ENABLED or configurable.get("intent_router") is False:
+        return {}
+
+    question = _last_question(state.get("messages", []))
+    sections = classify_intent(question) if question else None
+    if not sections:
+        return {}
+
+    logger.info(f"Pregunta enrutada directamente a la guía docente: {sections}")
+    tool_calls = [
+        {"name": GUIA_DOCENTE_TOOL, "args": {"seccion": section}, "id": f"router_{uuid.uuid4().hex[:12]}"}
+        for section in sections
+    ]
+    return {"messages": [AIMessage(content="", tool_calls=tool_calls)]}
+
+
+def after_routing(state: Dict[str, Any]) -> Literal["tools", "agent"]:
+    """Router: a herramientas si el nodo de enrutado emitió llamadas; si no, al agente."""
+    messages = state.get("messages", [])
+    if messages and isinstance(messages[-1], AIMessage) and messages[-1].tool_calls:
+        return "tools"
+    return "agent"
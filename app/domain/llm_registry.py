@@ -0,0 +1,137 @@
+"""
+Registro de proveedores LLM a nivel de proceso.
+
+Los modelos (y sus versiones con herramientas enlazadas) se crean una sola vez por
+(proveedor, modelo, temperatura, herramientas) y se reutilizan en cada paso del agente,
+compartiendo los pools de conexiones HTTP. El proveedor se elige en tiempo de ejecución
+(variable LLM_PROVIDER o `configurable.llm_provider` en la config del grafo).
+"""
+import os
+import threading
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+import httpx
+from dotenv import load_dotenv
+from langchain_core.language_models import BaseChatModel
+from langchain_core.runnables import Runnable, RunnableConfig
+from langchain_core.tools import BaseTool
+from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain_openai import ChatOpenAI
+
+load_dotenv()
+
+# --- CONFIGURACIÓN ---
+# "gemini" (API de Google) o "vllm" (inferencia local compatible con OpenAI)
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "gemini").lower()
+LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", "0"))
+GEMINI_MODEL_NAME = os.getenv("GEMINI_MODEL_NAME", "gemini-2.0-flash")
+VLLM_URL = os.getenv("VLLM_URL", "http://localhost:8000") + "/v1"
+VLLM_MODEL_NAME = os.getenv("MODEL_DIR", "/models/Sreenington--Phi-3-mini-4k-instruct-AWQ")
+# Límites del pool HTTP compartido por los clientes compatibles con OpenAI
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "50"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+
+SUPPORTED_PROVIDERS = ("gemini", "vllm")
+
+DEFAULT_MODELS = {
+    "gemini": GEMINI_MODEL_NAME,
+    "vllm": VLLM_MODEL_NAME,
+}
+
+
+class LLMRegistry:
+    """Caché de modelos y de modelos con herramientas enlazadas."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models: Dict[Tuple[str, str, float], BaseChatModel] = {}
+        self._bound: Dict[Tuple[str, str, float, Tuple[str, ...]], Runnable] = {}
+        self._http_client: Optional[httpx.Client] = None
+        self._http_async_client: Optional[httpx.AsyncClient] = None
+
+    def _limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+        )
+
+    def _openai_http_clients(self) -> Tuple[httpx.Client, httpx.AsyncClient]:
+        """Pools HTTP compartidos por todos los modelos compatibles con OpenAI."""
+        if self._http_client is None:
+            self._http_client = httpx.Client(limits=self._limits(), timeout=120)
+        if self._http_async_client is None:
+            self._http_async_client = httpx.AsyncClient(limits=self._limits(), timeout=120)
+        return self._http_client, self._http_async_client
+
+    def _create_model(self, provider: str, model: str, temperature: float) -> BaseChatModel:
+        if provider == "vllm":
+            http_client, http_async_client = self._openai_http_clients()
+            return ChatOpenAI(
+                model=model,
+                openai_api_key="EMPTY",
+                openai_api_base=VLLM_URL,
+                temperature=temperature,
+                http_client=http_client,
+                http_async_client=http_async_client,
+            )
+        if provider == "gemini":
+            return ChatGoogleGenerativeAI(model=model, temperature=temperature)
+        raise ValueError(f"Proveedor LLM desconocido: '{provider}'. Disponibles: {SUPPORTED_PROVIDERS}")
+
+    def get_model(self, provider: str = LLM_PROVIDER, model: Optional[str] = None,
+                  temperature: float = LLM_TEMPERATURE) -> BaseChatModel:
+        """Devuelve el modelo para (proveedor, modelo, temperatura), creándolo solo una vez."""
+        provider = provider.lower()
+        model = model or DEFAULT_MODELS.get(provider, "")
+        key = (provider, model, float(temperature))
+        with self._lock:
+            llm = self._models.get(key)
+            if llm is None:
+                llm = self._create_model(provider, model, temperature)
+                self._models[key] = llm
+            return llm
+
+    def get_bound_model(self, tools: Sequence[BaseTool], provider: str = LLM_PROVIDER,
+                        model: Optional[str] = None, temperature: float = LLM_TEMPERATURE) -> Runnable:
+        """Devuelve el modelo con las herramientas ya enlazadas (bind_tools una sola vez)."""
+        provider = provider.lower()
+        model = model or DEFAULT_MODELS.get(provider, "")
+        key = (provider, model, float(temperature), tuple(sorted(t.name for t in tools)))
+        with self._lock:
+            bound = self._bound.get(key)
+        if bound is not None:
+            return bound
+
+        bound = self.get_model(provider, model, temperature).bind_tools(list(tools))
+        with self._lock:
+            # Si otro hilo se adelantó, nos quedamos con su instancia
+            return self._bound.setdefault(key, bound)
+
+    def for_config(self, tools: Sequence[BaseTool], config: Optional[RunnableConfig] = None) -> Runnable:
+        """
+        Modelo con herramientas según la config del grafo. Se puede sobrescribir por
+        petición con `configurable.llm_provider`, `llm_model` y `llm_temperature`.
+        """
+        configurable: Dict[str, Any] = (config or {}).get("configurable", {}) or {}
+        return self.get_bound_model(
+            tools,
+            provider=configurable.get("llm_provider") or LLM_PROVIDER,
+            model=configurable.get("llm_model"),
+            temperature=configurable.get("llm_temperature", LLM_TEMPERATURE),
+        )
+
+    async def aclose(self) -> None:
+        """Cierra los pools HTTP compartidos (al apagar la aplicación)."""
+        if self._http_async_client is not None:
+            await self._http_async_client.aclose()
+            self._http_async_client = None
+        if self._http_client is not None:
+            self._http_client.close()
+            self._http_client = None
+        with self._lock:
+            self._models.clear()
+            self._bound.clear()
+
+
+# Instancia global del registro
+llm_registry = LLMRegistry()
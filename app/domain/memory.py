@@ -0,0 +1,177 @@
+"""
+Gestión de la memoria de la conversación dentro del grafo.
+
+El nodo `manage_memory` se ejecuta al inicio de cada turno, antes del agente:
+- Mantiene literalmente los últimos MEMORY_KEEP_TURNS turnos.
+- Resume los turnos más antiguos en un resumen acumulado (`summary` en el estado).
+- Sustituye el contenido de los ToolMessage de turnos anteriores por un marcador.
+- Respeta un presupuesto de tokens (MEMORY_TOKEN_BUDGET) para el historial.
+
+Los mensajes se eliminan/reemplazan con RemoveMessage y mensajes con el mismo id,
+así que el checkpoint también deja de crecer con la antigüedad de la conversación.
+"""
+import os
+from typing import Any, Dict, List, Tuple
+
+from langchain_core.messages import (
+    AIMessage, AnyMessage, HumanMessage, RemoveMessage, SystemMessage, ToolMessage
+)
+from langchain_core.runnables import RunnableConfig
+
+from domain.llm_registry import llm_registry, LLM_PROVIDER
+from services.utils_service import count_tokens
+
+# --- CONFIGURACIÓN ---
+MEMORY_ENABLED = os.getenv("MEMORY_ENABLED", "true").lower() == "true"
+# Turnos que se conservan literalmente tras resumir
+MEMORY_KEEP_TURNS = int(os.getenv("MEMORY_KEEP_TURNS", "4"))
+# Se resume cuando hay más turnos que este valor (histéresis: no se resume en cada turno)
+MEMORY_MAX_TURNS = int(os.getenv("MEMORY_MAX_TURNS", "8"))
+# Presupuesto de tokens del historial (sin contar el prompt de sistema)
+MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "6000"))
+# "llm" resume con el modelo; "extractive" usa un resumen barato sin LLM
+MEMORY_SUMMARY_MODE = os.getenv("MEMORY_SUMMARY_MODE", "llm").lower()
+MEMORY_SUMMARY_MAX_CHARS = int(os.getenv("MEMORY_SUMMARY_MAX_CHARS", "3000"))
+
+TOOL_PAYLOAD_PLACEHOLDER = "[Resultado de herramienta omitido para ahorrar contexto]"
+
+SUMMARY_PROMPT = """Resume de forma concisa la siguiente conversación entre un estudiante y un asistente académico.
+Conserva los temas consultados, los datos concretos que se dieron (fechas, porcentajes, nombres) y las dudas pendientes.
+Escribe en español, en prosa breve, sin saludos.
+
+Resumen previo:
+{summary}
+
+Nuevos turnos:
+{turns}
+
+Resumen actualizado:"""
+
+
+def message_tokens(message: AnyMessage) -> int:
+    """Tokens aproximados que ocupa un mensaje en el prompt."""
+    content = message.content if isinstance(message.content, str) else str(message.content)
+    tokens = count_tokens(content)
+    if isinstance(message, AIMessage) and message.tool_calls:
+        tokens += sum(count_tokens(f"{call['name']} {call['args']}") for call in message.tool_calls)
+    return tokens
+
+
+def _split_turns(messages: List[AnyMessage]) -> Tuple[List[AnyMessage], List[List[AnyMessage]]]:
+    """Separa los mensajes de sistema iniciales y agrupa el resto en turnos (cada HumanMessage abre uno)."""
+    head: List[AnyMessage] = []
+    turns: List[List[AnyMessage]] = []
+    for message in messages:
+        if isinstance(message, HumanMessage):
+            turns.append([message])
+        elif turns:
+            turns[-1].append(message)
+        else:
+            head.append(message)
+    return head, turns
+
+
+def _render_turns(turns: List[List[AnyMessage]]) -> str:
+    lines = []
+    for turn in turns:
+        for message in turn:
+            if isinstance(message, HumanMessage):
+                lines.append(f"Estudiante: {message.content}")
+            elif isinstance(message, AIMessage) and message.content:
+                lines.append(f"Asistente: {message.content}")
+    return "\n".join(lines)
+
+
+def _extractive_summary(summary: str, turns: List[List[AnyMessage]]) -> str:
+    """Resumen sin LLM: pregunta completa y comienzo de la respuesta final de cada turno."""
+    lines = [summary] if summary else []
+    for turn in turns:
+        question = next((m.content for m in turn if isinstance(m, HumanMessage)), "")
+        answer = next((m.content for m in reversed(turn)
+                       if isinstance(m, AIMessage) and isinstance(m.content, str) and m.content), "")
+        lines.append(f"- El estudiante preguntó: {question}. Respuesta: {answer[:200]}")
+    return "\n".join(lines)[-MEMORY_SUMMARY_MAX_CHARS:]
+
+
+async def _summarize(summary: str, turns: List[List[AnyMessage]], config: RunnableConfig) -> str:
+    if MEMORY_SUMMARY_MODE != "llm":
+        return _extractive_summary(summary, turns)
+    try:
+        configurable = (config or {}).get("configurable", {}) or {}
+        llm = llm_registry.get_model(
+            provider=configurable.get("llm_provider") or LLM_PROVIDER,
+            model=configurable.get("llm_model"),
+        )
+        prompt = SUMMARY_PROMPT.format(summary=summary or "(ninguno)", turns=_render_turns(turns))
+        response = await llm.ainvoke([HumanMessage(content=prompt)])
+        return str(response.content)[:MEMORY_SUMMARY_MAX_CHARS]
+    except Exception as e:
+        print(f"--- WARNING: Resumen con LLM fallido, usando resumen extractivo: {e} ---")
+        return _extractive_summary(summary, turns)
+
+
+def with_summary(messages: List[AnyMessage], summary: str) -> List[AnyMessage]:
+    """Inserta el resumen acumulado tras el prompt de sistema (solo para el prompt, no se guarda)."""
+    if not summary:
+        return messages
+    summary_message = SystemMessage(content=f"Resumen de la conversación anterior:\n{summary}")
+    if messages and isinstance(messages[0], SystemMessage):
+        return [messages[0], summary_message, *messages[1:]]
+    return [summary_message, *messages]
+
+
+async def manage_memory(state: Dict[str, Any], config: RunnableConfig) -> Dict[str, Any]:
+    """Nodo de memoria: acota el historial antes de llamar al agente."""
+    messages: List[AnyMessage] = state.get("messages", [])
+    if not MEMORY_ENABLED or not messages:
+        return {}
+
+    _, turns = _split_turns(messages)
+    summary = state.get("summary", "") or ""
+    tokens_before = sum(message_tokens(m) for turn in turns for m in turn) + count_tokens(summary)
+
+    updates: List[AnyMessage] = []
+
+    # 1. Resumir los turnos antiguos si hay demasiados o se supera el presupuesto
+    keep = len(turns)
+    if len(turns) > MEMORY_MAX_TURNS:
+        keep = MEMORY_KEEP_TURNS
+    while keep > 1 and sum(message_tokens(m) for t in turns[-keep:] for m in t) > MEMORY_TOKEN_BUDGET:
+        keep -= 1
+    keep = max(1, keep)
+    folded = turns[:-keep] if keep < len(turns) else []
+    kept = turns[-keep:] if turns else []
+
+    if folded:
+        summary = await _summarize(summary, folded, config)
+        updates.extend(RemoveMessage(id=m.id) for turn in folded for m in turn if m.id)
+
+    # 2. Vaciar las salidas de herramientas de turnos anteriores al actual
+    for turn in kept[:-1]:
+        for message in turn:
+            if (isinstance(message, ToolMessage) and message.id
+                    and message.content != TOOL_PAYLOAD_PLACEHOLDER):
+                updates.append(ToolMessage(
+                    content=TOOL_PAYLOAD_PLACEHOLDER,
+                    tool_call_id=message.tool_call_id,
+                    id=message.id,
+                ))
+
+    if not updates:
+        return {}
+
+    replaced = {m.id: m for m in updates if not isinstance(m, RemoveMessage)}
+    tokens_after = sum(
+        message_tokens(replaced.get(m.id, m)) for turn in kept for m in turn
+    ) + count_tokens(summary)
+    stats = {
+        "tokens_before": tokens_before,
+        "tokens_after": tokens_after,
+        "tokens_saved": max(0, tokens_before - tokens_after),
+        "turns_folded": len(folded),
+        "turns_kept": len(kept),
+    }
+    print(f"--- INFO: Memoria acotada: {stats['tokens_saved']} tokens de prompt ahorrados "
+          f"({tokens_before} -> {tokens_after}), {len(folded)} turnos resumidos ---")
+
+    return {"messages": updates, "summary": summary, "memory_stats": stats}
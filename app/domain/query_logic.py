@@ -1,18 +1,17 @@
 import os
-import re
-import requests
+import asyncio
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
-from langchain_google_genai import ChatGoogleGenerativeAI
 
-from langchain_core.messages import HumanMessage, SystemMessage
+from typing import AsyncIterator, Optional, Tuple
+from langchain_core.messages import HumanMessage, AIMessage, AIMessageChunk
 
-from domain.graph import build_graph, AgentState # Importa AgentState también
-from langchain_core.prompts import PromptTemplate
+from domain.graph import build_graph
+from domain.answer_cache import answer_cache, CacheProbe
+from domain.conversation_guard import conversation_guard, ConversationBusyError, ConversationTurn
+from domain.admission import admission, AdmissionRejectedError, PRIORITY_DEFAULT, PRIORITY_LTI
 
-# Langfuse imports for tracing
-from langfuse import Langfuse, get_client
-from langfuse.langchain import CallbackHandler
+from services.tracing_service import tracing
+from services.metrics_service import metrics
 
 load_dotenv()
 
@@ -26,94 +25,42 @@ VLLM_MODEL_NAME = os.getenv("MODEL_DIR", "/models/Sreenington--Phi-3-mini-4k-ins
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 os.environ["GOOGLE_API_KEY"] = GEMINI_API_KEY
 
-# =====================================
-# ========= LANGFUSE SETUP ============
-# =====================================
-
-# Initialize Langfuse client (uses environment variables)
-Langfuse()
-langfuse = get_client()
-
-# Safe flush helper (module-level) — prevents the app from crashing if Langfuse collector is unreachable
-def safe_flush(client):
-    try:
-        client.flush()
-    except Exception as e:
-        # Catch connection errors to the Langfuse collector (e.g., connection refused)
-        # Do not re-raise; just log and continue.
-        try:
-            import logging
-            logging.getLogger(__name__).warning(f"Langfuse flush failed: {e}")
-        except Exception:
-            pass
-
-# =====================================
-
 #Poner como función para iniciar en la api_router
 rag_graph = build_graph()
 
-System_prompt_template = PromptTemplate.from_template("""Eres un asistente académico especializado en {subject}. Tu función es responder preguntas usando SIEMPRE las herramientas disponibles.
-
-## REGLAS OBLIGATORIAS:
-
-1. **NUNCA pidas permiso para usar herramientas** - Úsalas directamente y automáticamente
-2. **NUNCA preguntes qué información quiere el usuario** - Busca toda la información relevante inmediatamente
-3. **USA las herramientas EN CADA RESPUESTA** antes de contestar
 
-## HERRAMIENTAS (úsalas automáticamente):
+def _thread_id(email: str, subject: str) -> str:
+    """Hilo de LangGraph (y clave de serialización) de la conversación de un usuario en una asignatura."""
+    return "-".join([email, subject])
 
-### chroma_retriever
-**USA PRIMERO** para TODAS las preguntas sobre conceptos, definiciones, teoría o contenido académico.
-Busca automáticamente información en los apuntes y documentos de la asignatura.
 
-### consultar_guia_docente  
-**USA** para preguntas sobre: profesorado, evaluación, temario, metodología, bibliografía, prerrequisitos, competencias, recursos.
-
-## PROTOCOLO OBLIGATORIO:
-
-**PASO 1:** Lee la pregunta del usuario
-**PASO 2:** USA inmediatamente la herramienta correspondiente (chroma_retriever para contenido académico, consultar_guia_docente para info administrativa)
-**PASO 3:** Con los resultados obtenidos, redacta una respuesta clara y completa
-
-## FORMATO DE RESPUESTA:
-
-1. **Respuesta directa** basada en la información recuperada
-2. **Explicación detallada** con ejemplos si es necesario
-3. **Contexto adicional** relacionando con otros temas de la asignatura
-4. **Síntesis** de los puntos clave
-
-## EJEMPLOS DE USO CORRECTO:
-
-Usuario: "¿Qué es la estimación puntual?"
-✅ CORRECTO: Usar chroma_retriever inmediatamente → Responder con la información encontrada
-
-❌ INCORRECTO: "¿Quieres que busque en los documentos?" o "¿Qué información específica necesitas?"
-
-Usuario: "¿Cómo se evalúa la asignatura?"  
-✅ CORRECTO: Usar consultar_guia_docente con sección "evaluacion" → Responder con los criterios
-
-❌ INCORRECTO: Pedir más detalles sobre qué aspecto de la evaluación
+async def acquire_turn(query_text: str, subject: str = None, email: str = "anonymous") -> ConversationTurn:
+    """
+    Turno sobre la conversación (ver domain.conversation_guard). El endpoint de streaming
+    lo pide antes de empezar a responder para poder contestar 409/429.
 
-## TONO:
-Claro, directo, académico pero accesible. Responde con confianza basándote en la información recuperada.
-""")
+    Raises:
+        ConversationBusyError: si la conversación está ocupada
+    """
+    return await conversation_guard.acquire(_thread_id(email, subject), query_text)
 
 
+def _prepare_run(query_text: str,
+                 subject: str,
+                 use_finetuned: bool,
+                 email: str,
+                 stream_tag: str = "query"
+                 ) -> Tuple[dict, dict, str]:
+    """
+    Prepara la entrada y la configuración del grafo para una pregunta.
 
+    No se lee el estado previo del hilo: el agente antepone el prompt de sistema de la
+    asignatura si la conversación no lo tiene ya, así que la entrada es la misma para
+    conversaciones nuevas y existentes.
 
-def query_rag(query_text: str,
-              subject: str = None,
-              use_finetuned: bool = False,
-              email: str = "anonymous"
-              ) -> dict:
-    """
-    Realiza búsqueda RAG y genera una respuesta.
+    Returns:
+        Tupla (input_data, config, model_desc)
     """
-
-    system_prompt = SystemMessage(
-        content=System_prompt_template.invoke({"subject": subject}).text
-        )
-    
     model_desc = None
 
     if use_finetuned and subject: 
@@ -121,58 +68,206 @@ def query_rag(query_text: str,
     else:
         model_desc = "base"    
 
-    conversation_id = "-".join([email, subject]) 
+    conversation_id = _thread_id(email, subject)
     config = {
         "configurable": {
             "thread_id": conversation_id,
             "subject": subject,
             "email": email,
         },
-        "callbacks": [CallbackHandler()],
+        # Solo las peticiones muestreadas llevan el handler de Langfuse (ver services.tracing_service)
+        "callbacks": tracing.callbacks_for(subject, [model_desc, stream_tag]),
         "metadata": {
             "langfuse_user_id": email,
             "langfuse_session_id": conversation_id,
-            "langfuse_tags": [subject, model_desc, "query"],
+            "langfuse_tags": [subject, model_desc, stream_tag],
         }
     }
-    
-    existing_state: AgentState = rag_graph.get_state(config)
 
-    input_data = {}
-    
-    if not existing_state or not existing_state.values.get("messages"):
-        print(f"--- INFO: Creando nueva conversación con ID: {conversation_id} ---")
-        input_data = {
-            "messages": [system_prompt, HumanMessage(content=query_text)],
-            "subject": subject,
-            "retrieved_docs": []
-        }
-    else:
-        print(f"--- INFO: Continuando conversación con ID: {conversation_id} ---")
-        input_data = {
-            "messages": [HumanMessage(content=query_text)]
-        }
+    input_data = {
+        "messages": [HumanMessage(content=query_text)],
+        "subject": subject,
+        # Las fuentes de la respuesta son solo las recuperadas en este turno
+        "retrieved_docs": [],
+        "context_stats": {}
+    }
 
-    #ASYNC PARA STREAMING?
-    final_result = None
-    for event in rag_graph.stream(input_data, config=config, stream_mode="values"):
-        # "values" nos da el estado completo después de cada paso
-        final_result = event
+    return input_data, config, model_desc
 
-    final_response_message = final_result["messages"][-1]
+
+def _build_result(final_result: dict, model_desc: str) -> dict:
+    """Extrae respuesta y fuentes del estado final del grafo."""
+    final_response_message = final_result["messages"][-1] if final_result else None
     final_response = final_response_message.content if final_response_message else "No se pudo generar respuesta."
     
-    final_docs = final_result.get('retrieved_docs', [])
+    final_docs = final_result.get('retrieved_docs', []) if final_result else []
     sources = [doc.metadata.get("source", "N/A") for doc in final_docs]
 
     print(f"Fuentes recuperadas: {sources}")
 
-    # Flush Langfuse events to ensure they are sent (safe - don't crash on connection errors)
-    safe_flush(langfuse)
+    context_stats = (final_result.get("context_stats") or {}) if final_result else {}
+    return {"response": final_response, "sources": sources, "model_used": model_desc,
+            "context_tokens_saved": context_stats.get("tokens_saved", 0)}
+
 
-    return {"response": final_response, "sources": sources, "model_used": model_desc}
+async def _cache_lookup(query_text: str, subject: str, use_cache: bool) -> Tuple[Optional[dict], Optional[CacheProbe]]:
+    """Consulta la caché semántica de respuestas (o registra que se la salta)."""
+    if not use_cache:
+        answer_cache.record_bypass(subject)
+        return None, None
+    try:
+        with metrics.stage("cache_lookup"):
+            return await answer_cache.lookup(subject, query_text)
+    except Exception as e:
+        print(f"--- WARNING: Caché de respuestas no disponible: {e} ---")
+        return None, None
+
+
+async def _record_cached_turn(input_data: dict, config: dict, response: str) -> None:
+    """Añade la pregunta y la respuesta cacheada al hilo, para que los siguientes turnos tengan contexto."""
+    try:
+        await rag_graph.aupdate_state(
+            config,
+            {**input_data, "messages": [*input_data["messages"], AIMessage(content=response)]},
+            as_node="agent",
+        )
+    except Exception as e:
+        print(f"--- WARNING: No se pudo guardar el turno cacheado en la conversación: {e} ---")
+
+
+async def query_rag(query_text: str,
+              subject: str = None,
+              use_finetuned: bool = False,
+              email: str = "anonymous",
+              use_cache: bool = True,
+              priority: int = PRIORITY_DEFAULT
+              ) -> dict:
+    """
+    Realiza búsqueda RAG y genera una respuesta.
+
+    Si `use_cache` está activo, primero se consulta la caché semántica de respuestas
+    de la asignatura; en caso de acierto no se ejecuta el grafo.
+
+    Las peticiones sobre la misma conversación se atienden de una en una, y una petición
+    idéntica a otra en curso reutiliza su respuesta (`"coalesced": True`).
+
+    La ejecución del grafo espera plaza en el control de admisión (domain.admission);
+    `priority` es PRIORITY_LTI para las sesiones lanzadas desde Moodle.
+
+    Raises:
+        ConversationBusyError: si la conversación está ocupada (409/429)
+        AdmissionRejectedError: si no hay plaza para ejecutar el agente (503)
+    """
+    async with await acquire_turn(query_text, subject, email) as turn:
+        if not turn.leader:
+            return {**await turn.wait(), "coalesced": True}
+        result = await _run_query(query_text, subject, use_finetuned, email, use_cache, priority)
+        turn.set_result(result)
+        return result
+
+
+async def _run_query(query_text: str, subject: str, use_finetuned: bool, email: str, use_cache: bool,
+                     priority: int = PRIORITY_DEFAULT) -> dict:
+    input_data, config, model_desc = _prepare_run(query_text, subject, use_finetuned, email)
 
-def clear_session(subject: str, email: str) -> bool:
+    cached, probe = await _cache_lookup(query_text, subject, use_cache)
+    if cached is not None:
+        await _record_cached_turn(input_data, config, cached["response"])
+        return {**cached, "cached": True}
+
+    final_result = None
+    async with admission.slot(subject, priority):
+        async for event in rag_graph.astream(input_data, config=config, stream_mode="values"):
+            # "values" nos da el estado completo después de cada paso
+            final_result = event
+
+
+    result = _build_result(final_result, model_desc)
+    answer_cache.store(probe, result)
+    return {**result, "cached": False}
+
+
+async def stream_query_rag(query_text: str,
+                           subject: str = None,
+                           use_finetuned: bool = False,
+                           email: str = "anonymous",
+                           use_cache: bool = True,
+                           turn: Optional[ConversationTurn] = None,
+                           priority: int = PRIORITY_DEFAULT
+                           ) -> AsyncIterator[dict]:
+    """
+    Igual que query_rag, pero va emitiendo eventos a medida que avanza el grafo:
+
+    - {"type": "tool_call", "tool": ..., "args": ...}   cuando el agente pide una herramienta
+    - {"type": "tool_result", "tool": ...}               cuando la herramienta termina
+    - {"type": "token", "content": ...}                 por cada fragmento de texto del LLM
+    - {"type": "done", "response": ..., "sources": [...], "model_used": ..., "cached": ...} al final
+
+    Con un acierto de la caché de respuestas se emite la respuesta completa en un solo token,
+    igual que cuando se reutiliza la respuesta de una petición idéntica en curso.
+
+    `turn` es el turno ya concedido con `acquire_turn`; si no se pasa, se pide aquí.
+    `priority` es la prioridad en el control de admisión, como en query_rag.
+    """
+    turn = turn or await acquire_turn(query_text, subject, email)
+    async with turn:
+        if not turn.leader:
+            result = await turn.wait()
+            yield {"type": "token", "content": result["response"]}
+            yield {"type": "done", **result, "coalesced": True}
+            return
+        async for event in _stream_events(query_text, subject, use_finetuned, email, use_cache, priority):
+            if event["type"] == "done":
+                turn.set_result({key: value for key, value in event.items() if key != "type"})
+            yield event
+
+
+async def _stream_events(query_text: str, subject: str, use_finetuned: bool, email: str,
+                         use_cache: bool, priority: int = PRIORITY_DEFAULT) -> AsyncIterator[dict]:
+    input_data, config, model_desc = _prepare_run(query_text, subject, use_finetuned, email, "stream")
+
+    cached, probe = await _cache_lookup(query_text, subject, use_cache)
+    if cached is not None:
+        await _record_cached_turn(input_data, config, cached["response"])
+        yield {"type": "token", "content": cached["response"]}
+        yield {"type": "done", **cached, "cached": True}
+        return
+
+    final_result = None
+    async with admission.slot(subject, priority):
+        async for mode, chunk in rag_graph.astream(input_data, config=config,
+                                                   stream_mode=["messages", "updates", "values"]):
+            if mode == "messages":
+                message, metadata = chunk
+                # Solo el texto que el agente genera, no los mensajes de herramientas
+                if metadata.get("langgraph_node") != "agent" or not isinstance(message, AIMessageChunk):
+                    continue
+                if isinstance(message.content, str) and message.content:
+                    yield {"type": "token", "content": message.content}
+            elif mode == "updates":
+                for node in ("router", "agent"):
+                    if not (chunk.get(node) or {}).get("messages"):
+                        continue
+                    for message in chunk[node]["messages"]:
+                        for call in getattr(message, "tool_calls", None) or []:
+                            yield {"type": "tool_call", "tool": call["name"], "args": call["args"]}
+                if "tools" in chunk:
+                    tool_names = {}
+                    last_ai = next((m for m in reversed((final_result or {}).get("messages", []))
+                                    if isinstance(m, AIMessage)), None)
+                    if last_ai is not None:
+                        tool_names = {call["id"]: call["name"] for call in last_ai.tool_calls}
+                    for message in chunk["tools"].get("messages", []):
+                        yield {"type": "tool_result", "tool": tool_names.get(message.tool_call_id, "unknown")}
+            else:
+                # "values" nos da el estado completo después de cada paso
+                final_result = chunk
+
+    result = _build_result(final_result, model_desc)
+    answer_cache.store(probe, result)
+    yield {"type": "done", **result, "cached": False}
+
+async def clear_session(subject: str, email: str) -> bool:
     """
     Limpia la memoria de una sesión específica (email + subject).
     
@@ -182,10 +277,17 @@ def clear_session(subject: str, email: str) -> bool:
         
     Returns:
         bool: True si la sesión fue limpiada exitosamente
+
+    Raises:
+        ConversationBusyError: si hay peticiones en curso sobre la conversación
     """
-    import time
+    async with await conversation_guard.acquire(_thread_id(email, subject)):
+        return await _clear_thread(subject, email)
+
+
+async def _clear_thread(subject: str, email: str) -> bool:
     try:
-        conversation_id = "-".join([email, subject])
+        conversation_id = _thread_id(email, subject)
         config = {
             "configurable": {
                 "thread_id": conversation_id,
@@ -195,38 +297,17 @@ def clear_session(subject: str, email: str) -> bool:
         }
         
         # Verificar si existe estado previo
-        existing_state = rag_graph.get_state(config)
+        existing_state = await rag_graph.aget_state(config)
         
         if existing_state and existing_state.values.get("messages"):
             print(f"--- INFO: Limpiando sesión con ID: {conversation_id} ---")
             
-            # Create system prompt for clean state
-            clean_system_prompt = SystemMessage(
-                content=System_prompt_template.invoke({"subject": subject}).text
-            )
-            
-            # Crear estado inicial limpio (solo con system prompt)
-            clean_state = {
-                "messages": [clean_system_prompt],  # Solo system prompt, sin historia
-                "subject": subject,
-                "retrieved_docs": []
-            }
-            
-            # Sobrescribir completamente el estado
-            try:
-                rag_graph.update_state(config, clean_state, as_node="__start__")
-                print(f"--- INFO: Estado completamente reiniciado ---")
-            except Exception as update_error:
-                print(f"--- WARNING: Error con as_node: {update_error} ---")
-                # Fallback sin as_node
-                rag_graph.update_state(config, clean_state)
-                print(f"--- INFO: Estado reiniciado (fallback) ---")
+            # Borrar el hilo entero (todos sus checkpoints y escrituras). El system prompt
+            # se añade en cada llamada al agente, así que el siguiente turno empieza limpio.
+            await rag_graph.checkpointer.adelete_thread(conversation_id)
                 
             print(f"--- INFO: Sesión {conversation_id} limpiada exitosamente ---")
             
-            # Flush Langfuse events (safe)
-            safe_flush(langfuse)
-            
             return True
         else:
             print(f"--- INFO: No hay sesión existente para limpiar: {conversation_id} ---")
@@ -245,18 +326,18 @@ if __name__ == "__main__":
     
     # Primera pregunta
     print("\n--- PRIMER TURNO ---")
-    response_1 = query_rag(
+    response_1 = asyncio.run(query_rag(
         query_text="¿qué es un algoritmo greedy?",
         subject="metaheuristicas",
         email="test@correo.ugr.es"
-    )
+    ))
     print(f"Agente: {response_1['response']}")
     
     # Segunda pregunta (el agente debería recordar el contexto si el modelo lo permite)
     print("\n--- SEGUNDO TURNO ---")
-    response_2 = query_rag(
+    response_2 = asyncio.run(query_rag(
         query_text="¿y podrías darme un ejemplo de uno de esos algoritmos?",
         subject="metaheuristicas", # El subject debe ser consistente
         email="test@correo.ugr.es"   # El email debe ser consistente
-    )
+    ))
     print(f"Agente: {response_2['response']}")
\ No newline at end of file
@@ -112,6 +112,21 @@ class LTISessionService:
         
         return session
     
+    async def find_active_session(self, session_token: str) -> Optional[Dict]:
+        """
+        Get an unexpired session by token without updating its last activity.
+        
+        Args:
+            session_token: Session token
+            
+        Returns:
+            Session dictionary (token and expiry only) or None
+        """
+        return await self.sessions_collection.find_one(
+            {"session_token": session_token, "expires_at": {"$gt": datetime.utcnow()}},
+            {"session_token": 1, "expires_at": 1}
+        )
+    
     async def delete_session(self, session_token: str) -> bool:
         """
         Delete a session.
@@ -11,6 +11,7 @@ Route modules:
 - chat: Chat and conversation management
 - users: User account management
 - subjects: Subject enrollment management
+- admin: Conversation storage statistics and maintenance
 """
 
 from fastapi import APIRouter
@@ -20,6 +21,7 @@ from .sessions import router as sessions_router
 from .chat import router as chat_router
 from .users import router as users_router
 from .subjects import router as subjects_router
+from .admin import router as admin_router
 
 # Create main router
 router = APIRouter()
@@ -30,5 +32,6 @@ router.include_router(sessions_router)
 router.include_router(chat_router)
 router.include_router(users_router)
 router.include_router(subjects_router)
+router.include_router(admin_router)
 
 __all__ = ["router"]
@@ -0,0 +1,163 @@
+"""
+Admin Routes
+
+Storage statistics and on-demand maintenance of the conversation checkpoints,
+answer cache statistics and invalidation, retrieval context packing, tracing export, analytics delivery,
+per-conversation request serialization and agent admission control metrics.
+
+Every endpoint requires the X-Admin-Token header to match ADMIN_TOKEN; if
+ADMIN_TOKEN is not set they are disabled and answer 404.
+"""
+
+import secrets
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, HTTPException
+
+from core.config import ADMIN_TOKEN
+
+from domain.answer_cache import answer_cache
+from domain.checkpointer import checkpoint_maintenance
+from domain.conversation_guard import conversation_guard
+from domain.admission import admission
+from domain.context_packing import CONTEXT_PACKING_ENABLED, packing_stats, token_budget
+from domain.query_logic import rag_graph
+from services.logging_service import analytics_emitter
+from services.tracing_service import tracing
+
+
+
+async def require_admin_token(x_admin_token: Optional[str] = Header(default=None)) -> None:
+    """Reject requests without the admin token (404 while ADMIN_TOKEN is not configured)."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if x_admin_token is None or not secrets.compare_digest(x_admin_token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid or missing admin token")
+
+
+router = APIRouter(
+    prefix="/admin",
+    tags=["admin"],
+    dependencies=[Depends(require_admin_token)]
+)
+
+
+@router.get("/storage")
+async def get_storage_stats():
+    """
+    Conversation storage statistics: file and WAL size, free pages, number of
+    threads, checkpoints and writes, idle threads and maintenance counters.
+    
+    Returns:
+        dict: Storage statistics of the active checkpoint backend
+    """
+    return await checkpoint_maintenance.stats(rag_graph)
+
+
+@router.post("/storage/maintenance")
+async def run_storage_maintenance(full: bool = False):
+    """
+    Run a maintenance pass now: prune old checkpoints, delete idle threads
+    and reclaim free pages.
+    
+    Args:
+        full: Prune every thread, not only the ones written since the last pass
+        
+    Returns:
+        dict: Storage statistics after the maintenance pass
+    """
+    return await checkpoint_maintenance.run_once(rag_graph, full=full)
+
+
+@router.get("/cache/stats")
+async def get_answer_cache_stats():
+    """
+    Semantic answer cache metrics: hits, misses, bypasses and hit rate,
+    globally and per subject.
+    
+    Returns:
+        dict: Cache statistics
+    """
+    return answer_cache.stats()
+
+
+@router.delete("/cache/{subject}")
+async def invalidate_answer_cache(subject: str):
+    """
+    Drop every cached answer of a subject (e.g. after editing its documents by hand).
+    
+    Args:
+        subject: Subject name
+        
+    Returns:
+        dict: Number of entries removed
+    """
+    removed = answer_cache.invalidate(subject.lower())
+    return {"subject": subject.lower(), "entries_removed": removed}
+
+
+@router.get("/context-packing")
+async def get_context_packing_stats():
+    """
+    Retrieval context packing metrics since startup: chunks merged, near-duplicates
+    dropped, documents truncated and tokens saved.
+    
+    Returns:
+        dict: Packing counters and the default token budget
+    """
+    requests = packing_stats["requests"]
+    return {
+        "enabled": CONTEXT_PACKING_ENABLED,
+        "token_budget": token_budget(),
+        **packing_stats,
+        "avg_tokens_saved": round(packing_stats["tokens_saved"] / requests, 1) if requests else 0.0,
+    }
+
+
+@router.get("/tracing")
+async def get_tracing_stats():
+    """
+    Langfuse tracing metrics: sample rates, sampled and skipped requests, spans
+    waiting in the export queue, and exported, failed and dropped spans.
+    
+    Returns:
+        dict: Tracing sampling and export counters
+    """
+    return tracing.stats()
+
+
+@router.get("/analytics")
+async def get_analytics_stats():
+    """
+    Analytics emitter metrics: events waiting in the queue, and events sent,
+    failed and dropped (queue full) since startup.
+    
+    Returns:
+        dict: Analytics queue and delivery counters
+    """
+    return analytics_emitter.get_stats()
+
+
+@router.get("/conversations")
+async def get_conversation_stats():
+    """
+    Per-conversation request serialization metrics: conversations with requests in
+    progress, identical requests coalesced, requests that waited for their turn and
+    requests rejected with 429 (too many queued) or 409 (turn timeout).
+    
+    Returns:
+        dict: Conversation lock and coalescing counters
+    """
+    return conversation_guard.get_stats()
+
+
+@router.get("/admission")
+async def get_admission_stats():
+    """
+    Agent admission control: runs in progress (total and per subject), requests
+    waiting for a slot by priority, and requests admitted, queued, rejected with
+    503 (queue full or wait timeout) or shed to make room for LTI requests.
+    
+    Returns:
+        dict: Admission slots, queue and counters
+    """
+    return admission.get_stats()
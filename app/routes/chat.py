@@ -3,15 +3,18 @@ Chat endpoints for the CEPRUD chatbot.
 
 This module handles:
 - Main chat conversations with RAG-enhanced responses
+- Token streaming of chat answers over Server-Sent Events
 - Session management and conversation memory clearing
 - Rate limiting and usage tracking
 - Conversation logging and analytics
 """
 
+import json
 import time
-from typing import Dict
+from typing import Any, Dict, List, Optional
 from fastapi import APIRouter, HTTPException, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
 
 from core import (
     ChatRequest,
@@ -26,16 +29,19 @@ from core import (
 )
 from domain.query_logic import (
     query_rag,
-    clear_session
+    stream_query_rag,
+    acquire_turn,
+    clear_session,
+    admission,
+    ConversationBusyError,
+    AdmissionRejectedError
 )
 from services import (
     get_or_create_session,
-    cleanup_old_sessions,
     log_request_info,
     anonymize_user_id,
     classify_query_type,
-    estimate_query_complexity,
-    active_sessions
+    estimate_query_complexity
 )
 from services.logging_service import (
     log_conversation_message,
@@ -43,6 +49,9 @@ from services.logging_service import (
     log_learning_event,
     log_session_event
 )
+from services.metrics_service import metrics, current_timings
+from domain.admission import LTIPriority
+from lti.session_service import LTISessionService
 
 # Setup logging
 import logging
@@ -52,41 +61,12 @@ logger = logging.getLogger(__name__)
 router = APIRouter(tags=["chat"])
 
 
-@router.post("/chat", response_model=ChatResponse, responses={
-    400: {"model": ErrorResponse}, 
-    429: {"model": RateLimitResponse}, 
-    500: {"model": ErrorResponse}
-})
-async def chat_endpoint(
-    request: Request,
-    chat_request: ChatRequest
-):
-    """
-    Process a chat message and return an AI-generated response.
-    
-    This endpoint:
-    1. Validates and rate-limits the request
-    2. Queries the RAG system for context-aware answers
-    3. Logs conversation data for analytics
-    4. Returns the response with metadata
-    
-    Rate limiting is applied per anonymized user to prevent abuse.
-    Sessions are automatically created/retrieved for conversation continuity.
-    """
-    start_time = time.time()
-    
-    # Extract validated data from Pydantic model
-    user_message = chat_request.message
-    selected_subject = chat_request.subject.lower()
-    email = chat_request.email
-    mode = chat_request.mode
-    
-    # Create anonymized user identifier for rate limiting
-    user_identifier = anonymize_user_id(email)
-    
-    # Check rate limit before processing
-    if not check_rate_limit(user_identifier):
-        rate_info = get_rate_limit_info(user_identifier)
+async def _enforce_rate_limit(request: Request, user_identifier: str, start_time: float) -> None:
+    """Raise a 429 HTTPException if the user has exceeded the rate limit."""
+    with metrics.stage("rate_limit"):
+        allowed = await check_rate_limit(user_identifier)
+    if not allowed:
+        rate_info = await get_rate_limit_info(user_identifier)
         current_time = int(time.time())
         retry_after = max(1, rate_info['reset_time'] - current_time)
         
@@ -102,53 +82,94 @@ async def chat_endpoint(
                 "retry_after": retry_after
             }
         )
-    
-    logger.info(f"Chat request - Subject: {selected_subject}, Email: {email}, Question: {user_message[:100]}...")
-    
-    try:
-        # Get or create session for this user-subject combination
-        session_id = get_or_create_session(email, selected_subject)
-        
-        # Periodic cleanup of old sessions (every request, but lightweight)
-        if len(active_sessions) > 10:  # Only cleanup when we have many sessions
-            cleanup_old_sessions()
-        
-        # Query the RAG system
-        result = query_rag(user_message, subject=selected_subject, use_finetuned=False, email=email)
-        
-        response_text = result.get('response', '')
-        sources = result.get('sources', [])
-        model_used = result.get('model_used', '')
 
-        query_type = classify_query_type(user_message)
-        complexity = estimate_query_complexity(user_message)
-        
+
+def _conversation_busy(request: Request, start_time: float, error: ConversationBusyError) -> HTTPException:
+    """409/429 HTTPException for a conversation that already has requests in progress."""
+    log_request_info(request, start_time, error.status_code)
+    return HTTPException(
+        status_code=error.status_code,
+        detail={"error": error.detail, "retry_after": error.retry_after},
+        headers={"Retry-After": str(error.retry_after)}
+    )
+
+
+# Admission priority from the X-Session-Token header, granted only to live LTI sessions
+# (read-only lookup: a priority check must not write the session's last activity)
+lti_priority = LTIPriority(lambda token: LTISessionService().find_active_session(token))
+
+
+async def _priority(request: Request) -> int:
+    """Requests from LTI-launched sessions (the frontend sends their X-Session-Token) go first."""
+    return await lti_priority.resolve(request.headers.get("X-Session-Token"))
+
+
+def _at_capacity(request: Request, start_time: float, error: AdmissionRejectedError) -> HTTPException:
+    """503 HTTPException for a request that got no agent run slot."""
+    log_request_info(request, start_time, 503)
+    return HTTPException(
+        status_code=503,
+        detail={"error": error.detail, "retry_after": error.retry_after},
+        headers={"Retry-After": str(error.retry_after)}
+    )
+
+
+async def _open_session(email: str, subject: str) -> str:
+    """Get or create the session for this user-subject combination (expired ones are swept in the background)."""
+    with metrics.stage("session"):
+        return await get_or_create_session(email, subject)
+
+
+async def _rate_limit_headers(user_identifier: str) -> Dict[str, str]:
+    """Build the X-RateLimit-* headers for a response."""
+    rate_info = await get_rate_limit_info(user_identifier)
+    return {
+        "X-RateLimit-Limit": str(RATE_LIMIT_REQUESTS),
+        "X-RateLimit-Remaining": str(rate_info['requests_remaining']),
+        "X-RateLimit-Reset": str(rate_info['reset_time'])
+    }
+
+
+async def _log_chat_analytics(
+    session_id: str,
+    user_identifier: str,
+    email: str,
+    subject: str,
+    user_message: str,
+    response_text: str,
+    sources: List[str],
+    query_type: str,
+    complexity: str,
+    model_used: str
+) -> None:
+    """Queue the conversation, user message and learning analytics for one chat turn (sent in the background)."""
+    with metrics.stage("analytics"):
         conversation_timestamp = time.time()
-        
+    
         # Log user message
         await log_conversation_message(
             session_id=session_id,
             user_id=user_identifier,
-            subject=selected_subject,
+            subject=subject,
             message_type="user",
             message_content=user_message,
             timestamp=conversation_timestamp
         )
-        
+    
         # Log bot response
         await log_conversation_message(
             session_id=session_id,
             user_id=user_identifier,
-            subject=selected_subject,
+            subject=subject,
             message_type="bot",
             message_content=response_text,
             timestamp=conversation_timestamp + 0.001  # Slightly later timestamp
         )
-        
+    
         await log_user_message(
             email=email, 
             message=user_message, 
-            subject=selected_subject, 
+            subject=subject, 
             response=response_text, 
             sources=sources,
             session_id=session_id,
@@ -162,42 +183,129 @@ async def chat_endpoint(
             await log_learning_event(
                 session_id=session_id,
                 event_type="complex_question_asked",
-                topic=selected_subject,
+                topic=subject,
                 confidence_level="medium" if len(sources) > 0 else "low"
             )
         elif query_type == "concept" or "concepto" in user_message.lower():
             await log_learning_event(
                 session_id=session_id,
                 event_type="concept_inquiry",
-                topic=selected_subject,
+                topic=subject,
                 confidence_level="high" if len(sources) > 2 else "medium"
             )
 
+
+def _debug_timings(chat_request: ChatRequest) -> Optional[List[Dict[str, Any]]]:
+    """Phase durations so far (same as the Server-Timing header) if the request asked for them."""
+    timings = current_timings()
+    if not chat_request.debug or timings is None:
+        return None
+    return timings.entries()
+
+
+def _sse_event(event_type: str, data: Dict[str, Any]) -> str:
+    """Format one Server-Sent Event."""
+    return f"event: {event_type}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@router.post("/chat", response_model=ChatResponse, responses={
+    400: {"model": ErrorResponse}, 
+    409: {"model": ErrorResponse}, 
+    429: {"model": RateLimitResponse}, 
+    500: {"model": ErrorResponse},
+    503: {"model": ErrorResponse}
+})
+async def chat_endpoint(
+    request: Request,
+    chat_request: ChatRequest
+):
+    """
+    Process a chat message and return an AI-generated response.
+    
+    This endpoint:
+    1. Validates and rate-limits the request
+    2. Queries the RAG system for context-aware answers
+    3. Logs conversation data for analytics
+    4. Returns the response with metadata
+    
+    Rate limiting is applied per anonymized user to prevent abuse.
+    Sessions are automatically created/retrieved for conversation continuity.
+    Requests on the same conversation are served one at a time: an identical
+    request already in progress is reused, a 409 is returned if the turn does
+    not come in time and a 429 if too many requests are already queued.
+    Agent runs are admission-controlled: when all slots are busy and the wait
+    queue is full (or the wait times out) a 503 with `Retry-After` is returned.
+    Requests from LTI sessions are queued ahead of the rest.
+    The `Server-Timing` header breaks the request down by phase; with `debug`
+    the same breakdown is returned in `timings`.
+    """
+    start_time = time.time()
+    
+    # Extract validated data from Pydantic model
+    user_message = chat_request.message
+    selected_subject = chat_request.subject.lower()
+    email = chat_request.email
+    
+    # Create anonymized user identifier for rate limiting
+    user_identifier = anonymize_user_id(email)
+    
+    # Check rate limit before processing
+    await _enforce_rate_limit(request, user_identifier, start_time)
+    
+    logger.info(f"Chat request - Subject: {selected_subject}, Email: {email}, Question: {user_message[:100]}...")
+    
+    try:
+        # Get or create session for this user-subject combination
+        session_id = await _open_session(email, selected_subject)
+        
+        # Query the RAG system
+        result = await query_rag(user_message, subject=selected_subject, use_finetuned=False, email=email,
+                                 use_cache=not chat_request.bypass_cache, priority=await _priority(request))
+        
+        response_text = result.get('response', '')
+        sources = result.get('sources', [])
+        model_used = result.get('model_used', '')
+
+        query_type = classify_query_type(user_message)
+        complexity = estimate_query_complexity(user_message)
+        
+        await _log_chat_analytics(
+            session_id=session_id,
+            user_identifier=user_identifier,
+            email=email,
+            subject=selected_subject,
+            user_message=user_message,
+            response_text=response_text,
+            sources=sources,
+            query_type=query_type,
+            complexity=complexity,
+            model_used=model_used
+        )
+
         response_size = len(response_text.encode('utf-8')) + sum(len(src.encode('utf-8')) for src in sources)
         log_request_info(request, start_time, 200, response_size)
 
-        # Get rate limit info for response headers
-        rate_info = get_rate_limit_info(user_identifier)
-
         response_data = ChatResponse(
             response=f"🤖: {response_text}",
             sources=sources,
             model_used=model_used,
             session_id=session_id,
-            query_type=query_type
+            query_type=query_type,
+            cached=result.get('cached', False),
+            timings=_debug_timings(chat_request)
         )
         
-        # Return JSON response with rate limit headers
+        # Return JSON response with rate limit headers (Server-Timing is added by the metrics middleware)
         response = JSONResponse(
-            content=response_data.model_dump(),
-            headers={
-                "X-RateLimit-Limit": str(RATE_LIMIT_REQUESTS),
-                "X-RateLimit-Remaining": str(rate_info['requests_remaining']),
-                "X-RateLimit-Reset": str(rate_info['reset_time'])
-            }
+            content=response_data.model_dump(exclude_none=True),
+            headers=await _rate_limit_headers(user_identifier)
         )
         return response
         
+    except ConversationBusyError as e:
+        raise _conversation_busy(request, start_time, e)
+    except AdmissionRejectedError as e:
+        raise _at_capacity(request, start_time, e)
     except Exception as e:
         error_msg = f"Error processing chat request: {str(e)}"
         logger.error(error_msg, exc_info=True)
@@ -209,8 +317,129 @@ async def chat_endpoint(
         )
 
 
+@router.post("/chat/stream", responses={
+    200: {"content": {"text/event-stream": {}}},
+    400: {"model": ErrorResponse}, 
+    409: {"model": ErrorResponse}, 
+    429: {"model": RateLimitResponse},
+    503: {"model": ErrorResponse}
+})
+async def chat_stream_endpoint(
+    request: Request,
+    chat_request: ChatRequest
+):
+    """
+    Process a chat message and stream the answer as Server-Sent Events.
+    
+    Events, in order:
+    - `tool_call` / `tool_result`: progress while the agent queries its tools
+    - `token`: fragments of the answer as the LLM generates them
+    - `done`: the final payload, same fields as the `/chat` response
+    - `error`: sent instead of `done` if the request fails mid-stream (with
+      `retry_after` if no agent run slot freed up in time)
+    
+    A 503 is returned before the stream starts if the agent is at capacity.
+    
+    Analytics are logged once the stream has completed, so they never delay
+    the first token. The `Server-Timing` header only covers the phases before
+    the stream starts; with `debug` the `done` event carries the full breakdown.
+    """
+    start_time = time.time()
+    
+    user_message = chat_request.message
+    selected_subject = chat_request.subject.lower()
+    email = chat_request.email
+    
+    user_identifier = anonymize_user_id(email)
+    await _enforce_rate_limit(request, user_identifier, start_time)
+    
+    logger.info(f"Chat stream request - Subject: {selected_subject}, Email: {email}, Question: {user_message[:100]}...")
+    
+    # Shed load before committing to a 200 stream; the slot itself is taken when the agent runs
+    priority = await _priority(request)
+    if admission.would_reject(selected_subject, priority):
+        raise _at_capacity(request, start_time, AdmissionRejectedError(
+            "The assistant is at capacity, please try again shortly", retry_after=admission.retry_after()))
+    
+    session_id = await _open_session(email, selected_subject)
+    headers = await _rate_limit_headers(user_identifier)
+    
+    query_type = classify_query_type(user_message)
+    complexity = estimate_query_complexity(user_message)
+    
+    # Take the conversation turn last, right before the response starts, so a busy
+    # conversation gets a 409/429 and nothing can fail between here and the stream
+    # that releases it
+    try:
+        turn = await acquire_turn(user_message, selected_subject, email)
+    except ConversationBusyError as e:
+        raise _conversation_busy(request, start_time, e)
+
+    async def event_stream():
+        result = None
+        try:
+            async for event in stream_query_rag(user_message, subject=selected_subject,
+                                                use_finetuned=False, email=email,
+                                                use_cache=not chat_request.bypass_cache, turn=turn,
+                                                priority=priority):
+                event_type = event.pop("type")
+                if event_type == "done":
+                    result = event
+                    response_data = ChatResponse(
+                        response=f"🤖: {result.get('response', '')}",
+                        sources=result.get('sources', []),
+                        model_used=result.get('model_used', ''),
+                        session_id=session_id,
+                        query_type=query_type,
+                        cached=result.get('cached', False),
+                        timings=_debug_timings(chat_request)
+                    )
+                    yield _sse_event("done", response_data.model_dump(exclude_none=True))
+                else:
+                    yield _sse_event(event_type, event)
+        except AdmissionRejectedError as e:
+            log_request_info(request, start_time, 503)
+            yield _sse_event("error", {"detail": e.detail, "retry_after": e.retry_after})
+            return
+        except Exception as e:
+            logger.error(f"Error processing chat stream: {str(e)}", exc_info=True)
+            log_request_info(request, start_time, 500)
+            yield _sse_event("error", {"detail": "❌ An error occurred while processing your request."})
+            return
+
+        response_text = result.get('response', '')
+        sources = result.get('sources', [])
+        await _log_chat_analytics(
+            session_id=session_id,
+            user_identifier=user_identifier,
+            email=email,
+            subject=selected_subject,
+            user_message=user_message,
+            response_text=response_text,
+            sources=sources,
+            query_type=query_type,
+            complexity=complexity,
+            model_used=result.get('model_used', '')
+        )
+        response_size = len(response_text.encode('utf-8')) + sum(len(src.encode('utf-8')) for src in sources)
+        log_request_info(request, start_time, 200, response_size)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            **headers,
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",  # Disable nginx proxy buffering
+        },
+        # The stream releases the turn when it ends; this covers a stream that never starts
+        background=BackgroundTask(turn.release)
+    )
+
+
 @router.post("/clear-session", response_model=ClearSessionResponse, responses={
     400: {"model": ErrorResponse}, 
+    409: {"model": ErrorResponse}, 
     429: {"model": RateLimitResponse}, 
     500: {"model": ErrorResponse}
 })
@@ -236,33 +465,17 @@ async def clear_session_endpoint(
     user_identifier = anonymize_user_id(email)
     
     # Check rate limit (lighter limit for clear operations)
-    if not check_rate_limit(user_identifier):
-        rate_info = get_rate_limit_info(user_identifier)
-        current_time = int(time.time())
-        retry_after = max(1, rate_info['reset_time'] - current_time)
-        
-        log_request_info(request, start_time, 429)
-        
-        raise HTTPException(
-            status_code=429,
-            detail={
-                "error": "Rate limit exceeded",
-                "requests_made": rate_info['requests_made'], 
-                "requests_remaining": rate_info['requests_remaining'],
-                "reset_time": rate_info['reset_time'],
-                "retry_after": retry_after
-            }
-        )
+    await _enforce_rate_limit(request, user_identifier, start_time)
     
     logger.info(f"Clear session request - Subject: {subject}, Email: {email}")
     
     try:
         # Clear the session memory
-        success = clear_session(subject, email)
+        success = await clear_session(subject, email)
         
         if success:
             # Also update our session tracking
-            session_id = get_or_create_session(email, subject)
+            session_id = await get_or_create_session(email, subject)
             
             # Log the session clear event
             await log_session_event(
@@ -286,6 +499,8 @@ async def clear_session_endpoint(
                 detail="Failed to clear session memory"
             )
             
+    except ConversationBusyError as e:
+        raise _conversation_busy(request, start_time, e)
     except Exception as e:
         error_msg = f"Error clearing session: {str(e)}"
         logger.error(error_msg)
@@ -1,11 +1,12 @@
 """
 Health and Monitoring Routes
 
-Provides health check and rate limit monitoring endpoints.
+Provides health check, rate limit and Prometheus metrics endpoints.
 """
 
 from datetime import datetime
 from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
 from core import (
     HealthResponse,
     RateLimitStatus,
@@ -16,6 +17,7 @@ from core import (
     API_VERSION
 )
 from services import anonymize_user_id
+from services.metrics_service import metrics
 
 router = APIRouter(
     prefix="",
@@ -38,6 +40,18 @@ async def health_check():
     )
 
 
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Latency histograms per request stage, LLM call and token counters and in-flight
+    gauges, in the Prometheus text exposition format (for scraping).
+    
+    Returns:
+        PlainTextResponse: Metrics in text format 0.0.4
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 @router.get("/rate-limit/{email}", response_model=RateLimitStatus)
 async def get_rate_limit_status(email: str):
     """
@@ -51,7 +65,7 @@ async def get_rate_limit_status(email: str):
         RateLimitStatus: Current rate limit information for the user
     """
     user_identifier = anonymize_user_id(email)
-    rate_info = get_rate_limit_info(user_identifier)
+    rate_info = await get_rate_limit_info(user_identifier)
     
     return RateLimitStatus(
         requests_made=rate_info['requests_made'],
@@ -74,7 +88,7 @@ async def get_rate_limit_info_endpoint(email: str):
         RateLimitStatus: Current rate limit information for the user
     """
     user_identifier = anonymize_user_id(email)
-    rate_info = get_rate_limit_info(user_identifier)
+    rate_info = await get_rate_limit_info(user_identifier)
     
     return RateLimitStatus(
         requests_made=rate_info['requests_made'],
@@ -2,10 +2,13 @@
 Services package for the chatbot application.
 
 This package contains all business service modules:
-- session_service: User session management
+- session_service: User session management (indexed store with background expiry)
 - logging_service: Microservice-based logging
 - utils_service: Utility functions and query analysis helpers
 - user_service: User data management via MongoDB service
+- tracing_service: Sampled Langfuse tracing with background export
+- spill_queue: Disk queue for analytics events the logging service could not take
+- metrics_service: Per-stage latency histograms and counters in the Prometheus format
 """
 
 from .session_service import (
@@ -14,7 +17,8 @@ from .session_service import (
     cleanup_old_sessions,
     get_session_info,
     get_active_sessions_count,
-    active_sessions
+    active_sessions,
+    session_store
 )
 
 from .logging_service import (
@@ -46,6 +50,7 @@ __all__ = [
     'get_session_info',
     'get_active_sessions_count',
     'active_sessions',
+    'session_store',
     
     # Logging service (microservice-based)
     'log_session_event',
@@ -2,15 +2,24 @@
 Logging service client for communicating with the external logging microservice.
 
 This module replaces direct file-based logging with HTTP calls to the logging service API.
+
+Analytics events are not sent in the request path: the `log_*` helpers put them on the
+bounded queue of `analytics_emitter`, whose background task sends them in batches
+(by size or time) over one pooled HTTP client. The queue is drained on shutdown.
+Events that cannot be delivered (logging service or MongoDB down) are spilled to a
+local disk queue and replayed in order, with exponential backoff, once it recovers.
 """
 
 import os
 import time
+import asyncio
 import logging
-from typing import List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 import httpx
 from fastapi import Request
 
+from .spill_queue import ANALYTICS_SPILL_DIR, Event, SpillQueue, open_spill_queue
+
 logger = logging.getLogger(__name__)
 
 # Get logging service URL from environment
@@ -20,10 +29,314 @@ LOGGING_API_BASE = f"{LOGGING_SERVICE_URL}/api/v1/logs"
 # Timeout configuration for logging requests
 LOGGING_TIMEOUT = 5.0
 
+# Analytics emitter configuration
+# Events waiting to be sent; beyond this new events are dropped (and counted)
+ANALYTICS_QUEUE_SIZE = int(os.getenv("ANALYTICS_QUEUE_SIZE", "1000"))
+# A batch is sent when it has this many events or ANALYTICS_FLUSH_INTERVAL seconds have passed
+ANALYTICS_BATCH_SIZE = int(os.getenv("ANALYTICS_BATCH_SIZE", "50"))
+ANALYTICS_FLUSH_INTERVAL = float(os.getenv("ANALYTICS_FLUSH_INTERVAL", "1.0"))
+ANALYTICS_MAX_CONNECTIONS = int(os.getenv("ANALYTICS_MAX_CONNECTIONS", "10"))
+ANALYTICS_SHUTDOWN_TIMEOUT = 5.0
+# Undelivered events go to the disk spill queue and are retried with backoff
+ANALYTICS_SPILL_ENABLED = os.getenv("ANALYTICS_SPILL_ENABLED", "true").lower() == "true"
+ANALYTICS_SPILL_RETRY_INITIAL = 1.0
+ANALYTICS_SPILL_RETRY_MAX = float(os.getenv("ANALYTICS_SPILL_RETRY_MAX", "60"))
+
+
+class AnalyticsEmitter:
+    """
+    Bounded async queue of analytics events with a background sender.
+
+    `emit` never waits on the network: it enqueues the event (or drops it when the
+    queue is full) and returns. The worker task collects up to `batch_size` events,
+    waiting at most `interval` seconds after the first one, and sends them in a single
+    request to `POST {base_url}/batch` over a shared `httpx.AsyncClient`. If the logging
+    service predates the batch endpoint, the events are posted one by one instead.
+
+    Events that fail for a transient reason (timeout, connection error, 5xx) are appended
+    to the `spill` queue. While it has a backlog, new batches are appended behind it so
+    the order is kept, and the worker replays it `batch_size` events at a time, backing
+    off exponentially (up to ANALYTICS_SPILL_RETRY_MAX seconds) while any event of the
+    replayed batch fails. A replayed event that fails stays at the head of the backlog.
+    """
+
+    def __init__(self, base_url: str = LOGGING_API_BASE,
+                 max_queue_size: int = ANALYTICS_QUEUE_SIZE,
+                 batch_size: int = ANALYTICS_BATCH_SIZE,
+                 interval: float = ANALYTICS_FLUSH_INTERVAL,
+                 transport: Optional[httpx.AsyncBaseTransport] = None,
+                 spill: Optional[SpillQueue] = None,
+                 spill_dir: Optional[str] = None):
+        self.base_url = base_url
+        self.max_queue_size = max_queue_size
+        self.batch_size = batch_size
+        self.interval = interval
+        self._transport = transport
+        self.spill = spill
+        self.spill_dir = spill_dir
+        self._queue: Optional["asyncio.Queue[Tuple[str, Dict[str, Any]]]"] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._closing = False
+        self._batch_endpoint = True
+        self._retry_delay = 0.0
+        self._next_replay = 0.0
+        self.stats = {"queued": 0, "sent": 0, "dropped": 0, "failed": 0, "rejected": 0,
+                      "replayed": 0, "batches": 0}
+
+    def _new_client(self) -> httpx.AsyncClient:
+        limits = httpx.Limits(max_connections=ANALYTICS_MAX_CONNECTIONS,
+                              max_keepalive_connections=ANALYTICS_MAX_CONNECTIONS)
+        return httpx.AsyncClient(timeout=LOGGING_TIMEOUT, limits=limits, transport=self._transport)
+
+    def start(self) -> bool:
+        """
+        Create the queue, the pooled client and the worker task on the running loop.
+        Called on app startup; otherwise the first emitted event does it.
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+        if self._loop is loop and self._worker is not None and not self._worker.done():
+            return True
+        if self.spill is None and self.spill_dir:
+            self.spill = open_spill_queue(self.spill_dir)
+        # First start, or a new event loop (scripts, tests): the old queue and pool are unusable
+        self._loop = loop
+        self._next_replay = 0.0
+        self._closing = False
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._client = self._new_client()
+        self._worker = loop.create_task(self._run(), name="analytics-emitter")
+        return True
+
+    def emit(self, endpoint: str, payload: Dict[str, Any]) -> bool:
+        """
+        Queue one event for `{base_url}/{endpoint}` without waiting.
+
+        Returns:
+            True if the event was queued, False if it was dropped
+        """
+        if self._closing or not self.start():
+            self.stats["dropped"] += 1
+            return False
+        try:
+            self._queue.put_nowait((endpoint, payload))
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+            logger.debug(f"Analytics queue full, dropping {endpoint} event")
+            return False
+        self.stats["queued"] += 1
+        return True
+
+    async def _next_batch(self, timeout: Optional[float] = None) -> List[Event]:
+        """Collect the next batch; with a timeout, an empty batch if nothing arrives in time."""
+        try:
+            if timeout is None:
+                batch = [await self._queue.get()]
+            elif timeout <= 0:
+                batch = [self._queue.get_nowait()]
+            else:
+                batch = [await asyncio.wait_for(self._queue.get(), timeout)]
+        except (asyncio.QueueEmpty, asyncio.TimeoutError):
+            return []
+        deadline = self._loop.time() + self.interval
+        while len(batch) < self.batch_size:
+            if self._closing or self._loop.time() >= deadline:
+                # Draining (or the window is over): take only what is already queued
+                if self._queue.empty():
+                    break
+                batch.append(self._queue.get_nowait())
+                continue
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), deadline - self._loop.time()))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _send(self, endpoint: str, payload: Dict[str, Any]) -> str:
+        """Post one event: "sent", "rejected" (4xx, retrying is pointless) or "failed"."""
+        try:
+            response = await self._client.post(f"{self.base_url}/{endpoint}", json=payload)
+            if 400 <= response.status_code < 500:
+                logger.warning(f"Logging service rejected {endpoint} event: HTTP {response.status_code}")
+                return "rejected"
+            response.raise_for_status()
+            return "sent"
+        except httpx.TimeoutException:
+            logger.warning(f"Timeout logging {endpoint} event")
+        except httpx.HTTPError as e:
+            logger.warning(f"HTTP error logging {endpoint} event: {e}")
+        except Exception as e:
+            logger.error(f"Unexpected error logging {endpoint} event: {e}")
+        return "failed"
+
+    async def _send_bulk(self, batch: List[Event]) -> Optional[List[str]]:
+        """
+        Post the whole batch to the batch endpoint.
+
+        Returns:
+            Status of each event (as in `_send`), or None if the logging service has no
+            batch endpoint
+        """
+        events = [{"type": endpoint, "data": payload} for endpoint, payload in batch]
+        try:
+            response = await self._client.post(f"{self.base_url}/batch", json={"events": events})
+            if response.status_code in (404, 405):
+                logger.info("Logging service has no batch endpoint, sending events one by one")
+                self._batch_endpoint = False
+                return None
+            if 400 <= response.status_code < 500:
+                logger.warning(f"Logging service rejected batch of {len(batch)} events: HTTP {response.status_code}")
+                return ["rejected"] * len(batch)
+            response.raise_for_status()
+            statuses = {result["index"]: result["status"] for result in response.json().get("results", [])}
+            outcome = {"ok": "sent", "fallback": "sent", "invalid": "rejected"}
+            return [outcome.get(statuses.get(index), "failed") for index in range(len(batch))]
+        except httpx.TimeoutException:
+            logger.warning(f"Timeout logging batch of {len(batch)} events")
+        except httpx.HTTPError as e:
+            logger.warning(f"HTTP error logging batch of {len(batch)} events: {e}")
+        except Exception as e:
+            logger.error(f"Unexpected error logging batch of {len(batch)} events: {e}")
+        return ["failed"] * len(batch)
+
+    async def _deliver(self, batch: List[Event]) -> List[Event]:
+        """
+        Send a batch and count the outcome.
+
+        Returns:
+            The events that failed for a transient reason and can be retried
+        """
+        statuses = await self._send_bulk(batch) if self._batch_endpoint else None
+        if statuses is None:
+            statuses = await asyncio.gather(*(self._send(endpoint, payload) for endpoint, payload in batch))
+        self.stats["sent"] += statuses.count("sent")
+        self.stats["rejected"] += statuses.count("rejected")
+        self.stats["batches"] += 1
+        return [event for event, status in zip(batch, statuses) if status == "failed"]
+
+    async def _spill(self, events: List[Event]) -> None:
+        if self.spill is None:
+            return
+        try:
+            await asyncio.to_thread(self.spill.append, events)
+        except OSError as e:
+            logger.error(f"Could not spill {len(events)} analytics events to disk: {e}")
+
+    def _backoff(self) -> None:
+        self._retry_delay = min(self._retry_delay * 2 or ANALYTICS_SPILL_RETRY_INITIAL, ANALYTICS_SPILL_RETRY_MAX)
+        self._next_replay = self._loop.time() + self._retry_delay
+
+    def _replay_delay(self) -> Optional[float]:
+        """Seconds until the next replay attempt, or None if there is nothing spilled."""
+        if self.spill is None or not self.spill.pending:
+            return None
+        return max(self._next_replay - self._loop.time(), 0.0)
+
+    async def _send_batch(self, batch: List[Event]) -> None:
+        if self._replay_delay() is not None:
+            # Keep the order: new events go behind the backlog being replayed
+            await self._spill(batch)
+            return
+        failed = await self._deliver(batch)
+        self.stats["failed"] += len(failed)
+        if failed and self.spill is not None:
+            logger.warning(f"Logging service unavailable, spilling {len(failed)} analytics events to disk")
+            await self._spill(failed)
+            self._backoff()
+
+    async def _replay(self) -> None:
+        """Send the oldest spilled events if the backoff has elapsed."""
+        if self._replay_delay() != 0.0:
+            return
+        try:
+            events, position, consumed = await asyncio.to_thread(self.spill.read, self.batch_size)
+            failed = await self._deliver(events) if events else []
+            if failed:
+                # The first failed event stays at the head: only the events before it are
+                # committed, the rest are read again on the next attempt (at least once)
+                failed_ids = {id(event) for event in failed}
+                head = next(index for index, event in enumerate(events) if id(event) in failed_ids)
+                self.stats["replayed"] += head
+                self._backoff()
+                if head:
+                    _, position, consumed = await asyncio.to_thread(self.spill.read, head)
+                    await asyncio.to_thread(self.spill.commit, position, consumed)
+                return
+            self.stats["replayed"] += len(events)
+            self._retry_delay = 0.0
+            await asyncio.to_thread(self.spill.commit, position, consumed)
+        except OSError as e:
+            logger.error(f"Error replaying spilled analytics events: {e}")
+            self._backoff()
+
+    async def _run(self) -> None:
+        while True:
+            # While draining for shutdown the backlog stays on disk for the next start
+            batch = await self._next_batch(None if self._closing else self._replay_delay())
+            if batch:
+                try:
+                    await self._send_batch(batch)
+                finally:
+                    for _ in batch:
+                        self._queue.task_done()
+            if not self._closing:
+                await self._replay()
+
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def drain(self, timeout: float = ANALYTICS_SHUTDOWN_TIMEOUT) -> bool:
+        """Wait (up to the timeout) until every queued event has been sent or has failed."""
+        if self._queue is None or self._loop is not asyncio.get_running_loop():
+            return True
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def stop(self, timeout: float = ANALYTICS_SHUTDOWN_TIMEOUT) -> None:
+        """Send what is still queued (bounded wait), stop the worker and close the pool. Call on app shutdown."""
+        if self._worker is None:
+            return
+        self._closing = True
+        if not await self.drain(timeout):
+            logger.warning(f"Analytics drain timed out, {self.pending()} events not sent")
+        self.stats["dropped"] += self.pending()
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        await self._client.aclose()
+        self._worker = self._client = self._queue = self._loop = None
+        self._closing = False
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Queue and delivery counters."""
+        return {
+            "running": self._worker is not None and not self._worker.done(),
+            "pending": self.pending(),
+            "queue_size": self.max_queue_size,
+            "batch_size": self.batch_size,
+            "flush_interval": self.interval,
+            **self.stats,
+            "retry_delay": self._retry_delay,
+            "spill": self.spill.get_stats() if self.spill is not None else None,
+        }
+
+
+# Global analytics emitter
+analytics_emitter = AnalyticsEmitter(spill_dir=ANALYTICS_SPILL_DIR if ANALYTICS_SPILL_ENABLED else None)
+
 
 async def log_session_event(session_id: str, user_id: str, subject: str, event_type: str):
     """
-    Log session-related events via the logging service API.
+    Queue a session-related event for the logging service API.
     
     Args:
         session_id: Session identifier
@@ -31,32 +344,18 @@ async def log_session_event(session_id: str, user_id: str, subject: str, event_t
         subject: Subject/course name
         event_type: Type of session event
     """
-    try:
-        async with httpx.AsyncClient(timeout=LOGGING_TIMEOUT) as client:
-            payload = {
-                "session_id": session_id,
-                "user_id": user_id,
-                "subject": subject,
-                "event_type": event_type
-            }
-            response = await client.post(
-                f"{LOGGING_API_BASE}/session-event",
-                json=payload
-            )
-            response.raise_for_status()
-            logger.debug(f"Session event logged successfully: {event_type}")
-    except httpx.TimeoutException:
-        logger.warning(f"Timeout logging session event: {event_type}")
-    except httpx.HTTPError as e:
-        logger.warning(f"HTTP error logging session event: {e}")
-    except Exception as e:
-        logger.error(f"Unexpected error logging session event: {e}")
+    analytics_emitter.emit("session-event", {
+        "session_id": session_id,
+        "user_id": user_id,
+        "subject": subject,
+        "event_type": event_type
+    })
 
 
 async def log_user_message(email: str, message: str, subject: str, response: str, sources: List[str], 
                           session_id: str, query_type: str, complexity: str, model_used: str):
     """
-    Log comprehensive user interaction data via the logging service API.
+    Queue comprehensive user interaction data for the logging service API.
     
     Args:
         email: User email (will be anonymized)
@@ -69,36 +368,22 @@ async def log_user_message(email: str, message: str, subject: str, response: str
         complexity: Estimated query complexity
         model_used: Model used for response
     """
-    try:
-        async with httpx.AsyncClient(timeout=LOGGING_TIMEOUT) as client:
-            payload = {
-                "session_id": session_id,
-                "user_id_partial": email[:8] + "...",  # Partial anonymization
-                "subject": subject,
-                "message_length": len(message),
-                "query_type": query_type,
-                "complexity": complexity,
-                "response_length": len(response),
-                "source_count": len(sources),
-                "llm_model_used": model_used  # Changed from model_used to match logging service
-            }
-            response = await client.post(
-                f"{LOGGING_API_BASE}/user-message",
-                json=payload
-            )
-            response.raise_for_status()
-            logger.debug(f"User message logged successfully for session: {session_id}")
-    except httpx.TimeoutException:
-        logger.warning(f"Timeout logging user message for session: {session_id}")
-    except httpx.HTTPError as e:
-        logger.warning(f"HTTP error logging user message: {e}")
-    except Exception as e:
-        logger.error(f"Unexpected error logging user message: {e}")
+    analytics_emitter.emit("user-message", {
+        "session_id": session_id,
+        "user_id_partial": email[:8] + "...",  # Partial anonymization
+        "subject": subject,
+        "message_length": len(message),
+        "query_type": query_type,
+        "complexity": complexity,
+        "response_length": len(response),
+        "source_count": len(sources),
+        "llm_model_used": model_used  # Changed from model_used to match logging service
+    })
 
 
 async def log_learning_event(session_id: str, event_type: str, topic: str, confidence_level: Optional[str] = None):
     """
-    Log learning-related events via the logging service API.
+    Queue a learning-related event for the logging service API.
     
     Args:
         session_id: Session identifier
@@ -106,26 +391,12 @@ async def log_learning_event(session_id: str, event_type: str, topic: str, confi
         topic: Topic or subject matter
         confidence_level: Confidence level if applicable
     """
-    try:
-        async with httpx.AsyncClient(timeout=LOGGING_TIMEOUT) as client:
-            payload = {
-                "session_id": session_id,
-                "event_type": event_type,
-                "topic": topic,
-                "confidence_level": confidence_level or "N/A"
-            }
-            response = await client.post(
-                f"{LOGGING_API_BASE}/learning-event",
-                json=payload
-            )
-            response.raise_for_status()
-            logger.debug(f"Learning event logged successfully: {event_type}")
-    except httpx.TimeoutException:
-        logger.warning(f"Timeout logging learning event: {event_type}")
-    except httpx.HTTPError as e:
-        logger.warning(f"HTTP error logging learning event: {e}")
-    except Exception as e:
-        logger.error(f"Unexpected error logging learning event: {e}")
+    analytics_emitter.emit("learning-event", {
+        "session_id": session_id,
+        "event_type": event_type,
+        "topic": topic,
+        "confidence_level": confidence_level or "N/A"
+    })
 
 
 def log_request_info(request: Request, start_time: float, status_code: int, response_size: int = 0):
@@ -151,14 +422,11 @@ def log_request_info(request: Request, start_time: float, status_code: int, resp
     )
 
 
-# Import helper functions from utils_service
-from .utils_service import classify_query_type, estimate_query_complexity, anonymize_user_id
-
 
 async def log_conversation_message(session_id: str, user_id: str, subject: str, 
                                  message_type: str, message_content: str, timestamp: float = None):
     """
-    Log individual conversation messages (both user and bot messages).
+    Queue an individual conversation message (both user and bot messages).
     
     This creates a detailed conversation log separate from the analytics data.
     
@@ -170,31 +438,22 @@ async def log_conversation_message(session_id: str, user_id: str, subject: str,
         message_content: The actual message content
         timestamp: Optional timestamp (uses current time if not provided)
     """
-    try:
-        if timestamp is None:
-            timestamp = time.time()
-            
-        async with httpx.AsyncClient(timeout=LOGGING_TIMEOUT) as client:
-            payload = {
-                "session_id": session_id,
-                "user_id": user_id,
-                "subject": subject,
-                "message_type": message_type,
-                "message_content": message_content,
-                "timestamp": timestamp
-            }
-            response = await client.post(
-                f"{LOGGING_API_BASE}/conversation-message",
-                json=payload
-            )
-            response.raise_for_status()
-            logger.debug(f"Conversation message logged successfully: {message_type}")
-    except httpx.TimeoutException:
-        logger.warning(f"Timeout logging conversation message for session: {session_id}")
-    except httpx.HTTPError as e:
-        logger.warning(f"HTTP error logging conversation message: {e}")
-    except Exception as e:
-        logger.error(f"Unexpected error logging conversation message: {e}")
+    if timestamp is None:
+        timestamp = time.time()
+    analytics_emitter.emit("conversation-message", {
+        "session_id": session_id,
+        "user_id": user_id,
+        "subject": subject,
+        "message_type": message_type,
+        "message_content": message_content,
+        "timestamp": timestamp
+    })
+
+
+async def _emit_and_drain(coro):
+    """Queue an event from a sync wrapper and send it before its event loop ends."""
+    await coro
+    await analytics_emitter.drain()
 
 
 def log_session_event_sync(session_id: str, user_id: str, subject: str, event_type: str):
@@ -207,10 +466,10 @@ def log_session_event_sync(session_id: str, user_id: str, subject: str, event_ty
             logger.warning("sync log_session_event called from async context")
             return
         else:
-            loop.run_until_complete(log_session_event(session_id, user_id, subject, event_type))
+            loop.run_until_complete(_emit_and_drain(log_session_event(session_id, user_id, subject, event_type)))
     except RuntimeError:
         # No event loop, create one
-        asyncio.run(log_session_event(session_id, user_id, subject, event_type))
+        asyncio.run(_emit_and_drain(log_session_event(session_id, user_id, subject, event_type)))
 
 
 def log_user_message_sync(email: str, message: str, subject: str, response: str, sources: List[str], 
@@ -223,11 +482,11 @@ def log_user_message_sync(email: str, message: str, subject: str, response: str,
             logger.warning("sync log_user_message called from async context")
             return
         else:
-            loop.run_until_complete(log_user_message(email, message, subject, response, sources,
-                                                   session_id, query_type, complexity, model_used))
+            loop.run_until_complete(_emit_and_drain(log_user_message(email, message, subject, response, sources,
+                                                                    session_id, query_type, complexity, model_used)))
     except RuntimeError:
-        asyncio.run(log_user_message(email, message, subject, response, sources,
-                                   session_id, query_type, complexity, model_used))
+        asyncio.run(_emit_and_drain(log_user_message(email, message, subject, response, sources,
+                                                    session_id, query_type, complexity, model_used)))
 
 
 def log_learning_event_sync(session_id: str, event_type: str, topic: str, confidence_level: Optional[str] = None):
@@ -239,9 +498,9 @@ def log_learning_event_sync(session_id: str, event_type: str, topic: str, confid
             logger.warning("sync log_learning_event called from async context")
             return
         else:
-            loop.run_until_complete(log_learning_event(session_id, event_type, topic, confidence_level))
+            loop.run_until_complete(_emit_and_drain(log_learning_event(session_id, event_type, topic, confidence_level)))
     except RuntimeError:
-        asyncio.run(log_learning_event(session_id, event_type, topic, confidence_level))
+        asyncio.run(_emit_and_drain(log_learning_event(session_id, event_type, topic, confidence_level)))
 
 
 def log_conversation_message_sync(session_id: str, user_id: str, subject: str, 
@@ -254,8 +513,8 @@ def log_conversation_message_sync(session_id: str, user_id: str, subject: str,
             logger.warning("sync log_conversation_message called from async context")
             return
         else:
-            loop.run_until_complete(log_conversation_message(session_id, user_id, subject, 
-                                                           message_type, message_content, timestamp))
+            loop.run_until_complete(_emit_and_drain(log_conversation_message(
+                session_id, user_id, subject, message_type, message_content, timestamp)))
     except RuntimeError:
-        asyncio.run(log_conversation_message(session_id, user_id, subject, 
-                                           message_type, message_content, timestamp))
+        asyncio.run(_emit_and_drain(log_conversation_message(
+            session_id, user_id, subject, message_type, message_content, timestamp)))
@@ -0,0 +1,358 @@
+"""
+In-process metrics in the Prometheus text format, without external dependencies.
+
+- Histograms of the duration of each stage of a chat request (rate limit, session,
+  answer cache, checkpoint load/save, agent steps, LLM calls, tools, RAG Service
+  requests, analytics), plus total request duration by endpoint and status.
+- Counters of LLM calls and tokens (from the model's usage metadata) by provider.
+- Gauges of operations in flight (requests, agent runs, LLM calls, tool calls, RAG
+  requests) and of requests waiting for an agent run slot, plus how long they waited.
+
+Recording a value is a lock, a bisect and two additions, so the hot path stays cheap.
+`GET /metrics` serves `metrics.render()`; `MetricsMiddleware` times the chat endpoints.
+
+The same stages are also collected per request (`RequestTimings`, kept in a context
+variable so LangGraph nodes and tool tasks add to the request that started them) and
+sent back in a `Server-Timing` header, so a single slow request can be diagnosed from
+the browser DevTools.
+"""
+
+import os
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Send the per-request phase breakdown in a Server-Timing header on the chat endpoints
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "true").lower() == "true"
+
+# Upper bounds (seconds) of the latency buckets: from fast in-process stages to slow LLM calls
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Sequence[str]) -> Tuple[str, ...]:
+        if len(labels) != len(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(label) for label in labels)
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Monotonic counter per label set."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(Counter):
+    """Value that goes up and down per label set."""
+
+    kind = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+    @contextmanager
+    def track(self, *labels: str) -> Iterator[None]:
+        """Count an operation in flight while the block runs."""
+        self.inc(*labels)
+        try:
+            yield
+        finally:
+            self.dec(*labels)
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram per label set."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label set -> [count per bucket (+Inf last), sum]
+        self._values: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def count(self, *labels: str) -> int:
+        entry = self._values.get(self._key(labels))
+        return sum(entry[0]) if entry else 0
+
+    def total(self, *labels: str) -> float:
+        entry = self._values.get(self._key(labels))
+        return entry[1] if entry else 0.0
+
+    @contextmanager
+    def time(self, *labels: str) -> Iterator[None]:
+        """Observe the duration of the block (also when it raises)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        lines = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {cumulative}")
+        return lines
+
+
+class RequestTimings:
+    """Phase durations of one request, rendered as a Server-Timing header."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        # (start offset, name, description, seconds)
+        self._phases: List[Tuple[float, str, str, float]] = []
+
+    def add(self, name: str, start: float, seconds: float, description: str = "") -> None:
+        self._phases.append((start - self.start, name, description, seconds))
+
+    def entries(self) -> List[Dict[str, Any]]:
+        """
+        Phases in start order plus the elapsed `total`. A phase that repeats (one per LLM
+        step or tool call) is numbered: llm-1, llm-2...
+        """
+        phases = sorted(self._phases)
+        repeats: Dict[str, int] = {}
+        for _, name, _, _ in phases:
+            repeats[name] = repeats.get(name, 0) + 1
+        seen: Dict[str, int] = {}
+        entries = []
+        for _, name, description, seconds in phases:
+            if repeats[name] > 1:
+                seen[name] = seen.get(name, 0) + 1
+                name = f"{name}-{seen[name]}"
+            entry = {"name": name, "duration_ms": round(seconds * 1000, 1)}
+            if description:
+                entry["description"] = description
+            entries.append(entry)
+        entries.append({"name": "total", "duration_ms": round((time.perf_counter() - self.start) * 1000, 1)})
+        return entries
+
+    def header(self) -> str:
+        """Server-Timing header value, e.g. `rate_limit;dur=0.2, llm-1;dur=812.4, total;dur=1204.9`."""
+        metrics = []
+        for entry in self.entries():
+            metric = f"{entry['name']};dur={entry['duration_ms']}"
+            if "description" in entry:
+                metric += f';desc="{_escape(entry["description"])}"'
+            metrics.append(metric)
+        return ", ".join(metrics)
+
+
+_request_timings: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+
+def current_timings() -> Optional[RequestTimings]:
+    """Phase durations of the request being served, if it is being timed."""
+    return _request_timings.get()
+
+
+class MetricsRegistry:
+    """The metrics of the process, rendered together."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric already registered: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+class ChatMetrics(MetricsRegistry):
+    """Metrics of the chat API hot path."""
+
+    def __init__(self):
+        super().__init__()
+        self.request_duration = self.register(Histogram(
+            "chatbot_request_duration_seconds", "Chat request duration by endpoint and status code.",
+            ["endpoint", "status"]))
+        self.stage_duration = self.register(Histogram(
+            "chatbot_stage_duration_seconds", "Duration of each stage of a chat request.", ["stage"]))
+        self.tool_duration = self.register(Histogram(
+            "chatbot_tool_duration_seconds", "Duration of each agent tool call.", ["tool"]))
+        self.rag_duration = self.register(Histogram(
+            "chatbot_rag_request_duration_seconds", "RAG Service request duration by operation and outcome.",
+            ["operation", "outcome"]))
+        self.llm_calls = self.register(Counter(
+            "chatbot_llm_calls_total", "LLM calls by provider and outcome.", ["provider", "outcome"]))
+        self.llm_tokens = self.register(Counter(
+            "chatbot_llm_tokens_total", "LLM tokens by provider and direction (input/output).",
+            ["provider", "direction"]))
+        self.in_flight = self.register(Gauge(
+            "chatbot_in_flight", "Operations in flight (request, agent, llm, tool, rag).", ["operation"]))
+        self.admission_wait = self.register(Histogram(
+            "chatbot_admission_wait_seconds", "Time waiting for an agent run slot, by priority and outcome.",
+            ["priority", "outcome"]))
+        self.admission_queued = self.register(Gauge(
+            "chatbot_admission_queued", "Requests waiting for an agent run slot, by priority.", ["priority"]))
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Time one stage of the request (histogram and Server-Timing breakdown)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.stage_duration.observe(elapsed, name)
+            timings = _request_timings.get()
+            if timings is not None:
+                timings.add(name, start, elapsed)
+
+    @contextmanager
+    def tool(self, name: str) -> Iterator[None]:
+        """Time one agent tool call and count it in flight."""
+        start = time.perf_counter()
+        self.in_flight.inc("tool")
+        try:
+            yield
+        finally:
+            self.in_flight.dec("tool")
+            elapsed = time.perf_counter() - start
+            self.tool_duration.observe(elapsed, name)
+            timings = _request_timings.get()
+            if timings is not None:
+                timings.add("tool", start, elapsed, name)
+
+    def record_llm_usage(self, provider: str, message) -> None:
+        """Count one LLM call and its tokens (from `usage_metadata`, when the provider reports it)."""
+        self.llm_calls.inc(provider, "ok")
+        usage = getattr(message, "usage_metadata", None) or {}
+        if usage.get("input_tokens"):
+            self.llm_tokens.inc(provider, "input", amount=usage["input_tokens"])
+        if usage.get("output_tokens"):
+            self.llm_tokens.inc(provider, "output", amount=usage["output_tokens"])
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware that records the duration and status of the requests to `paths`.
+
+    The request is observed when the last body chunk is sent, so a streamed answer is
+    timed until its final event and not just until the headers go out. It also starts
+    the per-request `RequestTimings` and adds the `Server-Timing` header with the phases
+    finished when the response starts (for a stream, those before the first event).
+    """
+
+    def __init__(self, app, paths: Sequence[str] = ("/chat", "/chat/stream", "/clear-session"),
+                 registry: "ChatMetrics" = None, server_timing: bool = SERVER_TIMING_ENABLED):
+        self.app = app
+        self.paths = frozenset(paths)
+        self.registry = registry or metrics
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        registry = self.registry
+        state = {"status": 500, "done": False}
+        start = time.perf_counter()
+        timings = RequestTimings()
+        _request_timings.set(timings)
+        registry.in_flight.inc("request")
+
+        def finish() -> None:
+            if not state["done"]:
+                state["done"] = True
+                registry.in_flight.dec("request")
+                registry.request_duration.observe(time.perf_counter() - start, scope["path"], str(state["status"]))
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+                if self.server_timing:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", timings.header().encode("latin-1")))
+                    message = {**message, "headers": headers}
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                finish()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            finish()
+
+
+# Global metrics registry
+metrics = ChatMetrics()
@@ -1,20 +1,184 @@
 """
 Cliente HTTP para comunicarse con el RAG Service
+
+Todas las peticiones comparten un pool de conexiones persistentes (keep-alive) con el
+RAG Service: uno asíncrono para el agente y otro síncrono para los scripts, que usan
+los métodos sin prefijo `a`. Ambas versiones de cada método comparten la petición y la
+lectura de la respuesta. Cada operación tiene su propio timeout. Los pools se cierran
+con `aclose()` al apagar la aplicación (y el de un event loop anterior, al sustituirlo).
 """
 import os
-import requests
-from typing import List, Dict, Any, Optional, Tuple
+import time
+import asyncio
+import httpx
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 from langchain_core.documents import Document
 from dotenv import load_dotenv
 
+from .metrics_service import metrics
+
 load_dotenv()
 
+# Límites del pool de conexiones con el RAG Service
+RAG_MAX_CONNECTIONS = int(os.getenv("RAG_MAX_CONNECTIONS", "50"))
+RAG_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("RAG_MAX_KEEPALIVE_CONNECTIONS", "20"))
+# Segundos que una conexión ociosa se mantiene abierta en el pool
+RAG_KEEPALIVE_EXPIRY = float(os.getenv("RAG_KEEPALIVE_EXPIRY", "30"))
+RAG_CONNECT_TIMEOUT = float(os.getenv("RAG_CONNECT_TIMEOUT", "5"))
+
+# Timeout (s) de cada operación, configurable con RAG_TIMEOUT_<OPERACIÓN>
+RAG_TIMEOUTS = {
+    operation: float(os.getenv(f"RAG_TIMEOUT_{operation.upper()}", default))
+    for operation, default in {
+        "search": "30",
+        "guia_docente": "10",
+        "embed": "10",
+        "subject_version": "5",
+        "subjects": "10",
+        "health": "5",
+        "populate": "30",
+    }.items()
+}
+
+
 class RAGServiceClient:
     """Cliente para comunicarse con el RAG Service"""
     
-    def __init__(self):
-        self.base_url = os.getenv("RAG_SERVICE_URL", "http://rag-service:8082")
-        
+    def __init__(self, base_url: Optional[str] = None, transport: Optional[httpx.BaseTransport] = None):
+        self.base_url = base_url or os.getenv("RAG_SERVICE_URL", "http://rag-service:8082")
+        self._transport = transport
+        self._client: Optional[httpx.Client] = None
+        self._async_client: Optional[httpx.AsyncClient] = None
+        self._async_loop: Optional[asyncio.AbstractEventLoop] = None
+        # Cierres de pools de event loops anteriores aún en curso
+        self._closing: Set[asyncio.Task] = set()
+
+    def _client_options(self) -> Dict[str, Any]:
+        return {
+            "base_url": self.base_url,
+            "limits": httpx.Limits(
+                max_connections=RAG_MAX_CONNECTIONS,
+                max_keepalive_connections=RAG_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=RAG_KEEPALIVE_EXPIRY,
+            ),
+            "timeout": httpx.Timeout(RAG_TIMEOUTS["search"], connect=RAG_CONNECT_TIMEOUT),
+            "transport": self._transport,
+        }
+
+    def _get_client(self) -> httpx.Client:
+        """Pool síncrono compartido, creado en la primera petición."""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.Client(**self._client_options())
+        return self._client
+
+    def _get_async_client(self) -> httpx.AsyncClient:
+        """Pool asíncrono compartido, creado en la primera petición."""
+        loop = asyncio.get_running_loop()
+        # Las conexiones pertenecen al event loop que las abrió (p. ej. otro loop en los tests)
+        if self._async_client is None or self._async_client.is_closed or self._async_loop is not loop:
+            if self._async_client is not None and not self._async_client.is_closed:
+                self._close_stale_pool(self._async_client, self._async_loop, loop)
+            self._async_client = httpx.AsyncClient(**self._client_options())
+            self._async_loop = loop
+        return self._async_client
+
+    def _close_stale_pool(self, client: httpx.AsyncClient, old_loop: Optional[asyncio.AbstractEventLoop],
+                          loop: asyncio.AbstractEventLoop) -> None:
+        """Cierra el pool de un event loop anterior: en ese loop si sigue vivo, si no en el actual."""
+        if old_loop is not None and old_loop.is_running():
+            asyncio.run_coroutine_threadsafe(self._aclose_quietly(client), old_loop)
+            return
+        task = loop.create_task(self._aclose_quietly(client))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    @staticmethod
+    async def _aclose_quietly(client: httpx.AsyncClient) -> None:
+        try:
+            await client.aclose()
+        except Exception as e:
+            # Sus conexiones pueden estar ya rotas con su event loop
+            print(f"Error cerrando un pool anterior del RAG Service: {str(e)}")
+
+    @staticmethod
+    def _timeout(operation: str) -> httpx.Timeout:
+        return httpx.Timeout(RAG_TIMEOUTS[operation], connect=RAG_CONNECT_TIMEOUT)
+
+    def _request(self, operation: str, method: str, path: str, **kwargs) -> httpx.Response:
+        """Petición síncrona al RAG Service, con las mismas métricas que `_arequest`."""
+        outcome = "error"
+        start = time.perf_counter()
+        try:
+            with metrics.in_flight.track("rag"):
+                response = self._get_client().request(method, path, timeout=self._timeout(operation), **kwargs)
+            outcome = str(response.status_code)
+            return response
+        finally:
+            metrics.rag_duration.observe(time.perf_counter() - start, operation, outcome)
+
+    async def _arequest(self, operation: str, method: str, path: str, **kwargs) -> httpx.Response:
+        """
+        Petición asíncrona al RAG Service, midiendo su duración por operación y resultado
+        (código HTTP o "error") y contándola como en curso (ver services.metrics_service).
+        """
+        outcome = "error"
+        start = time.perf_counter()
+        try:
+            with metrics.in_flight.track("rag"):
+                response = await self._get_async_client().request(
+                    method, path, timeout=self._timeout(operation), **kwargs)
+            outcome = str(response.status_code)
+            return response
+        finally:
+            metrics.rag_duration.observe(time.perf_counter() - start, operation, outcome)
+
+    # Cada operación se define una vez (petición y lectura de la respuesta); los métodos
+    # públicos síncronos y asíncronos solo eligen el pool con `_call` o `_acall`.
+
+    def _call(self, operation: str, handle: Callable[[httpx.Response], Any], fallback: Any,
+              method: str, path: str, **kwargs) -> Any:
+        """Petición síncrona cuya respuesta interpreta `handle`; si falla devuelve `fallback`."""
+        try:
+            return handle(self._request(operation, method, path, **kwargs))
+        except Exception as e:
+            return self._failed(operation, e, fallback)
+
+    async def _acall(self, operation: str, handle: Callable[[httpx.Response], Any], fallback: Any,
+                     method: str, path: str, **kwargs) -> Any:
+        """Versión asíncrona de `_call`."""
+        try:
+            return handle(await self._arequest(operation, method, path, **kwargs))
+        except Exception as e:
+            return self._failed(operation, e, fallback)
+
+    @staticmethod
+    def _failed(operation: str, error: Exception, fallback: Any) -> Any:
+        if isinstance(error, httpx.HTTPError):
+            print(f"Error conectando con RAG Service ({operation}): {str(error)}")
+        else:
+            print(f"Error inesperado en RAG Service ({operation}): {str(error)}")
+        return fallback
+
+    async def aclose(self) -> None:
+        """Cierra los pools de conexiones (al apagar la aplicación)."""
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    @staticmethod
+    def _search_request(query: str, subject: str, k: int, filter_metadata: Optional[Dict]) -> Dict[str, Any]:
+        return {
+            "json": {
+                "query": query,
+                "subject": subject,
+                "k": k,
+                "filter_metadata": filter_metadata
+            }
+        }
+
     def search_documents(
         self, 
         query: str, 
@@ -34,73 +198,66 @@ class RAGServiceClient:
         Returns:
             Tupla con (documentos, fuentes)
         """
-        try:
-            payload = {
-                "query": query,
-                "subject": subject,
-                "k": k,
-                "filter_metadata": filter_metadata
-            }
-            
-            response = requests.post(
-                f"{self.base_url}/search",
-                json=payload,
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                
-                # Convertir documentos de vuelta a objetos Document
-                documents = []
-                for doc_data in data["documents"]:
-                    doc = Document(
-                        page_content=doc_data["content"],
-                        metadata=doc_data["metadata"]
-                    )
-                    documents.append(doc)
-                
-                return documents, data["sources"]
-            else:
-                print(f"Error en RAG Service: {response.status_code} - {response.text}")
-                return [], []
-                
-        except requests.exceptions.RequestException as e:
-            print(f"Error conectando con RAG Service: {str(e)}")
-            return [], []
-        except Exception as e:
-            print(f"Error inesperado en RAG Service: {str(e)}")
+        return self._call("search", self._parse_search_response, ([], []), "POST", "/search",
+                          **self._search_request(query, subject, k, filter_metadata))
+    
+    async def asearch_documents(
+        self, 
+        query: str, 
+        subject: str, 
+        k: int = 5,
+        filter_metadata: Optional[Dict] = None
+    ) -> Tuple[List[Document], List[str]]:
+        """Versión asíncrona de search_documents (no bloquea el event loop)"""
+        return await self._acall("search", self._parse_search_response, ([], []), "POST", "/search",
+                                 **self._search_request(query, subject, k, filter_metadata))
+
+    @staticmethod
+    def _parse_search_response(response: httpx.Response) -> Tuple[List[Document], List[str]]:
+        """Convertir documentos de vuelta a objetos Document"""
+        if response.status_code != 200:
+            print(f"Error en RAG Service: {response.status_code} - {response.text}")
             return [], []
+        data = response.json()
+        documents = []
+        for doc_data in data["documents"]:
+            doc = Document(
+                page_content=doc_data["content"],
+                metadata=doc_data["metadata"]
+            )
+            documents.append(doc)
+        
+        return documents, data["sources"]
     
     def list_subjects(self) -> List[str]:
         """Lista las asignaturas disponibles"""
-        try:
-            response = requests.get(
-                f"{self.base_url}/subjects",
-                timeout=10
-            )
-            
+        def handle(response: httpx.Response) -> List[str]:
             if response.status_code == 200:
-                data = response.json()
-                return data["subjects"]
-            else:
-                print(f"Error listando asignaturas: {response.status_code}")
-                return []
-                
-        except Exception as e:
-            print(f"Error listando asignaturas: {str(e)}")
+                return response.json()["subjects"]
+            print(f"Error listando asignaturas: {response.status_code}")
             return []
+
+        return self._call("subjects", handle, [], "GET", "/subjects")
     
     def health_check(self) -> bool:
         """Verifica si el RAG Service está disponible"""
-        try:
-            response = requests.get(
-                f"{self.base_url}/health",
-                timeout=5
-            )
-            return response.status_code == 200
-        except:
-            return False
+        return self._call("health", lambda response: response.status_code == 200, False, "GET", "/health")
+
+    @staticmethod
+    def _guia_docente_request(section: Optional[str]) -> Dict[str, Any]:
+        return {"params": {"section": section} if section else {}}
+
+    @staticmethod
+    def _parse_guia_docente(subject: str) -> Callable[[httpx.Response], Optional[Dict[str, Any]]]:
+        def handle(response: httpx.Response) -> Optional[Dict[str, Any]]:
+            if response.status_code == 200:
+                return response.json()["data"]
+            if response.status_code == 404:
+                print(f"Guía docente no encontrada para: {subject}")
+            else:
+                print(f"Error obteniendo guía docente: {response.status_code} - {response.text}")
+            return None
+        return handle
         
     def get_guia_docente(self, subject: str, section: Optional[str] = None) -> Optional[Dict[str, Any]]:
         """
@@ -113,35 +270,50 @@ class RAGServiceClient:
         Returns:
             Diccionario con los datos de la guía docente o None si hay error
         """
-        try:
-            url = f"{self.base_url}/guia-docente/{subject}"
-            params = {}
-            if section:
-                params["section"] = section
-                
-            response = requests.get(
-                url,
-                params=params,
-                timeout=10
-            )
+        return self._call("guia_docente", self._parse_guia_docente(subject), None,
+                          "GET", f"/guia-docente/{subject}", **self._guia_docente_request(section))
+
+    async def aget_guia_docente(self, subject: str, section: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Versión asíncrona de get_guia_docente (no bloquea el event loop)"""
+        return await self._acall("guia_docente", self._parse_guia_docente(subject), None,
+                                 "GET", f"/guia-docente/{subject}", **self._guia_docente_request(section))
+
+    async def aembed_query(self, text: str) -> Optional[List[float]]:
+        """
+        Obtener el embedding de un texto con el modelo de las colecciones
+        
+        Args:
+            text: Texto a convertir en vector
             
+        Returns:
+            El vector o None si hay error
+        """
+        def handle(response: httpx.Response) -> Optional[List[float]]:
             if response.status_code == 200:
-                data = response.json()
-                return data["data"]
-            elif response.status_code == 404:
-                print(f"Guía docente no encontrada para: {subject}")
-                return None
-            else:
-                print(f"Error obteniendo guía docente: {response.status_code} - {response.text}")
-                return None
-                
-        except requests.exceptions.RequestException as e:
-            print(f"Error conectando con RAG Service para guía docente: {str(e)}")
+                return response.json()["embedding"]
+            print(f"Error obteniendo embedding: {response.status_code} - {response.text}")
             return None
-        except Exception as e:
-            print(f"Error inesperado obteniendo guía docente: {str(e)}")
+
+        return await self._acall("embed", handle, None, "POST", "/embed", json={"text": text})
+
+    async def aget_subject_version(self, subject: str) -> Optional[str]:
+        """
+        Obtener la versión de los documentos (corpus y guía docente) de una asignatura
+        
+        Args:
+            subject: Nombre de la asignatura
+            
+        Returns:
+            Identificador de versión o None si hay error
+        """
+        def handle(response: httpx.Response) -> Optional[str]:
+            if response.status_code == 200:
+                return response.json()["version"]
+            print(f"Error obteniendo versión de {subject}: {response.status_code} - {response.text}")
             return None
 
+        return await self._acall("subject_version", handle, None, "GET", f"/subjects/{subject}/version")
+
     def populate_subject(self, subject: str, file_paths: List[str], reset: bool = False) -> Dict[str, Any]:
         """
         Populate a subject with documents via the RAG Service
@@ -163,11 +335,7 @@ class RAGServiceClient:
                 "clear_existing": reset
             }
             
-            response = requests.post(
-                f"{self.base_url}/populate",
-                data=data,
-                timeout=30
-            )
+            response = self._request("populate", "POST", "/populate", data=data)
             
             if response.status_code == 200:
                 result = response.json()
@@ -183,7 +351,7 @@ class RAGServiceClient:
                     "message": f"Error populating subject: {response.status_code} - {response.text}"
                 }
                 
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             return {
                 "status": "error",
                 "message": f"Error connecting to RAG Service: {str(e)}"
@@ -5,136 +5,253 @@ This module handles:
 - User session creation and management
 - Session tracking and timeout handling
 - Session cleanup and maintenance
+
+Sessions live in a `SessionStore`. The in-memory store indexes them by user+subject
+and by session ID, so every lookup is O(1), and expires them from a min-heap of
+expiry times in a background task: no request ever scans the sessions of other users.
+A store backed by shared storage only has to implement the same interface.
 """
 
+import os
 import time
 import uuid
-from typing import Dict, Optional
+import heapq
+import asyncio
+from typing import Any, Callable, Dict, List, Optional, Tuple
 import logging
 
 logger = logging.getLogger(__name__)
 
-# Session management for learning analytics
-active_sessions: Dict[str, Dict] = {}
-
 # Configuration
 SESSION_TIMEOUT_SECONDS = 30 * 60  # 30 minutes
+# Seconds between background sweeps of expired sessions
+SESSION_SWEEP_INTERVAL = float(os.getenv("SESSION_SWEEP_INTERVAL", "60"))
+
+
+class SessionStore:
+    """Interface of the session stores."""
+
+    async def aget_or_create(self, user_email: str, subject: str) -> str:
+        """Session ID of the user+subject, creating a new session if there is none or it expired."""
+        raise NotImplementedError
+
+    async def atouch(self, user_email: str, subject: str) -> Optional[str]:
+        """Update the session activity and message count; session ID or None if there is no session."""
+        raise NotImplementedError
+
+    async def aget(self, session_id: str) -> Optional[Dict]:
+        """Copy of the session with this ID, or None."""
+        raise NotImplementedError
+
+    async def aexpire(self) -> int:
+        """Remove the sessions inactive for longer than the timeout; returns how many."""
+        raise NotImplementedError
+
+    async def acount(self) -> int:
+        raise NotImplementedError
+
+    async def aall(self) -> Dict[str, Dict]:
+        raise NotImplementedError
+
+    def start(self) -> None:
+        """Start background work, if any. Called on app startup."""
+
+    async def stop(self) -> None:
+        """Stop background work and release connections. Called on app shutdown."""
+
+
+class InMemorySessionStore(SessionStore):
+    """Sessions of this process, indexed by user+subject and by session ID, expired from a heap."""
+
+    def __init__(self, timeout: float = SESSION_TIMEOUT_SECONDS, sweep_interval: float = SESSION_SWEEP_INTERVAL,
+                 clock: Callable[[], float] = time.time):
+        self.timeout = timeout
+        self.sweep_interval = sweep_interval
+        self._clock = clock
+        # "email_subject" -> session
+        self.sessions: Dict[str, Dict[str, Any]] = {}
+        # session ID -> "email_subject"
+        self._by_id: Dict[str, str] = {}
+        # (expiry time when scheduled, session ID); a touched session is rescheduled when popped
+        self._expiry: List[Tuple[float, str]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def _remove(self, session_key: str) -> None:
+        session = self.sessions.pop(session_key)
+        self._by_id.pop(session['session_id'], None)
+
+    def get_or_create(self, user_email: str, subject: str) -> str:
+        session_key = f"{user_email}_{subject}"
+        current_time = self._clock()
+
+        # Check if we have an active session for this user+subject
+        session = self.sessions.get(session_key)
+        if session is not None:
+            if current_time - session['last_activity'] < self.timeout:
+                session['last_activity'] = current_time
+                return session['session_id']
+            self._remove(session_key)
+
+        # Create new session
+        session_id = str(uuid.uuid4())
+        self.sessions[session_key] = {
+            'session_id': session_id,
+            'email': user_email,
+            'subject': subject,
+            'created': current_time,
+            'last_activity': current_time,
+            'message_count': 0
+        }
+        self._by_id[session_id] = session_key
+        heapq.heappush(self._expiry, (current_time + self.timeout, session_id))
+
+        logger.info(f"Created new session for user {user_email[:8]}... in subject {subject}")
+        return session_id
+
+    def touch(self, user_email: str, subject: str) -> Optional[str]:
+        session = self.sessions.get(f"{user_email}_{subject}")
+        if session is None:
+            return None
+        session['message_count'] += 1
+        session['last_activity'] = self._clock()
+        return session['session_id']
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        session_key = self._by_id.get(session_id)
+        return self.sessions[session_key].copy() if session_key is not None else None
+
+    def expire(self) -> int:
+        """Pop the due entries of the heap; only sessions that really timed out are removed."""
+        current_time = self._clock()
+        removed = 0
+        while self._expiry and self._expiry[0][0] <= current_time:
+            _, session_id = heapq.heappop(self._expiry)
+            session_key = self._by_id.get(session_id)
+            if session_key is None:
+                continue  # replaced by a newer session of the same user+subject
+            expires_at = self.sessions[session_key]['last_activity'] + self.timeout
+            if expires_at > current_time:
+                heapq.heappush(self._expiry, (expires_at, session_id))
+                continue
+            logger.info(f"Cleaning up inactive session: {session_id}")
+            self._remove(session_key)
+            removed += 1
+        if removed:
+            logger.info(f"Cleaned up {removed} inactive sessions")
+        return removed
+
+    async def aget_or_create(self, user_email: str, subject: str) -> str:
+        return self.get_or_create(user_email, subject)
 
+    async def atouch(self, user_email: str, subject: str) -> Optional[str]:
+        return self.touch(user_email, subject)
 
-def get_or_create_session(user_email: str, subject: str) -> str:
+    async def aget(self, session_id: str) -> Optional[Dict]:
+        return self.get(session_id)
+
+    async def aexpire(self) -> int:
+        return self.expire()
+
+    async def acount(self) -> int:
+        return len(self.sessions)
+
+    async def aall(self) -> Dict[str, Dict]:
+        return self.sessions.copy()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            self.expire()
+
+    def start(self) -> None:
+        """Start the background expiry task. Called on app startup."""
+        if self.sweep_interval > 0 and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the background expiry task. Called on app shutdown."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# Session management for learning analytics
+session_store: SessionStore = InMemorySessionStore()
+active_sessions: Dict[str, Dict] = session_store.sessions
+
+
+async def get_or_create_session(user_email: str, subject: str) -> str:
     """
     Get existing session ID or create a new one for the user.
     Sessions are tied to email + subject combination.
-    
+
     Args:
         user_email: User's email address
         subject: Subject/course name
-        
+
     Returns:
         Session ID string
     """
-    session_key = f"{user_email}_{subject}"
-    current_time = time.time()
-    
-    # Check if we have an active session for this user+subject
-    if session_key in active_sessions:
-        last_activity = active_sessions[session_key]['last_activity']
-        if current_time - last_activity < SESSION_TIMEOUT_SECONDS:
-            active_sessions[session_key]['last_activity'] = current_time
-            return active_sessions[session_key]['session_id']
-    
-    # Create new session
-    session_id = str(uuid.uuid4())
-    active_sessions[session_key] = {
-        'session_id': session_id,
-        'email': user_email,
-        'subject': subject,
-        'created': current_time,
-        'last_activity': current_time,
-        'message_count': 0
-    }
-    
-    logger.info(f"Created new session for user {user_email[:8]}... in subject {subject}")
-    return session_id
-
-
-def update_session_activity(user_email: str, subject: str) -> Optional[str]:
+    return await session_store.aget_or_create(user_email, subject)
+
+
+async def update_session_activity(user_email: str, subject: str) -> Optional[str]:
     """
     Update session activity and increment message count.
-    
+
     Args:
         user_email: User's email address
         subject: Subject/course name
-        
+
     Returns:
         Session ID if session exists, None otherwise
     """
-    session_key = f"{user_email}_{subject}"
-    
-    if session_key in active_sessions:
-        active_sessions[session_key]['message_count'] += 1
-        active_sessions[session_key]['last_activity'] = time.time()
-        return active_sessions[session_key]['session_id']
-    
-    return None
+    return await session_store.atouch(user_email, subject)
 
 
-def get_session_info(session_id: str) -> Optional[Dict]:
+async def get_session_info(session_id: str) -> Optional[Dict]:
     """
     Get session information by session ID.
-    
+
     Args:
         session_id: Session ID to look up
-        
+
     Returns:
         Session information dict or None if not found
     """
-    for session_data in active_sessions.values():
-        if session_data['session_id'] == session_id:
-            return session_data.copy()
-    return None
+    return await session_store.aget(session_id)
 
 
-def cleanup_old_sessions() -> int:
+async def cleanup_old_sessions() -> int:
     """
     Remove sessions that have been inactive for too long.
-    
+    The store does this in the background; this runs one pass now.
+
     Returns:
         Number of sessions cleaned up
     """
-    if len(active_sessions) <= 10:  # Only cleanup when we have many sessions
-        return 0
-        
-    current_time = time.time()
-    sessions_to_remove = []
-    
-    for session_key, session_data in active_sessions.items():
-        if current_time - session_data['last_activity'] > SESSION_TIMEOUT_SECONDS:
-            sessions_to_remove.append(session_key)
-    
-    for session_key in sessions_to_remove:
-        logger.info(f"Cleaning up inactive session: {active_sessions[session_key]['session_id']}")
-        del active_sessions[session_key]
-    
-    logger.info(f"Cleaned up {len(sessions_to_remove)} inactive sessions")
-    return len(sessions_to_remove)
-
-
-def get_active_sessions_count() -> int:
+    return await session_store.aexpire()
+
+
+async def get_active_sessions_count() -> int:
     """
     Get the current number of active sessions.
-    
+
     Returns:
         Number of active sessions
     """
-    return len(active_sessions)
+    return await session_store.acount()
 
 
-def get_all_sessions() -> Dict[str, Dict]:
+async def get_all_sessions() -> Dict[str, Dict]:
     """
     Get all active sessions (for debugging/monitoring).
-    
+
     Returns:
         Copy of all active sessions
     """
-    return active_sessions.copy()
+    return await session_store.aall()
@@ -0,0 +1,228 @@
+"""
+Disk-backed, append-only spill queue for analytics events.
+
+Events that could not be delivered to the logging service are appended as JSON lines
+to segment files (`segment-<seq>.jsonl`) in ANALYTICS_SPILL_DIR. A new segment is
+started when the current one reaches ANALYTICS_SPILL_SEGMENT_BYTES, and when the
+directory grows past ANALYTICS_SPILL_MAX_BYTES the oldest segment is evicted (its
+events are counted as lost). Events are read back oldest first; a cursor file records
+how far the replay has been committed, so after a restart the replay resumes there.
+Delivery is at least once: events read but not committed are read again.
+
+All methods do blocking file I/O; the analytics emitter calls them off the event loop.
+"""
+
+import os
+import json
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Spill queue configuration
+ANALYTICS_SPILL_DIR = os.getenv(
+    "ANALYTICS_SPILL_DIR",
+    os.path.join(os.path.dirname(__file__), "..", "storage", "analytics_spill")
+)
+ANALYTICS_SPILL_MAX_BYTES = int(os.getenv("ANALYTICS_SPILL_MAX_MB", "50")) * 1024 * 1024
+ANALYTICS_SPILL_SEGMENT_BYTES = int(os.getenv("ANALYTICS_SPILL_SEGMENT_KB", "1024")) * 1024
+
+SEGMENT_PREFIX = "segment-"
+SEGMENT_SUFFIX = ".jsonl"
+CURSOR_FILE = "cursor.json"
+
+# (endpoint, payload), as queued by the analytics emitter
+Event = Tuple[str, Dict[str, Any]]
+# (segment sequence number, byte offset in that segment)
+Position = Tuple[int, int]
+
+
+class SpillQueue:
+    """Append-only segmented event log with a committed read cursor."""
+
+    def __init__(self, directory: str = ANALYTICS_SPILL_DIR,
+                 max_bytes: int = ANALYTICS_SPILL_MAX_BYTES,
+                 segment_bytes: int = ANALYTICS_SPILL_SEGMENT_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._segments = sorted(
+            int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+            for name in os.listdir(directory)
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)
+        )
+        self._cursor = self._load_cursor()
+        self._sealed = self._last_line_is_partial()
+        self.stats = {"spilled": 0, "evicted": 0, "corrupt": 0}
+        self.pending = self._count_pending()
+        if self.pending:
+            logger.info(f"Analytics spill queue has {self.pending} events to replay")
+
+    # Files
+
+    def _path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{segment:08d}{SEGMENT_SUFFIX}")
+
+    def _size(self, segment: int) -> int:
+        try:
+            return os.path.getsize(self._path(segment))
+        except OSError:
+            return 0
+
+    def _load_cursor(self) -> Position:
+        first = self._segments[0] if self._segments else 0
+        try:
+            with open(os.path.join(self.directory, CURSOR_FILE), encoding="utf-8") as f:
+                segment, offset = json.load(f)
+        except (OSError, ValueError, TypeError):
+            return first, 0
+        if segment not in self._segments:
+            return first, 0
+        return segment, offset
+
+    def _save_cursor(self) -> None:
+        path = os.path.join(self.directory, CURSOR_FILE)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(list(self._cursor), f)
+        os.replace(path + ".tmp", path)
+
+    def _last_line_is_partial(self) -> bool:
+        """A crash mid-append leaves a line without newline: never append after it."""
+        if not self._segments or not self._size(self._segments[-1]):
+            return False
+        with open(self._path(self._segments[-1]), "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) != b"\n"
+
+    def _count_pending(self) -> int:
+        count = 0
+        segment, offset = self._cursor
+        for seq in self._segments:
+            if seq < segment:
+                continue
+            with open(self._path(seq), "rb") as f:
+                f.seek(offset if seq == segment else 0)
+                count += sum(1 for line in f if line.endswith(b"\n"))
+        return count
+
+    def _remove(self, segment: int) -> None:
+        try:
+            os.remove(self._path(segment))
+        except OSError as e:
+            logger.warning(f"Could not remove analytics spill segment {segment}: {e}")
+        self._segments.remove(segment)
+
+    # Queue operations
+
+    def append(self, events: List[Event]) -> int:
+        """Append events at the tail, rotating segments and enforcing the size cap."""
+        if not events:
+            return 0
+        data = "".join(
+            json.dumps({"type": endpoint, "data": payload}, ensure_ascii=False) + "\n"
+            for endpoint, payload in events
+        ).encode("utf-8")
+        with self._lock:
+            if not self._segments or self._sealed or self._size(self._segments[-1]) >= self.segment_bytes:
+                self._segments.append(self._segments[-1] + 1 if self._segments else 0)
+                self._sealed = False
+                if len(self._segments) == 1:
+                    self._cursor = (self._segments[0], 0)
+            with open(self._path(self._segments[-1]), "ab") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            self.pending += len(events)
+            self.stats["spilled"] += len(events)
+            self._enforce_cap()
+        return len(events)
+
+    def _enforce_cap(self) -> None:
+        total = sum(self._size(seq) for seq in self._segments)
+        while total > self.max_bytes and len(self._segments) > 1:
+            oldest = self._segments[0]
+            offset = self._cursor[1] if self._cursor[0] == oldest else 0
+            with open(self._path(oldest), "rb") as f:
+                f.seek(offset)
+                lost = sum(1 for line in f if line.endswith(b"\n"))
+            total -= self._size(oldest)
+            self._remove(oldest)
+            self._cursor = (self._segments[0], 0)
+            self._save_cursor()
+            self.pending -= lost
+            self.stats["evicted"] += lost
+            logger.warning(f"Analytics spill queue over {self.max_bytes} bytes, evicted {lost} events")
+
+    def read(self, limit: int) -> Tuple[List[Event], Position, int]:
+        """
+        Read up to `limit` events from the cursor without consuming them.
+
+        Returns:
+            Tuple (events, position and number of lines read, to pass to `commit` once
+            the events are delivered). Corrupt lines are skipped but still consumed.
+        """
+        events: List[Event] = []
+        consumed = 0
+        with self._lock:
+            segment, offset = self._cursor
+            for seq in [s for s in self._segments if s >= segment]:
+                if seq != segment:
+                    segment, offset = seq, 0
+                with open(self._path(seq), "rb") as f:
+                    f.seek(offset)
+                    while len(events) < limit:
+                        line = f.readline()
+                        if not line.endswith(b"\n"):
+                            break
+                        offset += len(line)
+                        consumed += 1
+                        try:
+                            item = json.loads(line)
+                            events.append((item["type"], item["data"]))
+                        except (ValueError, KeyError, TypeError):
+                            self.stats["corrupt"] += 1
+                if len(events) >= limit:
+                    break
+            if not consumed:
+                # Nothing left on disk (the counter drifted, e.g. files removed by hand)
+                self.pending = 0
+        return events, (segment, offset), consumed
+
+    def commit(self, position: Position, count: int) -> None:
+        """Move the cursor past the `count` lines read up to `position` and delete consumed segments."""
+        with self._lock:
+            self._cursor = position
+            self.pending = max(self.pending - count, 0)
+            for seq in [s for s in self._segments if s < position[0]]:
+                self._remove(seq)
+            if self.pending == 0:
+                # Everything replayed: start again from an empty directory
+                for seq in list(self._segments):
+                    self._remove(seq)
+                self._cursor = (0, 0)
+                self._sealed = False
+            self._save_cursor()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Backlog size on disk and spill counters."""
+        with self._lock:
+            return {
+                "directory": os.path.abspath(self.directory),
+                "pending": self.pending,
+                "segments": len(self._segments),
+                "bytes": sum(self._size(seq) for seq in self._segments),
+                "max_bytes": self.max_bytes,
+                **self.stats,
+            }
+
+
+def open_spill_queue(directory: Optional[str] = None) -> Optional[SpillQueue]:
+    """Spill queue in `directory` (ANALYTICS_SPILL_DIR by default), or None if it cannot be used."""
+    try:
+        return SpillQueue(directory or ANALYTICS_SPILL_DIR)
+    except OSError as e:
+        logger.warning(f"Analytics spill queue disabled: {e}")
+        return None
@@ -0,0 +1,277 @@
+"""
+Langfuse tracing kept off the request path.
+
+- Sampling: each request is traced with probability TRACING_SAMPLE_RATE, which can be
+  overridden per subject or per tag with TRACING_SAMPLE_RATES
+  (e.g. "metaheuristicas=0.2,stream=0.05"). Unsampled requests get no callback handler.
+- Export: Langfuse's own span processor batches finished spans (TRACING_EXPORT_BATCH,
+  TRACING_EXPORT_INTERVAL) into a bounded queue (TRACING_QUEUE_SIZE) drained by a
+  background thread, so a slow or unreachable collector never blocks a request. Its
+  project and instrumentation scope filters (TRACING_BLOCKED_SCOPES) still apply.
+  Exported, failed and dropped spans are counted for /admin/tracing.
+- Nothing is flushed while serving a request; pending spans are flushed once on shutdown.
+"""
+
+import os
+import random
+import logging
+import threading
+from collections import deque
+from typing import Any, Dict, List, Optional, Sequence
+
+from opentelemetry import trace as otel_trace_api
+from opentelemetry.sdk.trace import SpanProcessor, TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, SpanExporter, SpanExportResult
+
+logger = logging.getLogger(__name__)
+
+# Tracing configuration
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+TRACING_SAMPLE_RATE = float(os.getenv("TRACING_SAMPLE_RATE", "1.0"))
+# Per subject/tag overrides: "subject_or_tag=rate,..."
+TRACING_SAMPLE_RATES = os.getenv("TRACING_SAMPLE_RATES", "")
+# Finished spans waiting to be exported; beyond this they are dropped
+TRACING_QUEUE_SIZE = int(os.getenv("TRACING_QUEUE_SIZE", "2048"))
+TRACING_EXPORT_BATCH = int(os.getenv("TRACING_EXPORT_BATCH", "256"))
+TRACING_EXPORT_INTERVAL = float(os.getenv("TRACING_EXPORT_INTERVAL", "2.0"))
+# Seconds allowed for each export request to the Langfuse collector
+TRACING_EXPORT_TIMEOUT = int(os.getenv("TRACING_EXPORT_TIMEOUT", "5"))
+# Instrumentation scopes whose spans are never exported, comma separated
+TRACING_BLOCKED_SCOPES = [scope.strip() for scope in os.getenv("TRACING_BLOCKED_SCOPES", "").split(",")
+                          if scope.strip()]
+TRACING_SHUTDOWN_TIMEOUT = 5.0
+
+
+def parse_sample_rates(spec: str) -> Dict[str, float]:
+    """
+    Parse "key=rate" pairs separated by commas.
+
+    Args:
+        spec: Sample rate overrides, e.g. "metaheuristicas=0.2,stream=0.05"
+
+    Returns:
+        Mapping of lowercase subject/tag to a rate clamped to [0, 1]
+    """
+    rates = {}
+    for item in spec.split(","):
+        key, sep, value = item.partition("=")
+        if not sep or not key.strip():
+            continue
+        try:
+            rates[key.strip().lower()] = min(max(float(value), 0.0), 1.0)
+        except ValueError:
+            logger.warning(f"Ignoring invalid tracing sample rate: {item!r}")
+    return rates
+
+
+class TraceSampler:
+    """Decides per request whether to trace it, by subject or tag."""
+
+    def __init__(self, default_rate: float = TRACING_SAMPLE_RATE,
+                 rates: Optional[Dict[str, float]] = None, rng=random.random):
+        self.default_rate = default_rate
+        self.rates = rates if rates is not None else parse_sample_rates(TRACING_SAMPLE_RATES)
+        self._rng = rng
+        self.sampled = 0
+        self.skipped = 0
+
+    def rate_for(self, subject: Optional[str], tags: Sequence[str] = ()) -> float:
+        """The subject override wins over tag overrides, which win over the default rate."""
+        for key in (subject, *tags):
+            if key and key.lower() in self.rates:
+                return self.rates[key.lower()]
+        return self.default_rate
+
+    def should_trace(self, subject: Optional[str], tags: Sequence[str] = ()) -> bool:
+        rate = self.rate_for(subject, tags)
+        sampled = rate >= 1.0 or (rate > 0.0 and self._rng() < rate)
+        if sampled:
+            self.sampled += 1
+        else:
+            self.skipped += 1
+        return sampled
+
+
+class CountingSpanExporter(SpanExporter):
+    """Delegates to the exporter Langfuse created and counts exported and failed spans."""
+
+    def __init__(self, exporter: SpanExporter, counters: Dict[str, int], lock: threading.Lock):
+        self.exporter = exporter
+        self._counters = counters
+        self._lock = lock
+
+    def export(self, spans):
+        result = SpanExportResult.FAILURE
+        try:
+            result = self.exporter.export(spans)
+            return result
+        finally:
+            with self._lock:
+                self._counters["exported" if result == SpanExportResult.SUCCESS else "failed"] += len(spans)
+
+    def shutdown(self) -> None:
+        self.exporter.shutdown()
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        return self.exporter.force_flush(timeout_millis)
+
+
+class DroppingSpanQueue(deque):
+    """
+    Queue of a batch processor: appending to it when full drops the oldest span, as the
+    plain deque does, but the drop is counted. The export thread pops under the same
+    lock, so a span taken for export is never counted as dropped.
+    """
+
+    def __init__(self, maxlen: int, on_drop):
+        super().__init__((), maxlen)
+        self._on_drop = on_drop
+        self._lock = threading.Lock()
+
+    def appendleft(self, span) -> None:
+        with self._lock:
+            if len(self) == self.maxlen:
+                self._on_drop()
+            super().appendleft(span)
+
+    def pop(self):
+        with self._lock:
+            return super().pop()
+
+
+class LangfuseTracerProvider(TracerProvider):
+    """
+    Tracer provider for the Langfuse client. The span processor Langfuse registers is
+    kept (it filters out spans of other projects and of blocked instrumentation scopes,
+    and batches the export in its own thread); the provider bounds its queue, counts
+    what it exports, fails to export or drops, and keeps a handle on it for the flush
+    on shutdown.
+    """
+
+    def __init__(self, max_queue_size: int = TRACING_QUEUE_SIZE, **kwargs):
+        super().__init__(**kwargs)
+        self.max_queue_size = max_queue_size
+        self.processor: Optional[BatchSpanProcessor] = None
+        self.counters = {"exported": 0, "failed": 0, "dropped": 0}
+        self._counters_lock = threading.Lock()
+
+    def add_span_processor(self, span_processor: SpanProcessor) -> None:
+        if self.processor is None and isinstance(span_processor, BatchSpanProcessor):
+            self.processor = span_processor
+            self._instrument(span_processor)
+        super().add_span_processor(span_processor)
+
+    def _instrument(self, processor: BatchSpanProcessor) -> None:
+        """
+        Langfuse builds its processor without a queue size, so the bound is set on the
+        batch processor behind it (opentelemetry-sdk >= 1.34), whose queue drops the
+        oldest span when full.
+        """
+        batch = getattr(processor, "_batch_processor", None)
+        if batch is None or not hasattr(batch, "_queue"):
+            logger.warning("Unsupported OpenTelemetry SDK: tracing queue bound and counters unavailable")
+            return
+        batch._max_queue_size = self.max_queue_size
+        batch._queue = DroppingSpanQueue(self.max_queue_size, self._count_drop)
+        batch._exporter = CountingSpanExporter(batch._exporter, self.counters, self._counters_lock)
+
+    def _count_drop(self) -> None:
+        with self._counters_lock:
+            self.counters["dropped"] += 1
+
+    def queued(self) -> int:
+        """Spans waiting in the processor's queue."""
+        batch = getattr(self.processor, "_batch_processor", None)
+        return len(batch._queue) if batch is not None and hasattr(batch, "_queue") else 0
+
+
+class TracingService:
+    """Sampled Langfuse tracing with background export."""
+
+    def __init__(self, enabled: bool = TRACING_ENABLED, sampler: Optional[TraceSampler] = None,
+                 blocked_scopes: Sequence[str] = TRACING_BLOCKED_SCOPES):
+        self.enabled = enabled
+        self.sampler = sampler or TraceSampler()
+        self.blocked_scopes = list(blocked_scopes)
+        self.provider: Optional[LangfuseTracerProvider] = None
+        self._client = None
+
+    def start(self) -> bool:
+        """
+        Create the Langfuse client once, with its batching settings and a tracer provider
+        of its own. Called on app startup; otherwise the first sampled request does it.
+        """
+        if self._client is not None:
+            return self.enabled
+        if not self.enabled:
+            return False
+        try:
+            from langfuse import Langfuse
+
+            self.provider = LangfuseTracerProvider()
+            if isinstance(otel_trace_api.get_tracer_provider(), otel_trace_api.ProxyTracerProvider):
+                # Langfuse flushes through the global provider
+                otel_trace_api.set_tracer_provider(self.provider)
+            self._client = Langfuse(
+                tracer_provider=self.provider,
+                timeout=TRACING_EXPORT_TIMEOUT,
+                flush_at=TRACING_EXPORT_BATCH,
+                flush_interval=TRACING_EXPORT_INTERVAL,
+                blocked_instrumentation_scopes=self.blocked_scopes,
+            )
+        except Exception as e:
+            logger.warning(f"Langfuse tracing unavailable: {e}")
+            self.enabled = False
+            return False
+        if self.provider.processor is None:
+            # Langfuse disables itself without credentials: skip the handlers altogether
+            logger.info("Langfuse tracing disabled (client not configured)")
+            self.enabled = False
+            return False
+        return True
+
+    def callbacks_for(self, subject: Optional[str], tags: Sequence[str] = ()) -> List[Any]:
+        """
+        LangChain callbacks for one request: a Langfuse handler if the request is sampled,
+        otherwise none.
+        """
+        if not self.enabled or not self.sampler.should_trace(subject, tags):
+            return []
+        if not self.start():
+            return []
+        from langfuse.langchain import CallbackHandler
+        return [CallbackHandler()]
+
+    def stats(self) -> Dict[str, Any]:
+        """Sampling counters, export counters and export settings."""
+        counters = dict(self.provider.counters) if self.provider else {"exported": 0, "failed": 0, "dropped": 0}
+        return {
+            "enabled": self.enabled,
+            "default_sample_rate": self.sampler.default_rate,
+            "sample_rates": dict(self.sampler.rates),
+            "sampled": self.sampler.sampled,
+            "skipped": self.sampler.skipped,
+            "export": {
+                **counters,
+                "queued": self.provider.queued() if self.provider else 0,
+                "queue_size": TRACING_QUEUE_SIZE,
+                "batch_size": TRACING_EXPORT_BATCH,
+                "interval": TRACING_EXPORT_INTERVAL,
+                "blocked_scopes": self.blocked_scopes,
+            },
+        }
+
+    def shutdown(self, timeout: float = TRACING_SHUTDOWN_TIMEOUT) -> None:
+        """Flush pending spans (bounded wait) and stop the export thread. Call on app shutdown."""
+        processor = self.provider.processor if self.provider else None
+        if processor is None:
+            return
+        try:
+            processor.force_flush(int(timeout * 1000))
+            self.provider.shutdown()
+        except Exception as e:
+            logger.warning(f"Trace flush on shutdown failed: {e}")
+
+
+# Global tracing instance
+tracing = TracingService()
@@ -5,14 +5,25 @@ This module provides:
 - User anonymization utilities
 - Text processing and sanitization
 - Query analysis and classification
+- Token counting for prompt budgeting
 - Common utility operations
 """
 
 import hashlib
 import logging
+import os
+import re
+import unicodedata
 
 logger = logging.getLogger(__name__)
 
+# Encoding used to approximate LLM token counts (Gemini/Phi-3 tokenizers are not
+# available locally; cl100k_base is close enough for budgeting purposes)
+TOKENIZER_ENCODING = os.getenv("TOKENIZER_ENCODING", "cl100k_base")
+
+_encoding = None
+_encoding_failed = False
+
 
 # --- User Anonymization ---
 
@@ -86,6 +97,75 @@ def truncate_text(text: str, max_length: int, suffix: str = "...") -> str:
     return text[:max_length - len(suffix)] + suffix
 
 
+def normalize_text(text: str) -> str:
+    """
+    Normalize text for matching: lowercase, no accents or punctuation, single spaces.
+    
+    Args:
+        text: Text to normalize
+        
+    Returns:
+        Normalized text
+    """
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+
+# --- Token Counting ---
+
+def _get_encoding():
+    """Load the tiktoken encoding once; fall back to a heuristic if unavailable."""
+    global _encoding, _encoding_failed
+    if _encoding is None and not _encoding_failed:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+        except Exception as e:
+            _encoding_failed = True
+            logger.warning(f"tiktoken unavailable, using character-based token estimate: {e}")
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """
+    Count (approximately) the LLM tokens in a text.
+    
+    Args:
+        text: Text to measure
+        
+    Returns:
+        Number of tokens (tiktoken if available, otherwise ~4 characters per token)
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return max(1, len(text) // 4)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    Cut a text to at most `max_tokens` tokens (same tokenizer as `count_tokens`).
+    
+    Args:
+        text: Text to cut
+        max_tokens: Maximum number of tokens to keep
+        
+    Returns:
+        The text itself if it fits, otherwise its longest prefix within the budget
+    """
+    if max_tokens <= 0 or not text:
+        return ""
+    encoding = _get_encoding()
+    if encoding is not None:
+        tokens = encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+    return text[:max_tokens * 4]
+
+
 # --- Query Analysis ---
 
 def classify_query_type(query: str) -> str:
@@ -0,0 +1,64 @@
+import httpx
+import pytest
+from fastapi import FastAPI
+from app.routes import admin
+
+
+def _client():
+    app = FastAPI()
+    app.include_router(admin.router)
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+
+@pytest.mark.asyncio
+async def test_admin_endpoints_are_disabled_without_a_configured_token(monkeypatch):
+    """Test /admin/* answers 404 while ADMIN_TOKEN is not set, even with a token header"""
+    monkeypatch.setattr(admin, "ADMIN_TOKEN", "")
+
+    async with _client() as client:
+        assert (await client.get("/admin/admission")).status_code == 404
+        response = await client.post("/admin/storage/maintenance?full=true", headers={"X-Admin-Token": ""})
+
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_admin_endpoints_require_the_admin_token(monkeypatch):
+    """Test maintenance only runs with the right X-Admin-Token header"""
+    monkeypatch.setattr(admin, "ADMIN_TOKEN", "s3cret-token")
+    runs = []
+
+    async def run_once(graph, full=False):
+        runs.append(full)
+        return {"backend": "sqlite", "threads": 0}
+
+    monkeypatch.setattr(admin.checkpoint_maintenance, "run_once", run_once)
+
+    async with _client() as client:
+        missing = await client.post("/admin/storage/maintenance?full=true")
+        wrong = await client.post("/admin/storage/maintenance?full=true", headers={"X-Admin-Token": "guess"})
+        allowed = await client.post("/admin/storage/maintenance?full=true",
+                                    headers={"X-Admin-Token": "s3cret-token"})
+        stats = await client.get("/admin/admission", headers={"X-Admin-Token": "s3cret-token"})
+
+    assert (missing.status_code, wrong.status_code) == (401, 401)
+    assert allowed.status_code == 200 and allowed.json() == {"backend": "sqlite", "threads": 0}
+    assert runs == [True]
+    assert stats.status_code == 200 and "running" in stats.json()
+
+
+@pytest.mark.asyncio
+async def test_answer_cache_endpoints_require_the_admin_token(monkeypatch):
+    """Test the answer cache can only be inspected or invalidated with the admin token"""
+    monkeypatch.setattr(admin, "ADMIN_TOKEN", "s3cret-token")
+    invalidated = []
+    monkeypatch.setattr(admin.answer_cache, "invalidate", lambda subject: invalidated.append(subject) or 3)
+
+    async with _client() as client:
+        anonymous = await client.delete("/admin/cache/IA")
+        stats = await client.get("/admin/cache/stats")
+        allowed = await client.delete("/admin/cache/IA", headers={"X-Admin-Token": "s3cret-token"})
+
+    assert (anonymous.status_code, stats.status_code) == (401, 401)
+    assert allowed.json() == {"subject": "ia", "entries_removed": 3}
+    assert invalidated == ["ia"]
@@ -0,0 +1,122 @@
+import asyncio
+import pytest
+from datetime import datetime, timezone
+from app.domain.admission import (
+    AdmissionController, AdmissionRejectedError, LTIPriority, PRIORITY_DEFAULT, PRIORITY_LTI
+)
+
+
+@pytest.mark.asyncio
+async def test_runs_are_capped_globally_and_per_subject():
+    """Test a busy subject queues its runs while another subject still gets a free slot"""
+    controller = AdmissionController(max_concurrent=3, max_per_subject=2, queue_size=4, queue_timeout=1.0)
+    running, peaks = {}, []
+
+    async def run(subject):
+        async with controller.slot(subject):
+            running[subject] = running.get(subject, 0) + 1
+            peaks.append((sum(running.values()), running[subject]))
+            await asyncio.sleep(0.02)
+            running[subject] -= 1
+
+    await asyncio.gather(*(run("ia") for _ in range(4)), run("poo"), run("poo"))
+
+    assert max(total for total, _ in peaks) == 3
+    assert max(per_subject for _, per_subject in peaks) == 2
+    stats = controller.get_stats()
+    assert stats["admitted"] == 6 and stats["running"] == 0 and stats["running_by_subject"] == {}
+
+
+@pytest.mark.asyncio
+async def test_lti_requests_go_first_and_take_the_place_of_others_when_full():
+    """Test LTI requests leave the queue first and shed the newest default request from a full queue"""
+    controller = AdmissionController(max_concurrent=1, max_per_subject=1, queue_size=2, queue_timeout=1.0)
+    await controller.acquire("ia")
+    order = []
+
+    async def wait(name, priority):
+        await controller.acquire("ia", priority)
+        order.append(name)
+        controller.release("ia")
+
+    first = asyncio.create_task(wait("default-1", PRIORITY_DEFAULT))
+    shed = asyncio.create_task(wait("default-2", PRIORITY_DEFAULT))
+    await asyncio.sleep(0)
+    assert controller.would_reject("ia", PRIORITY_DEFAULT)
+    assert not controller.would_reject("ia", PRIORITY_LTI)
+
+    with pytest.raises(AdmissionRejectedError):
+        await controller.acquire("ia", PRIORITY_DEFAULT)
+    lti = asyncio.create_task(wait("lti", PRIORITY_LTI))
+    await asyncio.sleep(0)
+    controller.release("ia")
+    await asyncio.gather(first, lti)
+
+    with pytest.raises(AdmissionRejectedError) as rejected:
+        await shed
+    assert rejected.value.retry_after >= 1
+    assert order == ["lti", "default-1"]
+    assert controller.get_stats()["rejected"] == 1 and controller.get_stats()["shed"] == 1
+
+
+@pytest.mark.asyncio
+async def test_wait_for_a_slot_is_bounded():
+    """Test a request that gets no slot in time is rejected and leaves the queue"""
+    controller = AdmissionController(max_concurrent=1, max_per_subject=1, queue_size=4, queue_timeout=0.05)
+    await controller.acquire("ia")
+
+    with pytest.raises(AdmissionRejectedError):
+        await controller.acquire("ia")
+    controller.release("ia")
+
+    stats = controller.get_stats()
+    assert stats["timeouts"] == 1 and stats["waiting"] == {"lti": 0, "default": 0} and stats["running"] == 0
+
+
+@pytest.mark.asyncio
+async def test_only_live_lti_sessions_get_priority():
+    """Test a bogus X-Session-Token gets the default priority and validations are cached briefly"""
+    now = [1000.0]
+    expires_at = datetime.fromtimestamp(1030, tz=timezone.utc).replace(tzinfo=None)
+    sessions = {"token-moodle": {"session_token": "token-moodle", "expires_at": expires_at}}
+    lookups = []
+
+    async def lookup(token):
+        lookups.append(token)
+        return sessions.get(token)
+
+    priority = LTIPriority(lookup, ttl=60, clock=lambda: now[0])
+
+    assert await priority.resolve("x") == PRIORITY_DEFAULT
+    assert await priority.resolve("x") == PRIORITY_DEFAULT
+    assert await priority.resolve(None) == PRIORITY_DEFAULT
+    assert await priority.resolve("token-moodle") == PRIORITY_LTI
+    assert await priority.resolve("token-moodle") == PRIORITY_LTI
+    assert lookups == ["x", "token-moodle"]
+
+    now[0] = 1031  # the session expired before the cache TTL: validated again
+    del sessions["token-moodle"]
+    assert await priority.resolve("token-moodle") == PRIORITY_DEFAULT
+
+
+
+@pytest.mark.asyncio
+async def test_lti_lookup_is_bounded_and_failures_are_not_retried_at_once():
+    """Test a hanging session lookup gives the default priority quickly and pauses lookups for a while"""
+    now = [1000.0]
+    calls = []
+
+    async def hanging(token):
+        calls.append(token)
+        await asyncio.sleep(10)
+
+    priority = LTIPriority(hanging, lookup_timeout=0.01, error_ttl=5, clock=lambda: now[0])
+
+    assert await asyncio.wait_for(priority.resolve("token-moodle"), 1) == PRIORITY_DEFAULT
+    assert await priority.resolve("otro-token") == PRIORITY_DEFAULT
+    assert calls == ["token-moodle"]
+    assert priority.stats["errors"] == 1 and priority.stats["skipped"] == 1
+
+    now[0] += 5
+    await priority.resolve("token-moodle")
+    assert calls == ["token-moodle", "token-moodle"]
@@ -0,0 +1,110 @@
+import pytest
+from unittest.mock import AsyncMock, patch
+from app.domain.answer_cache import SemanticAnswerCache, is_cacheable_question
+
+RESULT = {"response": "La evaluación continua vale un 60%", "sources": ["guia_docente_ia"], "model_used": "base"}
+
+
+@pytest.fixture
+def mock_rag_client():
+    """RAG client with a fixed document version and a toy 2-d embedding"""
+    with patch("app.domain.answer_cache.rag_client") as client:
+        client.aget_subject_version = AsyncMock(return_value="v1")
+        client.aembed_query = AsyncMock(return_value=[1.0, 0.0])
+        yield client
+
+
+@pytest.mark.asyncio
+async def test_similar_question_hits_cache(mock_rag_client):
+    """Test a paraphrased question above the threshold returns the stored answer"""
+    cache = SemanticAnswerCache(enabled=True, threshold=0.9)
+    cached, probe = await cache.lookup("ia", "¿Cómo se evalúa la asignatura?")
+    assert cached is None
+    assert cache.store(probe, RESULT)
+
+    mock_rag_client.aembed_query.return_value = [0.99, 0.05]
+    cached, probe = await cache.lookup("ia", "¿Qué porcentaje tiene cada parte de la evaluación?")
+
+    assert cached == RESULT
+    assert probe is None
+    stats = cache.stats()["subjects"]["ia"]
+    assert stats["hits"] == 1 and stats["misses"] == 1 and stats["hit_rate"] == 0.5
+
+
+@pytest.mark.asyncio
+async def test_exact_question_skips_embedding(mock_rag_client):
+    """Test the same question (ignoring case and accents) is served without embedding it again"""
+    cache = SemanticAnswerCache(enabled=True)
+    _, probe = await cache.lookup("ia", "¿Quién imparte la asignatura?")
+    cache.store(probe, RESULT)
+    mock_rag_client.aembed_query.reset_mock()
+
+    cached, _ = await cache.lookup("ia", "quien imparte la asignatura")
+
+    assert cached == RESULT
+    mock_rag_client.aembed_query.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_dissimilar_question_misses(mock_rag_client):
+    """Test a question below the threshold is a miss"""
+    cache = SemanticAnswerCache(enabled=True, threshold=0.9)
+    _, probe = await cache.lookup("ia", "¿Cómo se evalúa la asignatura?")
+    cache.store(probe, RESULT)
+
+    mock_rag_client.aembed_query.return_value = [0.0, 1.0]
+    cached, probe = await cache.lookup("ia", "¿Qué es un algoritmo genético?")
+
+    assert cached is None
+    assert probe is not None
+
+
+@pytest.mark.asyncio
+async def test_document_version_change_invalidates_subject(mock_rag_client):
+    """Test entries are dropped when the subject's documents change"""
+    cache = SemanticAnswerCache(enabled=True, version_ttl=0)
+    _, probe = await cache.lookup("ia", "¿Cómo se evalúa la asignatura?")
+    cache.store(probe, RESULT)
+
+    mock_rag_client.aget_subject_version.return_value = "v2"
+    cached, _ = await cache.lookup("ia", "¿Cómo se evalúa la asignatura?")
+
+    assert cached is None
+    assert cache.stats()["subjects"]["ia"]["invalidations"] == 1
+
+
+@pytest.mark.asyncio
+async def test_ungrounded_or_follow_up_answers_are_not_cached(mock_rag_client):
+    """Test answers without sources and context-dependent questions are never stored"""
+    cache = SemanticAnswerCache(enabled=True)
+    _, probe = await cache.lookup("ia", "¿Cómo se evalúa la asignatura?")
+    assert not cache.store(probe, {**RESULT, "sources": []})
+
+    cached, probe = await cache.lookup("ia", "¿y podrías darme otro ejemplo?")
+    assert cached is None and probe is None
+    assert not is_cacheable_question("¿y eso?")
+
+
+def test_bypass_is_counted():
+    """Test bypassed requests show up in the metrics"""
+    cache = SemanticAnswerCache(enabled=True)
+    cache.record_bypass("ia")
+    assert cache.stats()["bypassed"] == 1
+
+
+@pytest.mark.asyncio
+async def test_most_similar_entry_wins_after_new_entries(mock_rag_client):
+    """Test the lookup picks the closest stored question, including one stored after a previous lookup"""
+    cache = SemanticAnswerCache(enabled=True, threshold=0.9)
+    _, probe = await cache.lookup("ia", "¿Cómo se evalúa la asignatura?")
+    cache.store(probe, RESULT)
+
+    mock_rag_client.aembed_query.return_value = [0.0, 1.0]
+    _, probe = await cache.lookup("ia", "¿Quién imparte la asignatura?")
+    teachers = {**RESULT, "response": "La imparte el profesor del grupo A"}
+    assert cache.store(probe, teachers)
+
+    mock_rag_client.aembed_query.return_value = [0.1, 0.99]
+    cached, _ = await cache.lookup("ia", "¿Qué profesores dan la asignatura?")
+
+    assert cached == teachers
@@ -0,0 +1,148 @@
+import json
+import pytest
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage, ToolMessage
+from starlette.requests import Request
+from app.core.models import ChatRequest
+from app.routes import chat
+from domain import query_logic  # the module the routes import (pythonpath=app)
+
+TOOL_CALL = {"name": "rag_search", "args": {"query": "algoritmo voraz"}, "id": "call-1"}
+
+
+class FakeGraph:
+    """Compiled graph stand-in whose astream replays (mode, chunk) steps; an exception step is raised"""
+
+    def __init__(self, steps):
+        self.steps = steps
+
+    async def astream(self, input_data, config=None, stream_mode=None):
+        for step in self.steps:
+            if isinstance(step, Exception):
+                raise step
+            yield step
+
+
+def agent_run(answer_tokens):
+    """Steps of a run where the agent calls rag_search and then writes its answer token by token"""
+    question = HumanMessage(content="¿Qué es un algoritmo voraz?")
+    call = AIMessage(content="", tool_calls=[TOOL_CALL])
+    tool = ToolMessage(content="Tema 3: algoritmos voraces", tool_call_id="call-1")
+    answer = AIMessage(content="".join(answer_tokens))
+    return [
+        ("updates", {"agent": {"messages": [call]}}),
+        ("values", {"messages": [question, call]}),
+        ("updates", {"tools": {"messages": [tool]}}),
+        ("values", {"messages": [question, call, tool]}),
+        ("messages", (AIMessageChunk(content="(payload de la herramienta)"), {"langgraph_node": "tools"})),
+        *(("messages", (AIMessageChunk(content=token), {"langgraph_node": "agent"})) for token in answer_tokens),
+        ("updates", {"agent": {"messages": [answer]}}),
+        ("values", {"messages": [question, call, tool, answer],
+                    "retrieved_docs": [Document(page_content="...", metadata={"source": "tema3.pdf"})]}),
+    ]
+
+
+@pytest.fixture
+def graph(monkeypatch):
+    def install(steps):
+        monkeypatch.setattr(query_logic, "rag_graph", FakeGraph(steps))
+    return install
+
+
+@pytest.fixture
+def analytics(monkeypatch):
+    """Record the analytics calls of the endpoint (the session lookup is faked too)"""
+    calls = []
+    monkeypatch.setattr(chat, "_open_session", _fake_session)
+
+    async def log_chat_analytics(**kwargs):
+        calls.append(kwargs)
+
+    monkeypatch.setattr(chat, "_log_chat_analytics", log_chat_analytics)
+    return calls
+
+
+async def _fake_session(email, subject):
+    return "sesion-1"
+
+
+def _request():
+    return Request({"type": "http", "method": "POST", "path": "/chat/stream", "headers": [],
+                    "query_string": b"", "client": ("127.0.0.1", 50000)})
+
+
+async def _read_events(response, analytics):
+    """Parse the SSE body into (event, data, analytics calls queued by the time it was received)"""
+    events = []
+    async for chunk in response.body_iterator:
+        event_line, data_line = chunk.strip().split("\n")
+        events.append((event_line.removeprefix("event: "), json.loads(data_line.removeprefix("data: ")),
+                       len(analytics)))
+    return events
+
+
+@pytest.mark.asyncio
+async def test_stream_emits_tool_progress_then_tokens_then_done(graph):
+    """Test the events follow tool_call -> tool_result -> token* -> done, without tool node text"""
+    graph(agent_run(["Un algoritmo ", "que elige ", "el óptimo local"]))
+
+    events = [event async for event in query_logic.stream_query_rag(
+        "¿Qué es un algoritmo voraz?", subject="ia", email="stream@ugr.es", use_cache=False)]
+
+    assert [event["type"] for event in events] == ["tool_call", "tool_result", "token", "token", "token", "done"]
+    assert events[0] == {"type": "tool_call", "tool": "rag_search", "args": {"query": "algoritmo voraz"}}
+    assert events[1] == {"type": "tool_result", "tool": "rag_search"}
+    assert "".join(event["content"] for event in events[2:5]) == events[5]["response"]
+    assert events[5]["sources"] == ["tema3.pdf"] and events[5]["cached"] is False
+
+
+@pytest.mark.asyncio
+async def test_endpoint_queues_analytics_only_after_done(graph, analytics):
+    """Test the SSE response carries every event and the analytics are queued once done is sent"""
+    graph(agent_run(["Un algoritmo ", "voraz"]))
+    chat_request = ChatRequest(message="¿Qué es un algoritmo voraz?", subject="IA", email="sse-ok@ugr.es")
+
+    response = await chat.chat_stream_endpoint(_request(), chat_request)
+    events = await _read_events(response, analytics)
+
+    assert response.media_type == "text/event-stream"
+    assert [name for name, _, _ in events] == ["tool_call", "tool_result", "token", "token", "done"]
+    assert [queued for _, _, queued in events] == [0, 0, 0, 0, 0]
+    done = events[4][1]
+    assert done["response"] == "🤖: Un algoritmo voraz" and done["session_id"] == "sesion-1"
+    (call,) = analytics
+    assert call["response_text"] == "Un algoritmo voraz" and call["sources"] == ["tema3.pdf"]
+
+
+@pytest.mark.asyncio
+async def test_failure_mid_stream_sends_one_error_and_no_done(graph, analytics):
+    """Test an exception after the first token ends the stream with a single error event and no analytics"""
+    steps = agent_run(["Un algoritmo ", "voraz"])
+    graph(steps[:6] + [RuntimeError("vLLM connection reset")])
+    chat_request = ChatRequest(message="¿Qué es un algoritmo voraz?", subject="ia", email="sse-error@ugr.es")
+
+    response = await chat.chat_stream_endpoint(_request(), chat_request)
+    events = await _read_events(response, analytics)
+
+    assert [name for name, _, _ in events] == ["tool_call", "tool_result", "token", "error"]
+    assert "vLLM" not in events[-1][1]["detail"]
+    assert analytics == []
+
+
+@pytest.mark.asyncio
+async def test_setup_failure_before_the_stream_does_not_hold_the_conversation(graph, analytics, monkeypatch):
+    """Test a failing session backend does not leave the conversation turn taken"""
+    async def session_backend_down(email, subject):
+        raise ConnectionError("MongoDB unavailable")
+
+    monkeypatch.setattr(chat, "_open_session", session_backend_down)
+    chat_request = ChatRequest(message="¿Qué es un algoritmo voraz?", subject="ia", email="sse-down@ugr.es")
+
+    with pytest.raises(ConnectionError):
+        await chat.chat_stream_endpoint(_request(), chat_request)
+
+    assert query_logic.conversation_guard.get_stats()["active_conversations"] == 0
+    monkeypatch.setattr(chat, "_open_session", _fake_session)
+    graph(agent_run(["voraz"]))
+    response = await chat.chat_stream_endpoint(_request(), chat_request)
+    assert [name for name, _, _ in await _read_events(response, analytics)][-1] == "done"
@@ -0,0 +1,360 @@
+import operator
+import pytest
+from types import SimpleNamespace
+from typing import Annotated
+from pymongo import ReplaceOne
+from typing_extensions import TypedDict
+from langgraph.graph import StateGraph
+from app.domain.checkpointer import MongoSaver, ThreadedSqliteSaver, connect_sqlite, open_async_sqlite_saver
+
+
+class CounterState(TypedDict):
+    total: Annotated[int, operator.add]
+
+
+def _counter_graph(saver):
+    """Two-node graph: every run writes several checkpoints to the thread"""
+    builder = StateGraph(CounterState)
+    builder.add_node("first", lambda state: {"total": 1})
+    builder.add_node("second", lambda state: {"total": 1})
+    builder.set_entry_point("first")
+    builder.add_edge("first", "second")
+    return builder.compile(checkpointer=saver)
+
+
+def _count_checkpoints(conn, thread_id):
+    return conn.execute("SELECT COUNT(*) FROM checkpoints WHERE thread_id = ?", (thread_id,)).fetchone()[0]
+
+
+@pytest.mark.asyncio
+async def test_sqlite_saver_uses_wal_and_keeps_last_checkpoints(tmp_path):
+    """Test compaction keeps only the latest K checkpoints per thread without losing state"""
+    conn = connect_sqlite(str(tmp_path / "checkpoints.sqlite"))
+    saver = ThreadedSqliteSaver(conn, keep_last=3)
+    graph = _counter_graph(saver)
+    config = {"configurable": {"thread_id": "alumno-ia"}}
+
+    for _ in range(5):
+        await graph.ainvoke({"total": 0}, config)
+    assert _count_checkpoints(conn, "alumno-ia") == 20
+
+    deleted = await saver.acompact()
+
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert deleted == 17
+    assert _count_checkpoints(conn, "alumno-ia") == 3
+    assert (await graph.aget_state(config)).values["total"] == 10
+    await graph.ainvoke({"total": 0}, config)
+    assert (await graph.aget_state(config)).values["total"] == 12
+
+
+@pytest.mark.asyncio
+async def test_full_compaction_covers_threads_written_by_other_processes(tmp_path):
+    """Test a full compaction prunes threads that this process did not write"""
+    path = str(tmp_path / "checkpoints.sqlite")
+    writer = ThreadedSqliteSaver(connect_sqlite(path), keep_last=0)
+    for thread in ("a", "b"):
+        await _counter_graph(writer).ainvoke({"total": 0}, {"configurable": {"thread_id": thread}})
+
+    compactor = ThreadedSqliteSaver(connect_sqlite(path), keep_last=1)
+    assert await compactor.acompact() == 0
+    assert await compactor.acompact(full=True) == 6
+
+
+@pytest.mark.asyncio
+async def test_async_sqlite_saver_compacts(tmp_path):
+    """Test the aiosqlite backend runs the graph and prunes old checkpoints"""
+    saver = await open_async_sqlite_saver(str(tmp_path / "checkpoints.sqlite"))
+    saver.keep_last = 2
+    graph = _counter_graph(saver)
+    config = {"configurable": {"thread_id": "alumno-ia"}}
+    try:
+        await graph.ainvoke({"total": 0}, config)
+        await graph.ainvoke({"total": 0}, config)
+
+        assert await saver.acompact() == 6
+        assert (await graph.aget_state(config)).values["total"] == 4
+    finally:
+        await saver.conn.close()
+
+
+@pytest.mark.asyncio
+async def test_expire_idle_deletes_whole_threads(tmp_path):
+    """Test idle threads lose every checkpoint and write while active threads are kept"""
+    conn = connect_sqlite(str(tmp_path / "checkpoints.sqlite"))
+    saver = ThreadedSqliteSaver(conn, keep_last=0, thread_ttl=3600)
+    graph = _counter_graph(saver)
+    for thread in ("antiguo", "reciente"):
+        await graph.ainvoke({"total": 0}, {"configurable": {"thread_id": thread}})
+    await saver.aflush_activity()
+    conn.execute("UPDATE thread_activity SET last_activity = 0 WHERE thread_id = 'antiguo'")
+    conn.commit()
+
+    assert await saver.aexpire_idle() == ["antiguo"]
+
+    assert _count_checkpoints(conn, "antiguo") == 0
+    assert conn.execute("SELECT COUNT(*) FROM writes WHERE thread_id = 'antiguo'").fetchone()[0] == 0
+    assert _count_checkpoints(conn, "reciente") == 4
+    assert saver.expiry_stats["threads_deleted"] == 1
+
+
+def test_idle_expiry_sees_recent_writes_of_other_workers(tmp_path):
+    """Test a thread another worker keeps writing is not expired by this worker's maintenance"""
+    path = str(tmp_path / "checkpoints.sqlite")
+    maintenance = ThreadedSqliteSaver(connect_sqlite(path), keep_last=0, thread_ttl=3600)
+    worker = ThreadedSqliteSaver(connect_sqlite(path), keep_last=0, thread_ttl=3600)
+    config = {"configurable": {"thread_id": "compartido"}}
+    _counter_graph(worker).invoke({"total": 0}, config)
+    # Idle for a long time, with its activity last saved by the worker back then
+    worker.conn.execute("UPDATE thread_activity SET last_activity = 0")
+    worker.conn.commit()
+    worker._persisted["compartido"] = 0.0
+
+    _counter_graph(worker).invoke({"total": 0}, config)
+
+    assert maintenance.expire_idle() == []
+    assert _count_checkpoints(maintenance.conn, "compartido") == 8
+
+
+@pytest.mark.asyncio
+async def test_vacuum_reclaims_pages_and_reports_stats(tmp_path):
+    """Test deleted threads free pages that incremental vacuum returns to the filesystem"""
+    conn = connect_sqlite(str(tmp_path / "checkpoints.sqlite"))
+    saver = ThreadedSqliteSaver(conn, keep_last=0)
+    graph = _counter_graph(saver)
+    for thread in range(30):
+        await graph.ainvoke({"total": 0}, {"configurable": {"thread_id": f"hilo-{thread}"}})
+    for thread in range(30):
+        await saver.adelete_thread(f"hilo-{thread}")
+
+    before = await saver.astorage_stats()
+    freed = await saver.avacuum()
+    after = await saver.astorage_stats()
+
+    assert before["incremental_vacuum"] is True
+    assert before["freelist_pages"] > 0
+    assert freed == before["freelist_pages"]
+    assert after["page_count"] < before["page_count"]
+    assert after["threads"] == 0 and after["checkpoints"] == 0
+
+
+def test_threads_without_activity_are_adopted_once_at_setup(tmp_path):
+    """Test threads missing from thread_activity are adopted when the saver starts, not on every flush"""
+    path = str(tmp_path / "checkpoints.sqlite")
+    writer = ThreadedSqliteSaver(connect_sqlite(path), keep_last=0)
+    for thread in ("a", "b"):
+        _counter_graph(writer).invoke({"total": 0}, {"configurable": {"thread_id": thread}})
+    writer.conn.execute("DELETE FROM thread_activity")  # written before activity was tracked
+    writer.conn.commit()
+
+    conn = connect_sqlite(path)
+    saver = ThreadedSqliteSaver(conn)
+    saver.setup()
+    assert sorted(row[0] for row in conn.execute("SELECT thread_id FROM thread_activity")) == ["a", "b"]
+
+    statements = []
+    conn.set_trace_callback(statements.append)
+    saver._flush_activity()
+    assert statements and not any("FROM checkpoints" in statement for statement in statements)
+
+
+# --- MongoDB ---
+
+class FakeMongoCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, key, direction=None):
+        keys = [(key, direction)] if isinstance(key, str) else key
+        for field, order in reversed(keys):
+            self.docs.sort(key=lambda doc: doc[field], reverse=order == -1)
+        return self
+
+    def limit(self, count):
+        self.docs = self.docs[:count]
+        return self
+
+    def __iter__(self):
+        return iter(self.docs)
+
+
+class FakeMongoCollection:
+    """pymongo collection stand-in for the queries, updates and bulk writes used by MongoSaver"""
+
+    def __init__(self, database):
+        self.database = database
+        self.docs = []
+        self.calls = []
+
+    @staticmethod
+    def _matches(doc, query):
+        for field, condition in query.items():
+            value = doc.get(field)
+            if isinstance(condition, dict):
+                if "$lt" in condition and not (value is not None and value < condition["$lt"]):
+                    return False
+                if "$nin" in condition and value in condition["$nin"]:
+                    return False
+            elif value != condition:
+                return False
+        return True
+
+    def _upsert(self, query, replacement=None, update=None):
+        doc = next((doc for doc in self.docs if self._matches(doc, query)), None)
+        if replacement is not None:
+            if doc is not None:
+                self.docs.remove(doc)
+            self.docs.append(dict(replacement, **({"_id": query["_id"]} if "_id" in query else {})))
+            return
+        if doc is None:
+            doc = {**query, **update.get("$setOnInsert", {})}
+            self.docs.append(doc)
+        for field, value in update.get("$max", {}).items():
+            doc[field] = max(doc.get(field, value), value)
+
+    def create_index(self, keys, **kwargs):
+        pass
+
+    def find(self, query=None, projection=None):
+        self.calls.append("find")
+        return FakeMongoCursor([dict(doc) for doc in self.docs if self._matches(doc, query or {})])
+
+    def find_one(self, query, sort=None):
+        docs = list(self.find(query).sort(sort or []))
+        return docs[0] if docs else None
+
+    def replace_one(self, query, replacement, upsert=False):
+        self._upsert(query, replacement=replacement)
+
+    def bulk_write(self, operations, ordered=True):
+        self.calls.append("bulk_write")
+        for operation in operations:
+            if isinstance(operation, ReplaceOne):
+                self._upsert(operation._filter, replacement=operation._doc)
+            else:
+                self._upsert(operation._filter, update=operation._doc)
+
+    def delete_many(self, query):
+        deleted = [doc for doc in self.docs if self._matches(doc, query)]
+        self.docs = [doc for doc in self.docs if doc not in deleted]
+        return SimpleNamespace(deleted_count=len(deleted))
+
+    def delete_one(self, query):
+        self.delete_many(query)
+
+    def distinct(self, field):
+        self.calls.append("distinct")
+        return sorted({doc[field] for doc in self.docs})
+
+    def aggregate(self, pipeline):
+        (stage,) = pipeline
+        group = {name: ref[1:] for name, ref in stage["$group"]["_id"].items()}
+        keys = {tuple((name, doc[field]) for name, field in group.items()) for doc in self.docs}
+        return [{"_id": dict(key)} for key in keys]
+
+    def estimated_document_count(self):
+        return len(self.docs)
+
+    def count_documents(self, query):
+        return sum(1 for doc in self.docs if self._matches(doc, query))
+
+
+class FakeMongoDatabase(dict):
+    def __init__(self, name):
+        super().__init__()
+        self.name = name
+
+    def __missing__(self, collection):
+        self[collection] = FakeMongoCollection(self)
+        return self[collection]
+
+    def command(self, name):
+        return {"dataSize": 0, "storageSize": 0, "indexSize": 0}
+
+
+class FakeMongoClient(dict):
+    def __missing__(self, db_name):
+        self[db_name] = FakeMongoDatabase(db_name)
+        return self[db_name]
+
+
+@pytest.mark.asyncio
+async def test_mongo_saver_puts_gets_and_lists_checkpoints():
+    """Test the graph state round-trips through MongoDB and list honours order, before and limit"""
+    saver = MongoSaver(FakeMongoClient(), keep_last=0)
+    graph = _counter_graph(saver)
+    config = {"configurable": {"thread_id": "alumno-ia"}}
+
+    await graph.ainvoke({"total": 0}, config)
+    await graph.ainvoke({"total": 0}, config)
+
+    assert (await graph.aget_state(config)).values["total"] == 4
+    history = [item async for item in saver.alist(config)]
+    ids = [item.config["configurable"]["checkpoint_id"] for item in history]
+    assert len(ids) == 8 and ids == sorted(ids, reverse=True)
+    assert history[0].parent_config["configurable"]["checkpoint_id"] == ids[1]
+    assert history[-1].parent_config is None
+    assert [item.config for item in saver.list(config, before=history[1].config, limit=2)] == \
+        [item.config for item in history[2:4]]
+    assert [item.metadata["step"] for item in saver.list(config, filter={"source": "input"})] == [3, -1]
+    assert saver.get_tuple({"configurable": {**config["configurable"], "checkpoint_id": ids[3]}}).config == \
+        history[3].config
+    assert saver.writes.count_documents({"thread_id": "alumno-ia"}) > 0
+
+
+@pytest.mark.asyncio
+async def test_mongo_saver_prunes_old_checkpoints_and_their_writes():
+    """Test compaction keeps the last K checkpoints of each thread, drops orphan writes and keeps the state"""
+    saver = MongoSaver(FakeMongoClient(), keep_last=3)
+    graph = _counter_graph(saver)
+    config = {"configurable": {"thread_id": "alumno-ia"}}
+    for _ in range(3):
+        await graph.ainvoke({"total": 0}, config)
+
+    assert await saver.acompact() == 9
+
+    kept = {doc["checkpoint_id"] for doc in saver.checkpoints.docs}
+    assert len(kept) == 3
+    assert {doc["checkpoint_id"] for doc in saver.writes.docs} <= kept
+    assert (await graph.aget_state(config)).values["total"] == 6
+    assert saver.compaction_stats["checkpoints_deleted"] == 9
+
+
+@pytest.mark.asyncio
+async def test_mongo_saver_deletes_and_expires_whole_threads():
+    """Test delete_thread and idle expiry remove checkpoints, writes and activity of a thread only"""
+    saver = MongoSaver(FakeMongoClient(), keep_last=0)
+    saver.thread_ttl = 3600
+    graph = _counter_graph(saver)
+    for thread in ("borrado", "antiguo", "reciente"):
+        await graph.ainvoke({"total": 0}, {"configurable": {"thread_id": thread}})
+
+    await saver.adelete_thread("borrado")
+    await saver.aflush_activity()
+    next(doc for doc in saver.threads.docs if doc["_id"] == "antiguo")["last_activity"] = 0
+
+    assert await saver.aexpire_idle() == ["antiguo"]
+    for collection in (saver.checkpoints, saver.writes):
+        assert {doc["thread_id"] for doc in collection.docs} == {"reciente"}
+    assert [doc["_id"] for doc in saver.threads.docs] == ["reciente"]
+    stats = await saver.astorage_stats()
+    assert stats["threads"] == 1 and stats["expiry"]["threads_deleted"] == 1
+
+
+def test_mongo_saver_adopts_untracked_threads_once():
+    """Test threads without activity are adopted at setup and flushes do not scan the checkpoints"""
+    client = FakeMongoClient()
+    MongoSaver(client, keep_last=0).put(
+        {"configurable": {"thread_id": "previo", "checkpoint_ns": ""}},
+        {"v": 1, "id": "1", "ts": "", "channel_values": {}, "channel_versions": {}, "versions_seen": {}},
+        {}, {})
+    client["chatbot_checkpoints"]["checkpoint_threads"].docs.clear()  # written before activity was tracked
+    client["chatbot_checkpoints"]["checkpoints"].calls.clear()
+
+    saver = MongoSaver(client, keep_last=0)
+    saver.setup()
+    for _ in range(3):
+        saver._flush_activity()
+
+    assert [doc["_id"] for doc in saver.threads.docs] == ["previo"]
+    assert saver.checkpoints.calls.count("distinct") == 1
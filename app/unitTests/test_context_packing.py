@@ -0,0 +1,87 @@
+import pytest
+from unittest.mock import patch, AsyncMock
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage
+from app.domain.context_packing import drop_near_duplicates, fit_to_budget, merge_adjacent, pack_context
+from app.domain.graph import execute_tools
+from app.services.utils_service import count_tokens
+
+TEXT = ("La búsqueda local parte de una solución inicial y explora su vecindario. "
+        "En cada paso se sustituye la solución actual por un vecino mejor. "
+        "El algoritmo termina cuando ningún vecino mejora la solución, es decir, en un óptimo local. "
+        "El enfriamiento simulado acepta vecinos peores con una probabilidad que decrece con la temperatura.")
+
+
+def _chunk(source, index, start, end):
+    return Document(page_content=TEXT[start:end], metadata={"source": source, "id": f"{source}-{index}"})
+
+
+def test_merge_adjacent_joins_consecutive_chunks_without_repeating_overlap():
+    """Test consecutive chunks of the same source are merged and the shared overlap kept once"""
+    docs = [_chunk("tema2", 8, 120, len(TEXT)), _chunk("tema5", 1, 0, 60), _chunk("tema2", 7, 0, 150)]
+
+    merged, merges = merge_adjacent(docs)
+
+    assert merges == 1
+    assert [d.metadata["source"] for d in merged] == ["tema2", "tema5"]
+    assert merged[0].page_content == TEXT
+    assert merged[0].metadata["merged_chunks"] == 2
+
+
+def test_drop_near_duplicates_keeps_most_relevant_copy():
+    """Test a chunk repeated in another file is dropped"""
+    docs = [Document(page_content=TEXT, metadata={"source": "tema2"}),
+            Document(page_content=TEXT.replace("óptimo", "optimo"), metadata={"source": "copia_tema2"}),
+            Document(page_content="El algoritmo genético combina soluciones.", metadata={"source": "tema4"})]
+
+    kept, dropped = drop_near_duplicates(docs)
+
+    assert dropped == 1
+    assert [d.metadata["source"] for d in kept] == ["tema2", "tema4"]
+
+
+def test_fit_to_budget_truncates_the_last_document_that_fits_partially():
+    """Test documents are kept in relevance order and the overflowing one is cut"""
+    docs = [Document(page_content=TEXT, metadata={"source": str(i)}) for i in range(3)]
+    budget = count_tokens(TEXT) + 50
+
+    packed, used, truncated = fit_to_budget(docs, budget)
+
+    assert [d.metadata["source"] for d in packed] == ["0", "1"]
+    assert packed[1].metadata["truncated"] is True
+    assert truncated == 1
+    assert used <= budget
+
+
+def test_pack_context_reports_tokens_saved():
+    """Test the per-request statistics account for every dropped token"""
+    docs = [_chunk("tema2", 7, 0, 150), _chunk("tema2", 8, 120, len(TEXT)), _chunk("tema2", 7, 0, 150)]
+
+    packed, stats = pack_context(docs, budget=1000)
+
+    assert len(packed) == 1
+    assert stats["chunks_in"] == 3 and stats["chunks_out"] == 1
+    assert stats["tokens_out"] == count_tokens(TEXT)
+    assert stats["tokens_saved"] == stats["tokens_in"] - stats["tokens_out"] > 0
+
+
+@pytest.mark.asyncio
+@patch("app.domain.graph.rag_client")
+async def test_execute_tools_packs_retrieval_into_budget(mock_client):
+    """Test chroma_retriever results are packed with the budget from the graph config"""
+    docs = [Document(page_content=" ".join(f"concepto{i}_{j}" for j in range(40)), metadata={"source": f"tema{i}"})
+            for i in range(6)]
+    tokens = [count_tokens(d.page_content) for d in docs]
+    mock_client.asearch_documents = AsyncMock(return_value=(docs, [d.metadata["source"] for d in docs]))
+    state = {
+        "subject": "metaheuristicas",
+        "messages": [AIMessage(content="", tool_calls=[
+            {"name": "chroma_retriever", "args": {"pregunta": "búsqueda local"}, "id": "call_1"}
+        ])],
+    }
+
+    result = await execute_tools(state, {"configurable": {"context_token_budget": tokens[0] + tokens[1] + 10}})
+
+    assert result["retrieved_docs"] == docs[:2]
+    assert result["context_stats"]["chunks_in"] == 6
+    assert result["context_stats"]["tokens_saved"] == sum(tokens[2:])
@@ -0,0 +1,66 @@
+import asyncio
+import pytest
+from unittest.mock import patch
+from app.domain import query_logic
+from app.domain.conversation_guard import ConversationBusyError, ConversationGuard
+
+
+@pytest.mark.asyncio
+async def test_requests_on_one_conversation_run_one_at_a_time():
+    """Test different messages on the same thread are serialized and other threads are not"""
+    guard = ConversationGuard(timeout=1.0, max_pending=3)
+    running, overlaps = set(), []
+
+    async def request(thread_id, message):
+        async with await guard.acquire(thread_id, message) as turn:
+            overlaps.append(thread_id in running)
+            running.add(thread_id)
+            await asyncio.sleep(0.02)
+            running.discard(thread_id)
+            turn.set_result({"response": message})
+
+    await asyncio.gather(request("a-ia", "uno"), request("a-ia", "dos"), request("b-ia", "uno"))
+
+    assert overlaps == [False, False, False]
+    assert guard.get_stats()["waited"] == 1
+    assert guard.get_stats()["active_conversations"] == 0
+
+
+@pytest.mark.asyncio
+async def test_busy_conversation_is_rejected_with_429_or_409():
+    """Test a full queue is rejected at once and a turn that does not come in time gets 409"""
+    guard = ConversationGuard(timeout=0.05, max_pending=2)
+    first = await guard.acquire("a-ia", "uno")
+    waiting = asyncio.create_task(guard.acquire("a-ia", "dos"))
+    await asyncio.sleep(0)
+
+    with pytest.raises(ConversationBusyError) as rejected:
+        await guard.acquire("a-ia", "tres")
+    with pytest.raises(ConversationBusyError) as timed_out:
+        await waiting
+    first.release()
+
+    assert rejected.value.status_code == 429
+    assert timed_out.value.status_code == 409
+    assert guard.get_stats()["active_conversations"] == 0
+
+
+@pytest.mark.asyncio
+async def test_identical_requests_share_one_graph_run():
+    """Test a double-clicked question runs the graph once and both callers get the answer"""
+    calls = []
+
+    async def run_query(query_text, *args):
+        calls.append(query_text)
+        await asyncio.sleep(0.02)
+        return {"response": "Un algoritmo voraz...", "sources": ["tema2.pdf"], "cached": False}
+
+    with patch.object(query_logic, "_run_query", run_query):
+        first, second = await asyncio.gather(
+            query_logic.query_rag("¿Qué es un algoritmo greedy?", subject="ia", email="alumno@correo.ugr.es"),
+            query_logic.query_rag("¿qué es un  algoritmo greedy?", subject="ia", email="alumno@correo.ugr.es"),
+        )
+
+    assert calls == ["¿Qué es un algoritmo greedy?"]
+    assert first["response"] == second["response"]
+    assert second["coalesced"] is True and "coalesced" not in first
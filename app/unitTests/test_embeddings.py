@@ -1,4 +1,5 @@
 import pytest
+import httpx
 import requests
 from unittest.mock import patch, MagicMock
 from app.services.rag_client import RAGServiceClient
@@ -11,24 +12,22 @@ def test_rag_client_initialization():
     assert "rag" in client.base_url.lower() or "8082" in client.base_url
 
 
-@patch('requests.post')
-def test_rag_client_search_documents(mock_post):
+def test_rag_client_search_documents():
     """Test RAG client search documents functionality"""
     # Mock response
-    mock_response = MagicMock()
-    mock_response.status_code = 200
-    mock_response.json.return_value = {
-        "documents": [
-            {
-                "content": "Test content about IA",
-                "metadata": {"source": "test.pdf", "page": 1}
-            }
-        ],
-        "sources": ["test.pdf"]
-    }
-    mock_post.return_value = mock_response
+    def handler(request):
+        assert request.method == "POST" and request.url.path == "/search"
+        return httpx.Response(200, json={
+            "documents": [
+                {
+                    "content": "Test content about IA",
+                    "metadata": {"source": "test.pdf", "page": 1}
+                }
+            ],
+            "sources": ["test.pdf"]
+        })
     
-    client = RAGServiceClient()
+    client = RAGServiceClient(transport=httpx.MockTransport(handler))
     documents, sources = client.search_documents(
         query="¿Qué es la inteligencia artificial?",
         subject="test_subject"
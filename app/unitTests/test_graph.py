@@ -1,6 +1,8 @@
 import pytest
-from app.domain.graph import build_graph
-from unittest.mock import patch, MagicMock
+from app.domain.graph import build_graph, execute_tools
+from unittest.mock import patch, MagicMock, AsyncMock
+from langchain_core.messages import AIMessage, ToolMessage
+from langchain_core.documents import Document
 
 
 def test_build_graph_returns_graph():
@@ -21,6 +23,27 @@ def test_consultar_guia_docente_tool(mock_tool):
     assert isinstance(result[1], list)
 
 
+@pytest.mark.asyncio
+@patch("app.domain.graph.rag_client")
+async def test_execute_tools_awaits_async_tools(mock_client):
+    """Test execute_tools runs the async tools and collects their documents"""
+    doc = Document(page_content="Contenido del tema 3", metadata={"source": "tema3.pdf"})
+    mock_client.asearch_documents = AsyncMock(return_value=([doc], ["tema3.pdf"]))
+
+    state = {
+        "subject": "metaheuristicas",
+        "messages": [AIMessage(content="", tool_calls=[
+            {"name": "chroma_retriever", "args": {"pregunta": "tema 3"}, "id": "call_1"}
+        ])],
+    }
+    result = await execute_tools(state)
+
+    assert isinstance(result["messages"][0], ToolMessage)
+    assert "Contenido del tema 3" in result["messages"][0].content
+    assert result["retrieved_docs"] == [doc]
+    mock_client.asearch_documents.assert_awaited_once()
+
+
 def test_graph_state_management():
     """Test graph state management functionality"""
     graph = build_graph()
@@ -97,3 +120,168 @@ def test_query_integration(mock_query_rag):
     
     assert result is not None
     assert mock_query_rag.called
+
+
+def test_llm_registry_reuses_bound_models():
+    """Test the LLM registry binds tools once per (provider, model, temperature, tools)"""
+    from app.domain.llm_registry import LLMRegistry
+    from app.domain.graph import AGENT_TOOLS
+
+    registry = LLMRegistry()
+    fake_llm = MagicMock()
+    with patch.object(registry, "_create_model", return_value=fake_llm) as mock_create:
+        first = registry.get_bound_model(AGENT_TOOLS, provider="gemini", model="m", temperature=0)
+        second = registry.for_config(AGENT_TOOLS, {"configurable": {"llm_provider": "gemini", "llm_model": "m"}})
+        other = registry.get_bound_model(AGENT_TOOLS, provider="gemini", model="m", temperature=0.5)
+
+    assert first is second
+    assert mock_create.call_count == 2
+    assert fake_llm.bind_tools.call_count == 2
+    assert other is fake_llm.bind_tools.return_value
+
+
+@pytest.mark.asyncio
+@patch("app.domain.graph.TOOL_CALL_TIMEOUT", 0.2)
+@patch("app.domain.graph.rag_client")
+async def test_execute_tools_runs_calls_concurrently_in_order(mock_client):
+    """Test tool calls run concurrently, keep their order and time out individually"""
+    import asyncio
+    import time
+
+    async def slow_search(query, subject, k):
+        await asyncio.sleep(0.1)
+        return [Document(page_content=query, metadata={"source": f"{query}.pdf"})], [f"{query}.pdf"]
+
+    async def hanging_guia(subject, section):
+        await asyncio.sleep(5)
+
+    mock_client.asearch_documents = AsyncMock(side_effect=slow_search)
+    mock_client.aget_guia_docente = AsyncMock(side_effect=hanging_guia)
+
+    state = {
+        "subject": "metaheuristicas",
+        "messages": [AIMessage(content="", tool_calls=[
+            {"name": "chroma_retriever", "args": {"pregunta": "a"}, "id": "call_1"},
+            {"name": "consultar_guia_docente", "args": {"seccion": "evaluacion"}, "id": "call_2"},
+            {"name": "herramienta_inexistente", "args": {}, "id": "call_3"},
+            {"name": "chroma_retriever", "args": {"pregunta": "b"}, "id": "call_4"},
+        ])],
+    }
+    start = time.perf_counter()
+    result = await execute_tools(state)
+    elapsed = time.perf_counter() - start
+
+    assert elapsed < 0.5
+    assert [m.tool_call_id for m in result["messages"]] == ["call_1", "call_2", "call_3", "call_4"]
+    assert "tiempo límite" in result["messages"][1].content
+    assert "no existe" in result["messages"][2].content
+    assert [d.page_content for d in result["retrieved_docs"]] == ["a", "b"]
+
+
+@pytest.mark.asyncio
+@patch("app.domain.graph.rag_client")
+@patch("app.domain.graph.llm_registry")
+async def test_speculative_retrieval_is_reused_by_matching_tool_call(mock_registry, mock_client):
+    """Test the prefetched search replaces the tool call when the model asks for the same query"""
+    from langchain_core.messages import HumanMessage
+    from app.domain.graph import call_agent
+
+    doc = Document(page_content="La estimación puntual...", metadata={"source": "tema3.pdf"})
+    mock_client.asearch_documents = AsyncMock(return_value=([doc], ["tema3.pdf"]))
+    tool_call = AIMessage(content="", tool_calls=[
+        {"name": "chroma_retriever", "args": {"pregunta": "estimación puntual"}, "id": "call_1"}
+    ])
+    mock_registry.for_config.return_value.ainvoke = AsyncMock(return_value=tool_call)
+
+    state = {"subject": "estadistica", "messages": [HumanMessage(content="¿Qué es la estimación puntual?")]}
+    agent_result = await call_agent(state, {"configurable": {"speculative_retrieval": True}})
+    tools_result = await execute_tools({"subject": "estadistica", "messages": agent_result["messages"]})
+
+    mock_client.asearch_documents.assert_called_once_with(
+        query="¿Qué es la estimación puntual?", subject="estadistica", k=6
+    )
+    assert tools_result["retrieved_docs"] == [doc]
+    assert "tema3.pdf" in tools_result["messages"][0].content
+
+
+@pytest.mark.asyncio
+@patch("app.domain.graph.rag_client")
+@patch("app.domain.graph.llm_registry")
+async def test_speculative_retrieval_is_discarded_on_mismatch(mock_registry, mock_client):
+    """Test a prefetched search is not used when the model asks for something else"""
+    from langchain_core.messages import HumanMessage
+    from app.domain.graph import call_agent
+
+    mock_client.asearch_documents = AsyncMock(return_value=([], []))
+    tool_call = AIMessage(content="", tool_calls=[
+        {"name": "chroma_retriever", "args": {"pregunta": "intervalos de confianza"}, "id": "call_2"}
+    ])
+    mock_registry.for_config.return_value.ainvoke = AsyncMock(return_value=tool_call)
+
+    state = {"subject": "estadistica", "messages": [HumanMessage(content="¿Qué es la estimación puntual?")]}
+    agent_result = await call_agent(state, {"configurable": {"speculative_retrieval": True}})
+    await execute_tools({"subject": "estadistica", "messages": agent_result["messages"]})
+
+    queries = [call.kwargs["query"] for call in mock_client.asearch_documents.call_args_list]
+    assert queries == ["¿Qué es la estimación puntual?", "intervalos de confianza"]
+
+
+@pytest.mark.asyncio
+async def test_speculation_stats_count_reuse_on_handoff_and_expired_claims_as_discarded(monkeypatch):
+    """Test a claimed prefetch counts as reused only when a tool call takes it, and as discarded if it expires"""
+    import asyncio
+    from app.domain import graph
+
+    monkeypatch.setattr(graph, "_prefetched", {})
+    monkeypatch.setattr(graph, "speculation_stats", {"started": 0, "reused": 0, "discarded": 0})
+    question = "¿Qué es la estimación puntual?"
+
+    def tool_call(call_id):
+        return AIMessage(content="", tool_calls=[
+            {"name": "chroma_retriever", "args": {"pregunta": "estimación puntual"}, "id": call_id}
+        ])
+
+    abandoned = asyncio.create_task(asyncio.sleep(10))
+    graph._claim_prefetch(tool_call("call_1"), question, abandoned)
+    assert graph.speculation_stats == {"started": 0, "reused": 0, "discarded": 0}
+
+    # The run stopped before execute_tools: the claim expires
+    created, task = graph._prefetched["call_1"]
+    graph._prefetched["call_1"] = (created - graph.SPECULATIVE_PREFETCH_TTL - 1, task)
+    used = asyncio.create_task(asyncio.sleep(0))
+    graph._claim_prefetch(tool_call("call_2"), question, used)
+    await asyncio.sleep(0)
+
+    assert abandoned.cancelled() and "call_1" not in graph._prefetched
+    assert graph.speculation_stats["discarded"] == 1 and graph.speculation_stats["reused"] == 0
+
+    assert graph._take_prefetch("call_2") is used
+    assert graph._take_prefetch("call_2") is None
+    assert graph.speculation_stats == {"started": 0, "reused": 1, "discarded": 1}
+
+
+@pytest.mark.asyncio
+@patch("app.domain.graph.rag_client")
+async def test_failed_prefetch_falls_back_to_the_tool_call(mock_client, monkeypatch):
+    """Test a claimed prefetch that fails does not turn into an error: the search is run again"""
+    import asyncio
+    from app.domain import graph
+
+    monkeypatch.setattr(graph, "_prefetched", {})
+    monkeypatch.setattr(graph, "speculation_stats", {"started": 0, "reused": 0, "discarded": 0, "failed": 0})
+    doc = Document(page_content="La estimación puntual...", metadata={"source": "tema3.pdf"})
+    mock_client.asearch_documents = AsyncMock(return_value=([doc], ["tema3.pdf"]))
+
+    async def rag_down():
+        raise ConnectionError("rag-service unavailable")
+
+    tool_call = AIMessage(content="", tool_calls=[
+        {"name": "chroma_retriever", "args": {"pregunta": "estimación puntual"}, "id": "call_1"}
+    ])
+    graph._claim_prefetch(tool_call, "¿Qué es la estimación puntual?", asyncio.create_task(rag_down()))
+    result = await execute_tools({"subject": "estadistica", "messages": [tool_call]})
+
+    assert result["retrieved_docs"] == [doc]
+    assert "tema3.pdf" in result["messages"][0].content
+    mock_client.asearch_documents.assert_called_once()
+    assert graph.speculation_stats["failed"] == 1
@@ -0,0 +1,50 @@
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from app.domain.intent_router import after_routing, classify_intent, route_intent
+
+
+@pytest.mark.parametrize("question, sections", [
+    ("¿Cómo se evalúa la asignatura?", ["evaluacion"]),
+    ("¿Quién imparte la asignatura y cuándo son las tutorías?", ["profesorado"]),
+    ("¿Qué libros recomiendan?", ["bibliografia"]),
+    ("¿Cuál es el temario y qué porcentaje vale el examen?", ["temario", "evaluacion"]),
+])
+def test_classify_intent_administrative_questions(question, sections):
+    """Test administrative questions map to their guía docente sections"""
+    assert classify_intent(question) == sections
+
+
+@pytest.mark.parametrize("question", [
+    "¿Qué es un algoritmo greedy?",
+    "Explícame un ejemplo de examen de búsqueda local",
+    "¿Quién es el profesor, qué temas hay, cómo es el examen y qué libros uso?",
+    "hola",
+])
+def test_classify_intent_leaves_ambiguous_questions_to_agent(question):
+    """Test conceptual, ambiguous or unrelated questions are not routed"""
+    assert classify_intent(question) is None
+
+
+@pytest.mark.asyncio
+async def test_route_intent_emits_guia_docente_tool_call():
+    """Test the router node issues the tool call and sends the graph to the tools node"""
+    state = {"messages": [SystemMessage(content="sys"), HumanMessage(content="¿Cómo se evalúa?")]}
+
+    result = await route_intent(state, {"configurable": {"subject": "ia"}})
+
+    message = result["messages"][0]
+    assert isinstance(message, AIMessage)
+    assert message.tool_calls[0]["name"] == "consultar_guia_docente"
+    assert message.tool_calls[0]["args"] == {"seccion": "evaluacion"}
+    assert after_routing({"messages": state["messages"] + [message]}) == "tools"
+
+
+@pytest.mark.asyncio
+async def test_route_intent_can_be_disabled_per_request():
+    """Test configurable.intent_router=False falls back to the agent"""
+    state = {"messages": [HumanMessage(content="¿Cómo se evalúa?")]}
+
+    result = await route_intent(state, {"configurable": {"intent_router": False}})
+
+    assert result == {}
+    assert after_routing(state) == "agent"
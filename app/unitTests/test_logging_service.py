@@ -0,0 +1,165 @@
+import asyncio
+import json
+import httpx
+import pytest
+from app.services import logging_service
+from app.services.logging_service import AnalyticsEmitter, log_conversation_message, log_user_message
+from app.services.spill_queue import SpillQueue
+
+
+class SlowLoggingService:
+    """Mock transport for the logging service that answers after a delay"""
+
+    def __init__(self, delay=0.0, status_code=200, batch_endpoint=True):
+        self.down = False
+        self.delay = delay
+        self.status_code = status_code
+        self.batch_endpoint = batch_endpoint
+        self.requests = []
+
+    async def __call__(self, request):
+        await asyncio.sleep(self.delay)
+        if self.down:
+            return httpx.Response(503, json={"detail": "MongoDB unavailable"})
+        path, body = request.url.path, json.loads(request.content)
+        if path.endswith("/batch"):
+            if not self.batch_endpoint:
+                return httpx.Response(404, json={"detail": "Not Found"})
+            self.requests.extend((event["type"], event["data"]) for event in body["events"])
+            results = [{"index": i, "status": "ok"} for i in range(len(body["events"]))]
+            return httpx.Response(self.status_code, json={"results": results})
+        self.requests.append((path.rsplit("/", 1)[-1], body))
+        return httpx.Response(self.status_code, json={"success": True})
+
+
+@pytest.mark.asyncio
+async def test_log_helpers_return_without_waiting_for_the_service(monkeypatch):
+    """Test events are queued immediately and sent in one batch over the shared client"""
+    service = SlowLoggingService(delay=0.5)
+    emitter = AnalyticsEmitter(base_url="http://logging/api/v1/logs", batch_size=10, interval=0.05,
+                               transport=httpx.MockTransport(service))
+    monkeypatch.setattr(logging_service, "analytics_emitter", emitter)
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    await log_conversation_message("s1", "u1", "ia", "user", "¿Qué es A*?", timestamp=1.0)
+    await log_user_message("alumno@correo.ugr.es", "¿Qué es A*?", "ia", "Un algoritmo", ["tema2.pdf"],
+                           "s1", "question", "simple", "gemini")
+    assert loop.time() - started < 0.1
+    assert emitter.stats["queued"] == 2 and service.requests == []
+
+    await emitter.stop()
+
+    assert [event_type for event_type, _ in service.requests] == ["conversation-message", "user-message"]
+    assert emitter.stats["sent"] == 2 and emitter.stats["batches"] == 1
+
+
+@pytest.mark.asyncio
+async def test_full_queue_drops_events_and_failures_are_counted():
+    """Test a stalled logging service never blocks emit: extra events are dropped and errors counted"""
+    service = SlowLoggingService(delay=0.2, status_code=500)
+    emitter = AnalyticsEmitter(base_url="http://logging/api/v1/logs", max_queue_size=2, batch_size=1,
+                               interval=0.01, transport=httpx.MockTransport(service))
+
+    emitter.emit("learning-event", {"n": 0})
+    await asyncio.sleep(0.05)  # the worker takes the first event and waits on the service
+    results = [emitter.emit("learning-event", {"n": i}) for i in range(1, 5)]
+    await emitter.stop()
+
+    assert results == [True, True, False, False]
+    assert emitter.stats["dropped"] == 2
+    assert emitter.stats["failed"] == 3 and emitter.stats["sent"] == 0
+    assert [payload["n"] for _, payload in service.requests] == [0, 1, 2]
+
+
+@pytest.mark.asyncio
+async def test_falls_back_to_single_event_endpoints_without_batch_endpoint():
+    """Test an older logging service (404 on /batch) still receives every event"""
+    service = SlowLoggingService(batch_endpoint=False)
+    emitter = AnalyticsEmitter(base_url="http://logging/api/v1/logs", batch_size=10, interval=0.01,
+                               transport=httpx.MockTransport(service))
+
+    for event_type in ("session-event", "learning-event", "learning-event"):
+        emitter.emit(event_type, {"session_id": "s1"})
+    await emitter.stop()
+
+    assert [event_type for event_type, _ in service.requests] == ["session-event", "learning-event", "learning-event"]
+    assert emitter.stats["sent"] == 3 and emitter.stats["failed"] == 0
+
+
+def test_spill_queue_rotates_segments_evicts_oldest_and_resumes_after_restart(tmp_path):
+    """Test segments rotate, the size cap evicts the oldest one and the cursor survives a restart"""
+    spill = SpillQueue(str(tmp_path), max_bytes=10_000, segment_bytes=200)
+    spill.append([("learning-event", {"n": i}) for i in range(3)])
+    spill.append([("learning-event", {"n": i}) for i in range(3, 6)])
+    events, position, consumed = spill.read(4)
+    spill.commit(position, consumed)
+
+    reopened = SpillQueue(str(tmp_path), max_bytes=10_000, segment_bytes=200)
+    assert reopened.pending == 2
+    assert [payload["n"] for _, payload in reopened.read(10)[0]] == [4, 5]
+
+    reopened.max_bytes = 250
+    reopened.append([("learning-event", {"n": i}) for i in range(6, 9)])
+    stats = reopened.get_stats()
+    assert stats["evicted"] == 2 and stats["pending"] == 3
+    assert [payload["n"] for _, payload in reopened.read(10)[0]] == [6, 7, 8]
+
+
+@pytest.mark.asyncio
+async def test_undelivered_events_are_spilled_and_replayed_in_order(tmp_path, monkeypatch):
+    """Test events survive a logging service outage and are replayed in order once it recovers"""
+    monkeypatch.setattr(logging_service, "ANALYTICS_SPILL_RETRY_INITIAL", 0.05)
+    service = SlowLoggingService()
+    service.down = True
+    emitter = AnalyticsEmitter(base_url="http://logging/api/v1/logs", batch_size=2, interval=0.01,
+                               transport=httpx.MockTransport(service), spill=SpillQueue(str(tmp_path)))
+
+    emitter.emit("learning-event", {"n": 0})
+    emitter.emit("learning-event", {"n": 1})
+    await emitter.drain()
+    emitter.emit("learning-event", {"n": 2})
+    await emitter.drain()
+    assert emitter.spill.pending == 3 and service.requests == []
+
+    service.down = False
+    for _ in range(100):
+        if not emitter.spill.pending:
+            break
+        await asyncio.sleep(0.02)
+    await emitter.stop()
+
+    assert [payload["n"] for _, payload in service.requests] == [0, 1, 2]
+    assert emitter.stats["failed"] == 2 and emitter.stats["replayed"] == 3
+    assert emitter.get_stats()["spill"]["segments"] == 0
+
+
+@pytest.mark.asyncio
+async def test_replayed_event_that_fails_stays_at_the_head_and_backs_off(tmp_path, monkeypatch):
+    """Test a partially failed replay keeps the failed event first in the backlog and waits before retrying"""
+    monkeypatch.setattr(logging_service, "ANALYTICS_SPILL_RETRY_INITIAL", 0.05)
+    spill = SpillQueue(str(tmp_path))
+    spill.append([("learning-event", {"n": i}) for i in range(4)])
+    flaky = {1}  # n=1 fails on its first attempt only
+    attempts = []
+
+    def logging_api(request):
+        events = json.loads(request.content)["events"]
+        attempts.append((asyncio.get_running_loop().time(), [event["data"]["n"] for event in events]))
+        results = [{"index": i, "status": "error" if event["data"]["n"] in flaky else "ok"}
+                   for i, event in enumerate(events)]
+        flaky.clear()
+        return httpx.Response(200, json={"results": results})
+
+    emitter = AnalyticsEmitter(base_url="http://logging/api/v1/logs", batch_size=4, interval=0.01,
+                               transport=httpx.MockTransport(logging_api), spill=spill)
+    emitter.start()
+    for _ in range(100):
+        if not spill.pending:
+            break
+        await asyncio.sleep(0.02)
+    await emitter.stop()
+
+    assert [sent for _, sent in attempts] == [[0, 1, 2, 3], [1, 2, 3]]
+    assert attempts[1][0] - attempts[0][0] >= 0.05
+    assert emitter.stats["replayed"] == 4 and emitter._retry_delay == 0.0
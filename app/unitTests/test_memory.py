@@ -0,0 +1,65 @@
+import pytest
+from unittest.mock import patch
+from langchain_core.messages import (
+    AIMessage, HumanMessage, RemoveMessage, SystemMessage, ToolMessage
+)
+from app.domain.memory import manage_memory, with_summary, TOOL_PAYLOAD_PLACEHOLDER
+
+
+def _conversation(turns):
+    """Build a checkpointed-like history with one tool call per turn"""
+    messages = [SystemMessage(content="Eres un asistente", id="sys")]
+    for i in range(turns):
+        messages += [
+            HumanMessage(content=f"pregunta {i}", id=f"h{i}"),
+            AIMessage(content="", id=f"a{i}", tool_calls=[
+                {"name": "chroma_retriever", "args": {"pregunta": f"p{i}"}, "id": f"c{i}"}
+            ]),
+            ToolMessage(content="documento largo " * 50, tool_call_id=f"c{i}", id=f"t{i}"),
+            AIMessage(content=f"respuesta {i}", id=f"r{i}"),
+        ]
+    messages.append(HumanMessage(content="pregunta actual", id="current"))
+    return messages
+
+
+@pytest.mark.asyncio
+@patch("app.domain.memory.MEMORY_SUMMARY_MODE", "extractive")
+async def test_manage_memory_folds_old_turns_into_summary():
+    """Test old turns are removed and folded into the running summary"""
+    with patch("app.domain.memory.MEMORY_MAX_TURNS", 4), patch("app.domain.memory.MEMORY_KEEP_TURNS", 2):
+        result = await manage_memory({"messages": _conversation(6), "summary": ""}, {})
+
+    removed = {m.id for m in result["messages"] if isinstance(m, RemoveMessage)}
+    assert {"h0", "a0", "t0", "r0", "h4", "r4"} <= removed
+    assert "h5" not in removed and "current" not in removed and "sys" not in removed
+    assert "pregunta 0" in result["summary"]
+    assert result["memory_stats"]["turns_folded"] == 5
+    assert result["memory_stats"]["tokens_saved"] > 0
+
+
+@pytest.mark.asyncio
+async def test_manage_memory_drops_old_tool_payloads():
+    """Test tool outputs of previous turns are replaced but the current turn is untouched"""
+    result = await manage_memory({"messages": _conversation(2), "summary": ""}, {})
+
+    replaced = [m for m in result["messages"] if isinstance(m, ToolMessage)]
+    assert {m.id for m in replaced} == {"t0", "t1"}
+    assert all(m.content == TOOL_PAYLOAD_PLACEHOLDER for m in replaced)
+    assert not any(isinstance(m, RemoveMessage) for m in result["messages"])
+
+
+@pytest.mark.asyncio
+async def test_manage_memory_noop_for_short_conversations():
+    """Test a fresh conversation is left unchanged"""
+    messages = [SystemMessage(content="sys", id="sys"), HumanMessage(content="hola", id="h")]
+    assert await manage_memory({"messages": messages}, {}) == {}
+
+
+def test_with_summary_inserts_after_system_prompt():
+    """Test the running summary is injected right after the system prompt"""
+    messages = [SystemMessage(content="sys"), HumanMessage(content="hola")]
+    prompt = with_summary(messages, "resumen previo")
+    assert prompt[0] is messages[0]
+    assert "resumen previo" in prompt[1].content
+    assert prompt[2] is messages[1]
+    assert with_summary(messages, "") is messages
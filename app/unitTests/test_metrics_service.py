@@ -0,0 +1,110 @@
+import asyncio
+import httpx
+import pytest
+from unittest.mock import patch, AsyncMock
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from langchain_core.messages import AIMessage
+from app.domain import graph
+from app.services.metrics_service import ChatMetrics, Histogram, MetricsMiddleware, current_timings
+
+
+def test_histogram_renders_cumulative_buckets():
+    """Test observations land in cumulative buckets with sum and count"""
+    histogram = Histogram("stage_seconds", "Stage duration.", ["stage"], buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 3.0):
+        histogram.observe(value, "llm")
+
+    lines = histogram.render().splitlines()
+
+    assert lines[:2] == ["# HELP stage_seconds Stage duration.", "# TYPE stage_seconds histogram"]
+    assert lines[2:] == [
+        'stage_seconds_bucket{stage="llm",le="0.1"} 1',
+        'stage_seconds_bucket{stage="llm",le="1.0"} 3',
+        'stage_seconds_bucket{stage="llm",le="+Inf"} 4',
+        'stage_seconds_sum{stage="llm"} 4.05',
+        'stage_seconds_count{stage="llm"} 4',
+    ]
+
+
+@pytest.mark.asyncio
+async def test_middleware_times_streamed_responses_until_the_last_chunk():
+    """Test a streamed answer is observed once its final chunk is sent, not when headers go out"""
+    registry = ChatMetrics()
+    app = FastAPI()
+
+    @app.post("/chat/stream")
+    async def stream():
+        async def body():
+            for i in range(3):
+                await asyncio.sleep(0.05)
+                yield f"event: token\ndata: {i}\n\n"
+        return StreamingResponse(body(), media_type="text/event-stream")
+
+    app.add_middleware(MetricsMiddleware, registry=registry)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        await client.post("/chat/stream")
+        await client.post("/other")
+
+    assert registry.request_duration.count("/chat/stream", "200") == 1
+    assert registry.request_duration.total("/chat/stream", "200") >= 0.15
+    assert registry.in_flight.value("request") == 0
+    assert "/other" not in registry.render()
+
+
+@pytest.mark.asyncio
+@patch("app.domain.graph.rag_client")
+async def test_execute_tools_records_tool_and_stage_durations(mock_client):
+    """Test each tool call and the whole tools step are timed"""
+    mock_client.asearch_documents = AsyncMock(return_value=([], []))
+    state = {
+        "subject": "metaheuristicas",
+        "messages": [AIMessage(content="", tool_calls=[
+            {"name": "chroma_retriever", "args": {"pregunta": "búsqueda local"}, "id": "call_1"}
+        ])],
+    }
+    tool_calls = graph.metrics.tool_duration.count("chroma_retriever")
+    steps = graph.metrics.stage_duration.count("tools")
+
+    await graph.execute_tools(state, {"configurable": {}})
+
+    assert graph.metrics.tool_duration.count("chroma_retriever") == tool_calls + 1
+    assert graph.metrics.stage_duration.count("tools") == steps + 1
+    assert graph.metrics.in_flight.value("tool") == 0
+
+
+@pytest.mark.asyncio
+async def test_server_timing_header_and_debug_body_include_graph_phases():
+    """Test phases recorded inside graph tasks reach the Server-Timing header and the debug body"""
+    registry = ChatMetrics()
+    app = FastAPI()
+
+    @app.post("/chat")
+    async def chat(debug: bool = False):
+        with registry.stage("rate_limit"):
+            pass
+
+        async def agent_step():
+            with registry.stage("llm"):
+                await asyncio.sleep(0.01)
+            await asyncio.gather(*(tool_call(name) for name in ("chroma_retriever", "consultar_guia_docente")))
+
+        async def tool_call(name):
+            with registry.tool(name):
+                await asyncio.sleep(0.01)
+
+        await asyncio.create_task(agent_step())
+        with registry.stage("llm"):
+            pass
+        return {"timings": current_timings().entries()} if debug else {}
+
+    app.add_middleware(MetricsMiddleware, registry=registry)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.post("/chat", params={"debug": True})
+
+    names = [metric.split(";")[0] for metric in response.headers["server-timing"].split(", ")]
+    assert names == ["rate_limit", "llm-1", "tool-1", "tool-2", "llm-2", "total"]
+    assert 'desc="chroma_retriever"' in response.headers["server-timing"]
+    timings = response.json()["timings"]
+    assert [t["name"] for t in timings] == names
+    assert timings[1]["duration_ms"] >= 10
@@ -3,9 +3,10 @@ from app.domain.query_logic import query_rag, clear_session
 from unittest.mock import patch, MagicMock
 
 
+@pytest.mark.asyncio
 @patch('app.services.rag_client.RAGServiceClient')
 @patch('app.domain.graph.build_graph')
-def test_query_rag_basic(mock_build_graph, mock_rag_client):
+async def test_query_rag_basic(mock_build_graph, mock_rag_client):
     """Test basic RAG query functionality"""
     # Mock graph
     mock_graph = MagicMock()
@@ -19,7 +20,7 @@ def test_query_rag_basic(mock_build_graph, mock_rag_client):
     mock_client = MagicMock()
     mock_rag_client.return_value = mock_client
     
-    result = query_rag(
+    result = await query_rag(
         query_text="test question",
         subject="metaheuristicas",
         use_finetuned=False,
@@ -32,9 +33,10 @@ def test_query_rag_basic(mock_build_graph, mock_rag_client):
     assert "model_used" in result
 
 
+@pytest.mark.asyncio
 @patch('app.services.rag_client.RAGServiceClient')
 @patch('app.domain.graph.build_graph')
-def test_query_rag_with_finetuned(mock_build_graph, mock_rag_client):
+async def test_query_rag_with_finetuned(mock_build_graph, mock_rag_client):
     """Test RAG query with fine-tuned model"""
     # Mock graph
     mock_graph = MagicMock()
@@ -48,7 +50,7 @@ def test_query_rag_with_finetuned(mock_build_graph, mock_rag_client):
     mock_client = MagicMock()
     mock_rag_client.return_value = mock_client
     
-    result = query_rag(
+    result = await query_rag(
         query_text="specialized question",
         subject="metaheuristicas",
         use_finetuned=True,
@@ -60,8 +62,9 @@ def test_query_rag_with_finetuned(mock_build_graph, mock_rag_client):
     assert result.get("model_used") == "RAG + LoRA"
 
 
+@pytest.mark.asyncio
 @patch('app.domain.graph.build_graph')
-def test_clear_session(mock_build_graph):
+async def test_clear_session(mock_build_graph):
     """Test session clearing functionality"""
     # Mock graph
     mock_graph = MagicMock()
@@ -69,7 +72,7 @@ def test_clear_session(mock_build_graph):
     mock_build_graph.return_value = mock_graph
     
     # Test clear session - pass both required arguments: subject and email
-    result = clear_session("test_subject", "test@example.com")
+    result = await clear_session("test_subject", "test@example.com")
     
     # Should return a boolean indicating success
     assert isinstance(result, bool)
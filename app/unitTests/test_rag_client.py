@@ -0,0 +1,76 @@
+import httpx
+import pytest
+from app.services.rag_client import RAG_TIMEOUTS, RAGServiceClient
+
+
+class RecordingTransport(httpx.MockTransport):
+    """Mock RAG Service that records each request and the timeout it was sent with"""
+
+    def __init__(self):
+        self.requests = []
+        super().__init__(self.handle)
+
+    def handle(self, request):
+        self.requests.append((request.url.path, request.extensions["timeout"]["read"]))
+        if request.url.path == "/embed":
+            return httpx.Response(200, json={"embedding": [0.1, 0.2]})
+        if request.url.path.startswith("/guia-docente/"):
+            return httpx.Response(200, json={"data": {"profesores": ["Ana"]}})
+        return httpx.Response(404)
+
+
+@pytest.mark.asyncio
+async def test_async_calls_share_one_pool_with_per_operation_timeouts():
+    """Test every call reuses the same pooled client, with the timeout of its operation, until closed"""
+    transport = RecordingTransport()
+    client = RAGServiceClient(base_url="http://rag-service:8082", transport=transport)
+
+    assert await client.aembed_query("voraz") == [0.1, 0.2]
+    pool = client._async_client
+    assert await client.aget_guia_docente("ia", "profesores") == {"profesores": ["Ana"]}
+    assert await client.aget_subject_version("ia") is None
+
+    assert client._async_client is pool
+    assert transport.requests == [
+        ("/embed", RAG_TIMEOUTS["embed"]),
+        ("/guia-docente/ia", RAG_TIMEOUTS["guia_docente"]),
+        ("/subjects/ia/version", RAG_TIMEOUTS["subject_version"]),
+    ]
+
+    await client.aclose()
+    assert pool.is_closed and client._async_client is None
+
+
+def test_sync_facade_uses_the_same_client_and_reports_errors():
+    """Test the methods used by scripts go through the pooled sync client and handle failures"""
+    transport = RecordingTransport()
+    client = RAGServiceClient(base_url="http://rag-service:8082", transport=transport)
+
+    assert client.get_guia_docente("ia") == {"profesores": ["Ana"]}
+    assert client.health_check() is False
+    assert [path for path, _ in transport.requests] == ["/guia-docente/ia", "/health"]
+
+    def unavailable(request):
+        raise httpx.ConnectError("connection refused", request=request)
+
+    down = RAGServiceClient(base_url="http://rag-service:8082", transport=httpx.MockTransport(unavailable))
+    assert down.search_documents("voraz", "ia") == ([], [])
+
+
+def test_pool_of_a_previous_event_loop_is_closed_when_replaced():
+    """Test a new event loop gets its own pool and the previous one is closed instead of leaked"""
+    import asyncio
+
+    client = RAGServiceClient(base_url="http://rag-service:8082", transport=RecordingTransport())
+    asyncio.run(client.aembed_query("voraz"))
+    first = client._async_client
+
+    async def on_a_new_loop():
+        assert await client.aembed_query("voraz") == [0.1, 0.2]
+        for _ in range(3):
+            await asyncio.sleep(0)
+
+    asyncio.run(on_a_new_loop())
+
+    assert client._async_client is not first
+    assert first.is_closed and not client._async_client.is_closed
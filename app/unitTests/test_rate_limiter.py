@@ -0,0 +1,133 @@
+import pytest
+from app.core.rate_limiter import MongoRateLimiter, SlidingWindowRateLimiter
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_sliding_window_limits_and_reports_exact_info():
+    """Test the limit is enforced per user and the info matches the requests in the window"""
+    clock = FakeClock()
+    limiter = SlidingWindowRateLimiter(limit=3, window=60, sweep_interval=0, clock=clock)
+
+    results = []
+    for _ in range(4):
+        results.append(limiter.check("alumno"))
+        clock.now += 10
+
+    assert results == [True, True, True, False]
+    assert limiter.check("otro") is True
+    assert limiter.info("alumno") == {"requests_made": 3, "requests_remaining": 0, "reset_time": 1060}
+
+    clock.now = 1061  # the first request leaves the window
+    assert limiter.info("alumno") == {"requests_made": 2, "requests_remaining": 1, "reset_time": 1070}
+    assert limiter.check("alumno") is True
+    assert limiter.info("nuevo") == {"requests_made": 0, "requests_remaining": 3, "reset_time": 1121}
+
+
+def test_sweep_drops_only_users_without_requests_in_the_window():
+    """Test the sweeper removes expired users from the front and keeps recently active ones"""
+    clock = FakeClock()
+    limiter = SlidingWindowRateLimiter(limit=5, window=60, sweep_interval=0, clock=clock)
+    for i in range(3):
+        limiter.check(f"user-{i}")
+        clock.now += 20
+    limiter.check("user-0")  # user-0 becomes the most recently active
+
+    clock.now = 1085  # user-1 (1020) left the window; user-2 (1040) and user-0 (1060) did not
+    assert limiter.sweep() == 1
+    assert limiter.get_stats()["tracked_users"] == 2
+
+    clock.now = 1200
+    assert limiter.sweep() == 2
+    assert limiter.get_stats() == {"tracked_users": 0, "allowed": 4, "limited": 0, "swept": 3}
+
+
+class FakeRateLimitCollection:
+    """Motor collection stand-in that evaluates the aggregation expressions used by the limiter"""
+
+    OPERATORS = {
+        "$eq": lambda a, b: a == b,
+        "$lt": lambda a, b: a < b,
+        "$add": lambda *args: sum(args),
+        "$multiply": lambda a, b: a * b,
+        "$ifNull": lambda a, b: b if a is None else a,
+    }
+
+    def __init__(self):
+        self.docs = {}
+        self.round_trips = 0
+
+    def _eval(self, expr, doc):
+        if isinstance(expr, str) and expr.startswith("$"):
+            return doc.get(expr[1:])
+        if not isinstance(expr, dict):
+            return expr
+        (op, args), = expr.items()
+        if op == "$switch":
+            for branch in args["branches"]:
+                if self._eval(branch["case"], doc):
+                    return self._eval(branch["then"], doc)
+            return self._eval(args["default"], doc)
+        if op == "$cond":
+            return self._eval(args[1] if self._eval(args[0], doc) else args[2], doc)
+        return self.OPERATORS[op](*(self._eval(arg, doc) for arg in args))
+
+    async def create_index(self, *args, **kwargs):
+        pass
+
+    async def find_one_and_update(self, query, pipeline, upsert, return_document):
+        self.round_trips += 1
+        doc = dict(self.docs.get(query["_id"], query))
+        for stage in pipeline:
+            doc = {**doc, **{field: self._eval(expr, doc) for field, expr in stage["$set"].items()}}
+        self.docs[query["_id"]] = doc
+        return doc
+
+    async def find_one(self, query):
+        self.round_trips += 1
+        return self.docs.get(query["_id"])
+
+
+@pytest.mark.asyncio
+async def test_mongo_limiter_shares_the_quota_between_replicas():
+    """Test two replicas on the same collection enforce one quota and the window slides"""
+    clock, collection = FakeClock(now=600.0), FakeRateLimitCollection()
+    replicas = [MongoRateLimiter(collection, limit=4, window=60, clock=clock) for _ in range(2)]
+
+    results = [await replicas[i % 2].acheck("alumno") for i in range(6)]
+
+    assert results == [True, True, True, True, False, False]
+    assert collection.docs["alumno"]["count"] == 4
+    assert await replicas[1].ainfo("alumno") == {"requests_made": 4, "requests_remaining": 0, "reset_time": 660}
+
+    clock.now = 675.5  # the previous window now weighs 4 * 0.725 = 2.9 requests
+    assert [await replicas[i % 2].acheck("alumno") for i in range(3)] == [True, True, False]
+    assert collection.docs["alumno"]["prev"] == 4 and collection.docs["alumno"]["count"] == 2
+
+
+@pytest.mark.asyncio
+async def test_mongo_limiter_answers_from_local_cache_and_falls_back_when_down():
+    """Test headers and limited users are served without round trips, and MongoDB errors fall back"""
+    clock, collection = FakeClock(now=600.0), FakeRateLimitCollection()
+    limiter = MongoRateLimiter(collection, limit=2, window=60, cache_ttl=1.0, clock=clock)
+
+    await limiter.acheck("alumno")
+    await limiter.ainfo("alumno")  # same request: from the counters the check returned
+    await limiter.acheck("alumno")
+    # known to be limited from the counters of the last check: no round trip
+    assert [await limiter.acheck("alumno") for _ in range(2)] == [False, False]
+    assert collection.round_trips == 2
+    assert limiter.get_stats()["cache_hits"] == 3
+
+    async def unavailable(*args, **kwargs):
+        raise ConnectionError("MongoDB unavailable")
+
+    collection.find_one_and_update = unavailable
+    assert [await limiter.acheck("otro") for _ in range(3)] == [True, True, False]
+    assert limiter.get_stats()["errors"] == 3
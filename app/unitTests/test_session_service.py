@@ -0,0 +1,47 @@
+from app.services.session_service import InMemorySessionStore
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_sessions_are_reused_and_found_by_id():
+    """Test a user+subject keeps its session while active and the session is found by ID"""
+    clock = FakeClock()
+    store = InMemorySessionStore(timeout=60, sweep_interval=0, clock=clock)
+
+    session_id = store.get_or_create("alumno@correo.ugr.es", "ia")
+    clock.now += 30
+    assert store.get_or_create("alumno@correo.ugr.es", "ia") == session_id
+    assert store.get_or_create("alumno@correo.ugr.es", "metaheuristicas") != session_id
+    assert store.touch("alumno@correo.ugr.es", "ia") == session_id
+
+    info = store.get(session_id)
+    assert info["subject"] == "ia" and info["message_count"] == 1
+    assert store.get("desconocida") is None
+
+
+def test_expiry_only_removes_sessions_inactive_past_the_timeout():
+    """Test the heap expires idle sessions, reschedules touched ones and skips replaced ones"""
+    clock = FakeClock()
+    store = InMemorySessionStore(timeout=60, sweep_interval=0, clock=clock)
+    idle = store.get_or_create("a@correo.ugr.es", "ia")
+    active = store.get_or_create("b@correo.ugr.es", "ia")
+    replaced = store.get_or_create("c@correo.ugr.es", "ia")
+
+    clock.now += 50
+    store.get_or_create("b@correo.ugr.es", "ia")  # activity pushes b's expiry to 1110
+    clock.now += 20
+    renewed = store.get_or_create("c@correo.ugr.es", "ia")  # c timed out: new session
+
+    assert renewed != replaced and store.get(replaced) is None
+    assert store.expire() == 1
+    assert store.get(idle) is None and store.get(active) is not None
+
+    clock.now = 1200
+    assert store.expire() == 2
+    assert store.sessions == {} and store._expiry == []
@@ -0,0 +1,90 @@
+import os
+import threading
+from unittest.mock import patch
+from langfuse._client.span_processor import LangfuseSpanProcessor
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, SpanExporter, SpanExportResult
+from app.services.tracing_service import LangfuseTracerProvider, TraceSampler, TracingService, parse_sample_rates
+
+
+class RecordingExporter(SpanExporter):
+    """Stand-in for the OTLP exporter Langfuse creates: keeps the spans instead of sending them"""
+
+    def __init__(self, **kwargs):
+        self.exported = []
+
+    def export(self, spans):
+        self.exported.extend(spans)
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self):
+        pass
+
+
+def test_sample_rates_by_subject_then_tag():
+    """Test subject overrides win over tag overrides and the default rate"""
+    sampler = TraceSampler(default_rate=1.0, rates=parse_sample_rates("ia=0, stream=0.5,bad=x"))
+
+    assert sampler.rates == {"ia": 0.0, "stream": 0.5}
+    assert sampler.rate_for("IA", ["base", "stream"]) == 0.0
+    assert sampler.rate_for("metaheuristicas", ["base", "stream"]) == 0.5
+    assert sampler.rate_for("metaheuristicas", ["base", "query"]) == 1.0
+
+
+def test_unsampled_requests_get_no_callbacks():
+    """Test a request outside the sample is not instrumented at all"""
+    service = TracingService(enabled=True, sampler=TraceSampler(default_rate=0.0, rates={}))
+
+    assert service.callbacks_for("ia", ["base", "query"]) == []
+    assert service.stats()["skipped"] == 1
+
+
+def test_langfuse_filters_still_apply_to_exported_spans():
+    """Test Langfuse's own span processor is kept, so spans of blocked scopes are never exported"""
+    with patch("langfuse._client.span_processor.OTLPSpanExporter", RecordingExporter):
+        service = TracingService(enabled=True, sampler=TraceSampler(default_rate=1.0, rates={}),
+                                 blocked_scopes=["sqlalchemy"])
+        with patch.dict(os.environ, {"LANGFUSE_PUBLIC_KEY": "pk-test", "LANGFUSE_SECRET_KEY": "sk-test",
+                                     "LANGFUSE_HOST": "http://127.0.0.1:9"}):
+            assert service.start()
+
+    processor = service.provider.processor
+    assert isinstance(processor, LangfuseSpanProcessor)
+    with service.provider.get_tracer("sqlalchemy").start_as_current_span("SELECT"):
+        pass
+    with service.provider.get_tracer("chatbot").start_as_current_span("agent"):
+        pass
+    service.shutdown(timeout=2)
+
+    assert [span.name for span in processor.span_exporter.exporter.exported] == ["agent"]
+    assert service.stats()["export"]["exported"] == 1
+
+
+class BlockedExporter(RecordingExporter):
+    """Exporter stuck on a collector that does not answer until released"""
+
+    def __init__(self, **kwargs):
+        super().__init__()
+        self.release = threading.Event()
+
+    def export(self, spans):
+        self.release.wait(5)
+        return super().export(spans)
+
+
+def test_spans_beyond_the_queue_bound_are_dropped_and_counted():
+    """Test the provider bounds the processor queue and counts the spans it drops"""
+    exporter = BlockedExporter()
+    provider = LangfuseTracerProvider(max_queue_size=2)
+    provider.add_span_processor(BatchSpanProcessor(exporter, schedule_delay_millis=60000, max_export_batch_size=1))
+    tracer = provider.get_tracer("chatbot")
+
+    for name in ["a", "b", "c", "d", "e"]:
+        with tracer.start_as_current_span(name):
+            pass
+    exporter.release.set()
+    provider.processor.force_flush(2000)
+    provider.shutdown()
+
+    assert provider.counters["dropped"] >= 1
+    assert provider.counters["exported"] + provider.counters["dropped"] == 5
+    assert provider.counters["failed"] == 0
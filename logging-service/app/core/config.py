@@ -11,6 +11,9 @@ class Settings(BaseSettings):
     MONGODB_URL: str = os.getenv("MONGODB_URL", "mongodb://mongodb:27017")
     MONGODB_DATABASE: str = os.getenv("MONGODB_DATABASE", "chatbot_logs")
     
+    # Maximum number of events accepted by POST /logs/batch
+    BATCH_MAX_EVENTS: int = int(os.getenv("BATCH_MAX_EVENTS", "1000"))
+    
     # Service configuration
     service_host: str = "0.0.0.0"
     service_port: int = 8002
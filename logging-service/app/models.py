@@ -43,6 +43,29 @@ class LogResponse(BaseModel):
     message: str
     timestamp: datetime
 
+class BatchEvent(BaseModel):
+    """One event of a batch: `type` is the name of the single-event endpoint"""
+    type: str  # 'session-event', 'user-message', 'learning-event' or 'conversation-message'
+    data: Dict[str, Any]
+
+class BatchLogRequest(BaseModel):
+    """Model for batch logging - heterogeneous list of events"""
+    events: List[BatchEvent]
+
+class BatchItemResult(BaseModel):
+    """Outcome of one event of a batch, in request order"""
+    index: int
+    status: str  # 'ok', 'fallback' (written to CSV), 'invalid' or 'error'
+    error: Optional[str] = None
+
+class BatchLogResponse(BaseModel):
+    """Response model for the batch logging endpoint"""
+    success: bool
+    accepted: int
+    failed: int
+    results: List[BatchItemResult]
+    timestamp: datetime
+
 
 # MongoDB Document Models
 
@@ -1,7 +1,11 @@
 from fastapi import APIRouter, HTTPException, Depends, Query
-from app.models import SessionEventLog, UserMessageLog, LearningEventLog, ConversationMessageLog, LogResponse
+from app.models import (
+    SessionEventLog, UserMessageLog, LearningEventLog, ConversationMessageLog, LogResponse,
+    BatchLogRequest, BatchLogResponse
+)
 from app.services.logging_service import LoggingService
 from app.core.database import MongoDB
+from app.core.config import settings
 from datetime import datetime
 from typing import List, Optional
 import logging
@@ -89,6 +93,32 @@ async def log_conversation_message(
         timestamp=message.timestamp
     )
 
+@router.post("/logs/batch", response_model=BatchLogResponse)
+async def log_batch(
+    batch: BatchLogRequest,
+    logging_service: LoggingService = Depends(get_logging_service)
+):
+    """
+    Log a batch of session, user-message, learning and conversation events.
+    Each event is `{"type": <single-event endpoint name>, "data": <its body>}`.
+    Returns a status per event, in request order.
+    """
+    if len(batch.events) > settings.BATCH_MAX_EVENTS:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {settings.BATCH_MAX_EVENTS} events")
+    try:
+        results = await logging_service.log_batch(batch.events)
+    except Exception as e:
+        logger.error(f"Batch logging error: {e}")
+        raise HTTPException(status_code=500, detail="Failed to log batch")
+    failed = sum(1 for result in results if result.status in ("invalid", "error"))
+    return BatchLogResponse(
+        success=failed == 0,
+        accepted=len(results) - failed,
+        failed=failed,
+        results=results,
+        timestamp=datetime.utcnow()
+    )
+
 @router.get("/logs/health")
 async def logging_health():
     """Health check for logging service"""
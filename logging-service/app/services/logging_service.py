@@ -1,8 +1,12 @@
 import os
+import asyncio
 import logging
 import aiofiles
 from datetime import datetime
-from typing import Optional, List, Any
+from typing import Optional, List, Any, Dict, Tuple
+from pydantic import BaseModel, ValidationError
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
 from app.core.config import settings
 from app.core.database import MongoDB
 from app.models import (
@@ -10,11 +14,27 @@ from app.models import (
     ConversationDocument,
     SessionEventDocument,
     InteractionAnalyticsDocument,
-    LearningEventDocument
+    LearningEventDocument,
+    SessionEventLog,
+    UserMessageLog,
+    LearningEventLog,
+    ConversationMessageLog,
+    BatchEvent,
+    BatchItemResult
 )
 
 logger = logging.getLogger(__name__)
 
+# Batch event type -> (request model, MongoDB collection)
+BATCH_EVENT_TYPES = {
+    "session-event": (SessionEventLog, "session_events"),
+    "user-message": (UserMessageLog, "interaction_analytics"),
+    "learning-event": (LearningEventLog, "learning_events"),
+    "conversation-message": (ConversationMessageLog, "conversations"),
+}
+
+DUPLICATE_KEY_ERROR = 11000
+
 class LoggingService:
     """Service for handling MongoDB logging operations with CSV fallback"""
     
@@ -219,3 +239,207 @@ class LoggingService:
                 [session_id, user_id, subject, message_type, f'"{escaped_content}"',
                  conv_datetime.strftime("%Y-%m-%d"), conv_datetime.strftime("%H:%M:%S"), timestamp]
             )
+
+    # Batch logging
+
+    async def log_batch(self, events: List[BatchEvent]) -> List[BatchItemResult]:
+        """
+        Log a heterogeneous batch of events.
+
+        Events are validated one by one, grouped per collection and each group is
+        written with a single unordered bulk_write (groups are written concurrently).
+        Conversation messages are appended with one `$push` upsert per session.
+
+        Returns:
+            One result per event, in request order
+        """
+        results: List[Optional[BatchItemResult]] = [None] * len(events)
+        groups: Dict[str, List[Tuple[int, BaseModel]]] = {}
+        for index, event in enumerate(events):
+            spec = BATCH_EVENT_TYPES.get(event.type)
+            if spec is None:
+                results[index] = BatchItemResult(index=index, status="invalid",
+                                                 error=f"Unknown event type: {event.type}")
+                continue
+            try:
+                item = spec[0](**event.data)
+            except ValidationError as e:
+                results[index] = BatchItemResult(index=index, status="invalid",
+                                                 error=f"{e.error_count()} validation error(s)")
+                continue
+            groups.setdefault(event.type, []).append((index, item))
+
+        group_results = await asyncio.gather(
+            *(self._log_batch_group(event_type, items) for event_type, items in groups.items())
+        )
+        for group in group_results:
+            for result in group:
+                results[result.index] = result
+        return results
+
+    async def _log_batch_group(self, event_type: str, items: List[Tuple[int, BaseModel]]) -> List[BatchItemResult]:
+        """Write all the events of one type: one bulk_write, CSV fallback on error"""
+        now = datetime.utcnow()
+        if not self.use_mongodb:
+            return await self._log_batch_csv(event_type, items, now)
+
+        operations, operation_items = self._bulk_operations(event_type, items, now)
+        try:
+            collection = MongoDB.get_collection(BATCH_EVENT_TYPES[event_type][1])
+            errors = await self._bulk_write(collection, operations)
+        except Exception as e:
+            logger.error(f"Error bulk logging {len(items)} {event_type} events to MongoDB: {e}")
+            return await self._log_batch_csv(event_type, items, now)
+
+        results = []
+        for position, indices in enumerate(operation_items):
+            error = errors.get(position)
+            for index in indices:
+                results.append(BatchItemResult(index=index, status="error" if error else "ok", error=error))
+        logger.info(f"Batch of {len(items)} {event_type} events logged to MongoDB ({len(errors)} failed writes)")
+        return results
+
+    def _bulk_operations(self, event_type: str, items: List[Tuple[int, BaseModel]],
+                         now: datetime) -> Tuple[List[Any], List[List[int]]]:
+        """
+        Build the bulk_write operations of a group.
+
+        Returns:
+            Tuple (operations, indices of the events covered by each operation)
+        """
+        if event_type == "conversation-message":
+            return self._conversation_operations(items)
+
+        operations, operation_items = [], []
+        for index, item in items:
+            if event_type == "session-event":
+                document = SessionEventDocument(
+                    session_id=item.session_id,
+                    user_id=item.user_id,
+                    subject=item.subject,
+                    event_type=item.event_type,
+                    timestamp=now
+                )
+            elif event_type == "user-message":
+                document = InteractionAnalyticsDocument(**item.model_dump(), timestamp=now)
+            else:
+                document = LearningEventDocument(
+                    session_id=item.session_id,
+                    event_type=item.event_type,
+                    topic=item.topic,
+                    confidence_level=item.confidence_level or "N/A",
+                    timestamp=now
+                )
+            operations.append(InsertOne(document.model_dump()))
+            operation_items.append([index])
+        return operations, operation_items
+
+    def _conversation_operations(self, items: List[Tuple[int, BaseModel]]) -> Tuple[List[Any], List[List[int]]]:
+        """One `$push` upsert per session with all its messages, in timestamp order"""
+        sessions: Dict[str, List[Tuple[int, ConversationMessageLog]]] = {}
+        for index, item in items:
+            sessions.setdefault(item.session_id, []).append((index, item))
+
+        operations, operation_items = [], []
+        for session_id, session_items in sessions.items():
+            session_items.sort(key=lambda pair: pair[1].timestamp)
+            messages = [
+                ConversationMessage(
+                    message_type=item.message_type,
+                    content=item.message_content,
+                    timestamp=datetime.fromtimestamp(item.timestamp)
+                ).model_dump()
+                for _, item in session_items
+            ]
+            first = session_items[0][1]
+            operations.append(UpdateOne(
+                {"session_id": session_id},
+                {
+                    "$push": {"messages": {"$each": messages}},
+                    "$max": {"updated_at": messages[-1]["timestamp"]},
+                    "$setOnInsert": {
+                        "user_id": first.user_id,
+                        "subject": first.subject,
+                        "created_at": messages[0]["timestamp"],
+                        "metadata": None
+                    }
+                },
+                upsert=True
+            ))
+            operation_items.append([index for index, _ in session_items])
+        return operations, operation_items
+
+    async def _bulk_write(self, collection, operations: List[Any]) -> Dict[int, str]:
+        """
+        Unordered bulk_write. Upserts that lose a race with a concurrent insert of the same
+        session (duplicate key) are retried once, now as updates.
+
+        Returns:
+            Error message per failed operation position
+        """
+        try:
+            await collection.bulk_write(operations, ordered=False)
+            return {}
+        except BulkWriteError as e:
+            write_errors = e.details.get("writeErrors", [])
+        errors = {error["index"]: error.get("errmsg", "write error") for error in write_errors}
+        retry = [error["index"] for error in write_errors
+                 if error.get("code") == DUPLICATE_KEY_ERROR and isinstance(operations[error["index"]], UpdateOne)]
+        if not retry:
+            return errors
+        try:
+            await collection.bulk_write([operations[position] for position in retry], ordered=False)
+            failed_again = set()
+        except BulkWriteError as e:
+            failed_again = {retry[error["index"]] for error in e.details.get("writeErrors", [])}
+        for position in retry:
+            if position not in failed_again:
+                errors.pop(position)
+        return errors
+
+    def _csv_row(self, event_type: str, item: BaseModel, now: datetime) -> Tuple[str, List[str], List[Any]]:
+        """CSV file, headers and row of one event (same layout as the single-event fallbacks)"""
+        if event_type == "session-event":
+            return (
+                "learning_sessions.csv",
+                ["session_id", "user_id", "subject", "event_type", "date", "time", "timestamp"],
+                [item.session_id, item.user_id, item.subject, item.event_type,
+                 now.strftime("%Y-%m-%d"), now.strftime("%H:%M:%S"), now.timestamp()]
+            )
+        if event_type == "user-message":
+            return (
+                "chat_interactions_enhanced.csv",
+                ["session_id", "user_id_partial", "subject", "message_length", "query_type", 
+                 "complexity", "response_length", "source_count", "model_used", "date", "time", "timestamp"],
+                [item.session_id, item.user_id_partial, item.subject, item.message_length, item.query_type,
+                 item.complexity, item.response_length, item.source_count, item.llm_model_used,
+                 now.strftime("%Y-%m-%d"), now.strftime("%H:%M:%S"), now.timestamp()]
+            )
+        if event_type == "learning-event":
+            return (
+                "learning_events.csv",
+                ["session_id", "event_type", "topic", "confidence_level", "date", "time", "timestamp"],
+                [item.session_id, item.event_type, item.topic, item.confidence_level or "N/A",
+                 now.strftime("%Y-%m-%d"), now.strftime("%H:%M:%S"), now.timestamp()]
+            )
+        conv_datetime = datetime.fromtimestamp(item.timestamp)
+        escaped_content = item.message_content.replace('"', '""').replace('\n', '\\n').replace('\r', '\\r')
+        return (
+            "conversations.csv",
+            ["session_id", "user_id", "subject", "message_type", "message_content", "date", "time", "timestamp"],
+            [item.session_id, item.user_id, item.subject, item.message_type, f'"{escaped_content}"',
+             conv_datetime.strftime("%Y-%m-%d"), conv_datetime.strftime("%H:%M:%S"), item.timestamp]
+        )
+
+    async def _log_batch_csv(self, event_type: str, items: List[Tuple[int, BaseModel]],
+                             now: datetime) -> List[BatchItemResult]:
+        """CSV fallback for a whole group"""
+        results = []
+        for index, item in items:
+            try:
+                await self._write_csv_row(*self._csv_row(event_type, item, now))
+                results.append(BatchItemResult(index=index, status="fallback"))
+            except Exception as e:
+                logger.error(f"Error logging {event_type} event to CSV: {e}")
+                results.append(BatchItemResult(index=index, status="error", error=str(e)))
+        return results
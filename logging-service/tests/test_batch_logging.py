@@ -0,0 +1,191 @@
+import importlib
+import os
+import sys
+import pytest
+from pymongo import InsertOne
+from pymongo.errors import BulkWriteError, ServerSelectionTimeoutError
+
+SERVICE_DIR = os.path.join(os.path.dirname(__file__), "..")
+
+
+def _load_logging_service():
+    """Import the service module; logging-service/app and the backend share the package name "app\""""
+    backend = {name: module for name, module in sys.modules.items() if name == "app" or name.startswith("app.")}
+    for name in backend:
+        del sys.modules[name]
+    sys.path.insert(0, SERVICE_DIR)
+    try:
+        return importlib.import_module("app.services.logging_service")
+    finally:
+        sys.path.remove(SERVICE_DIR)
+        for name in [name for name in sys.modules if name == "app" or name.startswith("app.")]:
+            del sys.modules[name]
+        sys.modules.update(backend)
+
+
+logging_service = _load_logging_service()
+BatchEvent = logging_service.BatchEvent
+
+
+class FakeBulkCollection:
+    """Motor collection stand-in that applies bulk_write operations (InsertOne / upsert UpdateOne) in memory"""
+
+    def __init__(self):
+        self.docs = []
+        self.bulk_calls = []
+        self.racing = {}  # session_id -> upserts that still lose the race against a concurrent insert
+        self.down = False
+
+    def _find(self, query):
+        return next((doc for doc in self.docs if all(doc.get(k) == v for k, v in query.items())), None)
+
+    def _apply(self, operation):
+        update = operation._doc
+        doc = self._find(operation._filter)
+        if doc is None:
+            doc = dict(operation._filter, **update.get("$setOnInsert", {}))
+            self.docs.append(doc)
+        for field, value in update.get("$push", {}).items():
+            doc.setdefault(field, []).extend(value["$each"])
+        for field, value in update.get("$max", {}).items():
+            doc[field] = max(doc.get(field, value), value)
+
+    async def bulk_write(self, operations, ordered=True):
+        self.bulk_calls.append(len(operations))
+        if self.down:
+            raise ServerSelectionTimeoutError("mongodb:27017: [Errno 111] Connection refused")
+        write_errors = []
+        for position, operation in enumerate(operations):
+            if isinstance(operation, InsertOne):
+                self.docs.append(dict(operation._doc))
+                continue
+            session_id = operation._filter["session_id"]
+            if self.racing.get(session_id):
+                self.racing[session_id] -= 1
+                if self._find({"session_id": session_id}) is None:
+                    self.docs.append({"session_id": session_id, "user_id": "otra-replica", "messages": [{"content": "hola"}]})
+                write_errors.append({"index": position, "code": 11000, "errmsg": "E11000 duplicate key error"})
+                continue
+            self._apply(operation)
+        if write_errors:
+            raise BulkWriteError({"writeErrors": write_errors, "nInserted": 0, "nUpserted": 0})
+
+
+@pytest.fixture
+def collections(monkeypatch):
+    collections = {}
+    monkeypatch.setattr(logging_service.MongoDB, "get_collection",
+                        lambda name: collections.setdefault(name, FakeBulkCollection()))
+    return collections
+
+
+@pytest.fixture
+def service(monkeypatch, tmp_path):
+    monkeypatch.setattr(logging_service.settings, "BASE_LOG_DIR", str(tmp_path))
+    return logging_service.LoggingService()
+
+
+def conversation_message(session_id, message_type, content, timestamp):
+    return BatchEvent(type="conversation-message", data={
+        "session_id": session_id, "user_id": "alumno@ugr.es", "subject": "ia",
+        "message_type": message_type, "message_content": content, "timestamp": timestamp,
+    })
+
+
+@pytest.mark.asyncio
+async def test_mixed_batch_is_written_with_one_bulk_write_per_collection(service, collections):
+    """Test each type goes to its collection in one bulk_write and invalid events are reported in place"""
+    events = [
+        BatchEvent(type="session-event", data={"session_id": "s1", "user_id": "alumno", "subject": "ia",
+                                               "event_type": "session_start"}),
+        BatchEvent(type="user-message", data={"session_id": "s1", "user_id_partial": "alumno@u...",
+                                              "subject": "ia", "message_length": 24, "query_type": "concept",
+                                              "complexity": "low", "response_length": 512, "source_count": 3,
+                                              "llm_model_used": "gemma"}),
+        BatchEvent(type="unknown-event", data={}),
+        BatchEvent(type="learning-event", data={"session_id": "s1", "event_type": "topic", "topic": "A*"}),
+        BatchEvent(type="session-event", data={"session_id": "s1"}),
+        BatchEvent(type="session-event", data={"session_id": "s1", "user_id": "alumno", "subject": "ia",
+                                               "event_type": "session_end"}),
+    ]
+
+    results = await service.log_batch(events)
+
+    assert [(result.index, result.status) for result in results] == [
+        (0, "ok"), (1, "ok"), (2, "invalid"), (3, "ok"), (4, "invalid"), (5, "ok")
+    ]
+    assert {name: collection.bulk_calls for name, collection in collections.items()} == {
+        "session_events": [2], "interaction_analytics": [1], "learning_events": [1]
+    }
+    assert [doc["event_type"] for doc in collections["session_events"].docs] == ["session_start", "session_end"]
+    assert collections["learning_events"].docs[0]["confidence_level"] == "N/A"
+
+
+@pytest.mark.asyncio
+async def test_messages_of_one_session_become_a_single_upsert(service, collections):
+    """Test two messages of a session are appended with one $push/$each upsert, in timestamp order"""
+    events = [
+        conversation_message("s1", "bot", "Un algoritmo que elige el óptimo local", 1700000010.0),
+        conversation_message("s1", "user", "¿Qué es un algoritmo voraz?", 1700000000.0),
+    ]
+
+    operations, operation_items = service._conversation_operations(
+        [(index, logging_service.ConversationMessageLog(**event.data)) for index, event in enumerate(events)])
+    assert len(operations) == 1 and operation_items == [[1, 0]]
+    update = operations[0]._doc
+    assert [message["message_type"] for message in update["$push"]["messages"]["$each"]] == ["user", "bot"]
+    assert update["$setOnInsert"]["user_id"] == "alumno@ugr.es" and operations[0]._upsert
+
+    results = await service.log_batch(events)
+
+    assert [result.status for result in results] == ["ok", "ok"]
+    conversations = collections["conversations"]
+    assert conversations.bulk_calls == [1]
+    (doc,) = conversations.docs
+    assert [message["content"] for message in doc["messages"]] == [
+        "¿Qué es un algoritmo voraz?", "Un algoritmo que elige el óptimo local"
+    ]
+    assert doc["created_at"] < doc["updated_at"] and doc["subject"] == "ia"
+
+
+@pytest.mark.asyncio
+async def test_upserts_losing_the_race_on_session_id_are_retried_once(service, collections):
+    """Test only E11000 upserts are retried and retry errors are mapped back to their original position"""
+    conversations = collections.setdefault("conversations", FakeBulkCollection())
+    conversations.racing = {"s2": 1, "s3": 2}  # s2 succeeds on the retry, s3 loses again
+    events = [
+        conversation_message("s1", "user", "hola", 1700000000.0),
+        conversation_message("s2", "user", "hola", 1700000000.0),
+        conversation_message("s3", "user", "hola", 1700000000.0),
+    ]
+
+    results = await service.log_batch(events)
+
+    assert [result.status for result in results] == ["ok", "ok", "error"]
+    assert "E11000" in results[2].error
+    assert conversations.bulk_calls == [3, 2]
+    racing = next(doc for doc in conversations.docs if doc["session_id"] == "s2")
+    assert [message["content"] for message in racing["messages"]] == ["hola", "hola"]
+    assert racing["user_id"] == "otra-replica"  # the retry updated the concurrent insert
+
+
+@pytest.mark.asyncio
+async def test_failed_bulk_write_falls_back_to_csv(service, collections, tmp_path):
+    """Test a group whose bulk_write fails is written to its CSV file with the fallback status"""
+    collections["learning_events"] = FakeBulkCollection()
+    collections["learning_events"].down = True
+    events = [
+        BatchEvent(type="learning-event", data={"session_id": "s1", "event_type": "topic", "topic": "A*"}),
+        BatchEvent(type="learning-event", data={"session_id": "s1", "event_type": "topic", "topic": "minimax",
+                                                "confidence_level": "high"}),
+        BatchEvent(type="session-event", data={"session_id": "s1", "user_id": "alumno", "subject": "ia",
+                                               "event_type": "session_start"}),
+    ]
+
+    results = await service.log_batch(events)
+
+    assert [result.status for result in results] == ["fallback", "fallback", "ok"]
+    rows = (tmp_path / "learning_events.csv").read_text(encoding="utf-8").splitlines()
+    assert rows[0] == "session_id,event_type,topic,confidence_level,date,time,timestamp"
+    assert [row.split(",")[2:4] for row in rows[1:]] == [["A*", "N/A"], ["minimax", "high"]]
+    assert not (tmp_path / "learning_sessions.csv").exists()
@@ -1,5 +1,9 @@
 # get_embedding_function.py
 import os
+import time
+import threading
+from typing import List, Dict, Any, Optional
+from langchain_core.embeddings import Embeddings
 from langchain_openai import OpenAIEmbeddings
 from dotenv import load_dotenv
 
@@ -14,30 +18,274 @@ OLLAMA_URL = os.getenv("OLLAMA_URL", "http://ollama:11434")
 OLLAMA_MODEL_NAME = os.getenv("OLLAMA_MODEL_NAME", "nomic-embed-text")
 USE_OLLAMA = os.getenv("USE_OLLAMA", "true").lower() == "true"
 
-def get_embedding_function():
+# Router multi-backend: lista ordenada de backends (p.ej. "vllm,ollama").
+# Si está vacía se mantiene el comportamiento clásico controlado por USE_OLLAMA.
+# Todos los backends deben servir el MISMO modelo (mismos vectores).
+EMBEDDING_BACKENDS = [b.strip().lower() for b in os.getenv("EMBEDDING_BACKENDS", "").split(",") if b.strip()]
+# Modelo con el que se indexaron las colecciones. Cada backend declara el modelo que sirve
+# (*_EMBEDDING_MODEL_ID); si no coinciden entre sí o con este, el router no arranca.
+EMBEDDING_MODEL_ID = os.getenv("EMBEDDING_MODEL_ID", "")
+VLLM_EMBEDDING_MODEL_ID = os.getenv("VLLM_EMBEDDING_MODEL_ID", os.path.basename(VLLM_MODEL_NAME))
+OLLAMA_EMBEDDING_MODEL_ID = os.getenv("OLLAMA_EMBEDDING_MODEL_ID", OLLAMA_MODEL_NAME)
+# Dimensión de los vectores de las colecciones (si no se indica, se lee de las ya indexadas)
+EMBEDDING_DIMENSION = int(os.getenv("EMBEDDING_DIMENSION", "0")) or None
+# Coste relativo de cada backend: la ingesta masiva va al más barato disponible
+VLLM_EMBEDDING_COST = float(os.getenv("VLLM_EMBEDDING_COST", "2.0"))
+OLLAMA_EMBEDDING_COST = float(os.getenv("OLLAMA_EMBEDDING_COST", "1.0"))
+# Tiempo que un backend caído queda fuera de rotación antes de volver a probarlo
+EMBEDDING_BACKEND_COOLDOWN = float(os.getenv("EMBEDDING_BACKEND_COOLDOWN", "30"))
+# Peso de la última medida en la media móvil exponencial de latencia
+EMBEDDING_LATENCY_ALPHA = float(os.getenv("EMBEDDING_LATENCY_ALPHA", "0.2"))
+
+
+def _build_ollama_embeddings() -> Embeddings:
+    try:
+        from langchain_ollama import OllamaEmbeddings
+        return OllamaEmbeddings(
+            model=OLLAMA_MODEL_NAME,
+            base_url=OLLAMA_URL,
+            # Note: num_ctx and num_thread are configured via Ollama server
+            # using OLLAMA_NUM_PARALLEL environment variable in docker-compose
+        )
+    except ImportError:
+        raise ImportError(
+            "langchain-ollama is not installed. "
+            "Install it with: pip install langchain-ollama"
+        )
+
+
+def _build_vllm_embeddings() -> Embeddings:
+    return OpenAIEmbeddings(
+        model=VLLM_MODEL_NAME,
+        openai_api_base=VLLM_URL,
+        openai_api_key="NOT_USED"
+    )
+
+
+class EmbeddingBackend:
+    """Un backend de embeddings con su latencia móvil y su estado de salud"""
+
+    def __init__(self, name: str, embeddings: Embeddings, cost: float, model_id: str):
+        self.name = name
+        self.embeddings = embeddings
+        self.cost = cost
+        self.model_id = model_id
+        self.query_latency_ms: Optional[float] = None
+        self.bulk_latency_ms_per_doc: Optional[float] = None
+        self.dimension: Optional[int] = None
+        self.healthy = True
+        self.unhealthy_until = 0.0
+        self.incompatible = False
+        self.requests = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+
+    def available(self, now: float) -> bool:
+        """Sano, o caído pero con el cooldown vencido (se vuelve a probar)"""
+        if self.incompatible:
+            return False
+        return self.healthy or now >= self.unhealthy_until
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "model_id": self.model_id,
+            "cost": self.cost,
+            "healthy": self.healthy and not self.incompatible,
+            "incompatible": self.incompatible,
+            "query_latency_ms": round(self.query_latency_ms, 1) if self.query_latency_ms is not None else None,
+            "bulk_latency_ms_per_doc": (
+                round(self.bulk_latency_ms_per_doc, 2) if self.bulk_latency_ms_per_doc is not None else None
+            ),
+            "dimension": self.dimension,
+            "requests": self.requests,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
+
+
+class EmbeddingRouter(Embeddings):
+    """
+    Enruta las peticiones de embeddings entre varios backends del mismo modelo.
+
+    - Consultas interactivas (embed_query): al backend sano con menor latencia.
+    - Ingesta masiva (embed_documents): al backend sano más barato.
+    - Si un backend falla se marca como caído durante un cooldown y se prueba el siguiente.
+
+    Al construirse comprueba que todos los backends declaran el mismo modelo (`model_id`)
+    y que los que responden dan vectores de la dimensión de las colecciones (`dimension`);
+    si no, lanza ValueError y el servicio no arranca. Un backend que no respondía al
+    arrancar y luego da otra dimensión se descarta.
+    """
+
+    def __init__(self, backends: List[EmbeddingBackend], model_id: Optional[str] = None,
+                 dimension: Optional[int] = None, probe: bool = True):
+        if not backends:
+            raise ValueError("EmbeddingRouter necesita al menos un backend")
+        self.backends = backends
+        self._lock = threading.Lock()
+        self.model_id = self._check_models(backends, model_id)
+        self.dimension = dimension
+        if probe:
+            self._probe()
+
+    @staticmethod
+    def _check_models(backends: List[EmbeddingBackend], model_id: Optional[str]) -> str:
+        served = {b.name: b.model_id for b in backends}
+        expected = model_id or (backends[0].model_id if len(set(served.values())) == 1 else None)
+        if expected is None or any(served_id != expected for served_id in served.values()):
+            raise ValueError(
+                f"Los backends de embeddings no sirven el mismo modelo ({served}); "
+                f"todos deben servir '{model_id or 'el mismo modelo'}'. "
+                "Revisa EMBEDDING_MODEL_ID y *_EMBEDDING_MODEL_ID."
+            )
+        return expected
+
+    def _probe(self):
+        """Comprueba la dimensión de cada backend que responde contra la de las colecciones."""
+        dimensions = {}
+        for backend in self.backends:
+            try:
+                dimensions[backend.name] = len(backend.embeddings.embed_query("dimension probe"))
+            except Exception as e:
+                # Caído al arrancar: se comprobará con su primera respuesta
+                self._record_failure(backend, e)
+                continue
+            backend.dimension = dimensions[backend.name]
+        expected = self.dimension or next(iter(dimensions.values()), None)
+        if any(dimension != expected for dimension in dimensions.values()):
+            raise ValueError(
+                f"Los backends de embeddings dan vectores de dimensiones distintas ({dimensions}); "
+                f"las colecciones esperan {self.dimension or 'una sola dimensión'}"
+            )
+        self.dimension = expected
+
+    def _ranked(self, interactive: bool) -> List[EmbeddingBackend]:
+        now = time.time()
+        with self._lock:
+            candidates = [b for b in self.backends if b.available(now)]
+            if not candidates:
+                # Todos caídos: se prueba igualmente en orden de configuración
+                candidates = [b for b in self.backends if not b.incompatible]
+            if interactive:
+                # Sin medidas todavía cuenta como 0 para que se explore al menos una vez
+                return sorted(candidates, key=lambda b: b.query_latency_ms or 0.0)
+            return sorted(candidates, key=lambda b: (b.cost, b.bulk_latency_ms_per_doc or 0.0))
+
+    def _record_success(self, backend: EmbeddingBackend, elapsed_ms: float, vectors: List[List[float]],
+                        interactive: bool) -> bool:
+        """Actualiza latencia y salud. Devuelve False si el backend da vectores incompatibles."""
+        with self._lock:
+            backend.requests += 1
+            if vectors:
+                dimension = len(vectors[0])
+                if self.dimension is not None and dimension != self.dimension:
+                    backend.incompatible = True
+                    backend.last_error = f"Dimensión {dimension} distinta de la de las colecciones ({self.dimension})"
+                    print(f"❌ Backend de embeddings '{backend.name}' descartado: {backend.last_error}")
+                    return False
+                # Sin colecciones ni backends disponibles al arrancar, la fija la primera respuesta
+                self.dimension = self.dimension or dimension
+                backend.dimension = dimension
+
+            backend.healthy = True
+            alpha = EMBEDDING_LATENCY_ALPHA
+            if interactive:
+                previous = backend.query_latency_ms
+                backend.query_latency_ms = elapsed_ms if previous is None else alpha * elapsed_ms + (1 - alpha) * previous
+            elif vectors:
+                per_doc = elapsed_ms / len(vectors)
+                previous = backend.bulk_latency_ms_per_doc
+                backend.bulk_latency_ms_per_doc = per_doc if previous is None else alpha * per_doc + (1 - alpha) * previous
+            return True
+
+    def _record_failure(self, backend: EmbeddingBackend, error: Exception):
+        with self._lock:
+            backend.requests += 1
+            backend.failures += 1
+            backend.healthy = False
+            backend.unhealthy_until = time.time() + EMBEDDING_BACKEND_COOLDOWN
+            backend.last_error = str(error)
+        print(f"⚠️  Backend de embeddings '{backend.name}' falló, se desvía el tráfico: {str(error)}")
+
+    def _route(self, interactive: bool, call):
+        last_error: Optional[Exception] = None
+        for backend in self._ranked(interactive):
+            start = time.time()
+            try:
+                result = call(backend.embeddings)
+            except Exception as e:
+                self._record_failure(backend, e)
+                last_error = e
+                continue
+            vectors = [result] if interactive else result
+            if self._record_success(backend, (time.time() - start) * 1000, vectors, interactive):
+                return result
+        raise RuntimeError(f"Ningún backend de embeddings disponible: {last_error}")
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._route(True, lambda emb: emb.embed_query(text))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._route(False, lambda emb: emb.embed_documents(texts))
+
+    def status(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [b.to_dict() for b in self.backends]
+
+
+_BACKEND_FACTORIES = {
+    "vllm": (_build_vllm_embeddings, lambda: VLLM_EMBEDDING_COST, lambda: VLLM_EMBEDDING_MODEL_ID),
+    "ollama": (_build_ollama_embeddings, lambda: OLLAMA_EMBEDDING_COST, lambda: OLLAMA_EMBEDDING_MODEL_ID),
+}
+
+_router: Optional[EmbeddingRouter] = None
+_router_lock = threading.Lock()
+
+
+def get_embedding_router(dimension: Optional[int] = None) -> Optional[EmbeddingRouter]:
+    """
+    Router compartido por todo el proceso (None si no hay EMBEDDING_BACKENDS).
+
+    Args:
+        dimension: dimensión de las colecciones ya indexadas (EMBEDDING_DIMENSION tiene prioridad)
+
+    Raises:
+        ValueError: si los backends no sirven el mismo modelo o la misma dimensión
+    """
+    global _router
+    if not EMBEDDING_BACKENDS:
+        return None
+    with _router_lock:
+        if _router is None:
+            backends = []
+            for name in EMBEDDING_BACKENDS:
+                if name not in _BACKEND_FACTORIES:
+                    raise ValueError(
+                        f"Backend de embeddings desconocido: '{name}'. "
+                        f"Disponibles: {', '.join(_BACKEND_FACTORIES)}"
+                    )
+                factory, cost, model_id = _BACKEND_FACTORIES[name]
+                backends.append(EmbeddingBackend(name, factory(), cost(), model_id()))
+            _router = EmbeddingRouter(backends, model_id=EMBEDDING_MODEL_ID or None,
+                                      dimension=EMBEDDING_DIMENSION or dimension)
+        return _router
+
+
+def get_embedding_function(dimension: Optional[int] = None):
     """
     Carga la función de embeddings para el RAG Service.
-    Utiliza el servicio vLLM de embeddings (GPU) o Ollama (CPU) dependiendo de la configuración.
+    Con EMBEDDING_BACKENDS configurado devuelve el router multi-backend (vLLM en GPU
+    cuando está disponible, Ollama en CPU como respaldo), validado contra `dimension`,
+    la de las colecciones ya indexadas. Si no, utiliza el servicio vLLM de embeddings
+    (GPU) o Ollama (CPU) dependiendo de USE_OLLAMA.
     """
+    router = get_embedding_router(dimension)
+    if router is not None:
+        return router
     if USE_OLLAMA:
         # Use Ollama for CPU-based embeddings
-        try:
-            from langchain_ollama import OllamaEmbeddings
-            return OllamaEmbeddings(
-                model=OLLAMA_MODEL_NAME,
-                base_url=OLLAMA_URL,
-                # Note: num_ctx and num_thread are configured via Ollama server
-                # using OLLAMA_NUM_PARALLEL environment variable in docker-compose
-            )
-        except ImportError:
-            raise ImportError(
-                "langchain-ollama is not installed. "
-                "Install it with: pip install langchain-ollama"
-            )
+        return _build_ollama_embeddings()
     else:
         # Use vLLM for GPU-based embeddings
-        return OpenAIEmbeddings(
-            model=VLLM_MODEL_NAME,
-            openai_api_base=VLLM_URL,
-            openai_api_key="NOT_USED"
-        )
\ No newline at end of file
+        return _build_vllm_embeddings()
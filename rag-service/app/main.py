@@ -2,18 +2,45 @@
 RAG Service - Servicio independiente para manejo de ChromaDB y documentos RAG
 """
 import os
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Optional, Dict, Any
 import uvicorn
 from .rag_manager import rag_manager
 from .document_processor import document_processor
+from .warmup import readiness, run_warmup, WARMUP_RETRY_SECONDS
+from .embeddings import get_embedding_router
+
+
+async def _warmup_until_ready():
+    """Repite el warm-up (en un hilo) hasta que todas las dependencias estén listas"""
+    while True:
+        await asyncio.to_thread(run_warmup)
+        if readiness.ready:
+            return
+        await asyncio.sleep(WARMUP_RETRY_SECONDS)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Ciclo de vida: warm-up en segundo plano al arrancar, estadísticas al parar"""
+    warmup_task = asyncio.create_task(_warmup_until_ready())
+
+    yield
+
+    warmup_task.cancel()
+    rag_manager.save_usage_stats()
+
 
 app = FastAPI(
     title="RAG Service",
     description="Servicio para manejo de ChromaDB y búsquedas RAG",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS middleware
@@ -47,6 +74,24 @@ class HealthResponse(BaseModel):
     service: str
     version: str
 
+class ReadinessResponse(BaseModel):
+    status: str
+    checks: Dict[str, Any]
+    warmup: Dict[str, Any]
+
+class EmbedRequest(BaseModel):
+    text: str
+
+class EmbedResponse(BaseModel):
+    embedding: List[float]
+    dimension: int
+
+class SubjectVersionResponse(BaseModel):
+    subject: str
+    version: str
+    corpus_version: Optional[str] = None
+    guia_version: Optional[str] = None
+
 class GuiaDocenteRequest(BaseModel):
     subject: str
     section: Optional[str] = None  # Si no se especifica, devuelve toda la guía
@@ -68,6 +113,38 @@ async def health_check():
         version="1.0.0"
     )
 
+@app.get("/ready", response_model=ReadinessResponse, responses={503: {"model": ReadinessResponse}})
+async def readiness_check():
+    """
+    Readiness probe: 200 solo cuando el modelo de embeddings está cargado y las
+    colecciones más usadas están abiertas. Incluye los tiempos del warm-up.
+    """
+    state = readiness.to_dict()
+    return JSONResponse(status_code=200 if state["status"] == "ready" else 503, content=state)
+
+@app.get("/embeddings/backends")
+async def embedding_backends():
+    """
+    Estado del router de embeddings: latencia móvil, salud y fallos por backend
+    """
+    router = get_embedding_router()
+    if router is None:
+        return {"router_enabled": False, "backends": []}
+    return {"router_enabled": True, "model_id": router.model_id, "dimension": router.dimension,
+            "backends": router.status()}
+
+@app.post("/embed", response_model=EmbedResponse)
+async def embed_text(request: EmbedRequest):
+    """
+    Embedding de un texto con el mismo modelo que las colecciones (lo usa la
+    caché semántica de respuestas del backend)
+    """
+    try:
+        vector = await asyncio.to_thread(rag_manager.embedding_function.embed_query, request.text)
+        return EmbedResponse(embedding=vector, dimension=len(vector))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al calcular el embedding: {str(e)}")
+
 @app.post("/search", response_model=SearchResponse)
 async def search_documents(request: SearchRequest):
     """
@@ -115,12 +192,18 @@ async def populate_with_files(
                     detail=f"Archivo no soportado: {file.filename}. Solo se permiten: {', '.join(supported_extensions)}"
                 )
         
-        # Procesar archivos
-        result = await document_processor.populate_subject_from_files(
-            files=files,
-            subject=subject,
-            reset=reset
-        )
+        if reset:
+            rag_manager.evict_collection(subject)
+
+        # Procesar archivos (aunque falle a medias, la colección puede haber cambiado)
+        try:
+            result = await document_processor.populate_subject_from_files(
+                files=files,
+                subject=subject,
+                reset=reset
+            )
+        finally:
+            rag_manager.update_corpus_version(subject)
         
         if result["success"]:
             return {
@@ -191,10 +274,24 @@ async def clear_subject_database(subject: str):
     """
     try:
         result = document_processor.clear_database(subject)
+        rag_manager.evict_collection(subject)
+        rag_manager.update_corpus_version(subject)
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al limpiar: {str(e)}")
 
+@app.get("/subjects/{subject}/version", response_model=SubjectVersionResponse)
+async def subject_version(subject: str):
+    """
+    Versión de los documentos de una asignatura (corpus ChromaDB y guía docente).
+    Cambia cada vez que se repuebla, se borra o se actualiza alguno de ellos; la del
+    corpus se fija al indexar, así que consultarla no recorre la colección.
+    """
+    try:
+        return SubjectVersionResponse(**await asyncio.to_thread(rag_manager.subject_version, subject))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al obtener la versión: {str(e)}")
+
 @app.get("/guia-docente/{subject}")
 async def get_guia_docente(subject: str, section: Optional[str] = None):
     """
@@ -210,16 +307,7 @@ async def get_guia_docente(subject: str, section: Optional[str] = None):
         import json
         
         # Buscar el archivo de guía docente
-        possible_paths = [
-            f"/app/data/{subject}/guía_docente.json",
-            f"/app/data/{subject}/guia_docente.json"
-        ]
-        
-        guia_path = None
-        for path in possible_paths:
-            if os.path.exists(path):
-                guia_path = path
-                break
+        guia_path = rag_manager.find_guia_docente_path(subject)
         
         if not guia_path:
             raise HTTPException(
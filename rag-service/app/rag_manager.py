@@ -2,8 +2,13 @@
 Módulo para manejo de ChromaDB y búsquedas RAG
 """
 import os
+import json
 import shutil
+import hashlib
 import re
+import threading
+import uuid
+from collections import Counter
 from typing import List, Dict, Any, Optional
 from langchain_chroma import Chroma
 from langchain_core.documents import Document
@@ -12,12 +17,27 @@ from .embeddings import get_embedding_function
 
 # Configuración de rutas
 BASE_CHROMA_PATH = os.getenv("BASE_CHROMA_PATH", "/app/data/chroma")
+# Fichero donde se persiste el uso por asignatura entre reinicios (para el warm-up)
+USAGE_STATS_PATH = os.path.join(BASE_CHROMA_PATH, ".subject_usage.json")
+# Versión del corpus de cada asignatura, fijada al indexar o borrar su colección
+CORPUS_VERSIONS_PATH = os.path.join(BASE_CHROMA_PATH, ".corpus_versions.json")
+# Directorio con los datos de cada asignatura (guía docente, documentos)
+BASE_DATA_PATH = os.getenv("BASE_DATA_PATH", "/app/data")
 
 class RAGManager:
     """Clase para manejar operaciones de ChromaDB"""
     
     def __init__(self):
-        self.embedding_function = get_embedding_function()
+        self.embedding_function = get_embedding_function(self._indexed_dimension())
+        # Colecciones abiertas, reutilizadas entre peticiones
+        self._collections: Dict[str, Chroma] = {}
+        self._collections_lock = threading.Lock()
+        # Número de búsquedas por asignatura (se usa para elegir qué precalentar)
+        self.subject_usage: Counter = Counter()
+        # Versiones del corpus leídas de CORPUS_VERSIONS_PATH (se releen si cambia su mtime)
+        self._corpus_versions: Dict[str, str] = {}
+        self._corpus_versions_mtime: Optional[int] = None
+        self._corpus_versions_lock = threading.Lock()
         # Simple Spanish stop words for better keyword matching
         self.stop_words = {
             'el', 'la', 'de', 'que', 'y', 'a', 'en', 'un', 'es', 'se', 'no', 'te', 'lo', 'le', 'da', 'su', 'por', 'son',
@@ -34,9 +54,93 @@ class RAGManager:
         meaningful_words = [word for word in words if len(word) > 2 and word not in self.stop_words]
         return meaningful_words
         
+    def _indexed_dimension(self) -> Optional[int]:
+        """Dimensión de los vectores ya indexados (de la primera colección con datos), o None"""
+        if not os.path.isdir(BASE_CHROMA_PATH):
+            return None
+        for subject in sorted(os.listdir(BASE_CHROMA_PATH)):
+            chroma_path = self._get_chroma_path(subject)
+            if not os.path.isdir(chroma_path):
+                continue
+            try:
+                stored = Chroma(persist_directory=chroma_path)._collection.get(limit=1, include=["embeddings"])
+            except Exception as e:
+                print(f"⚠️  No se pudo leer la dimensión de {subject}: {str(e)}")
+                continue
+            embeddings = stored.get("embeddings")
+            if embeddings is not None and len(embeddings) > 0:
+                return len(embeddings[0])
+        return None
+
     def _get_chroma_path(self, subject: str) -> str:
         """Obtiene la ruta de ChromaDB para una asignatura"""
         return os.path.join(BASE_CHROMA_PATH, subject)
+
+    def get_collection(self, subject: str) -> Optional[Chroma]:
+        """
+        Devuelve la colección ChromaDB de una asignatura, abriéndola solo la primera vez.
+
+        Returns:
+            La colección o None si la asignatura no tiene base de datos
+        """
+        chroma_path = self._get_chroma_path(subject)
+        if not os.path.exists(chroma_path):
+            return None
+
+        with self._collections_lock:
+            db = self._collections.get(subject)
+            if db is None:
+                db = Chroma(
+                    persist_directory=chroma_path,
+                    embedding_function=self.embedding_function
+                )
+                self._collections[subject] = db
+            return db
+
+    def evict_collection(self, subject: str) -> None:
+        """Olvida la colección abierta de una asignatura (tras borrarla o resetearla)"""
+        with self._collections_lock:
+            self._collections.pop(subject, None)
+
+    def open_collections(self) -> List[str]:
+        """Lista las asignaturas cuya colección está abierta en memoria"""
+        with self._collections_lock:
+            return list(self._collections.keys())
+
+    def most_used_subjects(self, limit: int) -> List[str]:
+        """
+        Asignaturas ordenadas por número de búsquedas (persistido entre reinicios).
+        Las asignaturas sin uso registrado se añaden al final en orden alfabético.
+        """
+        usage = Counter(self.subject_usage)
+        try:
+            if os.path.exists(USAGE_STATS_PATH):
+                with open(USAGE_STATS_PATH, 'r', encoding='utf-8') as f:
+                    usage.update(json.load(f))
+        except Exception as e:
+            print(f"⚠️  No se pudo leer el uso por asignatura: {str(e)}")
+
+        available = set(self.list_subjects())
+        ranked = [subject for subject, _ in usage.most_common() if subject in available]
+        ranked += sorted(available - set(ranked))
+        return ranked[:limit]
+
+    def save_usage_stats(self) -> None:
+        """Persiste el uso por asignatura acumulado para el próximo arranque"""
+        if not self.subject_usage:
+            return
+        try:
+            usage = Counter()
+            if os.path.exists(USAGE_STATS_PATH):
+                with open(USAGE_STATS_PATH, 'r', encoding='utf-8') as f:
+                    usage.update(json.load(f))
+            usage.update(self.subject_usage)
+            os.makedirs(BASE_CHROMA_PATH, exist_ok=True)
+            with open(USAGE_STATS_PATH, 'w', encoding='utf-8') as f:
+                json.dump(dict(usage), f)
+            self.subject_usage.clear()
+        except Exception as e:
+            print(f"⚠️  No se pudo guardar el uso por asignatura: {str(e)}")
     
     def search_documents(
         self, 
@@ -57,17 +161,14 @@ class RAGManager:
         Returns:
             Tupla con (documentos, fuentes)
         """
-        chroma_path = self._get_chroma_path(subject)
-        
-        if not os.path.exists(chroma_path):
+        db = self.get_collection(subject)
+
+        if db is None:
             return [], []
-        
+
+        self.subject_usage[subject] += 1
+
         try:
-            # Crear conexión a ChromaDB
-            db = Chroma(
-                persist_directory=chroma_path,
-                embedding_function=self.embedding_function
-            )
             
             # Optional: Use expanded query for better results
             # expanded_query = self._expand_query(query)
@@ -179,6 +280,87 @@ class RAGManager:
             print(f"Error listando asignaturas: {str(e)}")
             return []
     
+    def find_guia_docente_path(self, subject: str) -> Optional[str]:
+        """Ruta del JSON de la guía docente de una asignatura, o None si no existe"""
+        for filename in ("guía_docente.json", "guia_docente.json"):
+            path = os.path.join(BASE_DATA_PATH, subject, filename)
+            if os.path.exists(path):
+                return path
+        return None
+
+    @staticmethod
+    def _fingerprint(paths: List[str]) -> Optional[str]:
+        """Huella barata (ruta, tamaño, mtime) de un conjunto de ficheros"""
+        stats = []
+        for path in sorted(paths):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            stats.append(f"{path}:{st.st_size}:{st.st_mtime_ns}")
+        if not stats:
+            return None
+        return hashlib.sha1("|".join(stats).encode("utf-8")).hexdigest()[:16]
+
+    def _load_corpus_versions(self) -> Dict[str, str]:
+        """Versiones del corpus persistidas; solo se vuelve a leer el fichero si otro proceso lo cambió"""
+        try:
+            mtime = os.stat(CORPUS_VERSIONS_PATH).st_mtime_ns
+        except OSError:
+            return {}
+        if mtime != self._corpus_versions_mtime:
+            try:
+                with open(CORPUS_VERSIONS_PATH, 'r', encoding='utf-8') as f:
+                    self._corpus_versions = json.load(f)
+                self._corpus_versions_mtime = mtime
+            except Exception as e:
+                print(f"⚠️  No se pudieron leer las versiones del corpus: {str(e)}")
+        return self._corpus_versions
+
+    def update_corpus_version(self, subject: str, version: Optional[str] = None) -> str:
+        """
+        Fija la versión del corpus de una asignatura. Se llama al indexar o borrar su
+        colección, de modo que consultar la versión no tenga que recorrer ChromaDB.
+        """
+        version = version or uuid.uuid4().hex[:16]
+        with self._corpus_versions_lock:
+            versions = dict(self._load_corpus_versions())
+            versions[subject] = version
+            os.makedirs(BASE_CHROMA_PATH, exist_ok=True)
+            tmp_path = f"{CORPUS_VERSIONS_PATH}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(versions, f)
+            os.replace(tmp_path, CORPUS_VERSIONS_PATH)
+            self._corpus_versions = versions
+            self._corpus_versions_mtime = None
+        return version
+
+    def subject_version(self, subject: str) -> Dict[str, Optional[str]]:
+        """
+        Versión de los documentos de una asignatura: cambia cuando se repuebla o borra
+        su colección ChromaDB o cuando se actualiza su guía docente.
+        """
+        corpus_version = self._load_corpus_versions().get(subject)
+        chroma_path = self._get_chroma_path(subject)
+        if corpus_version is None and os.path.exists(chroma_path):
+            # Colección indexada antes de registrar versiones: se calcula una sola vez
+            corpus_files = []
+            for root, _, files in os.walk(chroma_path):
+                corpus_files.extend(os.path.join(root, name) for name in files)
+            corpus_version = self._fingerprint(corpus_files)
+            if corpus_version:
+                self.update_corpus_version(subject, corpus_version)
+        guia_path = self.find_guia_docente_path(subject)
+
+        guia_version = self._fingerprint([guia_path]) if guia_path else None
+        combined = f"{corpus_version or '-'}:{guia_version or '-'}"
+        return {
+            "subject": subject,
+            "corpus_version": corpus_version,
+            "guia_version": guia_version,
+            "version": hashlib.sha1(combined.encode("utf-8")).hexdigest()[:16],
+        }
+
     def check_subject_exists(self, subject: str) -> bool:
         """Verifica si existe la base de datos para una asignatura"""
         chroma_path = self._get_chroma_path(subject)
@@ -187,10 +369,12 @@ class RAGManager:
     def clear_subject_database(self, subject: str) -> bool:
         """Limpia la base de datos de una asignatura"""
         chroma_path = self._get_chroma_path(subject)
+        self.evict_collection(subject)
         
         try:
             if os.path.exists(chroma_path):
                 shutil.rmtree(chroma_path)
+                self.update_corpus_version(subject)
                 print(f"🗑️ Base de datos eliminada: {chroma_path}")
                 return True
             return False
@@ -259,7 +443,10 @@ class RAGManager:
             )
             
             # Añadir documentos
-            db.add_documents(sample_docs)
+            try:
+                db.add_documents(sample_docs)
+            finally:
+                self.update_corpus_version(subject)
             
             print(f"✅ Poblada asignatura '{subject}' con {len(sample_docs)} documentos de ejemplo")
             return True
@@ -0,0 +1,139 @@
+"""
+Warm-up del RAG Service y estado de preparación (readiness)
+
+Al arrancar se lanza una petición de embedding para que el modelo quede cargado
+(Ollama/vLLM) y se abren las colecciones de las asignaturas más usadas. Mientras
+tanto /health sigue respondiendo (liveness) pero /ready devuelve 503, de modo que
+el orquestador no enruta tráfico hasta que el servicio es realmente rápido.
+"""
+import os
+import time
+import threading
+from typing import Dict, Any, Optional
+
+from .rag_manager import rag_manager
+
+# Configuración del warm-up
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+WARMUP_QUERY = os.getenv("WARMUP_QUERY", "¿Cuál es el temario de la asignatura?")
+WARMUP_MAX_SUBJECTS = int(os.getenv("WARMUP_MAX_SUBJECTS", "3"))
+WARMUP_RETRY_SECONDS = float(os.getenv("WARMUP_RETRY_SECONDS", "10"))
+# Lista explícita de asignaturas a precalentar (separadas por comas). Si está vacía
+# se usan las más consultadas según las estadísticas persistidas.
+WARMUP_SUBJECTS = [s.strip() for s in os.getenv("WARMUP_SUBJECTS", "").split(",") if s.strip()]
+
+
+class ReadinessState:
+    """Estado de preparación por dependencia, con los tiempos del warm-up"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.embeddings: Dict[str, Any] = {"ready": False, "duration_ms": None, "error": None}
+        self.collections: Dict[str, Dict[str, Any]] = {}
+
+    @property
+    def warming_up(self) -> bool:
+        return self.started_at is not None and self.finished_at is None
+
+    @property
+    def ready(self) -> bool:
+        with self._lock:
+            if not self.embeddings["ready"] or self.finished_at is None:
+                return False
+            return all(c["ready"] for c in self.collections.values())
+
+    def set_embeddings(self, ready: bool, duration_ms: float, error: Optional[str] = None):
+        with self._lock:
+            self.embeddings = {"ready": ready, "duration_ms": round(duration_ms, 1), "error": error}
+
+    def set_collection(self, subject: str, ready: bool, duration_ms: float, error: Optional[str] = None):
+        with self._lock:
+            self.collections[subject] = {
+                "ready": ready,
+                "duration_ms": round(duration_ms, 1),
+                "error": error
+            }
+
+    def to_dict(self) -> Dict[str, Any]:
+        ready = self.ready
+        with self._lock:
+            total_ms = None
+            if self.started_at is not None and self.finished_at is not None:
+                total_ms = round((self.finished_at - self.started_at) * 1000, 1)
+            return {
+                "status": "ready" if ready else ("warming_up" if self.warming_up else "not_ready"),
+                "checks": {
+                    "embeddings": dict(self.embeddings),
+                    "collections": {k: dict(v) for k, v in self.collections.items()},
+                },
+                "warmup": {
+                    "enabled": WARMUP_ENABLED,
+                    "total_ms": total_ms,
+                    "open_collections": rag_manager.open_collections(),
+                }
+            }
+
+
+readiness = ReadinessState()
+
+
+def _warm_embeddings() -> bool:
+    """Lanza un embedding de prueba para que el modelo quede cargado en memoria"""
+    start = time.time()
+    try:
+        vector = rag_manager.embedding_function.embed_query(WARMUP_QUERY)
+        if not vector:
+            raise ValueError("El servicio de embeddings devolvió un vector vacío")
+        readiness.set_embeddings(True, (time.time() - start) * 1000)
+        print(f"🔥 Embeddings precalentados en {(time.time() - start):.2f}s")
+        return True
+    except Exception as e:
+        readiness.set_embeddings(False, (time.time() - start) * 1000, str(e))
+        print(f"❌ Warm-up de embeddings fallido: {str(e)}")
+        return False
+
+
+def _warm_collection(subject: str) -> None:
+    """Abre la colección de una asignatura y hace una búsqueda para cargar el índice"""
+    start = time.time()
+    try:
+        db = rag_manager.get_collection(subject)
+        if db is None:
+            # Una asignatura inexistente no debe bloquear la preparación del servicio
+            print(f"⚠️  No existe base de datos para '{subject}', se omite del warm-up")
+            return
+        db.similarity_search(WARMUP_QUERY, k=1)
+        readiness.set_collection(subject, True, (time.time() - start) * 1000)
+        print(f"🔥 Colección '{subject}' precalentada en {(time.time() - start):.2f}s")
+    except Exception as e:
+        readiness.set_collection(subject, False, (time.time() - start) * 1000, str(e))
+        print(f"❌ Warm-up de la colección '{subject}' fallido: {str(e)}")
+
+
+def run_warmup() -> Dict[str, Any]:
+    """
+    Ejecuta el warm-up completo (bloqueante; pensado para lanzarse en un hilo).
+
+    Returns:
+        El estado de preparación tras el warm-up
+    """
+    readiness.started_at = time.time()
+    readiness.finished_at = None
+
+    if not WARMUP_ENABLED:
+        readiness.set_embeddings(True, 0.0)
+        readiness.finished_at = time.time()
+        return readiness.to_dict()
+
+    print("🔥 Iniciando warm-up del RAG Service...")
+    if _warm_embeddings():
+        subjects = WARMUP_SUBJECTS or rag_manager.most_used_subjects(WARMUP_MAX_SUBJECTS)
+        for subject in subjects:
+            _warm_collection(subject)
+
+    readiness.finished_at = time.time()
+    print(f"✅ Warm-up terminado en {(readiness.finished_at - readiness.started_at):.2f}s "
+          f"(ready={readiness.ready})")
+    return readiness.to_dict()
@@ -0,0 +1,113 @@
+import importlib.util
+import os
+import pytest
+from langchain_core.embeddings import Embeddings
+
+# rag-service/app and the backend share the package name "app": load the module by path
+_spec = importlib.util.spec_from_file_location(
+    "rag_service_embeddings", os.path.join(os.path.dirname(__file__), "..", "app", "embeddings.py"))
+embeddings = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(embeddings)
+
+EmbeddingBackend, EmbeddingRouter = embeddings.EmbeddingBackend, embeddings.EmbeddingRouter
+
+
+class FakeEmbeddings(Embeddings):
+    """Embedding server stand-in with a fixed dimension that can be taken down"""
+
+    def __init__(self, dimension=4, down=False):
+        self.dimension = dimension
+        self.down = down
+        self.calls = 0
+
+    def _vector(self):
+        self.calls += 1
+        if self.down:
+            raise ConnectionError("connection refused")
+        return [0.1] * self.dimension
+
+    def embed_query(self, text):
+        return self._vector()
+
+    def embed_documents(self, texts):
+        return [self._vector() for _ in texts]
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(embeddings, "time", clock)
+    return clock
+
+
+def backend(name, cost=1.0, model_id="qwen3-embedding-0.6b", **kwargs):
+    return EmbeddingBackend(name, FakeEmbeddings(**kwargs), cost, model_id)
+
+
+def test_queries_go_to_fastest_backend_and_bulk_to_cheapest(clock):
+    """Test interactive queries follow the rolling latency and ingestion follows the cost"""
+    gpu, cpu = backend("vllm", cost=2.0), backend("ollama", cost=1.0)
+    router = EmbeddingRouter([gpu, cpu], dimension=4, probe=False)
+    gpu.query_latency_ms, cpu.query_latency_ms = 15.0, 120.0
+
+    router.embed_query("¿Qué es un algoritmo voraz?")
+    router.embed_documents(["tema 1", "tema 2"])
+
+    assert (gpu.embeddings.calls, cpu.embeddings.calls) == (1, 2)
+
+    cpu.query_latency_ms = 5.0
+    router.embed_query("¿Qué es un algoritmo voraz?")
+    assert cpu.embeddings.calls == 3
+
+
+def test_failed_backend_fails_over_and_returns_after_cooldown(clock):
+    """Test a failing backend is skipped during the cooldown and retried once it expires"""
+    gpu, cpu = backend("vllm", down=True), backend("ollama")
+    router = EmbeddingRouter([gpu, cpu], dimension=4, probe=False)
+
+    assert router.embed_query("pregunta") == [0.1] * 4
+    assert not gpu.healthy and gpu.failures == 1
+
+    router.embed_query("pregunta")
+    assert gpu.embeddings.calls == 1  # still cooling down
+
+    gpu.embeddings.down = False
+    clock.now += embeddings.EMBEDDING_BACKEND_COOLDOWN
+    router.embed_query("pregunta")
+    assert gpu.embeddings.calls == 2 and gpu.healthy
+
+
+def test_backends_of_different_models_refuse_to_start():
+    """Test mismatched model ids or dimensions at construction raise instead of mixing vector spaces"""
+    with pytest.raises(ValueError):
+        EmbeddingRouter([backend("vllm"), backend("ollama", model_id="nomic-embed-text")], probe=False)
+    with pytest.raises(ValueError):
+        EmbeddingRouter([backend("vllm"), backend("ollama")], model_id="nomic-embed-text", probe=False)
+    with pytest.raises(ValueError):
+        EmbeddingRouter([backend("vllm", dimension=1024), backend("ollama", dimension=768)])
+    with pytest.raises(ValueError):
+        EmbeddingRouter([backend("vllm", dimension=768)], dimension=1024)
+
+
+def test_backend_with_wrong_dimension_is_discarded_against_the_collections(clock):
+    """Test a backend that was down at startup is judged by the collection dimension, not by timing"""
+    gpu, cpu = backend("vllm", dimension=1024), backend("ollama", dimension=768, down=True)
+    router = EmbeddingRouter([gpu, cpu], dimension=1024)
+    assert cpu.dimension is None  # unreachable during the probe
+
+    cpu.embeddings.down = False
+    clock.now += embeddings.EMBEDDING_BACKEND_COOLDOWN
+    gpu.cost, cpu.cost = 2.0, 1.0
+    vectors = router.embed_documents(["tema 1"])  # cheapest first: ollama answers, then is discarded
+
+    assert len(vectors[0]) == 1024
+    assert cpu.incompatible and not gpu.incompatible
+    assert router.status()[1]["healthy"] is False
@@ -0,0 +1,83 @@
+"""
+Benchmark del rate limiter con muchos usuarios activos a la vez.
+
+Compara el coste de una comprobación (`check_rate_limit`) del limitador actual con el
+algoritmo anterior, que recorría todos los usuarios en cada petición.
+
+Uso:
+    python scripts/benchmark_rate_limiter.py --users 10000 --checks 20000
+"""
+
+import argparse
+import logging
+import random
+import sys
+import time
+from pathlib import Path
+
+# Get project root directory (parent of scripts folder)
+SCRIPT_DIR = Path(__file__).parent
+PROJECT_ROOT = SCRIPT_DIR.parent
+sys.path.insert(0, str(PROJECT_ROOT / "app"))
+
+from core.rate_limiter import SlidingWindowRateLimiter, RATE_LIMIT_REQUESTS, RATE_LIMIT_WINDOW
+
+
+class FullScanRateLimiter:
+    """El algoritmo anterior: limpia los timestamps de todos los usuarios en cada comprobación."""
+
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+        self.storage = {}
+
+    def check(self, user_identifier):
+        current_time = time.time()
+        cleanup_time = current_time - self.window
+        users_to_remove = []
+        for user_id, data in self.storage.items():
+            data['requests'] = [req_time for req_time in data['requests'] if req_time > cleanup_time]
+            if not data['requests']:
+                users_to_remove.append(user_id)
+        for user_id in users_to_remove:
+            del self.storage[user_id]
+        user_requests = self.storage.setdefault(user_identifier, {'requests': []})['requests']
+        if len([req_time for req_time in user_requests if req_time > cleanup_time]) >= self.limit:
+            return False
+        user_requests.append(current_time)
+        return True
+
+
+def run(limiter, users, checks, seed=0):
+    """Activa `users` usuarios y mide `checks` comprobaciones de usuarios aleatorios."""
+    for i in range(users):
+        limiter.check(f"user-{i}")
+    rng = random.Random(seed)
+    identifiers = [f"user-{rng.randrange(users)}" for _ in range(checks)]
+    start = time.perf_counter()
+    for user_identifier in identifiers:
+        limiter.check(user_identifier)
+    elapsed = time.perf_counter() - start
+    return elapsed / checks * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del rate limiter")
+    parser.add_argument("--users", type=int, default=10000, help="Usuarios activos en la ventana")
+    parser.add_argument("--checks", type=int, default=20000, help="Comprobaciones medidas")
+    parser.add_argument("--baseline-checks", type=int, default=200,
+                        help="Comprobaciones medidas con el algoritmo anterior (es lento)")
+    args = parser.parse_args()
+    # Los usuarios que superan el límite generan un warning por petición
+    logging.getLogger("core.rate_limiter").setLevel(logging.ERROR)
+
+    print(f"{args.users} usuarios activos, límite {RATE_LIMIT_REQUESTS} peticiones / {RATE_LIMIT_WINDOW} s")
+    current = run(SlidingWindowRateLimiter(sweep_interval=0), args.users, args.checks)
+    print(f"  actual (deque por usuario):      {current:10.2f} µs por comprobación")
+    if args.baseline_checks:
+        baseline = run(FullScanRateLimiter(RATE_LIMIT_REQUESTS, RATE_LIMIT_WINDOW), args.users, args.baseline_checks)
+        print(f"  anterior (recorrido completo):   {baseline:10.2f} µs por comprobación ({baseline / current:.0f}x)")
+
+
+if __name__ == "__main__":
+    main()